@@ -61,6 +61,73 @@ def _rk45(system,
     return y_solve
 
 
+def solve_ode_batch(system,
+                    init_cond: np.ndarray,
+                    params: np.ndarray,
+                    start: np.ndarray,
+                    stop: np.ndarray) -> np.ndarray:
+    """Solves many independent runs of an ODE system on a common daily grid.
+
+    Each run (a location, a draw, ...) is integrated exactly as
+    :func:`solve_ode` would integrate it on its own, with time measured in
+    days from its own start, but all runs are stepped together in a single
+    parallel kernel.
+
+    Parameters
+    ----------
+    system
+        A numba compiled ODE system with signature `system(t, y, params)`.
+    init_cond
+        Initial conditions with shape (runs, states).
+    params
+        Daily parameters on the common grid with shape (runs, days, params).
+    start
+        Index of the first day of each run on the common grid.
+    stop
+        One past the index of the last day of each run on the common grid.
+
+    Returns
+    -------
+    y
+        The daily solution with shape (runs, days, states). Days outside
+        of a run's [start, stop) window are NaN.
+
+    """
+    y = np.full(params.shape[:2] + init_cond.shape[1:], np.nan,
+                dtype=init_cond.dtype)
+    steps_per_day = int(round(1 / SOLVER_DT))
+    _rk45_batch(system, init_cond, params, start, stop, y, steps_per_day, SOLVER_DT)
+    return y
+
+
+@numba.njit(parallel=True)
+def _rk45_batch(system,
+                init_cond: np.ndarray,
+                params: np.ndarray,
+                start: np.ndarray,
+                stop: np.ndarray,
+                y: np.ndarray,
+                steps_per_day: int,
+                dt: float):
+    for run in numba.prange(init_cond.shape[0]):
+        y_run = init_cond[run].copy()
+        y[run, start[run]] = y_run
+        for day in range(start[run], stop[run] - 1):
+            p0 = params[run, day]
+            dp = params[run, day + 1] - p0
+            t0 = float(day - start[run])
+            for step in range(steps_per_day):
+                w = step * dt
+                t = t0 + w
+                k1 = system(t, y_run, p0 + w * dp)
+                k2 = system(t + dt / 2, y_run + dt / 2 * k1, p0 + (w + dt / 2) * dp)
+                k3 = system(t + dt / 2, y_run + dt / 2 * k2, p0 + (w + dt / 2) * dp)
+                k4 = system(t + dt, y_run + dt * k3, p0 + (w + dt) * dp)
+                y_run = y_run + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+            y[run, day + 1] = y_run
+    return y
+
+
 @numba.njit
 def safe_divide(a: float, b: float):
     """Divide that returns zero if numerator and denominator are both zero."""
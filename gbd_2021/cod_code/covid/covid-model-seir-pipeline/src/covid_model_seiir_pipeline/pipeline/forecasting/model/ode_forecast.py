@@ -2,7 +2,6 @@ from typing import Dict, Tuple, TYPE_CHECKING
 
 import numpy as np
 import pandas as pd
-import tqdm
 
 from covid_model_seiir_pipeline.lib import (
     math,
@@ -260,31 +259,37 @@ def run_ode_model(initial_conditions: pd.DataFrame,
         axis=1
     )
 
-    forecasts = []
-    initial_conditions_iter = tqdm.tqdm(initial_conditions.iterrows(),
-                                        total=len(initial_conditions),
-                                        disable=not progress_bar)
-    for location_id, initial_condition in initial_conditions_iter:
-        loc_parameters = parameters.loc[location_id].sort_index()
-        loc_date = loc_parameters.reset_index().date
-        loc_times = np.array((loc_date - loc_date.min()).dt.days)
-
-        ic = initial_condition.values
-        p = loc_parameters.values.T  # Each row is a param, each column a day
-
-        solution = math.solve_ode(
-            system=ode.forecast_system,
-            t=loc_times,
-            init_cond=ic,
-            params=p
-        )
-
-        result = pd.DataFrame(
-            data=solution.T,
-            columns=initial_conditions.columns.tolist()
-        )
-        result['date'] = loc_date
-        result['location_id'] = location_id
-        forecasts.append(result.set_index(['location_id', 'date']))
-    forecasts = pd.concat(forecasts).sort_index()
+    # Stack every location on a common daily grid, with each location's
+    # forecast occupying the days from its own first to its last date.
+    location_ids = initial_conditions.index.unique().sort_values()
+    parameters = parameters.loc[parameters.index.get_level_values('location_id').isin(location_ids)].sort_index()
+    runs = location_ids.get_indexer(parameters.index.get_level_values('location_id'))
+    dates = parameters.index.get_level_values('date')
+    days = np.array((dates - dates.min()).days)
+
+    n_days = days.max() + 1
+    start = np.full(len(location_ids), n_days)
+    np.minimum.at(start, runs, days)
+    stop = np.zeros(len(location_ids), dtype=int)
+    np.maximum.at(stop, runs, days + 1)
+    if (np.bincount(runs, minlength=len(location_ids)) != stop - start).any():
+        raise ValueError('ODE forecast parameters must be daily with no gaps in the dates of a location.')
+
+    p = np.full((len(location_ids), n_days, parameters.shape[1]), np.nan)
+    p[runs, days] = parameters.values
+    ic = initial_conditions.loc[location_ids].values
+
+    solution = math.solve_ode_batch(
+        system=ode.forecast_system,
+        init_cond=ic,
+        params=p,
+        start=start,
+        stop=stop,
+    )
+
+    forecasts = pd.DataFrame(
+        data=solution[runs, days],
+        index=parameters.index,
+        columns=initial_conditions.columns.tolist(),
+    )
     return forecasts
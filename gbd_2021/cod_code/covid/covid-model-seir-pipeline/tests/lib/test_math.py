@@ -0,0 +1,86 @@
+import dataclasses
+
+import numba
+import numpy as np
+import pandas as pd
+import pytest
+
+from covid_model_seiir_pipeline.lib import math, ode
+from covid_model_seiir_pipeline.pipeline.forecasting.model.ode_forecast import run_ode_model
+
+
+@numba.njit
+def sir_system(t, y, params):
+    beta, gamma = params[0], params[1]
+    new_infections = beta * y[0] * y[1] / y.sum()
+    recoveries = gamma * y[1]
+    return np.array([-new_infections, new_infections - recoveries, recoveries])
+
+
+@pytest.fixture
+def windows():
+    "[start, stop) windows of runs on a 30 day grid, including a one day run."
+    return np.array([0, 5, 12, 20]), np.array([30, 20, 25, 21])
+
+
+@pytest.fixture
+def batch_inputs(windows):
+    start, stop = windows
+    rng = np.random.default_rng(20)
+    init_cond = np.column_stack([
+        rng.uniform(9e5, 1e6, start.size),
+        rng.uniform(10, 1000, start.size),
+        np.zeros(start.size),
+    ])
+    days = np.arange(30)
+    params = np.full((start.size, days.size, 2), np.nan)
+    for run in range(start.size):
+        window = slice(start[run], stop[run])
+        params[run, window, 0] = 0.3 + 0.1 * np.sin(days[window] / 5 + run)
+        params[run, window, 1] = rng.uniform(0.1, 0.2)
+    return init_cond, params
+
+
+def test_solve_ode_batch_matches_solve_ode(windows, batch_inputs):
+    start, stop = windows
+    init_cond, params = batch_inputs
+
+    y = math.solve_ode_batch(sir_system, init_cond, params, start, stop)
+
+    assert y.shape == (start.size, params.shape[1], init_cond.shape[1])
+    for run in range(start.size):
+        t = np.arange(stop[run] - start[run], dtype=float)
+        expected = math.solve_ode(
+            sir_system, t, init_cond[run], params[run, start[run]:stop[run]].T,
+        )
+        np.testing.assert_allclose(y[run, start[run]:stop[run]], expected.T, rtol=1e-12)
+
+
+def test_solve_ode_batch_pads_outside_windows(windows, batch_inputs):
+    start, stop = windows
+    init_cond, params = batch_inputs
+
+    y = math.solve_ode_batch(sir_system, init_cond, params, start, stop)
+
+    for run in range(start.size):
+        assert np.isnan(y[run, :start[run]]).all()
+        assert np.isnan(y[run, stop[run]:]).all()
+        assert not np.isnan(y[run, start[run]:stop[run]]).any()
+
+
+def test_run_ode_model_rejects_gaps_in_dates():
+    dates = pd.date_range('2021-01-01', periods=10)
+    index = pd.MultiIndex.from_tuples(
+        [(1, date) for date in dates] + [(2, date) for date in dates.delete(4)],
+        names=['location_id', 'date'],
+    )
+    model_parameters = ode.ForecastParameters(**{
+        field.name: pd.Series(0.5, index=index)
+        for field in dataclasses.fields(ode.ForecastParameters)
+    })
+    initial_conditions = pd.DataFrame(
+        1.0, index=pd.Index([1, 2], name='location_id'), columns=['S', 'I'],
+    )
+
+    with pytest.raises(ValueError, match='no gaps'):
+        run_ode_model(initial_conditions, model_parameters, progress_bar=False)
@@ -67,6 +67,7 @@ else:
 
 sys.path.append(code_path)
 import BeersInterpolation as beers
+import spectrum_kernel as kernel
 
 cohort_groups = ['1B', '2A', '2B']
 if stage == 'stage_1' and group in cohort_groups:
@@ -228,18 +229,12 @@ def normBounds(a, b):
 
 def updateAllStateTotal(year):
     '''Update "all" category in population object.'''
+    adultHIV = adultState.totals(year)
     for age in population:
-        for sex in sexes:
+        for s, sex in enumerate(sexes):
             population[age][year][sex]['all'] = 0.0
             if age > 15:
-                for c in noARTCD4statesNeg:
-                    if c == 'neg':
-                        population[age][year][sex]['all'] += population[age][year][sex][c]
-                    else:
-                        population[age][year][sex]['all'] += sum(population[age][year][sex][c])
-                for c in ARTCD4states:
-                    for d in population[age][year][sex][c]:
-                        population[age][year][sex]['all'] += sum(population[age][year][sex][c][d])
+                population[age][year][sex]['all'] += population[age][year][sex]['neg'] + adultHIV[age - 15, s]
             elif age <= 4:
                 population[age][year][sex]['all'] += population[age][year][sex]['neg']
                 for c in u5CD4States:
@@ -281,11 +276,10 @@ def getEligiblePregnantWomen(age, t):
 #TF - updated with child update August 2017
 def getARTpatients(a1, a2, t, sex):
     tempSum = 0
+    adultART = adultState.year(t)[1][:, sexes.index(sex)].sum(-1).sum(-1).sum(-1)
     for age in xrange(a1, a2+1):
         if age > childMaxAge:
-            for c in ARTCD4states:
-                for d in adultARTdurations:
-                    tempSum += sum(population[age][t][sex][c][d])
+            tempSum += adultART[age - adultState.min_age]
         else:
             if age < 5:           
                 for c in u5CD4States:
@@ -297,7 +291,6 @@ def getARTpatients(a1, a2, t, sex):
     return tempSum
 
 def calcBFtransmission(m1, m2, t):
-    BFTR = 0
     percentOptA = treatPercent['optionA_BF']
     percentOptB = treatPercent['optionB_BF']
 
@@ -312,31 +305,34 @@ def calcBFtransmission(m1, m2, t):
             excess = (percentOptA + percentOptB - treatPercent['tripleARTbefPreg'] - treatPercent['tripleARTdurPreg']) - propGE350
             optionATransRate = (propGE350 * MTCtransRates['optionA']['BFGE350'] + excess * 1.45 / 0.46 * MTCtransRates['optionA']['BFGE350']) / (propGE350 + excess)
             optionBTransRate = (propGE350 * MTCtransRates['optionB']['BFGE350'] + excess * 1.45 / 0.46 * MTCtransRates['optionB']['BFGE350']) / (propGE350 + excess)
-    for d in xrange(m1, m2+1):
-        percentOptA = treatPercent['optionA'] / (math.e ** (d * 2 * math.log(1 + dropoutOptA / 100)))
-        percentOptB = treatPercent['optionB'] / (math.e ** (d * 2 * math.log(1 + dropoutOptB / 100)))
-        percentNoProph = 1 - percentOptA - percentOptB - treatPercent['tripleARTbefPreg'] - treatPercent['tripleARTdurPreg']
-        if percentNoProph < 0:
-            percentNoProph = 0
-        BFTR += (((1 - percentBFnoART[t-minYear][d] / 100) * (1 - percentInProgram)
-            + (1 - percentBFonART[t-minYear][d] / 100) * percentInProgram)
-            * percentNoProph
-            * (propLT350 * MTCtransRates['LT200']['BFLT350']
-                + propGE350 * MTCtransRates['GT350']['BFGE350']
-                + propIncidentInfections / 12 * MTCtransRates['IncidentInf']['BFLT350']))
-        BFTR += (1 - percentBFonART[t-minYear][d] / 100) * percentOptA * optionATransRate
-        BFTR += (1 - percentBFonART[t-minYear][d] / 100) * percentOptB * optionBTransRate
-
-        if getARTpatients(15, maxAge, t, 'female') <= 0:
-            propNewART = 0
-        else:
-            propNewART = (currentYearART['female'] - prevYearART['female']) / getARTpatients(15, maxAge, t, 'female')
-        BFTR += ((1 - percentBFonART[t-minYear][d] / 100) * treatPercent['tripleARTbefPreg']
-            * ((1 - propNewART) * MTCtransRates['tripleARTbefPreg']['BFLT350']
-                + propNewART * MTCtransRates['tripleARTdurPreg']['BFLT350']))
-        BFTR += ((1 - percentBFonART[t-minYear][d] / 100) * treatPercent['tripleARTdurPreg']
-            * (propNewART * MTCtransRates['tripleARTbefPreg']['BFLT350']
-                + (1 - propNewART) * MTCtransRates['tripleARTdurPreg']['BFLT350']))
+    # Every month of breastfeeding m1 ... m2 at once
+    months = np.arange(m1, m2+1)
+    BFnoART = 1 - np.array([percentBFnoART[t-minYear][d] for d in months]) / 100
+    BFonART = 1 - np.array([percentBFonART[t-minYear][d] for d in months]) / 100
+    percentOptA = treatPercent['optionA'] / (math.e ** (months * 2 * math.log(1 + dropoutOptA / 100)))
+    percentOptB = treatPercent['optionB'] / (math.e ** (months * 2 * math.log(1 + dropoutOptB / 100)))
+    percentNoProph = np.maximum(0, 1 - percentOptA - percentOptB - treatPercent['tripleARTbefPreg'] - treatPercent['tripleARTdurPreg'])
+
+    ARTpatients = getARTpatients(15, maxAge, t, 'female')
+    if ARTpatients <= 0:
+        propNewART = 0
+    else:
+        propNewART = (currentYearART['female'] - prevYearART['female']) / ARTpatients
+
+    BFTR = ((BFnoART * (1 - percentInProgram) + BFonART * percentInProgram)
+        * percentNoProph
+        * (propLT350 * MTCtransRates['LT200']['BFLT350']
+            + propGE350 * MTCtransRates['GT350']['BFGE350']
+            + propIncidentInfections / 12 * MTCtransRates['IncidentInf']['BFLT350']))
+    BFTR = BFTR + BFonART * percentOptA * optionATransRate
+    BFTR = BFTR + BFonART * percentOptB * optionBTransRate
+    BFTR = BFTR + (BFonART * treatPercent['tripleARTbefPreg']
+        * ((1 - propNewART) * MTCtransRates['tripleARTbefPreg']['BFLT350']
+            + propNewART * MTCtransRates['tripleARTdurPreg']['BFLT350']))
+    BFTR = BFTR + (BFonART * treatPercent['tripleARTdurPreg']
+        * (propNewART * MTCtransRates['tripleARTbefPreg']['BFLT350']
+            + (1 - propNewART) * MTCtransRates['tripleARTdurPreg']['BFLT350']))
+    BFTR = BFTR.sum()
 
     return BFTR * 2
 
@@ -352,16 +348,6 @@ def getBirths(t, sex = None):
 #New functions to make it possible to use predicted ART coverage
 #Predicted ART coverage provided by the forecasting team as of Jan 2017
 
-def getARTSurvivors(adultARTdurations,onARTmortality,sex,t,timeStep, population, age, cd4, onARTScalar):
-    ARTsurvivors = 0
-    age10 = ((age - (age - 5) % 10) - 15) / 10
-    if age > 55:
-        age10 = ((55 - (55 -5) % 10) - 15) / 10
-    for d in adultARTdurations:
-        alpha = onARTmortality[sex][d][age10]["ART" +cd4] * onARTScalar
-        ARTsurvivors += sum(population[age][t][sex]["ART" +cd4][d]) * (1 - alpha / timeStep)
-    return ARTsurvivors
-
 #scaling so the input predicted coverage will add to the input coverage counts
 def getPredARTCoverageCounts(popByCD4, predARTCoverage, t, currentYearART, noARTCD4states):
     ARTCoverageCounts = {'female':{}, 'male':{}}
@@ -423,15 +409,13 @@ def rescale(popByCD4, predARTCoverage, sex, t, currentYearART, ARTCoverageCounts
 #Used for calculation #people living with HIV by CD4 counts for pred ART coverage counts
 def getPopByCD4(population, noARTCD4states):
     popByCD4 = {'female':{}, 'male':{}}
+    adultHIV = adultState.by_cd4(t)
     for sex in popByCD4.keys():
+        s = sexes.index(sex)
         for age in range(15, 81):
             popByCD4[sex][age] = {}
-            for c in noARTCD4states:             
-                popNoART = sum(population[age][t][sex][c])
-                popART = 0
-                for d in adultARTdurations:
-                    popART += sum(population[age][t][sex]["ART" + c][d])
-                popByCD4[sex][age][c] = (popNoART + popART)
+            for c in xrange(len(noARTCD4states)):
+                popByCD4[sex][age][noARTCD4states[c]] = adultHIV[age - 15, s, c]
     return popByCD4
 
 #Reading in predicted ART coverage (Feb 2019)
@@ -524,6 +508,26 @@ def findU5EligibilityGroups(age, t, childEligibilityPercent, u5CD4States):
                 break
     return CD4Elig 
 
+# Names the draw loops bind themselves, left out of the draw contexts
+driverNames = set(['t', 't1', 'run_id', 'adultStep'])
+
+def saveDraw(draw):
+    '''Keep the module variables and random number streams of a draw.'''
+    drawContexts[draw] = {
+        'variables': dict((k, v) for k, v in globals().items() if k not in driverNames),
+        'np.random': np.random.get_state(),
+        'random': random.getstate()}
+
+def loadDraw(draw):
+    '''Make a draw's variables and random number streams the current ones.'''
+    globals().update(drawContexts[draw]['variables'])
+    np.random.set_state(drawContexts[draw]['np.random'])
+    random.setstate(drawContexts[draw]['random'])
+
+def drawValues(name):
+    '''A variable of every draw, stacked on a leading draw axis.'''
+    return np.array([context['variables'][name] for context in drawContexts])
+
 col = lambda data, str: data[0].index(str)
 
 
@@ -816,6 +820,14 @@ for age in range(0,15):
     for t in range(minYear, maxYear + 1):
         childARTDistribution[age][t] = childARTDist.loc[(childARTDist['age'] == age) & (childARTDist['year'] == t)].value.item()
 
+# Draws are projected together: each draw's inputs are sampled and its objects
+# set up in turn, then every year is projected for all draws. The adult HIV+
+# population of all draws lives in one batched state, stepped through ART and
+# CD4 progression at once; the rest of the projection runs draw by draw on the
+# draw's own objects, swapped in with loadDraw.
+adultStates = kernel.AdultState(minYear, maxYear, childMaxAge + 1, maxAge, n_draws=indiv_run_nums)
+drawContexts = [None] * indiv_run_nums
+
     # run_id = 1
 for run_id in xrange(indiv_run_nums):
     iteration_number = 0  # Maybe take this out
@@ -825,6 +837,11 @@ for run_id in xrange(indiv_run_nums):
     np.random.seed(seeds[individual_id])
     random.seed(seeds[individual_id])
 
+    # Output rows of this draw, added to the run's once every draw is projected
+    drawCsvData = []
+    drawCoverageData = []
+    drawCohortData = []
+
     # Initialize key objects
     adjustments = {}
     population = {}
@@ -842,16 +859,10 @@ for run_id in xrange(indiv_run_nums):
                     if obj == population:
                         obj[i][j][k] = {}
                         if i > childMaxAge:
-                            for l in noARTCD4statesNeg:
-                                obj[i][j][k][l] = []
-                                for m in xrange(minYear, maxYear + 1):
-                                    obj[i][j][k][l].append(0.0)
-                            for l in ARTCD4states:
-                                obj[i][j][k][l] = {}
-                                for d in adultARTdurations:
-                                    obj[i][j][k][l][d] = []
-                                    for m in xrange(minYear, maxYear + 1):
-                                        obj[i][j][k][l][d].append(0.0)
+                            # CD4 states are views of adultState (bound below)
+                            obj[i][j][k]['neg'] = []
+                            for m in xrange(minYear, maxYear + 1):
+                                obj[i][j][k]['neg'].append(0.0)
 
                         #U5 CD4 states divided by percent
                         elif i <=4:
@@ -894,6 +905,9 @@ for run_id in xrange(indiv_run_nums):
                         for l in xrange(minYear, maxYear + 1):
                             obj[i][j][k].append(0.0)
 
+    # Adult HIV+ population as dense arrays by (year, age, sex, CD4, [ART duration,] year of infection)
+    adultState = adultStates.draw(run_id)
+    adultState.bind(population, sexes, noARTCD4states, ARTCD4states, adultARTdurations)
 
     AIDSdeathsCD4 = {}
     for age in xrange(0, 80, 5):
@@ -1600,21 +1614,6 @@ for run_id in xrange(indiv_run_nums):
         for sex in sexes:
             newPatients[c][sex] = 0
 
-    entrants = {}
-    exits = {}
-    for obj in [entrants, exits]:
-        for c in allCD4states:
-            obj[c] = {}
-            if c in noARTCD4states:
-                obj[c][1] = []
-                for i in xrange(minYear, maxYear+1):
-                    obj[c][1].append(0.0)
-            else:
-                for d in adultARTdurations:
-                    obj[c][d] = []
-                    for i in xrange(minYear, maxYear+1):
-                        obj[c][d].append(0.0)
-
     # Use generalized age pattern of incidence
     # Create age distribution object
     # (As of right now, it is the same for each year)
@@ -1926,7 +1925,7 @@ for run_id in xrange(indiv_run_nums):
             need15plus[year][sex] = 0
     t = minYear
 
-    # Write initial data to csvData list
+    # Write initial data to drawCsvData list
     out_cats = ['neg', 'LT200CD4', '200to350CD4', 'GT350CD4', 'ART']
 
 
@@ -1936,7 +1935,7 @@ for run_id in xrange(indiv_run_nums):
             tmp_row = [individual_id, t, a, s]
             out_deaths = [0.0 for i in xrange(minYear, maxYear+1)]
             tmp_row.extend(out_deaths)
-            cohortData.append(tmp_row)
+            drawCohortData.append(tmp_row)
 
     tmpPop = {}
     for sex in sexes:
@@ -1978,7 +1977,7 @@ for run_id in xrange(indiv_run_nums):
                 PnoARTData.append(tmpPnoART[q])
             out_data = [individual_id, t, sex, age, tmpDeaths, tmpNewHIV, tmpHIVbirths, np.sum(popData), tmpNonAIDSdeaths, tmpTotalBirths, tmpBirthPrev]
             out_data.extend(popData)
-            csvData.append(out_data)
+            drawCsvData.append(out_data)
         for age in xrange(15, 80, 5):
             tmpBirthPrev = 0
             popData = []
@@ -2023,7 +2022,7 @@ for run_id in xrange(indiv_run_nums):
             # out_data.extend(HivDnoARTData)
             # out_data.extend(PonARTData)
             # out_data.extend(PnoARTData)
-            csvData.append(out_data)
+            drawCsvData.append(out_data)
         age = 80
         popData = []
         tmpNewHIV = 0
@@ -2059,7 +2058,7 @@ for run_id in xrange(indiv_run_nums):
             popData.append(tmpPop[c])
         out_data = [individual_id, t, sex, age, tmpDeaths, tmpNewHIV, tmpHIVbirths, np.sum(popData), tmpNonAIDSdeaths, tmpTotalBirths, tmpBirthPrev]
         out_data.extend(popData)
-        csvData.append(out_data)
+        drawCsvData.append(out_data)
 
 
     perinatalTransmission = []
@@ -2097,7 +2096,7 @@ for run_id in xrange(indiv_run_nums):
     for a in ['adult', 'child']:
         for sex in sexes:
             for c in allInterventions:
-                coverageData.append([individual_id, t, a, sex, c, allInterventionCoverage[t][a][sex][c]['coverage'], allInterventionCoverage[t][a][sex][c]['eligible']])
+                drawCoverageData.append([individual_id, t, a, sex, c, allInterventionCoverage[t][a][sex][c]['coverage'], allInterventionCoverage[t][a][sex][c]['eligible']])
     newChildART = {}
     for age in range(0, 15):
         newChildART[age] = {}
@@ -2116,15 +2115,35 @@ for run_id in xrange(indiv_run_nums):
     if usePredCoverage == True:  
         predARTCoverage = readPredARTCoverage(ISO)
 
-    # ## Projection
+    # Rates by single adult age, sex, and CD4 category for the adult ART step
+    adultAges = range(childMaxAge + 1, maxAge + 1)
+    adultProgression = np.zeros((len(adultAges), len(sexes), len(noARTCD4states)))
+    adultNoARTmortality = np.zeros((len(adultAges), len(sexes), len(noARTCD4states)))
+    adultOnARTmortality = np.zeros((len(adultAges), len(sexes), len(noARTCD4states), len(adultARTdurations)))
+    for a, age in enumerate(adultAges):
+        age10 = int(kernel.adult_age_group(age, 45))
+        age10_2 = int(kernel.adult_age_group(age, 55))
+        for s, sex in enumerate(sexes):
+            for c in xrange(len(noARTCD4states)):
+                adultProgression[a, s, c] = progressionParameters[15 + 10 * age10][sex][noARTCD4states[c]]
+                adultNoARTmortality[a, s, c] = noARTmortality[sex][age10][noARTCD4states[c]]
+                for k, d in enumerate(adultARTdurations):
+                    adultOnARTmortality[a, s, c, k] = onARTmortality[sex][d][age10_2][ARTCD4states[c]]
+    adultCD4lowerLimits = np.array([CD4lowerLimits[c] for c in noARTCD4states])
+
+    saveDraw(run_id)
 
-    # ## Projection
+# ## Projection
 
-    # In[6]:
+# ## Projection
 
-    for t in xrange(minYear + 1, maxYear + 1):
+# In[6]:
+
+for t in xrange(minYear + 1, maxYear + 1):
     #     t = minYear + 1
-        print t
+    print t
+    for run_id in xrange(indiv_run_nums):
+        loadDraw(run_id)
         newChildHIV = {}
         for sex in sexes:
             newChildHIV[sex] = {}
@@ -2275,17 +2294,11 @@ for run_id in xrange(indiv_run_nums):
                                             population[age][t][sex][c][d][i-minYear] = 0                
                 # Infected Adults [16, 80)
                 if age in range(16, maxAge):
-                    for c in allCD4states:
-                        for i in xrange(minYear, t):
-                            if c in noARTCD4states:
-                                population[age][t][sex][c][i-minYear] = population[age-1][t-1][sex][c][i-minYear] * sr + population[age-1][t-1][sex][c][i-minYear] * mr * (1 + sr) / 2
-                                if population[age][t][sex][c][i-minYear] < 0:
-                                    population[age][t][sex][c][i-minYear] = 0
-                            else:
-                                for d in adultARTdurations:
-                                    population[age][t][sex][c][d][i-minYear] = population[age-1][t-1][sex][c][d][i-minYear] * sr + population[age-1][t-1][sex][c][d][i-minYear] * mr * (1 + sr) / 2
-                                    if population[age][t][sex][c][d][i-minYear] < 0:
-                                        population[age][t][sex][c][d][i-minYear] = 0
+                    s = sexes.index(sex)
+                    noART, onART = adultState.year(t)
+                    prevNoART, prevOnART = adultState.year(t-1)
+                    noART[age-15, s, :, :t-minYear] = kernel.age_forward(prevNoART[age-16, s, :, :t-minYear], sr, mr)
+                    onART[age-15, s, :, :, :t-minYear] = kernel.age_forward(prevOnART[age-16, s, :, :, :t-minYear], sr, mr)
             # Age group 80
             sr = survivalRates[80][t][sex]
             sr1 = survivalRates[81][t][sex]
@@ -2300,23 +2313,14 @@ for run_id in xrange(indiv_run_nums):
                 mr = mr / (population[79][t-1][sex]['all'] + population[80][t-1][sex]['all'])
             else:
                 mr = 0
-            for c in allCD4statesNeg:
-                if c in noARTCD4statesNeg:
-                    if c == 'neg':
-                        population[80][t][sex][c] = population[79][t-1][sex][c] * sr + population[79][t-1][sex][c] * mr * (1 + sr) / 2 + population[80][t-1][sex][c] * sr1 + population[80][t-1][sex][c] * mr * (1 + sr1) / 2
-                        if population[80][t][sex][c] < 0:
-                            population[80][t][sex][c] = 0
-                    else:
-                        for i in xrange(minYear, t):
-                            population[80][t][sex][c][i-minYear] = population[79][t-1][sex][c][i-minYear] * sr + population[79][t-1][sex][c][i-minYear] * mr * (1 + sr) / 2 + population[80][t-1][sex][c][i-minYear] * sr1 + population[80][t-1][sex][c][i-minYear] * mr * (1 + sr1) / 2
-                            if population[80][t][sex][c][i-minYear] < 0:
-                                population[80][t][sex][c][i-minYear] = 0
-                else:
-                    for d in adultARTdurations:
-                        for i in xrange(minYear, t):
-                            population[80][t][sex][c][d][i-minYear] = population[79][t-1][sex][c][d][i-minYear] * sr + population[79][t-1][sex][c][d][i-minYear] * mr * (1 + sr) / 2 + population[80][t-1][sex][c][d][i-minYear] * sr1 + population[80][t-1][sex][c][d][i-minYear] * mr * (1 + sr1) / 2                         
-                            if population[80][t][sex][c][d][i-minYear] < 0:
-                                population[80][t][sex][c][d][i-minYear] = 0
+            population[80][t][sex]['neg'] = population[79][t-1][sex]['neg'] * sr + population[79][t-1][sex]['neg'] * mr * (1 + sr) / 2 + population[80][t-1][sex]['neg'] * sr1 + population[80][t-1][sex]['neg'] * mr * (1 + sr1) / 2
+            if population[80][t][sex]['neg'] < 0:
+                population[80][t][sex]['neg'] = 0
+            s = sexes.index(sex)
+            for state, prevState in zip(adultState.year(t), adultState.year(t-1)):
+                prev79 = prevState[79-15, s, ..., :t-minYear]
+                prev80 = prevState[80-15, s, ..., :t-minYear]
+                state[80-15, s, ..., :t-minYear] = np.maximum(0, prev79 * sr + prev79 * mr * (1 + sr) / 2 + prev80 * sr1 + prev80 * mr * (1 + sr1) / 2)
 
         numFemales = {}
         for age in xrange(15, 50):
@@ -2446,8 +2450,7 @@ for run_id in xrange(indiv_run_nums):
                 currentYearART[sex] = adultARTCoverage[sex][t-minYear] * sum([population[age][t][sex]["all"] for age in range(15, 81)]) / 100
             sumART = 0
         #capping coverage at 90% of the total population living with HIV - 2/28/17
-            plwhiv = sum([sum([sum(population[age][t][sex][c]) for c in noARTCD4states]) for age in range(15,81)])
-            plwhiv +=  sum([sum([sum([sum(population[age][t][sex][c][d]) for d in adultARTdurations]) for c in ARTCD4states]) for age in range(15,81)])
+            plwhiv = adultState.totals(t)[:, sexes.index(sex)].sum()
             if currentYearART[sex] > (0.9 * plwhiv):
                 currentYearART[sex] = 0.9 * plwhiv
         if usePredCoverage == True:    
@@ -2465,35 +2468,47 @@ for run_id in xrange(indiv_run_nums):
             onARTScalar = np.asscalar(onARTScalar)
         else:
             onARTScalar = 1
-        for t1 in xrange(1, 11):
-            for sex in sexes:
-                if usePredCoverage == False:
-                    eligibleAdults[t - minYear][sex] = 0
-                    for age in xrange(15, 81):
-                            for c in noARTCD4states:
-                                if CD4lowerLimits[c] < adultARTeligibility[t-minYear]:
-                                    for i in xrange(minYear, t):
-                                        eligibleAdults[t - minYear][sex] += population[age][t][sex][c][i-minYear]
-                                if sex =='female' and age in xrange(15, 50):
-                                    eligibleAdults[t - minYear][sex] += getEligiblePregnantWomen(age, t)
+        noART, onART = adultState.year(t)
+        noART = noART[..., :t-minYear]
+        onART = onART[..., :t-minYear]
+        adultARTmortality = adultOnARTmortality * onARTScalar
+        cd4Eligible = adultCD4lowerLimits < adultARTeligibility[t-minYear]
+        newlyNeedingCD4 = adultCD4lowerLimits == adultARTeligibility[t-minYear]
+        if usePredCoverage == True:
+            ARTtargets = np.array([[[ARTCoverageCounts[sex][age][c] for c in noARTCD4states] for sex in sexes] for age in adultAges])
+        saveDraw(run_id)
+
+    # Step the adults of all draws together, each with its own rates and targets
+    noARTdraws, onARTdraws = adultStates.year(t)
+    adultStep = {
+        'noART': noARTdraws[..., :t-minYear],
+        'onART': onARTdraws[..., :t-minYear],
+        'progression': drawValues('adultProgression'),
+        'noARTmortality': drawValues('adultNoARTmortality'),
+        'ARTmortality': drawValues('adultARTmortality'),
+        'cd4Eligible': drawValues('cd4Eligible')[:, np.newaxis, np.newaxis],
+        'newlyNeedingCD4': drawValues('newlyNeedingCD4')[:, np.newaxis, np.newaxis],
+        'sumART': np.zeros(indiv_run_nums),
+        'newlyNeedingART': np.zeros(indiv_run_nums),
+        'tempDeaths': np.zeros(indiv_run_nums)}
+    adultStep['noARTdeaths'] = np.zeros_like(adultStep['noART'])
+    adultStep['onARTdeaths'] = np.zeros_like(adultStep['onART'])
+    if usePredCoverage == True:
+        adultStep['targets'] = drawValues('ARTtargets')
+    for t1 in xrange(1, 11):
+        if usePredCoverage == False:
+            # New patients by sex and CD4 category, from each draw's eligible adults
+            for run_id in xrange(indiv_run_nums):
+                loadDraw(run_id)
+                for sex in sexes:
+                    s = sexes.index(sex)
+                    eligibleAdults[t - minYear][sex] = noART[:, s][:, cd4Eligible].sum()
+                    if sex =='female':
+                        for age in xrange(15, 50):
+                            eligibleAdults[t - minYear][sex] += getEligiblePregnantWomen(age, t) * len(noARTCD4states)
 
                     # Use ART survivors to get new adult ART patients
-                    test_aggregate = {25:0, 50:0}
-                    ARTsurvivors = 0
-                    for age in xrange(15, maxAge + 1):
-                        age10 = ((age - (age - 5) % 10) - 15) / 10
-                        if age > 55:
-                            age10 = ((55 - (55 -5) % 10) - 15) / 10
-                        for c in ARTCD4states:
-                            for d in adultARTdurations:
-                                alpha = onARTmortality[sex][d][age10][c] * onARTScalar
-                                for i in xrange(minYear, t):
-                                    ARTsurvivors += population[age][t][sex][c][d][i-minYear] * (1 - alpha / timeStep)
-                                # ARTsurvivors += sum(population[age][t][sex][c][d]) * (1 - alpha / timeStep)
-                                if age > 25:
-                                    test_aggregate[50] += sum(population[age][t][sex][c][d])
-                                if age <= 25:
-                                    test_aggregate[25] += sum(population[age][t][sex][c][d])
+                    ARTsurvivors = kernel.art_survivors(onART[:, s], adultARTmortality[:, s], timeStep).sum()
 
                     if adultARTCoverageType[t-minYear] == 'percent':
                         neededART = ARTsurvivors + (currentYearART[sex] - ARTsurvivors) / timeStep * t1
@@ -2513,13 +2528,14 @@ for run_id in xrange(indiv_run_nums):
                     prop1 = {}
                     prop2 = {}
 
+                    noARTbyAge = noART[:, s].sum(-1)
                     for c in noARTCD4states:
+                        ci = noARTCD4states.index(c)
                         eligibleAdultsCD4[c][sex] = 0
                         prop1[c] = 0
                         prop2[c] = 0
                         if CD4lowerLimits[c] < adultARTeligibility[t-minYear]:
-                            for age in xrange(15, maxAge + 1):
-                                eligibleAdultsCD4[c][sex] += sum(population[age][t][sex][c])
+                            eligibleAdultsCD4[c][sex] += noARTbyAge[:, ci].sum()
                         else:
                             eligibleAdultsCD4[c][sex] += eligibleSpecialPops[c][sex]
                         # IF EACH CD4 CATEGORY GETS THE SAME WEIGHT IN NEW ART:
@@ -2536,8 +2552,7 @@ for run_id in xrange(indiv_run_nums):
                             age10 = ((age - (age - 5) % 10) - 15) / 10
                             if age > 45:
                                 age10 = ((45 - (45 -5) % 10) - 15) / 10
-                            for i in xrange(minYear, t):
-                                eligByAge[age10][c][sex] += population[age][t][sex][c][i-minYear]
+                            eligByAge[age10][c][sex] += noARTbyAge[age-15, ci]
 
                         # Calculate all-age noART deaths for each CD4 category
                         sum1 = 0
@@ -2578,110 +2593,45 @@ for run_id in xrange(indiv_run_nums):
 
                         # Average the two proportions to get the distribution of new patients
                         newPatients[c][sex] = (prop1[c] + prop2[c]) / 2 * eligibleAdultsCD4[c][sex]
-
-                for age in xrange(childMaxAge + 1, maxAge + 1):
-                    age5 = age - age % 5
-                    age5_2 = (age - 15) - (age - 15) % 10 + 15
-                    age10 = ((age - (age - 5) % 10) - 15) / 10
-                    if age > 45:
-                        age5_2 = 45 - 45 % 5
-                        age10 = ((45 - (45 - 5) % 10) - 15) / 10
-                    age10_2 = ((age - (age - 5) % 10) - 15) / 10
-                    if age > 55:
-                        age10_2 = ((55 - (55 - 5) % 10) - 15) / 10
-                    GT12MoDeaths = 0
-                    tmp_startart = 0
-                    tmp_noARTpop = 0
-                    tmp_total_share = 0
-                    for c in reversed(xrange(len(noARTCD4states))):
-                        tmp_new_art = 0
-                        tmp_noARTpop_2 = 0
-         
-                        age10_num = (10*(age10 + 1) + 5)
-                        if (sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, age10_num + 10)]) for d in adultARTdurations]) + sum([sum(population[a10][t][sex][noARTCD4states[c]]) for a10 in range(age10_num, age10_num + 10)])) > 0:
-                            if age <= 45:
-                                lastTenthCov = sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, age10_num + 10)]) for d in adultARTdurations]) / (sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, age10_num + 10)]) for d in adultARTdurations]) + sum([sum(population[a10][t][sex][noARTCD4states[c]]) for a10 in range(age10_num, age10_num + 10)]))
-                            else:
-                                lastTenthCov = sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, 81)]) for d in adultARTdurations]) / (sum([sum([sum(population[a10][t][sex][ARTCD4states[c]][d]) for a10 in range(age10_num, 81)]) for d in adultARTdurations]) + sum([sum(population[a10][t][sex][noARTCD4states[c]]) for a10 in range(age10_num, 81)]))
-
-                        else:
-                            lastTenthCov = 0
-                        if usePredCoverage == True:
-                            cd4 = noARTCD4states[c]
-                            targetCoverage = ARTCoverageCounts[sex][age][cd4]
-                            survivors = getARTSurvivors(adultARTdurations,onARTmortality,sex,t,timeStep, population, age, cd4, onARTScalar)
-                        for i in xrange(minYear, t):
-                            startART = 0
-                            if sum(population[age][t][sex][noARTCD4states[c]]) > 0:
-                                tmp_inf_share = population[age][t][sex][noARTCD4states[c]][i-minYear] / sum(population[age][t][sex][noARTCD4states[c]])
-                            else:
-                                tmp_inf_share = 0
-                            if usePredCoverage == True:
-                                startART = max(0.0, tmp_inf_share * (targetCoverage - survivors)/(timeStep - (t1 - 1)))
-                            else:
-                                if eligibleAdultsCD4[noARTCD4states[c]][sex] <= 0:
-                                    startART = 0
-                                else:
-                                    if CD4lowerLimits[noARTCD4states[c]] < adultARTeligibility[t-minYear]:
-                                        # SPECIAL POPULATIONS
-                                        startART = tmp_inf_share * min(sum(population[age][t][sex][noARTCD4states[c]]), newPatients[noARTCD4states[c]][sex] * sum(population[age][t][sex][noARTCD4states[c]]) / eligibleAdultsCD4[noARTCD4states[c]][sex])
-                                        tmp_noARTpop += population[age][t][sex][noARTCD4states[c]][i-minYear]
-                                        tmp_noARTpop_2 += population[age][t][sex][noARTCD4states[c]][i-minYear]
-                                tmp_startart += startART
-                                if c == 0:
-                                    tmp_total_share += tmp_inf_share
-                                tmp_new_art += startART
-
-                            sumART += startART
-                            population[age][t][sex][noARTCD4states[c]][i-minYear] -= startART
-                            if population[age][t][sex][noARTCD4states[c]][i-minYear] < 0:
-                                population[age][t][sex][noARTCD4states[c]][i-minYear] = 0
-                            # Calculate noART entrants to and exits from groups
-                            if noARTCD4states[c] == 'GT500CD4':
-                                # This will be incidence
-                                entrants[noARTCD4states[c]][1][i-minYear] = 0
-                            else:
-                                # Use lambda to calculate entrants from one noART HIV+ group to another
-                                entrants[noARTCD4states[c]][1][i-minYear] = population[age][t][sex][noARTCD4states[c+1]][i-minYear] * progressionParameters[age5_2][sex][noARTCD4states[c+1]]
-                            mu = noARTmortality[sex][age10][noARTCD4states[c]]
-                            # Caculate the total number of exits from a group
-                            exits[noARTCD4states[c]][1][i-minYear] = (population[age][t][sex][noARTCD4states[c]][i-minYear] *
-                                (progressionParameters[age5_2][sex][noARTCD4states[c]] + mu)) 
-                            # exits[noARTCD4states[c]][1] = (population[age][t][sex][noARTCD4states[c]] *
-                            #   (lambdaCoeff(age, noARTCD4states[c]) + mu)) + startART
-
-                            temp = min(mu * population[age][t][sex][noARTCD4states[c]][i-minYear], population[age][t][sex][noARTCD4states[c]][i-minYear])
-                            AIDSdeaths[age][t][sex][i-minYear] += max(0, temp)
-                            tempDeaths += temp
-
-                            AIDSdeathsCD4[age5][t][sex][noARTCD4states[c]] += max(0, temp)
-
-                            # Calculate new need for ART
-                            if CD4lowerLimits[noARTCD4states[c]] == adultARTeligibility[t-minYear]:
-                                newlyNeedingART += population[age][t][sex][noARTCD4states[c]][i-minYear] * progressionParameters[age5_2][sex][noARTCD4states[c]]
-                            # Calculate movement in the onART categories
-                            for d in adultARTdurations:
-                                alpha = onARTmortality[sex][d][age10_2][ARTCD4states[c]] * onARTScalar
-                                if d == 'LT6Mo':
-                                    entrants[ARTCD4states[c]][d][i-minYear] = startART
-                                    exits[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]][d][i-minYear] * alpha / timeStep + population[age][t][sex][ARTCD4states[c]][d][i-minYear] * (12 / 6) / timeStep
-                                elif d == '6to12Mo':
-                                    entrants[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]]['LT6Mo'][i-minYear] * (12 / 6) / timeStep
-                                    exits[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]][d][i-minYear] * alpha / timeStep + population[age][t][sex][ARTCD4states[c]][d][i-minYear] * (12 / 6) / timeStep
-                                elif d == 'GT12Mo':
-                                    entrants[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]]['6to12Mo'][i-minYear] * (12 / 6) / timeStep
-                                    exits[ARTCD4states[c]][d][i-minYear] = population[age][t][sex][ARTCD4states[c]][d][i-minYear] * alpha /timeStep
-                                    GT12MoDeaths += alpha * population[age][t][sex][ARTCD4states[c]][d][i-minYear] / timeStep
-                                temp = min(alpha * population[age][t][sex][ARTCD4states[c]][d][i-minYear] / timeStep, population[age][t][sex][ARTCD4states[c]][d][i-minYear])
-                                AIDSdeaths[age][t][sex][i-minYear] += max(0, temp)
-                                AIDSdeathsCD4[age5][t][sex][ARTCD4states[c]][d] += max(0, temp)
-
-                    for c in xrange(len(noARTCD4states)):
-                        # Add entrants and remove exits
-                        for i in xrange(minYear, t):
-                            population[age][t][sex][noARTCD4states[c]][i-minYear] = max(0, population[age][t][sex][noARTCD4states[c]][i-minYear] + entrants[noARTCD4states[c]][1][i-minYear] - exits[noARTCD4states[c]][1][i-minYear])
-                            for d in adultARTdurations:
-                                population[age][t][sex][ARTCD4states[c]][d][i-minYear] = max(0, population[age][t][sex][ARTCD4states[c]][d][i-minYear] + entrants[ARTCD4states[c]][d][i-minYear] - exits[ARTCD4states[c]][d][i-minYear])
+                newPatientsBySex = np.array([[newPatients[c][sex] for c in noARTCD4states] for sex in sexes])
+                eligibleBySex = np.array([[eligibleAdultsCD4[c][sex] for c in noARTCD4states] for sex in sexes])
+                saveDraw(run_id)
+
+        # Start ART, then progress all draws, adult ages and both sexes at once
+        if usePredCoverage == True:
+            ARTsurvivors = kernel.art_survivors(adultStep['onART'], adultStep['ARTmortality'], timeStep)
+            startART = kernel.start_art_from_targets(adultStep['noART'], adultStep['targets'], ARTsurvivors, t1, timeStep)
+        else:
+            startART = kernel.start_art_from_patients(adultStep['noART'], drawValues('newPatientsBySex')[:, np.newaxis],
+                drawValues('eligibleBySex')[:, np.newaxis], adultStep['cd4Eligible'])
+        adultStep['sumART'] += startART.reshape(indiv_run_nums, -1).sum(-1)
+        newlyNeeding = adultStep['noART'] * (adultStep['progression'] * adultStep['newlyNeedingCD4'])[..., np.newaxis]
+        adultStep['newlyNeedingART'] += newlyNeeding.reshape(indiv_run_nums, -1).sum(-1)
+        stepNoARTdeaths, stepOnARTdeaths = kernel.progress(adultStep['noART'], adultStep['onART'], startART,
+            adultStep['progression'], adultStep['noARTmortality'], adultStep['ARTmortality'], timeStep)
+        adultStep['tempDeaths'] += stepNoARTdeaths.reshape(indiv_run_nums, -1).sum(-1)
+        adultStep['noARTdeaths'] += stepNoARTdeaths
+        adultStep['onARTdeaths'] += stepOnARTdeaths
+
+    for run_id in xrange(indiv_run_nums):
+        loadDraw(run_id)
+        sumART += adultStep['sumART'][run_id]
+        newlyNeedingART += adultStep['newlyNeedingART'][run_id]
+        tempDeaths += adultStep['tempDeaths'][run_id]
+        adultNoARTdeaths = adultStep['noARTdeaths'][run_id]
+        adultOnARTdeaths = adultStep['onARTdeaths'][run_id]
+
+        # Add the adult HIV deaths of the year to the death objects
+        for a, age in enumerate(adultAges):
+            age5 = age - age % 5
+            for s, sex in enumerate(sexes):
+                deathsByInfYear = adultNoARTdeaths[a, s].sum(0) + adultOnARTdeaths[a, s].sum(0).sum(0)
+                for i in xrange(minYear, t):
+                    AIDSdeaths[age][t][sex][i-minYear] += deathsByInfYear[i-minYear]
+                for c in xrange(len(noARTCD4states)):
+                    AIDSdeathsCD4[age5][t][sex][noARTCD4states[c]] += adultNoARTdeaths[a, s, c].sum()
+                    for k, d in enumerate(adultARTdurations):
+                        AIDSdeathsCD4[age5][t][sex][ARTCD4states[c]][d] += adultOnARTdeaths[a, s, c, k].sum()
 
         updateAllStateTotal(t)                  
         lastAge = 49
@@ -2717,14 +2667,7 @@ for run_id in xrange(indiv_run_nums):
 
             for age in xrange(15, lastAge + 1):
                 adults[sex] += population[age][t][sex]['all']
-                for c in allCD4states:
-                    if c in noARTCD4states:
-                        for i in xrange(minYear, t):
-                            adultHIV[sex] += population[age][t][sex][c][i-minYear]
-                    else:
-                        for d in adultARTdurations:
-                            for i in xrange(minYear, t):
-                                adultHIV[sex] += population[age][t][sex][c][d][i-minYear]
+            adultHIV[sex] += adultState.totals(t)[:lastAge - 14, sexes.index(sex)].sum()
 
         adults['both'] = adults['male'] + adults['female']
         adultHIV['both'] = adultHIV['male'] + adultHIV['female']
@@ -2750,14 +2693,7 @@ for run_id in xrange(indiv_run_nums):
             prevYearAdults[sex] = 0
             for age in xrange(15, lastAge + 1):
                 prevYearAdults[sex] += population[age][t-1][sex]['all']
-                for c in allCD4states:
-                    if c in noARTCD4states:
-                        for i in xrange(minYear, t):
-                            prevYearAdultHIV[sex] += population[age][t-1][sex][c][i-minYear]
-                    else:
-                        for d in adultARTdurations:
-                            for i in xrange(minYear, t):
-                                prevYearAdultHIV[sex] += population[age][t-1][sex][c][d][i-minYear]
+            prevYearAdultHIV[sex] += adultState.totals(t-1)[:lastAge - 14, sexes.index(sex)].sum()
         newHIV = {}
 
         if (prevYearAdults['female'] - prevYearAdultHIV['female'] + prevYearAdults['male'] - prevYearAdults['female']) == 0:
@@ -3397,7 +3333,7 @@ for run_id in xrange(indiv_run_nums):
                 for i in xrange(minYear, maxYear+1):
                     tmp_deaths.append(AIDSdeaths[a][t][s][i-minYear])
                 tmp_row.extend(tmp_deaths)
-                cohortData.append(tmp_row)
+                drawCohortData.append(tmp_row)
 
 
 
@@ -3443,7 +3379,7 @@ for run_id in xrange(indiv_run_nums):
                     popData.append(tmpPop[c])
                 out_data = [individual_id, t, sex, age, tmpDeaths, tmpNewHIV, tmpHIVbirths, tmpSusceptPop, tmpNonAIDSdeaths, tmpTotalBirths, tmpBirthPrev]
                 out_data.extend(popData)
-                csvData.append(out_data)
+                drawCsvData.append(out_data)
             for age in xrange(15, 80, 5):
                 tmpBirthPrev = 0
                 popData = []
@@ -3484,7 +3420,7 @@ for run_id in xrange(indiv_run_nums):
                     popData.append(tmpPop[c])
                 out_data = [individual_id, t, sex, age, tmpDeaths, tmpNewHIV, tmpHIVbirths, tmpSusceptPop, tmpNonAIDSdeaths, tmpTotalBirths, tmpBirthPrev]
                 out_data.extend(popData)
-                csvData.append(out_data)
+                drawCsvData.append(out_data)
             age = 80
             popData = []
             tmpBirthPrev = 0
@@ -3519,7 +3455,7 @@ for run_id in xrange(indiv_run_nums):
                 popData.append(tmpPop[c])
             out_data = [individual_id, t, sex, age, tmpDeaths, tmpNewHIV, tmpHIVbirths, tmpSusceptPop, tmpNonAIDSdeaths, tmpTotalBirths, tmpBirthPrev]
             out_data.extend(popData)
-            csvData.append(out_data)
+            drawCsvData.append(out_data)
 
         tmpPop0 = 0
         sex = 'male'
@@ -3551,7 +3487,15 @@ for run_id in xrange(indiv_run_nums):
         for a in ['adult', 'child']:
             for sex in sexes:
                 for c in allInterventions:
-                    coverageData.append([individual_id, t, a, sex, c, allInterventionCoverage[t][a][sex][c]['coverage'], allInterventionCoverage[t][a][sex][c]['eligible']])
+                    drawCoverageData.append([individual_id, t, a, sex, c, allInterventionCoverage[t][a][sex][c]['coverage'], allInterventionCoverage[t][a][sex][c]['eligible']])
+        saveDraw(run_id)
+
+# Write each draw's outputs in turn, as the draws were run one after another
+for run_id in xrange(indiv_run_nums):
+    loadDraw(run_id)
+    csvData.extend(drawCsvData)
+    coverageData.extend(drawCoverageData)
+    cohortData.extend(drawCohortData)
 
     if detailed_output:
         ## Output coverage data for forecasting
@@ -0,0 +1,165 @@
+'''
+Dense array state and vectorized projection steps for the adult (15+)
+HIV-positive population of cohort_spectrum.py.
+
+The adult population lives in two arrays:
+    no_art  (year, age, sex, CD4 category, year of infection)
+    art     (year, age, sex, CD4 category, ART duration, year of infection)
+The nested population dicts used by the rest of the projection point at views
+of these arrays, so reads and writes through population[age][t][sex][c][i]
+and population[age][t][sex][ARTc][d][i] land in the same memory.
+
+The step functions only look at the trailing (age, sex, CD4[, duration],
+year of infection) axes of the arrays they are given, so a batch of draws is
+stepped with one call per sub-year step. An AdultState made with n_draws has
+a leading draw axis on both arrays, and rates and targets given per draw
+carry the same leading axis. AdultState.draw gives the state of one draw,
+sharing the batch's memory, for the parts of the projection run draw by draw.
+'''
+from __future__ import division
+
+import numpy as np
+
+
+def adult_age_group(ages, cap):
+    ''' Ten-year age group (0 for 15-24, 1 for 25-34, ...) of each age,
+with ages above cap in cap's group.'''
+    return (np.minimum(np.asarray(ages), cap) - 15) // 10
+
+
+class AdultState(object):
+    def __init__(self, min_year, max_year, min_age=15, max_age=80,
+            n_sexes=2, n_cd4=7, n_durations=3, n_draws=None):
+        ''' Zeroed adult state for every year of the projection, with a
+leading axis over draws if n_draws is given.'''
+        self.min_year = min_year
+        self.min_age = min_age
+        self.ages = range(min_age, max_age + 1)
+        self.draws = () if n_draws is None else (slice(None),)
+        draws = () if n_draws is None else (n_draws,)
+        n_years = max_year - min_year + 1
+        n_ages = max_age - min_age + 1
+        self.no_art = np.zeros(draws + (n_years, n_ages, n_sexes, n_cd4,
+            n_years))
+        self.art = np.zeros(draws + (n_years, n_ages, n_sexes, n_cd4,
+            n_durations, n_years))
+
+    def draw(self, d):
+        ''' State of draw d of a batched state, viewing the batch's arrays.'''
+        state = AdultState.__new__(AdultState)
+        state.min_year = self.min_year
+        state.min_age = self.min_age
+        state.ages = self.ages
+        state.draws = ()
+        state.no_art = self.no_art[d]
+        state.art = self.art[d]
+        return state
+
+    def bind(self, population, sexes, no_art_states, art_states, durations):
+        ''' Point the CD4 states of the adult ages in population at views of
+the state arrays.'''
+        for a, age in enumerate(self.ages):
+            for j in range(self.no_art.shape[0]):
+                year = self.min_year + j
+                for s, sex in enumerate(sexes):
+                    for c in range(len(no_art_states)):
+                        population[age][year][sex][no_art_states[c]] = self.no_art[j, a, s, c]
+                        population[age][year][sex][art_states[c]] = dict(
+                            (d, self.art[j, a, s, c, k]) for k, d in enumerate(durations))
+
+    def year(self, t):
+        ''' (no_art, art) views of year t, indexed by [draw,] age, sex, CD4
+[, ART duration] and year of infection.'''
+        j = self.draws + (t - self.min_year,)
+        return self.no_art[j], self.art[j]
+
+    def by_cd4(self, t):
+        ''' HIV+ adults in year t by [draw,] age, sex and CD4 category, on
+and off ART.'''
+        no_art, art = self.year(t)
+        return no_art.sum(-1) + art.sum(-1).sum(-1)
+
+    def totals(self, t):
+        ''' HIV+ adults in year t by [draw,] age and sex.'''
+        return self.by_cd4(t).sum(-1)
+
+
+def age_forward(pop, sr, mr):
+    ''' Survive and migrate a cohort by one year, flooring at zero.'''
+    return np.maximum(0., pop * sr + pop * mr * (1 + sr) / 2)
+
+
+def art_survivors(art, art_mortality, time_step):
+    ''' Adults on ART surviving one step, by age, sex and CD4 category.'''
+    return (art.sum(-1) * (1 - art_mortality / time_step)).sum(-1)
+
+
+def start_art_from_targets(no_art, target, survivors, t1, time_step):
+    ''' Move adults off no_art onto ART when coverage is set by age, sex
+and CD4 category: the shortfall of survivors from target, spread over the
+steps left in the year, is split across years of infection by their share
+of the CD4 category. As in the original loop, each year of infection's
+share is taken of what the earlier years left behind, so the years are
+stepped through in order.
+
+Returns the number starting ART, shaped like no_art.'''
+    need = (target - survivors) / (time_step - (t1 - 1))
+    start = np.zeros_like(no_art)
+    remaining = no_art.sum(-1)
+    for i in range(no_art.shape[-1]):
+        pop = no_art[..., i].copy()
+        positive = remaining > 0
+        share = np.where(positive, pop / np.where(positive, remaining, 1.), 0.)
+        start[..., i] = np.maximum(0., share * need)
+        no_art[..., i] = np.maximum(0., pop - start[..., i])
+        remaining = remaining - (pop - no_art[..., i])
+    return start
+
+
+def start_art_from_patients(no_art, new_patients, eligible, cd4_eligible):
+    ''' Move adults off no_art onto ART when new patients are set by sex
+and CD4 category: each eligible category starts the same fraction,
+new_patients / eligible capped at one, at every age and year of infection.
+Per draw, new_patients and eligible are shaped (draw, 1, sex, CD4).
+
+Returns the number starting ART, shaped like no_art.'''
+    positive = eligible > 0
+    fraction = np.where(positive & cd4_eligible,
+        np.minimum(1., new_patients / np.where(positive, eligible, 1.)), 0.)
+    start = no_art * fraction[..., np.newaxis]
+    no_art -= start
+    np.maximum(no_art, 0., out=no_art)
+    return start
+
+
+def progress(no_art, art, start_art, progression, mortality, art_mortality,
+        time_step):
+    ''' Apply one step of CD4 progression and HIV mortality off ART, and
+duration progression and HIV mortality on ART, in place. start_art are
+those who started ART this step and have already left no_art.
+
+progression and mortality are per-step rates by age, sex and CD4 category;
+art_mortality are annual rates by age, sex, CD4 category and duration.
+
+Returns the HIV deaths off and on ART, shaped like no_art and art.'''
+    progression = progression[..., np.newaxis]
+    mortality = mortality[..., np.newaxis]
+    alpha = art_mortality[..., np.newaxis]
+
+    entrants = np.zeros_like(no_art)
+    entrants[..., :-1, :] = no_art[..., 1:, :] * progression[..., 1:, :]
+    exits = no_art * (progression + mortality)
+    no_art_deaths = np.maximum(0., np.minimum(mortality * no_art, no_art))
+
+    dying = art * alpha / time_step
+    moving = art[..., :-1, :] * (12 / 6) / time_step
+    art_entrants = np.empty_like(art)
+    art_entrants[..., 0, :] = start_art
+    art_entrants[..., 1:, :] = moving
+    art_exits = dying.copy()
+    art_exits[..., :-1, :] += moving
+    art_deaths = np.maximum(0., np.minimum(dying, art))
+
+    no_art[...] = np.maximum(0., no_art + entrants - exits)
+    art[...] = np.maximum(0., art + art_entrants - art_exits)
+    return no_art_deaths, art_deaths
@@ -0,0 +1,297 @@
+import numpy as np
+
+import spectrum_kernel as kernel
+
+MIN_YEAR, MAX_YEAR = 2000, 2005
+N_DRAWS = 4
+TIME_STEP = 10
+
+SEXES = ['male', 'female']
+NO_ART = ['LT50CD4', '50to99CD4', '100to199CD4', '200to249CD4', '250to349CD4',
+    '350to500CD4', 'GT500CD4']
+ART = ['ART' + c for c in NO_ART]
+DURATIONS = ['LT6Mo', '6to12Mo', 'GT12Mo']
+AGES = range(15, 81)
+
+
+def random_inputs(rng):
+    ''' State and rates of one draw, as the projection passes them.'''
+    state = kernel.AdultState(MIN_YEAR, MAX_YEAR)
+    state.no_art[...] = rng.random(state.no_art.shape) * 100
+    state.art[...] = rng.random(state.art.shape) * 50
+    shape = state.no_art.shape[1:4]
+    return state, dict(
+        progression=rng.random(shape) * .1,
+        mortality=rng.random(shape) * .05,
+        art_mortality=rng.random(shape + (3,)) * .3,
+        targets=rng.random(shape) * 400,
+        new_patients=rng.random(shape[1:]) * 50,
+        eligible=rng.random(shape[1:]) * 500,
+        sr=rng.random(shape[1]) * .1 + .9,
+        mr=rng.random(shape[1]) * .01)
+
+
+def project_year(state, t, inputs, targets, sr, mr, cd4_eligible):
+    ''' Age year t - 1 into t, then run the ten ART and progression steps of
+year t, as cohort_spectrum.py does.'''
+    no_art, art = state.year(t)
+    prev_no_art, prev_art = state.year(t - 1)
+    no_art[..., 1:, :, :, :] = kernel.age_forward(
+        prev_no_art[..., :-1, :, :, :], sr[..., np.newaxis, :, np.newaxis, np.newaxis],
+        mr[..., np.newaxis, :, np.newaxis, np.newaxis])
+    art[..., 1:, :, :, :, :] = kernel.age_forward(
+        prev_art[..., :-1, :, :, :, :],
+        sr[..., np.newaxis, :, np.newaxis, np.newaxis, np.newaxis],
+        mr[..., np.newaxis, :, np.newaxis, np.newaxis, np.newaxis])
+
+    no_art = no_art[..., :t - MIN_YEAR]
+    art = art[..., :t - MIN_YEAR]
+    deaths = [np.zeros_like(no_art), np.zeros_like(art)]
+    for t1 in range(1, TIME_STEP + 1):
+        if targets:
+            survivors = kernel.art_survivors(art, inputs['art_mortality'], TIME_STEP)
+            start = kernel.start_art_from_targets(
+                no_art, inputs['targets'], survivors, t1, TIME_STEP)
+        else:
+            start = kernel.start_art_from_patients(
+                no_art, inputs['new_patients'], inputs['eligible'], cd4_eligible)
+        step_deaths = kernel.progress(
+            no_art, art, start, inputs['progression'], inputs['mortality'],
+            inputs['art_mortality'], TIME_STEP)
+        deaths[0] += step_deaths[0]
+        deaths[1] += step_deaths[1]
+    return deaths
+
+
+def check_batch_matches_draws(targets):
+    rng = np.random.default_rng(18)
+    draws = [random_inputs(rng) for _ in range(N_DRAWS)]
+    cd4_eligible = np.array([False, False, True, True, True, True, True])
+
+    batch = kernel.AdultState(MIN_YEAR, MAX_YEAR, n_draws=N_DRAWS)
+    batch.no_art[...] = np.stack([state.no_art for state, _ in draws])
+    batch.art[...] = np.stack([state.art for state, _ in draws])
+    batch_inputs = dict(
+        (k, np.stack([inputs[k] for _, inputs in draws])) for k in draws[0][1])
+    # rates by sex and CD4 only get a singleton age axis after the draw axis
+    for k in ['new_patients', 'eligible']:
+        batch_inputs[k] = batch_inputs[k][:, np.newaxis]
+
+    for t in range(MIN_YEAR + 1, MAX_YEAR + 1):
+        batch_deaths = project_year(
+            batch, t, batch_inputs, targets, batch_inputs['sr'],
+            batch_inputs['mr'], cd4_eligible)
+        for d, (state, inputs) in enumerate(draws):
+            deaths = project_year(
+                state, t, inputs, targets, inputs['sr'], inputs['mr'],
+                cd4_eligible)
+            np.testing.assert_allclose(batch_deaths[0][d], deaths[0], rtol=1e-12)
+            np.testing.assert_allclose(batch_deaths[1][d], deaths[1], rtol=1e-12)
+            np.testing.assert_allclose(batch.by_cd4(t)[d], state.by_cd4(t), rtol=1e-12)
+            np.testing.assert_allclose(batch.totals(t)[d], state.totals(t), rtol=1e-12)
+
+
+def test_batched_targets_match_per_draw_runs():
+    check_batch_matches_draws(targets=True)
+
+
+def test_batched_patients_match_per_draw_runs():
+    check_batch_matches_draws(targets=False)
+
+
+def test_bind_draw_views():
+    batch = kernel.AdultState(MIN_YEAR, MAX_YEAR, 15, 16, n_draws=2)
+    sexes = ['male', 'female']
+    no_art_states = ['c%d' % c for c in range(7)]
+    art_states = ['a%d' % c for c in range(7)]
+    population = dict(
+        (age, dict((year, dict((sex, {}) for sex in sexes))
+            for year in range(MIN_YEAR, MAX_YEAR + 1)))
+        for age in range(15, 17))
+    batch.draw(1).bind(population, sexes, no_art_states, art_states,
+        [6, 12, 13])
+
+    population[16][2003]['female']['c2'][0] = 5.
+    population[16][2003]['female']['a2'][12][1] = 7.
+    no_art, art = batch.year(2003)
+    assert no_art[1, 1, 1, 2, 0] == 5.
+    assert art[1, 1, 1, 2, 1, 1] == 7.
+    assert no_art[0].sum() == 0. and art[0].sum() == 0.
+
+
+def reference_rates(rng):
+    ''' Adult rates in the nested dicts cohort_spectrum.py reads them into.'''
+    def by(keys, value):
+        return dict((k, value()) for k in keys)
+    return dict(
+        progression=by([15, 25, 35, 45], lambda: by(SEXES,
+            lambda: by(NO_ART, lambda: rng.random() * .1))),
+        no_art_mortality=by(SEXES, lambda: by(range(4),
+            lambda: by(NO_ART, lambda: rng.random() * .05))),
+        on_art_mortality=by(SEXES, lambda: by(DURATIONS, lambda: by(range(5),
+            lambda: by(ART, lambda: rng.random() * .3)))))
+
+
+def kernel_rates(rates):
+    ''' The rate arrays cohort_spectrum.py builds from the nested dicts.'''
+    progression = np.zeros((len(AGES), len(SEXES), len(NO_ART)))
+    mortality = np.zeros((len(AGES), len(SEXES), len(NO_ART)))
+    art_mortality = np.zeros((len(AGES), len(SEXES), len(NO_ART), len(DURATIONS)))
+    for a, age in enumerate(AGES):
+        age10 = int(kernel.adult_age_group(age, 45))
+        age10_2 = int(kernel.adult_age_group(age, 55))
+        for s, sex in enumerate(SEXES):
+            for c in range(len(NO_ART)):
+                progression[a, s, c] = rates['progression'][15 + 10 * age10][sex][NO_ART[c]]
+                mortality[a, s, c] = rates['no_art_mortality'][sex][age10][NO_ART[c]]
+                for k, d in enumerate(DURATIONS):
+                    art_mortality[a, s, c, k] = rates['on_art_mortality'][sex][d][age10_2][ART[c]]
+    return progression, mortality, art_mortality
+
+
+def reference_step(population, t, t1, rates, on_art_scalar, coverage=None,
+        new_patients=None, eligible=None, lower_limits=None, eligibility=None):
+    ''' One ART and progression step of the per-element loop cohort_spectrum.py
+ran before the adult state was held in arrays, in place on population: ART
+is started from coverage counts by sex, age and CD4 category if coverage is
+given, or else from new patients and eligible adults by CD4 category and sex.
+
+Returns the HIV deaths by age, sex and year of infection.'''
+    deaths = np.zeros((len(AGES), len(SEXES), t - MIN_YEAR))
+    for s, sex in enumerate(SEXES):
+        for age in AGES:
+            age5_2 = (age - 15) - (age - 15) % 10 + 15
+            age10 = ((age - (age - 5) % 10) - 15) // 10
+            if age > 45:
+                age5_2 = 45 - 45 % 5
+                age10 = ((45 - (45 - 5) % 10) - 15) // 10
+            age10_2 = ((age - (age - 5) % 10) - 15) // 10
+            if age > 55:
+                age10_2 = ((55 - (55 - 5) % 10) - 15) // 10
+            pop = population[age][t][sex]
+            entrants = {}
+            exits = {}
+            for c in reversed(range(len(NO_ART))):
+                cd4 = NO_ART[c]
+                if coverage is not None:
+                    target = coverage[sex][age][cd4]
+                    survivors = 0
+                    for d in DURATIONS:
+                        alpha = rates['on_art_mortality'][sex][d][age10_2][ART[c]] * on_art_scalar
+                        survivors += sum(pop[ART[c]][d]) * (1 - alpha / TIME_STEP)
+                for i in range(MIN_YEAR, t):
+                    j = i - MIN_YEAR
+                    start_art = 0
+                    if sum(pop[cd4]) > 0:
+                        share = pop[cd4][j] / sum(pop[cd4])
+                    else:
+                        share = 0
+                    if coverage is not None:
+                        start_art = max(0.0, share * (target - survivors) / (TIME_STEP - (t1 - 1)))
+                    elif eligible[cd4][sex] > 0 and lower_limits[cd4] < eligibility:
+                        start_art = share * min(sum(pop[cd4]),
+                            new_patients[cd4][sex] * sum(pop[cd4]) / eligible[cd4][sex])
+                    pop[cd4][j] -= start_art
+                    if pop[cd4][j] < 0:
+                        pop[cd4][j] = 0
+                    if cd4 == 'GT500CD4':
+                        entrants[cd4, j] = 0
+                    else:
+                        entrants[cd4, j] = pop[NO_ART[c + 1]][j] * rates['progression'][age5_2][sex][NO_ART[c + 1]]
+                    mu = rates['no_art_mortality'][sex][age10][cd4]
+                    exits[cd4, j] = pop[cd4][j] * (rates['progression'][age5_2][sex][cd4] + mu)
+                    deaths[age - 15, s, j] += max(0, min(mu * pop[cd4][j], pop[cd4][j]))
+
+                    art = pop[ART[c]]
+                    for d in DURATIONS:
+                        alpha = rates['on_art_mortality'][sex][d][age10_2][ART[c]] * on_art_scalar
+                        if d == 'LT6Mo':
+                            entrants[ART[c], d, j] = start_art
+                            exits[ART[c], d, j] = art[d][j] * alpha / TIME_STEP + art[d][j] * (12 / 6) / TIME_STEP
+                        elif d == '6to12Mo':
+                            entrants[ART[c], d, j] = art['LT6Mo'][j] * (12 / 6) / TIME_STEP
+                            exits[ART[c], d, j] = art[d][j] * alpha / TIME_STEP + art[d][j] * (12 / 6) / TIME_STEP
+                        else:
+                            entrants[ART[c], d, j] = art['6to12Mo'][j] * (12 / 6) / TIME_STEP
+                            exits[ART[c], d, j] = art[d][j] * alpha / TIME_STEP
+                        deaths[age - 15, s, j] += max(0, min(alpha * art[d][j] / TIME_STEP, art[d][j]))
+
+            for c in range(len(NO_ART)):
+                for j in range(t - MIN_YEAR):
+                    pop[NO_ART[c]][j] = max(0, pop[NO_ART[c]][j] + entrants[NO_ART[c], j] - exits[NO_ART[c], j])
+                    for d in DURATIONS:
+                        pop[ART[c]][d][j] = max(0, pop[ART[c]][d][j] + entrants[ART[c], d, j] - exits[ART[c], d, j])
+    return deaths
+
+
+def check_kernel_matches_reference_loop(targets):
+    rng = np.random.default_rng(2017)
+    t = MIN_YEAR + 3
+    state = kernel.AdultState(MIN_YEAR, MAX_YEAR)
+    state.no_art[...] = rng.random(state.no_art.shape) * 100
+    state.art[...] = rng.random(state.art.shape) * 50
+    # nobody has been infected in year t or later yet
+    state.no_art[..., t - MIN_YEAR:] = 0
+    state.art[..., t - MIN_YEAR:] = 0
+    reference = kernel.AdultState(MIN_YEAR, MAX_YEAR)
+    reference.no_art[...] = state.no_art
+    reference.art[...] = state.art
+    population = dict(
+        (age, dict((year, dict((sex, {}) for sex in SEXES))
+            for year in range(MIN_YEAR, MAX_YEAR + 1)))
+        for age in AGES)
+    reference.bind(population, SEXES, NO_ART, ART, DURATIONS)
+
+    rates = reference_rates(rng)
+    on_art_scalar = .8
+    lower_limits = dict(zip(NO_ART, [0, 50, 100, 200, 250, 350, 500]))
+    eligibility = 350
+    coverage = dict((sex, dict((age, dict((c, rng.random() * 400)
+        for c in NO_ART)) for age in AGES)) for sex in SEXES)
+    new_patients = dict((c, dict((sex, rng.random() * 50) for sex in SEXES))
+        for c in NO_ART)
+    eligible = dict((c, dict((sex, rng.random() * 500) for sex in SEXES))
+        for c in NO_ART)
+    eligible['50to99CD4']['female'] = 0
+
+    # the ART step as cohort_spectrum.py calls the kernel
+    progression, mortality, art_mortality = kernel_rates(rates)
+    art_mortality = art_mortality * on_art_scalar
+    no_art, art = state.year(t)
+    no_art = no_art[..., :t - MIN_YEAR]
+    art = art[..., :t - MIN_YEAR]
+    target_counts = np.array([[[coverage[sex][age][c] for c in NO_ART]
+        for sex in SEXES] for age in AGES])
+    new_patients_by_sex = np.array([[new_patients[c][sex] for c in NO_ART]
+        for sex in SEXES])
+    eligible_by_sex = np.array([[eligible[c][sex] for c in NO_ART]
+        for sex in SEXES])
+    cd4_eligible = np.array([lower_limits[c] for c in NO_ART]) < eligibility
+
+    for t1 in range(1, TIME_STEP + 1):
+        if targets:
+            expected = reference_step(population, t, t1, rates, on_art_scalar,
+                coverage=coverage)
+            survivors = kernel.art_survivors(art, art_mortality, TIME_STEP)
+            start = kernel.start_art_from_targets(no_art, target_counts,
+                survivors, t1, TIME_STEP)
+        else:
+            expected = reference_step(population, t, t1, rates, on_art_scalar,
+                new_patients=new_patients, eligible=eligible,
+                lower_limits=lower_limits, eligibility=eligibility)
+            start = kernel.start_art_from_patients(no_art,
+                new_patients_by_sex, eligible_by_sex, cd4_eligible)
+        no_art_deaths, art_deaths = kernel.progress(no_art, art, start,
+            progression, mortality, art_mortality, TIME_STEP)
+        deaths = no_art_deaths.sum(-2) + art_deaths.sum(-2).sum(-2)
+        np.testing.assert_allclose(deaths, expected, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(state.no_art, reference.no_art, rtol=1e-10, atol=1e-12)
+        np.testing.assert_allclose(state.art, reference.art, rtol=1e-10, atol=1e-12)
+
+
+def test_targets_match_reference_loop():
+    check_kernel_matches_reference_loop(targets=True)
+
+
+def test_patients_match_reference_loop():
+    check_kernel_matches_reference_loop(targets=False)
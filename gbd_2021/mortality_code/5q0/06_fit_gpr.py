@@ -1,41 +1,29 @@
 '''
-Description: Runs GPR on all data using selected parameters
+Description: Runs GPR on all data using selected parameters, for every
+location in one process
 '''
-import pylab as pl
+import argparse
 import os
 import sys
+
 import numpy as np
-import getpass
-import argparse
 import pandas as pd
 
-from pymc import *
-from pymc.gp import *
-from pymc.gp.cov_funs import matern
-
 # Get GPR settings
-import argparse
-
 parser = argparse.ArgumentParser()
-parser.add_argument('--location_id', type=int, required=True,
-                    action='store', help='The location_id for GPR')
-parser.add_argument('--ihme_loc_id', type=str, required=True,
-                    action='store', help='The ihme_loc_id for GPR')
 parser.add_argument('--version_id', type=int, required=True,
                     action='store', help='The version_id for GPR')
 parser.add_argument('--code_dir', type=str, required=True,
                     action='store',
-					help='Directory where child-mortality code is cloned')
+                    help='Directory where child-mortality code is cloned')
 args = parser.parse_args()
 
-location_id = args.location_id
-ihme_loc_id = args.ihme_loc_id
 version_id = args.version_id
 code_dir = args.code_dir
 
-# Load GPR library
-sys.path.append(code_dir)
-import gpr
+# mortgpr sits next to the stage directories of the mortality code
+sys.path.insert(0, os.path.join(code_dir, os.pardir))
+import mortgpr
 
 # Set directories
 version_dir = "FILEPATH"
@@ -46,73 +34,45 @@ output_dir = "FILEPATH"
 input_file = "FILEPATH"
 data = pd.read_csv(input_file)
 
-# Create vectors of data
-all_location_index = (data['ihme_loc_id'] == ihme_loc_id)
-index = (data['ihme_loc_id'] == ihme_loc_id) & (data['data'] == 1)
-region_name = pl.array(data['region_name'][all_location_index])[0]
-print(region_name)
-data_year = pl.array(data['year'][index])
-data_mort = pl.array(data['logit_mort'][index])
-data_var = pl.array(data['logit_var'][index])
-data_category = pl.array(data['category'][index])
+# Prediction years
+predictionyears = np.arange(int(data['year'].min()), int(data['year'].max()) + 1) + 0.5
 
-# Prior
-index = (data['ihme_loc_id'] == ihme_loc_id)
-prior_year = pl.array(data['year'][index])
-prior_mort = gpr.logit(data['pred2final'][index]) # this is to convert the prior to logit space
+# Prior, converted to logit space
+prior = pd.DataFrame({'ihme_loc_id': data['ihme_loc_id'],
+                      'year': data['year'],
+                      'prior': mortgpr.logit(data['pred2final'])})
 
-# Prediction years
-predictionyears = pl.array(range(int(min(data['year'])),int(max(data['year']))+1)) + 0.5
-mse = pl.array(data['mse'][index])
-mse = float(mse[0])
+# Data
+observed = data.loc[data['data'] == 1, ['ihme_loc_id', 'year', 'logit_mort', 'logit_var']]
+observed.columns = ['ihme_loc_id', 'year', 'value', 'variance']
 
 '''
 Import best parameters
 '''
+location_file = "FILEPATH"
+location_data = pd.read_csv(location_file)
 spacetime_parameter_file = "FILEPATH"
-data = pd.read_csv(spacetime_parameter_file)
-
-best_scale = float(data['scale'][(data['best']==1) & (data['location_id']==location_id)].iloc[0])
-best_amp2x = 1 
-
-
+param_data = pd.read_csv(spacetime_parameter_file)
+best = param_data.loc[param_data['best'] == 1].drop_duplicates('location_id')
+best = pd.merge(best[['location_id', 'scale']],
+                location_data[['location_id', 'ihme_loc_id']], on='location_id')
+
+params = data.drop_duplicates('ihme_loc_id')[['ihme_loc_id', 'mse']]
+params = pd.merge(params, best[['ihme_loc_id', 'scale']], on='ihme_loc_id', how='left')
+missing = params.loc[params['scale'].isnull(), 'ihme_loc_id']
+if len(missing):
+    raise ValueError("No best scale for {}".format(', '.join(missing)))
+best_amp2x = 1
+params['amp'] = np.sqrt(params['mse'] * best_amp2x)
+params['diff_degree'] = 1.
 
 '''
 Fit model with best parameters
 '''
-
-# fit model, get predictions
-if (len(data_year) == 0): # no data model
-	[M,C] = gpr.gpmodel_nodata(pyear=prior_year,pmort=prior_mort,scale=best_scale,predictionyears=predictionyears,sim=1000,amp2x=best_amp2x,mse=mse)
-else: # data model
-	[M,C] = gpr.gpmodel(ihme_loc_id,region_name,data_year,data_mort,data_var,data_category,prior_year,prior_mort,mse,best_scale,best_amp2x,predictionyears)
-
-
-## find mean and standard error, drawing from M and C
-draws = 1000
-mort_draws = np.zeros((draws, len(predictionyears)))
-gpr_seeds = [x+123456 for x in range(1,1001)]
-for draw in range(draws):
-	np.random.seed(gpr_seeds[draw])
-	mort_draws[draw,:] = Realization(M, C)(predictionyears)
-
-# collapse across draws
-# note: space transformations need to be performed at the draw level
-logit_est = gpr.collapse_sims(mort_draws)
-unlogit_est = gpr.collapse_sims(gpr.inv_logit(mort_draws))
-# the difference of the mean of the antilogited draws from the antilogit of the mean of the draws 
-mean_diff = np.subtract(unlogit_est,gpr.inv_logit(logit_est))
-
-
-# save the sims
-all_sim = []
-for i in range(len(predictionyears)):
-	for s in range(draws):
-		all_sim.append((ihme_loc_id, predictionyears[i], s, gpr.inv_logit(mort_draws[s][i])-mean_diff[i]))
-
-all_sim = pl.array(all_sim, [('ihme_loc_id', '|S32'), ('year', '<f8'), ('sim', '<f8'), ('mort', '<f8')])
-all_sim = pd.DataFrame(all_sim)
-all_sim['ihme_loc_id'] = all_sim['ihme_loc_id'].str.decode('utf-8')
-
-
-all_sim.to_csv("{}/gpr_{}.csv".format(output_dir, location_id), index = False)
+# Draws are inverse logit transformed at the draw level and shifted so their
+# mean is the inverse logit of the mean of the logit draws
+output_file = "{}/gpr.arrow".format(output_dir)
+with mortgpr.DrawWriter(output_file, value_name='mort') as writer:
+    for keys, mort_draws in mortgpr.fit(prior, observed, params, ['ihme_loc_id'],
+                                        predictionyears, draws=1000):
+        writer.write(keys, predictionyears, mortgpr.inv_logit_draws(mort_draws))
@@ -1,5 +1,6 @@
 import os
 import argparse
+import sys
 from multiprocessing import Pool
 
 import pandas as pd
@@ -8,6 +9,10 @@ import pandas as pd
 from core_maths.summarize import get_summary
 from gbd5q0py.config import Config5q0
 
+# mortgpr sits next to the stage directories of the mortality code
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+import mortgpr
+
 
 def make_summaries(data):
     """
@@ -73,10 +78,8 @@ for r in config.rakings:
 raking_files = [v for k, v in raking_dict.items()]
 raking_locations = [k for k, v in raking_dict.items()]
 
-# Get a list of GPR locations
-gpr_dict = {}
-for l in location_data.location_id.unique():
-    gpr_dict[l] = "FILEPATH"
+# GPR draws of every location
+gpr_file = "FILEPATH"
 
 # Read in and format raked and GPR data
 keep_cols = ['location_id', 'ihme_loc_id', 'year', 'sim', 'mort']
@@ -86,7 +89,9 @@ if location_id in raking_locations:
     data = pd.merge(data, location_data[['location_id', 'ihme_loc_id']],
                     on=['location_id'])
 else:
-    data = pd.read_csv(gpr_dict[location_id])
+    ihme_loc_id = location_data.loc[
+        location_data['location_id'] == location_id, 'ihme_loc_id']
+    data = mortgpr.read_draws(gpr_file, ihme_loc_id=ihme_loc_id.unique())
     data = pd.merge(data, location_data[['location_id', 'ihme_loc_id']],
                     on=['ihme_loc_id'])
 data = data[keep_cols]
@@ -1,18 +1,14 @@
 '''
-Description: Runs GPR on all data using selected parameters
+Description: Runs GPR on all data using selected parameters, for every
+location, sex and age group in one process
 '''
 import os
-import sys
-import getpass
 import argparse
+import logging
+import sys
 
 import numpy as np
-import pylab as pl
 import pandas as pd
-from pymc import *
-from pymc.gp import *
-from pymc.gp.cov_funs import matern
-import logging
 
 logging.basicConfig(
     format='%(asctime)s %(levelname)-8s %(message)s',
@@ -24,126 +20,96 @@ logging.info('Setting up')
 # Get GPR settings
 parser = argparse.ArgumentParser()
 parser.add_argument('--version_id', type=int, required=True,
-                    action='store', help='The location_id for GPR')
-parser.add_argument('--ihme_loc_id', type=str, required=True,
-                    action='store', help='The ihme_loc_id for GPR')
+                    action='store', help='The version_id for GPR')
 parser.add_argument('--code_dir', type=str, required=True,
                     action='store', help='Directory where age-sex code is cloned')
 args = parser.parse_args()
 
 version_id = args.version_id
-cc = args.ihme_loc_id
 code_dir = args.code_dir
+
+# mortgpr sits next to the stage directories of the mortality code
+sys.path.insert(0, os.path.join(code_dir, os.pardir))
+import mortgpr
+
 input_dir = "FILEPATH"
+output_dir = "FILEPATH"
 
-locations = pd.read_csv("FILEPATH")
-rr = locations.loc[locations["ihme_loc_id"] == cc, "region_name"].item()
+try:
+    os.makedirs(output_dir)
+except:
+    pass
 
-sys.path.append(code_dir)
-import gpr
-os.chdir(code_dir)
+series = ['ihme_loc_id', 'sex', 'age']
+priors = []
+observations = []
+all_params = []
+predictionyears = None
 
 for sex in ['male', 'female']:
     for age in ["enn", "lnn", "pnn", "pna", "pnb", "inf", "ch", "cha", "chb"]:
 
-        logging.info("Running {} {}".format(sex, age))
-
-        output_dir = "FILEPATH"
-
-        try:
-            os.makedirs(output_dir)
-        except:
-            pass
-
-        '''
-        Get GPR settings
-        '''
-        rnum = int(1)
-        hivsims = int(0)
+        logging.info("Importing {} {}".format(sex, age))
 
         '''
         Import data
         '''
         input_file = "FILEPATH"
         data = pd.read_csv(input_file)
+        data['sex'] = sex
+        data['age'] = age
 
         # data
-        index = (data['ihme_loc_id'] == cc) & (data['data'] == 1)
-        data_year = pl.array(data['year_id'][index])
-        data_mort = pl.array(data['log_qx_data'][index])
-        data_var = pl.array(data['data_var'][index])
-        data_category = pl.array(data['category'][index])
+        observed = data.loc[data['data'] == 1, series + ['year_id', 'log_qx_data', 'data_var']]
+        observed.columns = series + ['year', 'value', 'variance']
+        observations.append(observed)
 
         # prior
-        index = (data['ihme_loc_id'] == cc)
-        prior_year = pl.array(data['year_id'][index])
-        prior_mort = data['pred_log_qx_s2'][index]
+        prior = data[series + ['year_id', 'pred_log_qx_s2']]
+        prior.columns = series + ['year', 'prior']
+        priors.append(prior)
 
         # prediction years
-        predictionyears = pl.array(range(int(min(data['year_id'])),int(max(data['year_id']))+1)) + 0.5
-        mse = pl.array(data['mse'][index])
-        mse = float(mse[0])
+        years = np.arange(int(data['year_id'].min()), int(data['year_id'].max()) + 1) + 0.5
+        if predictionyears is None:
+            predictionyears = years
+        elif not np.array_equal(years, predictionyears):
+            raise ValueError("Prediction years of {} {} differ from the other models".format(sex, age))
 
         '''
         Import best parameters
         '''
         model_parameter_file = "FILEPATH"
-        data = pd.read_csv(model_parameter_file)
-        best_scale = float(data['scale'][(data['best']==1) & (data['ihme_loc_id']==cc)].iloc[0])
-        best_amp2x = float(data['amp2x'][(data['best']==1) & (data['ihme_loc_id']==cc)].iloc[0])
-
-        '''
-        Fit model with best parameters
-        '''
-        # fit model, get predictions
-        if (len(data_year) == 0): # no data model
-            [M,C] = gpr.gpmodel_nodata(pyear=prior_year,
-                                       pmort=prior_mort,
-                                       scale=best_scale,
-                                       predictionyears=predictionyears,
-                                       sim=1000,
-                                       amp2x=best_amp2x,
-                                       mse=mse)
-        else: # data model
-            [M,C] = gpr.gpmodel(cc,rr,data_year,data_mort,data_var,data_category,prior_year,prior_mort,mse,best_scale,best_amp2x,predictionyears)
-
-
-        ## find mean and standard error, drawing from M and C
-        draws = 1000
-        mort_draws = np.zeros((draws, len(predictionyears)))
-        gpr_seeds = [x+123456 for x in range(1,1001)]
-        for draw in range(draws):
-            np.random.seed(gpr_seeds[draw])
-            mort_draws[draw,:] = Realization(M, C)(predictionyears)
-
-        # collapse across draws
-        # note: space transformations need to be performed at the draw level
-        # not actually doing any transformations here, we'll do after
-        logit_est = gpr.collapse_sims(mort_draws)
-        unlogit_est = gpr.collapse_sims(mort_draws)
-
-        # save the predictions
-        all_est = []
-        for i in range(len(predictionyears)):
-            all_est.append((cc, predictionyears[i], unlogit_est['med'][i], unlogit_est['lower'][i], unlogit_est['upper'][i]))
-        labels = ['ihme_loc_id','year','med','lower','upper']
-        all_est_df = pd.DataFrame.from_records(all_est, columns=labels)
-        output_file = "{}/gpr_{}_{}_{}.txt".format(output_dir, cc, sex, age)
-        all_est_df.to_csv(output_file, index = False)
-
-        # save the sims
-        all_sim = []
-        for i in range(len(predictionyears)):
-            for s in range(draws):
-                all_sim.append((cc, predictionyears[i], s, mort_draws[s][i]))
- 
-        labels = ['ihme_loc_id','year','sim','mort']
-        all_sim_df = pd.DataFrame.from_records(all_sim, columns=labels)
-        output_file = "FILEPATH"
+        param_data = pd.read_csv(model_parameter_file)
+        best = param_data.loc[param_data['best'] == 1].drop_duplicates('ihme_loc_id')
+
+        params = data.drop_duplicates('ihme_loc_id')[series + ['mse']]
+        params = pd.merge(params, best[['ihme_loc_id', 'scale', 'amp2x']], on='ihme_loc_id', how='left')
+        missing = params.loc[params['scale'].isnull(), 'ihme_loc_id']
+        if len(missing):
+            raise ValueError("No best parameters for {} {}: {}".format(sex, age, ', '.join(missing)))
+        params['amp'] = np.sqrt(params['mse'] * params['amp2x'])
+        # the no data model is twice differentiable, the data model once
+        params['diff_degree'] = np.where(params['ihme_loc_id'].isin(observed['ihme_loc_id']), 1., 2.)
+        all_params.append(params)
 
+'''
+Fit model with best parameters
+'''
+# not actually doing any transformations here, we'll do after
+logging.info('Fitting and making draws')
+all_est = []
+output_file = "{}/gpr_sims.arrow".format(output_dir)
+with mortgpr.DrawWriter(output_file, value_name='mort') as writer:
+    for keys, mort_draws in mortgpr.fit(pd.concat(priors), pd.concat(observations),
+                                        pd.concat(all_params), series,
+                                        predictionyears, draws=1000):
         # first, assert not na
-        logging.info('Asserting no NAs in gpr output for {} {}'.format(sex, age))
-        nas = all_sim_df['mort'].notna()
-        assert nas.all()
-
-        all_sim_df.to_csv(output_file, index = False)
+        assert not np.isnan(mort_draws).any()
+        writer.write(keys, predictionyears, mort_draws)
+        all_est.append(mortgpr.summary_frame(keys, predictionyears, mort_draws))
+
+# save the predictions
+logging.info('Saving summaries')
+output_file = "{}/gpr.arrow".format(output_dir)
+pd.concat(all_est, ignore_index=True).to_feather(output_file)
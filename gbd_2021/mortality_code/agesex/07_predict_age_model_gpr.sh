@@ -5,9 +5,8 @@ conda_path=$2
 conda_env=$3
 
 version_id=$4
-ihme_loc_id=$5
-code_dir=$6
+code_dir=$5
 
 source ${conda_path}/bin/activate ${conda_env}
 
-eval "python ${code_path} --version_id ${version_id} --ihme_loc_id ${ihme_loc_id} --code_dir ${code_dir}"
\ No newline at end of file
+eval "python ${code_path} --version_id ${version_id} --code_dir ${code_dir}"
\ No newline at end of file
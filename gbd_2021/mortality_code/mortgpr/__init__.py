@@ -0,0 +1,5 @@
+from mortgpr.draws import DrawWriter, read_draws, summary_frame
+from mortgpr.model import (
+    SEED, fit, inv_logit, inv_logit_draws, logit, matern, mquantiles,
+    prior_mean, summarize,
+)
@@ -0,0 +1,91 @@
+'''
+Description: Columnar GPR output
+
+A run writes all of its draws to one Arrow IPC (feather v2) file instead of a
+CSV per location. The file is written one batch of series at a time, so a run
+never holds all of its draws in memory, and readers can filter it by location
+without loading the rest: pyarrow.dataset in Python, or arrow::open_dataset
+in R.
+'''
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from mortgpr.model import summarize
+
+
+class DrawWriter(object):
+
+    def __init__(self, path, value_name='mort', constants=None):
+        '''
+        Arguments:
+        path - file to write
+        value_name - column to hold the draws
+        constants - dict of columns with the same value in every row, like
+            the sex of a sex-specific run
+        '''
+        self.path = path
+        self.value_name = value_name
+        self.constants = constants or {}
+        self._writer = None
+
+    def write(self, keys, years, sims):
+        '''
+        Append the draws of a batch of series, one row per series, year and
+        sim, with the columns of keys, the constants, year, sim and the value.
+
+        Arguments:
+        keys - one row per series identifying it
+        years - years the series were predicted for
+        sims - draws with shape (series, years, draws)
+        '''
+        n_series, n_years, n_draws = sims.shape
+        rows = n_years * n_draws
+        df = pd.DataFrame({k: np.repeat(keys[k].values, rows) for k in keys})
+        for k, v in self.constants.items():
+            df[k] = v
+        df['year'] = np.tile(np.repeat(np.asarray(years, dtype=float), n_draws), n_series)
+        df['sim'] = np.tile(np.arange(n_draws), n_series * n_years)
+        df[self.value_name] = sims.ravel()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            self._writer = pa.ipc.new_file(self.path, table.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def summary_frame(keys, years, sims, columns=('med', 'lower', 'upper')):
+    '''
+    The mean, 2.5th and 97.5th percentiles of a batch of draws, one row per
+    series and year, with the columns of keys, year and columns
+    '''
+    est = keys.loc[keys.index.repeat(len(years))].reset_index(drop=True)
+    est['year'] = np.tile(np.asarray(years, dtype=float), len(keys))
+    for column, values in zip(columns, summarize(sims)):
+        est[column] = values.ravel()
+    return est
+
+
+def read_draws(path, columns=None, **filters):
+    '''
+    Read draws written by DrawWriter, keeping the rows whose columns take
+    one of the given values, e.g. read_draws(path, ihme_loc_id=['USA'])
+    '''
+    condition = None
+    for column, values in filters.items():
+        values = list(np.atleast_1d(values))
+        match = ds.field(column).isin(values)
+        condition = match if condition is None else condition & match
+    table = ds.dataset(path, format='arrow').to_table(columns=columns, filter=condition)
+    return table.to_pandas()
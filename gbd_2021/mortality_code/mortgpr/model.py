@@ -0,0 +1,231 @@
+'''
+Description: Gaussian process regression of many time series at once
+
+Replaces the PyMC2 gpmodel/gpmodel_nodata + Realization loop of the stage
+gpr.py modules. Every series gets the model those functions built: a mean
+prior interpolated from the stage-2 predictions, a Matern covariance with
+amplitude sqrt(mse * amp2x), and the data observed with their variances. The
+posterior is computed in closed form, and the series are fit in batches whose
+covariances are stacked and factorized with one batched Cholesky
+decomposition.
+
+The kernels mirror ST-GPR's batched engine (stgpr.st_gpr.gpr_batch) but are
+kept here, so the stage scripts only need numpy, scipy and pandas.
+'''
+
+from __future__ import division
+
+import numpy as np
+import pandas as pd
+from scipy.special import gamma, kv
+
+# First of the seeds the stage scripts re-seeded each draw with
+SEED = 123456
+
+# Most series fit together; bounds the memory taken by a batch of draws
+MAX_BATCH_SIZE = 100
+
+# Relative diagonal jitter tried, in order, when a covariance matrix is not
+# numerically positive definite
+JITTERS = [0., 1e-12, 1e-10, 1e-8, 1e-6]
+
+
+def logit(p):
+    return np.log(p / (1 - p))
+
+
+def inv_logit(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def inv_logit_draws(sims):
+    '''
+    Inverse logit of logit-space draws over the last axis, shifted so the
+    mean of the draws is the inverse logit of the mean of the logit draws
+    '''
+    p = inv_logit(sims)
+    mean_diff = p.mean(axis=-1) - inv_logit(sims.mean(axis=-1))
+    return p - mean_diff[..., np.newaxis]
+
+
+def mquantiles(x, prob, axis=-1):
+    '''
+    Quantiles of x along axis, with the plotting positions of
+    scipy.stats.mstats.mquantiles' defaults (alphap=betap=0.4)
+    '''
+    x = np.sort(x, axis=axis)
+    n = x.shape[axis]
+    aleph = n * prob + 0.4 + prob * 0.2
+    k = int(np.floor(np.clip(aleph, 1, n - 1)))
+    g = np.clip(aleph - k, 0., 1.)
+    return ((1 - g) * np.take(x, k - 1, axis=axis) +
+            g * np.take(x, k, axis=axis))
+
+
+def summarize(sims):
+    '''Mean, 2.5th and 97.5th percentiles of draws over the last axis'''
+    return (sims.mean(axis=-1), mquantiles(sims, .025), mquantiles(sims, .975))
+
+
+def matern(x, y, amp, scale, diff_degree=2):
+    '''
+    Matern covariance between every point of x and every point of y, over
+    the last axis of each, in the parameterization of PyMC2's
+    gp.matern.euclidean; leading axes are broadcast
+    '''
+    t = np.abs(x[..., :, np.newaxis] - y[..., np.newaxis, :])
+    t = t * 2. * np.sqrt(diff_degree) / scale
+    with np.errstate(invalid='ignore'):
+        cov = (0.5**(diff_degree - 1.) / gamma(diff_degree) *
+               t**diff_degree * kv(diff_degree, t))
+    cov[t == 0] = 1.
+    return amp**2 * cov
+
+
+def cholesky(matrices, sizes):
+    '''
+    Lower Cholesky factors of a stack of covariance matrices, adding the
+    smallest diagonal jitter relative to sizes that makes every matrix
+    positive definite, or else symmetric square roots from the
+    eigendecomposition
+    '''
+    identity = np.eye(matrices.shape[-1])
+    jitter_scale = sizes[:, np.newaxis, np.newaxis] * identity
+    for jitter in JITTERS:
+        try:
+            return np.linalg.cholesky(matrices + jitter * jitter_scale)
+        except np.linalg.LinAlgError:
+            continue
+    values, vectors = np.linalg.eigh(matrices)
+    return vectors * np.sqrt(np.clip(values, 0., None))[:, np.newaxis, :]
+
+
+def posterior(years, prior, amp, scale, diff_degree, obs_year, obs_value,
+              obs_prior, obs_var, obs_mask):
+    '''
+    Posterior mean and covariance of a stack of series on the same years.
+
+    Arguments:
+    years - (T,) years to predict
+    prior - (G, T) mean prior at years
+    amp - (G,) amplitudes
+    scale, diff_degree - Matern scale and differentiability, either shared
+        scalars or (G,) arrays
+    obs_year, obs_value, obs_prior, obs_var, obs_mask - the observations
+        padded to the most observed series, each (G, N)
+
+    Returns:
+    (mean, cov) with shapes (G, T) and (G, T, T)
+    '''
+    size = amp**2
+    amp = amp[:, np.newaxis, np.newaxis]
+    scale = np.reshape(scale, np.shape(scale) + (1, 1))
+    diff_degree = np.reshape(diff_degree, np.shape(diff_degree) + (1, 1))
+    mean = prior
+    cov = size[:, np.newaxis, np.newaxis] * matern(years, years, 1., scale,
+                                                   diff_degree)
+
+    mask = obs_mask
+    if mask.any():
+        # Padded observations are uncorrelated with everything and have unit
+        # variance and zero residual, so they leave the solves unchanged
+        pair = mask[:, :, np.newaxis] & mask[:, np.newaxis, :]
+        obs_cov = np.where(pair, matern(obs_year, obs_year, amp, scale,
+                                        diff_degree), 0.)
+        obs_cov += np.eye(mask.shape[1]) * np.where(mask, obs_var, 1.)[:, np.newaxis, :]
+        cross = matern(np.broadcast_to(years, prior.shape), obs_year, amp,
+                       scale, diff_degree)
+        cross = np.where(mask[:, np.newaxis, :], cross, 0.)
+        resid = np.where(mask, obs_value - obs_prior, 0.)
+
+        factor = cholesky(obs_cov, size)
+        whitened_cross = np.linalg.solve(factor, np.swapaxes(cross, 1, 2))
+        whitened_resid = np.linalg.solve(factor, resid[:, :, np.newaxis])
+        mean = mean + np.matmul(np.swapaxes(whitened_cross, 1, 2),
+                                whitened_resid)[:, :, 0]
+        cov = cov - np.matmul(np.swapaxes(whitened_cross, 1, 2),
+                              whitened_cross)
+    return mean, cov
+
+
+def prior_mean(x, pyear, pmort):
+    '''
+    The mean prior: the unique (year, prior) pairs sorted by year and
+    interpolated at x
+    '''
+    pairs = pd.DataFrame({'year': np.asarray(pyear, dtype=float),
+                          'prior': np.asarray(pmort, dtype=float)})
+    pairs = pairs.drop_duplicates().sort_values('year', kind='mergesort')
+    return np.interp(x, pairs['year'].values, pairs['prior'].values)
+
+
+def _split(frame, codes, n):
+    '''The rows of frame with each of the codes 0 ... n - 1'''
+    order = np.argsort(codes, kind='mergesort')
+    bounds = np.searchsorted(codes[order], np.arange(n + 1))
+    return [frame.iloc[order[bounds[i]:bounds[i + 1]]] for i in range(n)]
+
+
+def fit(prior, data, params, by, years, draws=1000, seed=SEED,
+        batch_size=MAX_BATCH_SIZE):
+    '''
+    Fit GPR to every series in params and draw from the posteriors.
+
+    Arguments:
+    prior - by + ['year', 'prior']: the mean prior of each series
+    data - by + ['year', 'value', 'variance']: the observations of each series;
+        series without any get the no-data model
+    params - by + ['amp', 'scale', 'diff_degree']: one row per series, with
+        amp = sqrt(mse * amp2x)
+    by - columns identifying a series
+    years - years to predict estimates for
+    draws - number of draws per series
+    seed - seed of the standard normals behind the draws. Every series is
+        drawn from the same normals, as the stage scripts drew every location
+        with the same per-draw seeds
+
+    Yields:
+    (keys, sims) for each batch of series, in the order of params: keys are
+    the rows of params[by] in the batch, and sims the draws, with shape
+    (series, years, draws)
+    '''
+    years = np.asarray(years, dtype=float)
+    noise = np.random.RandomState(seed).standard_normal((len(years), draws))
+
+    params = params.reset_index(drop=True)
+    series = pd.MultiIndex.from_frame(params[by])
+    if not series.is_unique:
+        raise ValueError("params has more than one row for a series")
+    priors = _split(prior, series.get_indexer(pd.MultiIndex.from_frame(prior[by])), len(params))
+    observed = _split(data, series.get_indexer(pd.MultiIndex.from_frame(data[by])), len(params))
+
+    for start in range(0, len(params), batch_size):
+        stop = min(start + batch_size, len(params))
+        chunk = params.iloc[start:stop]
+        n_obs = [len(observed[i]) for i in range(start, stop)]
+        width = max(n_obs)
+        batch = {
+            'amp': chunk['amp'].values.astype(float),
+            'scale': chunk['scale'].values.astype(float),
+            'diff_degree': chunk['diff_degree'].values.astype(float),
+            'prior': np.zeros((len(chunk), len(years))),
+            'obs_mask': np.arange(width) < np.array(n_obs)[:, np.newaxis]}
+        for name in ['obs_year', 'obs_value', 'obs_var', 'obs_prior']:
+            batch[name] = np.zeros((len(chunk), width))
+        for g, i in enumerate(range(start, stop)):
+            if len(priors[i]) == 0:
+                raise ValueError("No prior for series {}".format(series[i]))
+            pyear, pmort = priors[i]['year'].values, priors[i]['prior'].values
+            obs = observed[i]
+            batch['prior'][g] = prior_mean(years, pyear, pmort)
+            batch['obs_year'][g, :n_obs[g]] = obs['year'].values
+            batch['obs_value'][g, :n_obs[g]] = obs['value'].values
+            batch['obs_var'][g, :n_obs[g]] = obs['variance'].values
+            batch['obs_prior'][g, :n_obs[g]] = prior_mean(obs['year'].values, pyear, pmort)
+
+        mean, cov = posterior(
+            years, batch['prior'], batch['amp'], batch['scale'], batch['diff_degree'],
+            batch['obs_year'], batch['obs_value'], batch['obs_prior'], batch['obs_var'],
+            batch['obs_mask'])
+        sims = mean[:, :, np.newaxis] + np.matmul(cholesky(cov, batch['amp']**2), noise)
+        yield chunk[by].reset_index(drop=True), sims
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+
+from mortgpr import DrawWriter, fit, inv_logit, inv_logit_draws, matern, read_draws
+
+YEARS = np.arange(1990., 2000.)
+DRAWS = 40
+
+
+def closed_form_posterior(prior, amp, scale, diff_degree, obs_year=(),
+                          obs_value=(), obs_var=()):
+    '''GP posterior mean and covariance of one series, from the dense formulas'''
+    obs_year = np.asarray(obs_year, dtype=float)
+    cov = matern(YEARS, YEARS, amp, scale, diff_degree)
+    if not len(obs_year):
+        return prior, cov
+    obs_prior = np.interp(obs_year, YEARS, prior)
+    obs_cov = matern(obs_year, obs_year, amp, scale, diff_degree) + np.diag(obs_var)
+    cross = matern(YEARS, obs_year, amp, scale, diff_degree)
+    gain = np.linalg.solve(obs_cov, cross.T).T
+    return (prior + gain.dot(np.asarray(obs_value) - obs_prior),
+            cov - gain.dot(cross.T))
+
+
+def test_fit_matches_closed_form_posterior():
+    rng = np.random.RandomState(21)
+    locations = ['A', 'B', 'C']
+    prior = pd.DataFrame({
+        'ihme_loc_id': np.repeat(locations, len(YEARS)),
+        'year': np.tile(YEARS, len(locations)),
+        'prior': rng.uniform(-4, -3, len(YEARS) * len(locations))})
+    # C has no data and gets the no-data model
+    data = pd.DataFrame({
+        'ihme_loc_id': ['A', 'A', 'A', 'B'],
+        'year': [1991.5, 1995., 1998., 1993.],
+        'value': [-3.2, -3.6, -3.1, -3.9],
+        'variance': [.01, .02, .05, .03]})
+    params = pd.DataFrame({
+        'ihme_loc_id': locations, 'amp': [.2, .3, .25], 'scale': [10., 15., 10.],
+        'diff_degree': [2., 2., 1.]})
+
+    batches = list(fit(prior, data, params, ['ihme_loc_id'], YEARS,
+                       draws=DRAWS, batch_size=2))
+
+    assert [b[0]['ihme_loc_id'].tolist() for b in batches] == [['A', 'B'], ['C']]
+    sims = np.concatenate([b[1] for b in batches])
+    assert sims.shape == (len(locations), len(YEARS), DRAWS)
+    noise = np.random.RandomState(123456).standard_normal((len(YEARS), DRAWS))
+    for i, p in params.iterrows():
+        obs = data[data.ihme_loc_id == p.ihme_loc_id]
+        mean, cov = closed_form_posterior(
+            prior.loc[prior.ihme_loc_id == p.ihme_loc_id, 'prior'].values,
+            p.amp, p.scale, p.diff_degree,
+            obs['year'], obs['value'], obs['variance'])
+        # the draws are the posterior mean plus a square root of the
+        # posterior covariance times the shared standard normals
+        factor = (sims[i] - mean[:, np.newaxis]).dot(np.linalg.pinv(noise))
+        np.testing.assert_allclose(factor.dot(noise), sims[i] - mean[:, np.newaxis],
+                                   atol=1e-10)
+        np.testing.assert_allclose(factor.dot(factor.T), cov, atol=1e-8)
+
+
+def test_inv_logit_draws_keeps_mean():
+    sims = np.random.RandomState(3).normal(-2, .5, (2, 5, 100))
+    p = inv_logit_draws(sims)
+    np.testing.assert_allclose(p.mean(axis=-1), inv_logit(sims.mean(axis=-1)))
+    np.testing.assert_allclose(np.diff(p, axis=-1), np.diff(inv_logit(sims), axis=-1))
+
+
+def test_draw_writer_round_trip(tmp_path):
+    path = str(tmp_path / 'draws.arrow')
+    rng = np.random.RandomState(5)
+    batches = [(pd.DataFrame({'ihme_loc_id': ['A', 'B']}), rng.rand(2, 3, 4)),
+               (pd.DataFrame({'ihme_loc_id': ['C']}), rng.rand(1, 3, 4))]
+    with DrawWriter(path, constants={'sex': 'male'}) as writer:
+        for keys, sims in batches:
+            writer.write(keys, YEARS[:3], sims)
+
+    draws = read_draws(path, ihme_loc_id=['B', 'C'])
+
+    assert list(draws.columns) == ['ihme_loc_id', 'sex', 'year', 'sim', 'mort']
+    assert sorted(draws.ihme_loc_id.unique()) == ['B', 'C']
+    assert (draws.sex == 'male').all()
+    draws = draws.set_index(['ihme_loc_id', 'year', 'sim'])['mort'].sort_index()
+    np.testing.assert_array_equal(draws.loc['B'].values, batches[0][1][1].ravel())
+    np.testing.assert_array_equal(draws.loc['C'].values, batches[1][1][0].ravel())
@@ -1,6 +1,5 @@
 import glob
 import os
-import math
 import datetime
 import argparse
 
@@ -11,7 +10,8 @@ from core_maths.summarize import get_summary
 
 from gbdu5.io import get_sex_data, read_empirical_life_tables, get_finalizer_draws
 from gbdu5.rescale import rescale_qx_conditional, convert_qx_to_days
-from gbdu5.age_groups import MortAgeGroup, bin_five_year_ages, btime_to_wk
+from gbdu5.age_groups import MortAgeGroup, bin_five_year_ages
+from gbdu5.cohort import cohort_timing, to_array, cohort_deaths_person_years
 from gbdu5.transformations import reshape_wide, ready_to_merge, calculate_annualized_pct_change, back_calculate
 
 """
@@ -147,7 +147,7 @@ data = data.loc[data['age']<5]
 # Convert qx and qx_agg to log
 for c in ['qx', 'qxfive']:
     data = data.loc[data[c]>0]
-    data['ln{}'.format(c)] = data[c].apply(math.log)
+    data['ln{}'.format(c)] = np.log(data[c])
 
 # Run a simple regression to predict lnqx using lnqx_agg
 pars = []
@@ -185,7 +185,7 @@ else:
 
 data = pd.merge(data, pars, on=['sex_id', 'age'])
 
-data['lnq_3x2'] = data['q_3x2'].apply(math.log)
+data['lnq_3x2'] = np.log(data['q_3x2'])
 
 data['qx'] = np.exp(data['par_lnagg'] * data['lnq_3x2'] + data['par_cons'])
 
@@ -217,7 +217,7 @@ for a in ages:
     data[f'day_qx_{a.name}'] = convert_qx_to_days(data[f'qx_{a.name}'], a.days)
 
 
-data['year_id'] = data['year'].apply(math.floor).astype('int64')
+data['year_id'] = np.floor(data['year']).astype('int64')
 
 
 data['location_id'] = location_id
@@ -226,38 +226,8 @@ for c in ['location_id', 'year_id', 'sex_id', 'sim']:
 
 data_qx = data.copy(deep=True)
 
-# Create a DataFrame for the amount of time elapsed for each week in a year
-data = []
-for w in range(52):
-    # Convert weeks to year space using the midpoint of the week (x + 0.5)
-    week_time = (w + 0.5) * (1 / 52.0)
-    for year_id in range(start_year, end_year + 1):
-        data.append([year_id, year_id + week_time])
-data = pd.DataFrame(data, columns=['year_id', 'btime'])
-
-# Create timing DataFrame
-for a in ages:
-    # Calculate the start and end day of that age group for someone born at btime (birth time)
-    data[f'start_time_{a.name}'] = data['btime'] + a.start_year
-    data[f'end_time_{a.name}'] = data['btime'] + a.end_year
-
-    # Calculate the start and end year of that age group for someone born at btime (birth time)
-    data[f'start_year_{a.name}'] = data[f'start_time_{a.name}'].apply(math.floor).astype('int64')
-    data[f'end_year_{a.name}'] = data[f'end_time_{a.name}'].apply(math.floor).astype('int64')
-
-    # Calculate number of days in the start and end year
-    sc = f'days_in_start_year_{a.name}'
-    data[sc] = ((
-        1 - (data[f'start_time_{a.name}'] - data[f'start_year_{a.name}'])) * 365)
-    data[sc] = data[sc].apply(round)
-    data.loc[data[sc] > a.days, sc] = float(a.days)
-
-    # Calculate number of days in year after start year
-    ec = f'days_in_end_year_{a.name}'
-    data[ec] = float(a.days) - data[sc]
-
-data_timing = data.copy(deep=True)
-data_timing['week'] = data_timing['btime'].map(lambda x: btime_to_wk(x))
+# Timing of the weekly birth cohorts of each year through the age groups
+cohort_years, timing = cohort_timing(ages, start_year, end_year)
 
 
 # Read in birth data
@@ -269,124 +239,24 @@ df_births = df_births[['location_id', 'year_id', 'sex_id', 'sim', 'births']]
 for c in ['location_id', 'year_id', 'sex_id', 'sim']:
     df_births[c] = df_births[c].astype('int64')
 
-# Convert births to weeks
-df_births['start_alive'] = df_births['births'] / 52
-data_births = df_births[['location_id', 'year_id', 'sex_id', 'sim', 'start_alive']]
-
-# Set up initial values
-data_start_alive = {}
-data_start_alive['0'] = pd.merge(data_timing[['year_id', 'btime', 'week']],
-                                 data_births, on=['year_id'])
-
-# Define output container and columns
-output = []
-output_cols = ['location_id', 'year_id', 'btime', 'week', 'sex_id', 'age', 'sim',
-               'start_alive', 'start_deaths', 'mid_alive', 'end_deaths',
-               'end_alive','start_person_years', 'end_person_years',
-               'start_year', 'end_year']
-
-# Loop through
-previous_age = '0'
-for a_name in [a.name for a in ages]:
-    print(a_name)
-
-    data_qx_cols = ['location_id', 'year_id', 'sex_id', 'sim', f'day_qx_{a_name}']
-
-    # Define age-sepcific qx column
-    qx_col = f'day_qx_{a_name}'
-
-    # Define age-specific start and end columns
-    sy_col = f'start_year_{a_name}'
-    ey_col = f'end_year_{a_name}'
-    dsy_col = f'days_in_start_year_{a_name}'
-    dey_col = f'days_in_end_year_{a_name}'
-
-    # Define timing columns
-    timing_cols = ['year_id', 'week', sy_col, ey_col, dsy_col, dey_col]
-
-    # Merge initial alive with timing data
-    data = pd.merge(data_timing[timing_cols], data_start_alive[previous_age],
-                on=['year_id', 'week'])
-
-    # Merge on qx values for the start year
-    temp_qx = data_qx[data_qx_cols].copy(deep=True)
-    temp_qx = temp_qx.rename(columns={qx_col: 'qx_start', 'year_id': sy_col})
-    data = pd.merge(data, temp_qx, on=['location_id', 'sex_id', 'sim', sy_col],
-                    how='left')
-
-    # Merge on qx values for the end year
-    temp_qx = data_qx[data_qx_cols].copy(deep=True)
-    temp_qx = temp_qx.rename(columns={qx_col: 'qx_end', 'year_id': ey_col})
-    data = pd.merge(data, temp_qx, on=['location_id', 'sex_id', 'sim', ey_col],
-                    how='left')
-
-    # Calculate deaths in start year
-    data['start_deaths'] = (1 - (1 - data['qx_start'])**data[dsy_col]) * data['start_alive']
-
-    # Calculate number alive after start year
-    data['mid_alive'] = ((1 - data['qx_start'])**data[dsy_col]) * data['start_alive']
-
-    # Calculate deaths in end year
-    data['end_deaths'] = (1 - (1 - data['qx_end'])**data[dey_col]) * data['mid_alive']
-
-    # Calculate number alive after start year
-    data['end_alive'] = ((1 - data['qx_end'])**data[dey_col]) * data['mid_alive']
-
-    # Calculate person-years in start year
-    data['start_person_years'] = (
-        data['start_deaths'] * (data[dsy_col] / 2) / 365 + data['mid_alive'] * data[dsy_col] / 365)
-
-    # Calculate person-years in end year
-    data['end_person_years'] = (
-        (1 - (1 - data['qx_end'])**data[dey_col]) * data['mid_alive'] * (data[dsy_col] / 2) / 365 +
-        ((1 - data['qx_end'])**data[dey_col]) * data['mid_alive'] * (data[dey_col]/365)
-    )
-
-    # Add age to DataFrame
-    data['age'] = a_name
-
-    # Add data to output
-    data['start_year'] = data[sy_col]
-    data['end_year'] = data[ey_col]
-    data = data[output_cols]
-    output.append(data)
-
-    # Create DataFrame for next age group
-    data = data[['location_id', 'year_id', 'sex_id', 'sim', 'btime', 'week', 'end_alive']]
-    data = data.rename(columns={'end_alive': 'start_alive'})
-    data_start_alive[a_name] = data.copy(deep=True)
-
-    previous_age = a_name
-
-data_aged = pd.concat(output).reset_index(drop=True)
-
-# Calculate all of the deaths and person years for the start years
-start_year_index_cols = ['location_id', 'start_year', 'sex_id', 'age', 'sim']
-start_year_rename_cols = {
-    'start_year': 'year_id',
-    'start_deaths': 'deaths',
-    'start_person_years': 'person_years'
-}
-data_start_year = data_aged.groupby(start_year_index_cols)['start_deaths', 'start_person_years'].sum().copy(deep=True)
-data_start_year = data_start_year.reset_index()
-data_start_year = data_start_year.rename(columns=start_year_rename_cols)
-
-# Get all of the deaths and person years for the end years
-end_year_index_cols = ['location_id', 'end_year', 'sex_id', 'age', 'sim']
-end_year_rename_cols = {
-    'end_year': 'year_id',
-    'end_deaths': 'deaths',
-    'end_person_years': 'person_years'
-}
-data_end_year = data_aged.groupby(end_year_index_cols)['end_deaths', 'end_person_years'].sum().copy(deep=True)
-data_end_year = data_end_year.reset_index()
-data_end_year = data_end_year.rename(columns=end_year_rename_cols)
-
-# Combine start year and end year deaths & person years
-index_cols = ['location_id', 'year_id', 'sex_id', 'age', 'sim']
-final_data = pd.concat([data_start_year, data_end_year])
-final_data = final_data.groupby(index_cols)['deaths', 'person_years'].sum()
-final_data = final_data.reset_index()
+# Hold qx as a (location, sex, year, sim, age) array and births on the same
+# locations, sexes and sims over the cohort years
+index_cols = ['location_id', 'sex_id', 'year_id', 'sim']
+age_names = [a.name for a in ages]
+levels, day_qx = to_array(data_qx, index_cols, [f'day_qx_{a_name}' for a_name in age_names])
+births_levels = [levels[0], levels[1], cohort_years, levels[3]]
+_, births = to_array(df_births, index_cols, ['births'], levels=births_levels)
+
+# Age the cohorts through each age group
+deaths, person_years = cohort_deaths_person_years(
+    day_qx, levels[2], births[..., 0], cohort_years, timing, age_names)
+
+final_index = pd.MultiIndex.from_product(
+    [levels[0], levels[1], cohort_years, levels[3], age_names],
+    names=['location_id', 'sex_id', 'year_id', 'sim', 'age'])
+final_data = pd.DataFrame({'deaths': deaths.ravel(), 'person_years': person_years.ravel()},
+                          index=final_index).reset_index()
+final_data = final_data[['location_id', 'year_id', 'sex_id', 'age', 'sim', 'deaths', 'person_years']]
 
 # Get annualized rate of change from 1955 to 1960
 roc_data = calculate_annualized_pct_change(
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+
+def cohort_timing(ages, start_year, end_year, weeks=52):
+    # For weekly birth cohorts (birth year x week), the calendar years each age
+    # group starts and ends in and the number of days spent in each of them
+    years = np.arange(start_year, end_year + 1)
+    # Convert weeks to year space using the midpoint of the week (x + 0.5)
+    week_time = (np.arange(weeks) + 0.5) * (1 / float(weeks))
+    btime = years[:, None] + week_time[None, :]
+
+    timing = {}
+    for a in ages:
+        start_time = btime + a.start_year
+        end_time = btime + a.end_year
+        start_year_a = np.floor(start_time).astype('int64')
+        end_year_a = np.floor(end_time).astype('int64')
+
+        days_in_start_year = np.round((1 - (start_time - start_year_a)) * 365)
+        days_in_start_year = np.minimum(days_in_start_year, float(a.days))
+        days_in_end_year = float(a.days) - days_in_start_year
+
+        timing[a.name] = (start_year_a, end_year_a, days_in_start_year, days_in_end_year)
+
+    return years, timing
+
+
+def to_array(data, index_cols, value_cols, levels=None):
+    # Dense array of a long DataFrame with one axis per index column and a last
+    # axis over value_cols. Axes run over the sorted unique values of each
+    # index column unless levels are given; missing cells are NaN
+    data = data.set_index(index_cols)[value_cols]
+    if levels is None:
+        levels = data.index.remove_unused_levels().levels
+    levels = [np.asarray(l) for l in levels]
+    full = pd.MultiIndex.from_product(levels, names=index_cols)
+    shape = [len(l) for l in levels] + [len(value_cols)]
+    return levels, data.reindex(full).values.reshape(shape)
+
+
+def _gather_years(qx, qx_years, years):
+    # qx (location, sex, year, sim) at a (birth year, week) table of calendar
+    # years, NaN where the year has no qx
+    pos = np.minimum(np.searchsorted(qx_years, years), len(qx_years) - 1)
+    found = qx_years[pos] == years
+    gathered = qx[:, :, pos, :]
+    gathered[:, :, ~found, :] = np.nan
+    return gathered
+
+
+def _sum_by_year(values, cohort_years, years):
+    # Sum (location, sex, birth year, week, sim) values into the calendar years
+    # given per cohort, skipping missing values like a groupby sum
+    n_loc, n_sex, _, _, n_sim = values.shape
+    indicator = (cohort_years.ravel()[None, :] == years[:, None]).astype(np.float64)
+    values = np.nan_to_num(values.reshape(n_loc, n_sex, -1, n_sim), nan=0.0)
+    return np.einsum('yc,lscd->lsyd', indicator, values, optimize=True)
+
+
+def cohort_deaths_person_years(day_qx, qx_years, births, years, timing, age_names):
+    # Deaths and person-years by calendar year of weekly birth cohorts, aging
+    # through each age group in turn.
+    #   day_qx: (location, sex, qx year, sim, age) daily qx of age_names
+    #   births: (location, sex, birth year, sim) births over years
+    #   timing: from cohort_timing over years
+    # Returns deaths and person-years as (location, sex, year, sim, age)
+    weeks = timing[age_names[0]][0].shape[1]
+    start_alive = np.repeat(births[:, :, :, None, :] / float(weeks), weeks, axis=3)
+
+    shape = births.shape[:2] + (len(years), births.shape[3], len(age_names))
+    deaths = np.zeros(shape)
+    person_years = np.zeros(shape)
+
+    for i, a_name in enumerate(age_names):
+        sy, ey, dsy, dey = timing[a_name]
+        dsy = dsy[None, None, :, :, None]
+        dey = dey[None, None, :, :, None]
+
+        qx_start = _gather_years(day_qx[..., i], qx_years, sy)
+        qx_end = _gather_years(day_qx[..., i], qx_years, ey)
+
+        # Survival through the days spent in the start and end years
+        start_survival = (1 - qx_start)**dsy
+        end_survival = (1 - qx_end)**dey
+
+        start_deaths = (1 - start_survival) * start_alive
+        mid_alive = start_survival * start_alive
+        end_deaths = (1 - end_survival) * mid_alive
+        end_alive = end_survival * mid_alive
+
+        start_person_years = start_deaths * (dsy / 2) / 365 + mid_alive * dsy / 365
+        end_person_years = (
+            (1 - end_survival) * mid_alive * (dsy / 2) / 365 + end_survival * mid_alive * (dey / 365))
+
+        deaths[..., i] = _sum_by_year(start_deaths, sy, years) + _sum_by_year(end_deaths, ey, years)
+        person_years[..., i] = (_sum_by_year(start_person_years, sy, years) +
+                                _sum_by_year(end_person_years, ey, years))
+
+        start_alive = end_alive
+
+    return deaths, person_years
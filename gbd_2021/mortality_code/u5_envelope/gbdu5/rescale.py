@@ -1,3 +1,6 @@
+import numpy as np
+
+
 def rescale_qx_conditional(t):
     # Convert single-year qx to conditional probability space
     # Given that they will die between 2 and 4 what is the probability they will die during this age group
@@ -16,46 +19,63 @@ def rescale_qx_conditional(t):
     return t
 
 
-def rescale_qx_iterator(t, iterations, number_of_scalars, scalar_max, scalar_min):
+def solve_qx_scalar(qx, target, scalar_max, scalar_min, tol=1e-12, max_iterations=100):
+    # Find, for every row of qx (rows x ages), the scalar r for which
+    # 1 - prod(1 - qx * (1 + r)) matches target, by bracketed Newton steps
+    qx = np.asarray(qx, dtype=np.float64)
+    target = np.asarray(target, dtype=np.float64)
+    n = qx.shape[0]
+
+    # Scalars are kept positive, as the grid search did after its first pass.
+    # The adjusted probability is increasing in r until the largest qx
+    # reaches 1, where it equals 1, so the bracket is capped there
+    lo = np.full(n, max(float(scalar_min), 0.000000001))
+    hi = np.minimum(float(scalar_max), 1. / qx.max(axis=1) - 1.)
+    hi = np.maximum(hi, lo)
+
+    def adjusted(r, rows=slice(None)):
+        survival = 1 - qx[rows] * (1 + r[:, None])
+        return 1 - survival.prod(axis=1), survival
+
+    f_lo = adjusted(lo)[0] - target
+    f_hi = adjusted(hi)[0] - target
+
+    # Targets outside the bracket take the closest bound
+    r = np.where(f_lo >= 0, lo, np.where(f_hi <= 0, hi, (lo + hi) / 2))
+    active = (f_lo < 0) & (f_hi > 0)
+
+    for _ in range(max_iterations):
+        idx = np.flatnonzero(active)
+        if not len(idx):
+            break
+        ri = r[idx]
+        adj, survival = adjusted(ri, idx)
+        f = adj - target[idx]
+        lo[idx] = np.where(f < 0, ri, lo[idx])
+        hi[idx] = np.where(f > 0, ri, hi[idx])
+
+        # Newton step on d/dr of 1 - prod(1 - qx * (1 + r)), falling back to
+        # bisection when it leaves the bracket
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fprime = survival.prod(axis=1) * (qx[idx] / survival).sum(axis=1)
+            step = ri - f / fprime
+        outside = ~np.isfinite(step) | (step <= lo[idx]) | (step >= hi[idx])
+        step[outside] = (lo[idx][outside] + hi[idx][outside]) / 2
+
+        done = np.abs(f) < tol
+        r[idx] = np.where(done, ri, step)
+        active[idx[done | (np.abs(step - ri) < tol)]] = False
+
+    return r
+
+
+def rescale_qx_iterator(t, scalar_max, scalar_min, tol=1e-12, max_iterations=100):
     # Calculate 4q1 based off of individual qx values for 1-4
     t['pv4q1'] = 1 - (1 - t['qx_1']) * (1 - t['qx_2']) * (1 - t['qx_3']) * (1 - t['qx_4'])
 
-    # Set scalar min and max as columns in the data
-    t['scalar_max'] = scalar_max
-    t['scalar_min'] = scalar_min
-
-    # Begin iterator
-    for x in range(iterations):
-        diff_columns = []
-        # For some reason we do 11 instead of 10
-        for cq in range(number_of_scalars + 1):
-            #
-            cq_col = "y{}".format(cq)
-            rq_col = "r{}".format(cq + 1)
-            t[cq_col] = t['scalar_min'] + cq * ((t['scalar_max'] - t['scalar_min']) / float(number_of_scalars))
-            t[rq_col] = t[cq_col]
-
-            adjusted_col = "adjusted_4q1_{}".format(cq + 1)
-
-            t[adjusted_col] = 1 - (1 - t['qx_1'] * (1 + t[rq_col])) * (1 - t['qx_2'] * (1 + t[rq_col])) * (1 - t['qx_3'] * (1 + t[rq_col])) * (1 - t['qx_4'] * (1 + t[rq_col]))
-
-            diff_col = "diff_4q1_{}".format(cq + 1)
-            diff_columns.append(diff_col)
-            t.loc[t[adjusted_col] != 0, diff_col] = abs(t.loc[t[adjusted_col] != 0, adjusted_col] - t.loc[t[adjusted_col] != 0, "q_ch"])
-
-        t['diff_min'] = t[diff_columns].min(axis=1)
-
-        for cq in range(number_of_scalars + 1):
-            rq_col = "r{}".format(cq + 1)
-            diff_col = "diff_4q1_{}".format(cq + 1)
-
-            t.loc[t[diff_col] == t['diff_min'], 'r_min'] = t.loc[t[diff_col] == t['diff_min'], rq_col]
-
-
-        t['scalar_adjustment'] = abs(t['scalar_max'] - t['scalar_min']) / float(number_of_scalars)
-        t['scalar_max'] = t['r_min'] + 2 * t['scalar_adjustment']
-        t['scalar_min'] = t['r_min'] - 2 * t['scalar_adjustment']
-        t.loc[t['scalar_min'] < 0, 'scalar_min']  = 0.000000001
+    # Scalar that makes the rescaled single-year qx match 4q1
+    t['r_min'] = solve_qx_scalar(t[['qx_1', 'qx_2', 'qx_3', 'qx_4']].values, t['q_ch'].values,
+                                 scalar_max, scalar_min, tol=tol, max_iterations=max_iterations)
 
     return t
 
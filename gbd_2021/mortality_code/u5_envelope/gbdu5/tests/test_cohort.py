@@ -0,0 +1,151 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+from gbdu5.age_groups import MortAgeGroup, btime_to_wk
+from gbdu5.cohort import cohort_timing, to_array, cohort_deaths_person_years
+from gbdu5.rescale import convert_qx_to_days
+
+START_YEAR, END_YEAR = 1950, 1956
+
+a_enn = MortAgeGroup('enn', 7, 0)
+a_lnn = MortAgeGroup('lnn', 21, a_enn.end_day)
+a_pna = MortAgeGroup('pna', 155, a_lnn.end_day)
+a_pnb = MortAgeGroup('pnb', 182, a_pna.end_day)
+a_1 = MortAgeGroup('1', 365, a_pnb.end_day)
+a_2 = MortAgeGroup('2', 365, a_1.end_day)
+a_3 = MortAgeGroup('3', 365, a_2.end_day)
+a_4 = MortAgeGroup('4', 365, a_3.end_day)
+AGES = [a_enn, a_lnn, a_pna, a_pnb, a_1, a_2, a_3, a_4]
+
+INDEX_COLS = ['location_id', 'year_id', 'sex_id', 'age', 'sim']
+
+
+def merge_reference(ages, data_qx, df_births, start_year, end_year):
+    # The merge-based loop 01_u5.py aged the weekly birth cohorts with,
+    # before cohort.py replaced it with arrays
+    data = []
+    for w in range(52):
+        week_time = (w + 0.5) * (1 / 52.0)
+        for year_id in range(start_year, end_year + 1):
+            data.append([year_id, year_id + week_time])
+    data = pd.DataFrame(data, columns=['year_id', 'btime'])
+    for a in ages:
+        data[f'start_time_{a.name}'] = data['btime'] + a.start_year
+        data[f'end_time_{a.name}'] = data['btime'] + a.end_year
+        data[f'start_year_{a.name}'] = data[f'start_time_{a.name}'].apply(math.floor).astype('int64')
+        data[f'end_year_{a.name}'] = data[f'end_time_{a.name}'].apply(math.floor).astype('int64')
+        sc = f'days_in_start_year_{a.name}'
+        data[sc] = ((1 - (data[f'start_time_{a.name}'] - data[f'start_year_{a.name}'])) * 365)
+        data[sc] = data[sc].apply(round)
+        data.loc[data[sc] > a.days, sc] = float(a.days)
+        data[f'days_in_end_year_{a.name}'] = float(a.days) - data[sc]
+    data_timing = data.copy(deep=True)
+    data_timing['week'] = data_timing['btime'].map(btime_to_wk)
+
+    df_births = df_births.copy()
+    df_births['start_alive'] = df_births['births'] / 52
+    start_alive = pd.merge(data_timing[['year_id', 'btime', 'week']],
+                           df_births[['location_id', 'year_id', 'sex_id', 'sim', 'start_alive']],
+                           on=['year_id'])
+
+    output = []
+    for a_name in [a.name for a in ages]:
+        qx_col = f'day_qx_{a_name}'
+        sy_col, ey_col = f'start_year_{a_name}', f'end_year_{a_name}'
+        dsy_col, dey_col = f'days_in_start_year_{a_name}', f'days_in_end_year_{a_name}'
+        data = pd.merge(data_timing[['year_id', 'week', sy_col, ey_col, dsy_col, dey_col]],
+                        start_alive, on=['year_id', 'week'])
+        data_qx_cols = ['location_id', 'year_id', 'sex_id', 'sim', qx_col]
+        temp_qx = data_qx[data_qx_cols].rename(columns={qx_col: 'qx_start', 'year_id': sy_col})
+        data = pd.merge(data, temp_qx, on=['location_id', 'sex_id', 'sim', sy_col], how='left')
+        temp_qx = data_qx[data_qx_cols].rename(columns={qx_col: 'qx_end', 'year_id': ey_col})
+        data = pd.merge(data, temp_qx, on=['location_id', 'sex_id', 'sim', ey_col], how='left')
+
+        data['start_deaths'] = (1 - (1 - data['qx_start'])**data[dsy_col]) * data['start_alive']
+        data['mid_alive'] = ((1 - data['qx_start'])**data[dsy_col]) * data['start_alive']
+        data['end_deaths'] = (1 - (1 - data['qx_end'])**data[dey_col]) * data['mid_alive']
+        data['end_alive'] = ((1 - data['qx_end'])**data[dey_col]) * data['mid_alive']
+        data['start_person_years'] = (
+            data['start_deaths'] * (data[dsy_col] / 2) / 365 + data['mid_alive'] * data[dsy_col] / 365)
+        data['end_person_years'] = (
+            (1 - (1 - data['qx_end'])**data[dey_col]) * data['mid_alive'] * (data[dsy_col] / 2) / 365 +
+            ((1 - data['qx_end'])**data[dey_col]) * data['mid_alive'] * (data[dey_col] / 365))
+        data['age'] = a_name
+        data['start_year'] = data[sy_col]
+        data['end_year'] = data[ey_col]
+        output.append(data)
+
+        start_alive = data[['location_id', 'year_id', 'sex_id', 'sim', 'btime', 'week', 'end_alive']]
+        start_alive = start_alive.rename(columns={'end_alive': 'start_alive'})
+
+    data_aged = pd.concat(output).reset_index(drop=True)
+    parts = []
+    for when in ['start', 'end']:
+        part = data_aged.groupby(['location_id', f'{when}_year', 'sex_id', 'age', 'sim'])[
+            [f'{when}_deaths', f'{when}_person_years']].sum().reset_index()
+        parts.append(part.rename(columns={f'{when}_year': 'year_id', f'{when}_deaths': 'deaths',
+                                          f'{when}_person_years': 'person_years'}))
+    return pd.concat(parts).groupby(INDEX_COLS)[['deaths', 'person_years']].sum()
+
+
+def synthetic_inputs(rng):
+    qx_index = pd.MultiIndex.from_product(
+        [[6, 102], range(START_YEAR, END_YEAR + 1), [1, 2], range(3)],
+        names=['location_id', 'year_id', 'sex_id', 'sim']).to_frame(index=False)
+    data_qx = qx_index.copy()
+    for a in AGES:
+        data_qx[f'day_qx_{a.name}'] = convert_qx_to_days(
+            pd.Series(rng.uniform(.001, .05, len(qx_index))), a.days)
+    df_births = qx_index.copy()
+    df_births['births'] = rng.uniform(1e3, 1e5, len(qx_index))
+    return data_qx, df_births
+
+
+def test_cohort_deaths_person_years_match_merge_loop():
+    data_qx, df_births = synthetic_inputs(np.random.default_rng(23))
+
+    cohort_years, timing = cohort_timing(AGES, START_YEAR, END_YEAR)
+    index_cols = ['location_id', 'sex_id', 'year_id', 'sim']
+    age_names = [a.name for a in AGES]
+    levels, day_qx = to_array(data_qx, index_cols, [f'day_qx_{a_name}' for a_name in age_names])
+    _, births = to_array(df_births, index_cols, ['births'],
+                         levels=[levels[0], levels[1], cohort_years, levels[3]])
+    deaths, person_years = cohort_deaths_person_years(
+        day_qx, levels[2], births[..., 0], cohort_years, timing, age_names)
+    result = pd.DataFrame(
+        {'deaths': deaths.ravel(), 'person_years': person_years.ravel()},
+        index=pd.MultiIndex.from_product(
+            [levels[0], levels[1], cohort_years, levels[3], age_names],
+            names=['location_id', 'sex_id', 'year_id', 'sim', 'age'])
+    ).reorder_levels(INDEX_COLS).sort_index()
+
+    expected = merge_reference(AGES, data_qx, df_births, START_YEAR, END_YEAR)
+
+    # The merge loop also emits the years after END_YEAR that cohorts age
+    # into; with no qx there, their deaths and person-years are all zero
+    after_end = expected.index.get_level_values('year_id') > END_YEAR
+    assert after_end.any()
+    assert (expected[after_end] == 0).all().all()
+    # and it has no rows for the age-years no cohort reaches yet, which are
+    # zero in the arrays
+    expected = expected[~after_end]
+    unreached = ~result.index.isin(expected.index)
+    assert unreached.any()
+    assert (result[unreached] == 0).all().all()
+    result = result[~unreached]
+    expected = expected.reindex(result.index)
+
+    np.testing.assert_allclose(result['deaths'], expected['deaths'], rtol=1e-12)
+    np.testing.assert_allclose(result['person_years'], expected['person_years'], rtol=1e-12)
+
+
+def test_cohort_timing_days_add_up():
+    years, timing = cohort_timing(AGES, START_YEAR, END_YEAR)
+    assert (years == np.arange(START_YEAR, END_YEAR + 1)).all()
+    for a in AGES:
+        start_year, end_year, days_in_start, days_in_end = timing[a.name]
+        assert start_year.shape == (len(years), 52)
+        np.testing.assert_array_equal(days_in_start + days_in_end, float(a.days))
+        assert ((end_year - start_year) <= 1).all()
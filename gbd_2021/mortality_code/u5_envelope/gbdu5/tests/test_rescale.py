@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+from gbdu5.rescale import rescale_qx_iterator, solve_qx_scalar
+
+SCALAR_MAX, SCALAR_MIN = 2., -.5
+
+
+def adjusted_4q1(qx, r):
+    return 1 - np.prod(1 - qx * (1 + r[:, np.newaxis]), axis=1)
+
+
+def grid_search(qx, target, iterations=10, number_of_scalars=10):
+    # The 11-point grid search solve_qx_scalar replaced
+    scalar_max = np.full(len(qx), SCALAR_MAX)
+    scalar_min = np.full(len(qx), SCALAR_MIN)
+    for _ in range(iterations):
+        grid = scalar_min[:, np.newaxis] + np.arange(number_of_scalars + 1) * (
+            (scalar_max - scalar_min) / number_of_scalars)[:, np.newaxis]
+        diff = np.abs(np.stack(
+            [adjusted_4q1(qx, grid[:, i]) for i in range(grid.shape[1])], axis=1)
+            - target[:, np.newaxis])
+        r_min = grid[np.arange(len(qx)), diff.argmin(axis=1)]
+        adjustment = np.abs(scalar_max - scalar_min) / number_of_scalars
+        scalar_max = r_min + 2 * adjustment
+        scalar_min = np.where(r_min - 2 * adjustment < 0, 0.000000001, r_min - 2 * adjustment)
+    return r_min
+
+
+def random_qx(rng, n_rows):
+    qx = rng.uniform(.001, .05, (n_rows, 4))
+    true_r = rng.uniform(0, 1.5, n_rows)
+    return qx, adjusted_4q1(qx, true_r)
+
+
+def test_solve_qx_scalar_matches_grid_search():
+    rng = np.random.default_rng(22)
+    qx, target = random_qx(rng, 2000)
+
+    r = solve_qx_scalar(qx, target, SCALAR_MAX, SCALAR_MIN)
+
+    np.testing.assert_allclose(adjusted_4q1(qx, r), target, rtol=0, atol=1e-12)
+    # the grid search only got within its last grid spacing of the solution
+    np.testing.assert_allclose(r, grid_search(qx, target), rtol=0, atol=1e-4)
+
+
+def test_solve_qx_scalar_bounds():
+    qx = np.array([[.01, .02, .03, .04]] * 3)
+    target = adjusted_4q1(qx, np.array([-.2, 0, 1]))
+    target[2] = .99
+
+    r = solve_qx_scalar(qx, target, SCALAR_MAX, SCALAR_MIN)
+
+    # scalars stay positive, and targets past the upper bound take it
+    assert r[0] == r[1] == 0.000000001
+    assert r[2] == SCALAR_MAX
+
+
+def test_rescale_qx_iterator():
+    rng = np.random.default_rng(4)
+    qx, target = random_qx(rng, 10)
+    t = pd.DataFrame(qx, columns=['qx_1', 'qx_2', 'qx_3', 'qx_4']).assign(q_ch=target)
+
+    t = rescale_qx_iterator(t, SCALAR_MAX, SCALAR_MIN)
+
+    np.testing.assert_allclose(t['pv4q1'], adjusted_4q1(qx, np.zeros(10)))
+    np.testing.assert_allclose(
+        t['r_min'], solve_qx_scalar(qx, target, SCALAR_MAX, SCALAR_MIN))
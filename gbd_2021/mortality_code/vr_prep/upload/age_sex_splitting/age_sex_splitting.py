@@ -12,6 +12,7 @@ There are three main classes:
         objects are passed in.
 """
 
+import os
 import pandas as pd
 import numpy as np
 import sys
@@ -24,6 +25,81 @@ sys.path.append("".format(getpass.getuser()))
 from cod_prep.utils import report_if_merge_fail
 
 
+def _key_codes(frames, columns):
+    """
+    Jointly integer-code the key columns of several DataFrames, so that rows
+    with equal keys (missing values included) get equal codes in every frame.
+    Codes are recompressed after each column to keep them bounded.
+    """
+    lengths = [len(f) for f in frames]
+    codes = np.zeros(sum(lengths), dtype=np.int64)
+    for c in columns:
+        values = pd.concat([f[c] for f in frames], ignore_index=True)
+        column_codes, uniques = pd.factorize(values)
+        codes = codes * (len(uniques) + 1) + (column_codes + 1)
+        codes = pd.factorize(codes)[0].astype(np.int64)
+    return np.split(codes, np.cumsum(lengths)[:-1])
+
+
+def _left_join_index(left_codes, right_codes):
+    """
+    Row positions of a many-to-many left join on integer codes, in the row
+    order of pandas.merge(how='left'). Unmatched left rows get -1 on the right.
+    """
+    order = np.argsort(right_codes, kind='stable')
+    sorted_codes = right_codes[order]
+    start = np.searchsorted(sorted_codes, left_codes, side='left')
+    counts = np.searchsorted(sorted_codes, left_codes, side='right') - start
+
+    n = np.maximum(counts, 1)
+    left = np.repeat(np.arange(len(left_codes)), n)
+    offset = np.arange(len(left)) - np.repeat(np.cumsum(n) - n, n)
+    right = np.full(len(left), -1, dtype=np.int64)
+    matched = np.repeat(counts, n) > 0
+    right[matched] = order[np.repeat(start, n)[matched] + offset[matched]]
+    return left, right
+
+
+def _take_columns(data, positions, columns):
+    """
+    Columns of data at positions, with missing values where a position is -1
+    """
+    taken = {}
+    missing = positions < 0
+    for c in columns:
+        if len(data) == 0:
+            # Nothing joins to an empty frame
+            taken[c] = np.full(len(positions), np.nan)
+            continue
+        values = data[c].to_numpy()[np.where(missing, 0, positions)]
+        if missing.any():
+            values = pd.Series(values).where(~missing).to_numpy()
+        taken[c] = values
+    return taken
+
+
+class SplitIndex(object):
+    """
+    CSR mapping from aggregate groups to their most-detailed groups: the
+    detailed groups of aggregates[i] are detailed[indptr[i]:indptr[i + 1]]
+    """
+    def __init__(self, mapping, aggregate_column, detailed_column):
+        mapping = mapping.drop_duplicates().sort_values(aggregate_column, kind='mergesort')
+        self.aggregates, counts = np.unique(mapping[aggregate_column].to_numpy(), return_counts=True)
+        self.indptr = np.concatenate([[0], np.cumsum(counts)])
+        self.detailed = mapping[detailed_column].to_numpy()
+
+    def counts(self, aggregate_ids):
+        """
+        Number of detailed groups for each aggregate id, 0 when it is unmapped
+        """
+        aggregate_ids = np.asarray(aggregate_ids)
+        pos = np.minimum(np.searchsorted(self.aggregates, aggregate_ids), len(self.aggregates) - 1)
+        found = self.aggregates[pos] == aggregate_ids
+        return np.where(found, self.indptr[pos + 1] - self.indptr[pos], 0), pos
+
+
+
 class AgeSexInputData(object):
     def __init__(self, input_data, sex_id_column='sex_id',
                  age_group_id_column='age_group_id', value_column='value'):
@@ -108,7 +184,8 @@ class AgeSexDistribution(object):
 
 
 class AgeSexDataSplit(object):
-    def __init__(self, input_data, distribution_data, pop_data, gbd_round_id, is_cod_vr, out_dir):
+    def __init__(self, input_data, distribution_data, pop_data, gbd_round_id, is_cod_vr, out_dir,
+                 cache_dir=None):
         # Input data
         self.input_data = input_data
         self.distribution_data = distribution_data
@@ -119,6 +196,10 @@ class AgeSexDataSplit(object):
         self.is_cod_vr = is_cod_vr
         self.out_dir = out_dir
 
+        # Directory where the age split mapping is cached, shared by every
+        # VR run of the GBD round
+        self.cache_dir = cache_dir
+
 
     # Validation
     def check_valid_age_groups(self):
@@ -197,9 +278,22 @@ class AgeSexDataSplit(object):
     def get_age_split_mapping(self, age_group_list):
         """
         Look up each age group id to determine the underlying most-detailed ages
+
+        When a cache_dir is set, the mapping is read from and added to an
+        on-disk cache for the GBD round, so the age trees are only looked up
+        once across runs.
         """
+        cache_file = None
+        cached = pd.DataFrame(columns=['age_group_id_aggregate', 'age_group_id'])
+        if self.cache_dir is not None:
+            cache_file = "{}/age_split_mapping_{}.csv".format(self.cache_dir, self.gbd_round_id)
+            if os.path.exists(cache_file):
+                cached = pd.read_csv(cache_file)
+
         mapping = []
         for age_group_id in age_group_list:
+            if age_group_id in cached['age_group_id_aggregate'].values:
+                continue
 
             # We want GBD2019 age groups for all non-22 age groups. New age groups should only be split to from unknown and both sex.
             if (age_group_id == 22):
@@ -211,41 +305,74 @@ class AgeSexDataSplit(object):
                 mapping.append({
                     'age_group_id_aggregate': age_group_id,
                     'age_group_id': l.id})
-        return pd.DataFrame(mapping)
-
 
-    # Data prep
-    def expand_age_groups(self, data):
-        # Get age group mappings
-        age_group_list = data['age_group_id'].drop_duplicates().tolist()
-        age_group_id_mapping = self.get_age_split_mapping(age_group_list)
+        if len(mapping) == 0:
+            mapping = cached
+        else:
+            mapping = pd.concat([cached, pd.DataFrame(mapping)], ignore_index=True)
+            if cache_file is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                # Write then rename, so a concurrent run never reads a partial file
+                tmp_file = "{}.{}.tmp".format(cache_file, os.getpid())
+                mapping.to_csv(tmp_file, index=False)
+                os.replace(tmp_file, cache_file)
 
-        # Merge on mappings to expand age groups
-        data = data.rename(columns={'age_group_id': 'age_group_id_aggregate'})
-        data = pd.merge(
-            data, age_group_id_mapping, on='age_group_id_aggregate', how='left')
-        report_if_merge_fail(df=data, check_col='age_group_id', merge_cols=['age_group_id_aggregate'])
+        mapping = mapping.astype('int64')
+        return mapping.loc[mapping['age_group_id_aggregate'].isin(age_group_list)].reset_index(drop=True)
 
-        return data
 
-    def expand_sex_groups(self, data):
-        # Get sex mappings
-        sex_id_mapping = self.get_sex_split_mapping()
+    # Data prep
+    def expand_age_sex_groups(self, data):
+        """
+        Expand each row to the most-detailed sex and age groups of its
+        aggregate sex and age group, using CSR mappings of aggregate to
+        detailed groups instead of merges
+        """
+        sex_index = SplitIndex(self.get_sex_split_mapping(), 'sex_id_aggregate', 'sex_id')
+        age_group_list = data['age_group_id'].drop_duplicates().tolist()
+        age_index = SplitIndex(
+            self.get_age_split_mapping(age_group_list), 'age_group_id_aggregate', 'age_group_id')
+
+        sex_counts, sex_pos = sex_index.counts(data['sex_id'].to_numpy())
+        age_counts, age_pos = age_index.counts(data['age_group_id'].to_numpy())
+
+        # Rows are expanded sex first, then age within sex. Unmapped groups
+        # keep one row with a missing detailed group
+        n_sex = np.maximum(sex_counts, 1)
+        n_age = np.maximum(age_counts, 1)
+        n = n_sex * n_age
+        rows = np.repeat(np.arange(len(data)), n)
+        offset = np.arange(len(rows)) - np.repeat(np.cumsum(n) - n, n)
+        row_n_age = n_age[rows]
+
+        data = data.rename(columns={
+            'sex_id': 'sex_id_aggregate', 'age_group_id': 'age_group_id_aggregate'})
+        data = data.iloc[rows].reset_index(drop=True)
+
+        for column, index, counts, pos, within in [
+                ('sex_id', sex_index, sex_counts, sex_pos, offset // row_n_age),
+                ('age_group_id', age_index, age_counts, age_pos, offset % row_n_age)]:
+            found = counts[rows] > 0
+            detailed = index.detailed[np.where(found, index.indptr[pos[rows]] + within, 0)]
+            if not found.all():
+                detailed = np.where(found, detailed, np.nan)
+            data[column] = detailed
 
-        # Merge on mappings to expand age groups
-        data = data.rename(columns={'sex_id': 'sex_id_aggregate'})
-        data = pd.merge(data, sex_id_mapping, on='sex_id_aggregate', how='left')
         report_if_merge_fail(df=data, check_col="sex_id", merge_cols=['sex_id_aggregate'])
+        report_if_merge_fail(df=data, check_col='age_group_id', merge_cols=['age_group_id_aggregate'])
 
         return data
 
-    def expand_age_sex_groups(self, data):
-        # Expand sex groups
-        data = self.expand_sex_groups(data)
-
-        # Expand age groups
-        data = self.expand_age_groups(data)
-
+    def left_join(self, data, other, on):
+        """
+        pandas.merge(data, other, on=on, how='left') on integer-coded keys
+        """
+        left_codes, right_codes = _key_codes([data, other], on)
+        left, right = _left_join_index(left_codes, right_codes)
+        data = data.iloc[left].reset_index(drop=True)
+        columns = [c for c in other.columns if c not in on]
+        for c, values in _take_columns(other, right, columns).items():
+            data[c] = values
         return data
 
     def prep_data(self):
@@ -357,17 +484,16 @@ class AgeSexDataSplit(object):
         final_weights = pd.concat([final_weights, new_wts4], sort=True)
 
         # Merge on weights
-        data = pd.merge(
-            data, final_weights,
-            on=self.distribution_data.index_columns, how='left')
+        data = self.left_join(
+            data, final_weights.reset_index(drop=True), self.distribution_data.index_columns)
 
         # If all
         report_if_merge_fail(df=data, check_col="weight", merge_cols=self.distribution_data.index_columns)
 
         # Merge on population
-        data = pd.merge(
-            data, self.pop_data.copy(deep=True),
-            on=['location_id', 'year_id', 'sex_id', 'age_group_id'], how='left')
+        data = self.left_join(
+            data, self.pop_data.reset_index(drop=True),
+            ['location_id', 'year_id', 'sex_id', 'age_group_id'])
         report_if_merge_fail(df=data, check_col="population", merge_cols=['location_id', 'year_id', 'sex_id', 'age_group_id'])
 
         return data
@@ -375,11 +501,14 @@ class AgeSexDataSplit(object):
 
     # Do math
     def calculate_k_denominator(self, data):
-        data = data.copy(deep=True)
-        data.loc[:,'k_denominator'] = data['weight'] * data['population']
-        data = data.groupby(self.k_denominator_index_columns)['k_denominator'].sum()
-        data = data.reset_index()
-        return data
+        """
+        Sum of weight * population over each aggregate group, as a segment
+        sum over integer group codes, aligned with the rows of data
+        """
+        groups = _key_codes([data], self.k_denominator_index_columns)[0]
+        expected = (data['weight'] * data['population']).to_numpy(dtype=np.float64)
+        k_denominator = np.bincount(groups, weights=np.nan_to_num(expected))
+        return k_denominator[groups]
 
 
     def relative_rate_split(self, data):
@@ -415,12 +544,7 @@ class AgeSexDataSplit(object):
         data = self.prep_data()
 
         # Calculate k denominators
-        k_denominator = self.calculate_k_denominator(data)
-        data = pd.merge(
-            data, k_denominator,
-            on=self.k_denominator_index_columns,
-            how='left')
-        report_if_merge_fail(df=data, check_col="k_denominator", merge_cols=self.k_denominator_index_columns)
+        data['k_denominator'] = self.calculate_k_denominator(data)
 
         # Run age-sex split
         data = self.relative_rate_split(data)
@@ -0,0 +1,139 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import age_sex_splitting as asp
+
+AGE_SPLIT_MAPPING = pd.DataFrame({
+    'age_group_id_aggregate': [22, 22, 22, 1, 1, 5, 2],
+    'age_group_id': [2, 3, 5, 2, 3, 5, 2],
+})
+
+
+def make_split(input_data=None):
+    split = asp.AgeSexDataSplit(
+        input_data=input_data, distribution_data=None, pop_data=None,
+        gbd_round_id=7, is_cod_vr="FALSE", out_dir=None)
+    split.get_age_split_mapping = lambda age_group_list: AGE_SPLIT_MAPPING
+    return split
+
+
+def test_left_join_index_matches_merge():
+    rng = np.random.default_rng(24)
+    for _ in range(50):
+        left_codes = rng.integers(0, 6, rng.integers(0, 12))
+        right_codes = rng.integers(0, 6, rng.integers(0, 9))
+
+        left, right = asp._left_join_index(left_codes, right_codes)
+
+        expected = pd.merge(
+            pd.DataFrame({'code': left_codes, 'left': np.arange(len(left_codes))}),
+            pd.DataFrame({'code': right_codes, 'right': np.arange(len(right_codes))}),
+            on='code', how='left')
+        np.testing.assert_array_equal(left, expected['left'])
+        np.testing.assert_array_equal(right, expected['right'].fillna(-1))
+
+
+@pytest.mark.parametrize('n_right', [7, 0])
+def test_left_join_matches_merge(n_right):
+    rng = np.random.default_rng(n_right)
+    on = ['location_id', 'year_id', 'sex_id']
+    data = pd.DataFrame({
+        'location_id': rng.integers(1, 3, 10),
+        'year_id': rng.integers(2018, 2021, 10),
+        'sex_id': rng.choice([1, 2, np.nan], 10),
+        'deaths': rng.random(10),
+    })
+    # keys repeat, as they do for the copied years of the weights
+    other = pd.DataFrame({
+        'location_id': rng.integers(1, 3, n_right),
+        'year_id': rng.integers(2018, 2021, n_right),
+        'sex_id': rng.choice([1, 2, np.nan], n_right),
+        'weight': rng.random(n_right),
+    })
+
+    result = make_split().left_join(data, other, on)
+
+    expected = pd.merge(data, other, on=on, how='left')
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_expand_age_sex_groups_matches_merge():
+    data = pd.DataFrame({
+        'location_id': [6, 6, 6, 6, 6],
+        'sex_id': [3, 1, 9, 2, 3],
+        'age_group_id': [22, 5, 1, 1, 2],
+        'value_aggregate': [10., 2., 3., 4., 5.],
+    })
+    split = make_split()
+
+    result = split.expand_age_sex_groups(data)
+
+    # the sex, then age, merges the split index replaced
+    expected = pd.merge(
+        data.rename(columns={'sex_id': 'sex_id_aggregate'}),
+        split.get_sex_split_mapping(), on='sex_id_aggregate', how='left')
+    expected = pd.merge(
+        expected.rename(columns={'age_group_id': 'age_group_id_aggregate'}),
+        AGE_SPLIT_MAPPING, on='age_group_id_aggregate', how='left')
+    pd.testing.assert_frame_equal(
+        result, expected[result.columns], check_dtype=False)
+
+
+def test_split_index_counts():
+    index = asp.SplitIndex(AGE_SPLIT_MAPPING, 'age_group_id_aggregate', 'age_group_id')
+    counts, pos = index.counts([22, 1, 283, 2, 0])
+    np.testing.assert_array_equal(counts, [3, 2, 0, 1, 0])
+    np.testing.assert_array_equal(
+        index.detailed[index.indptr[pos[0]]:index.indptr[pos[0] + 1]], [2, 3, 5])
+
+
+def test_k_denominator_matches_groupby():
+    rng = np.random.default_rng(4)
+    input_data = SimpleNamespace(index_columns=['location_id', 'year_id'])
+    data = pd.DataFrame({
+        'location_id': rng.integers(1, 3, 40),
+        'year_id': rng.integers(2018, 2020, 40),
+        'sex_id_aggregate': rng.choice([3, 9], 40),
+        'age_group_id_aggregate': rng.choice([22, 1], 40),
+        'weight': rng.random(40),
+        'population': rng.random(40) * 1000,
+    })
+    data.loc[[3, 17], 'weight'] = np.nan
+    split = make_split(input_data)
+
+    result = split.calculate_k_denominator(data)
+
+    columns = split.k_denominator_index_columns
+    k_denominator = (
+        data.assign(k_denominator=data['weight'] * data['population'])
+        .groupby(columns)['k_denominator'].sum().reset_index())
+    expected = pd.merge(data, k_denominator, on=columns, how='left')
+    np.testing.assert_allclose(result, expected['k_denominator'], rtol=1e-12)
+
+
+def test_age_split_mapping_cache(tmp_path, monkeypatch):
+    calls = []
+
+    def agetree(age_group_id, gbd_round_id):
+        calls.append(age_group_id)
+        leaves = AGE_SPLIT_MAPPING.loc[
+            AGE_SPLIT_MAPPING.age_group_id_aggregate == age_group_id, 'age_group_id']
+        return SimpleNamespace(leaves=lambda: [SimpleNamespace(id=i) for i in leaves])
+
+    monkeypatch.setattr(asp, 'agetree', agetree)
+
+    def split():
+        return asp.AgeSexDataSplit(
+            input_data=None, distribution_data=None, pop_data=None,
+            gbd_round_id=7, is_cod_vr="FALSE", out_dir=None,
+            cache_dir=str(tmp_path / 'round_7'))
+
+    first = split().get_age_split_mapping([22, 5])
+    second = split().get_age_split_mapping([5, 1])
+
+    assert calls == [22, 5, 1]
+    assert sorted(first.age_group_id_aggregate.unique()) == [5, 22]
+    assert sorted(second.age_group_id_aggregate.unique()) == [1, 5]
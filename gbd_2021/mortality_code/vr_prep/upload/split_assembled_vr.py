@@ -45,6 +45,10 @@ if not isinstance(RELEASE_ID, int):
 
 NID_MAP_PATH = "".format(NEW_RUN_ID)
 
+# Age split mappings only depend on the GBD round, so they are cached outside
+# of the run directories and shared by every run of the round
+AGE_SPLIT_CACHE_DIR = "".format(GBD_ROUND_ID)
+
 
 def remove_overlapping_ages(vr_data):
     """
@@ -710,7 +714,8 @@ def main(input_vr_file, input_distribution_file, is_cod_vr, out_dir):
         pop_data=pop_input_data,
         gbd_round_id=GBD_ROUND_ID,
         is_cod_vr = is_cod_vr,
-        out_dir = out_dir
+        out_dir = out_dir,
+        cache_dir = AGE_SPLIT_CACHE_DIR
     )
 
     # Run age sex splitting
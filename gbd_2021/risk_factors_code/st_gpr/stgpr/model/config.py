@@ -30,6 +30,9 @@ ST_VAR = 'st'
 # specify maximum number of parallel submissions of full model run
 MAX_SUBMISSIONS = 10
 
+# number of processes each GPR task fits its batches of time series in
+GPR_PROCESSES = 1
+
 # Amplitude and NSV thresholds
 AMP_THRESHOLD = 10
 AMP_CUTOFF_DEFAULT_PERCENTILE = 80  # default - 80th percentile of data density
@@ -16,7 +16,7 @@ from stgpr_helpers.api import internal as stgpr_helpers_internal
 
 from stgpr.model import paths
 from stgpr.model.config import *
-from stgpr.st_gpr import gpr as gp, helpers as hlp
+from stgpr.st_gpr import gpr_batch, helpers as hlp
 
 np.seterr(invalid='ignore')
 
@@ -41,7 +41,8 @@ class RunGPR:
                  nparallel=100,
                  holdout_num=1,
                  n_params=1,
-                 param_set=0):
+                 param_set=0,
+                 n_processes=GPR_PROCESSES):
 
         self.run_id = run_id
         self.loc_group = location_group
@@ -50,6 +51,7 @@ class RunGPR:
         self.draws = draws
         self.holdout_num = holdout_num
         self.nparallel = nparallel
+        self.n_processes = n_processes
 
         self.spacevar = spacevar
         self.timevar = timevar
@@ -129,15 +131,17 @@ class RunGPR:
 
     def run_gpr(self):
 
-        groups = self.in_gpr.groupby(
-            by=[self.spacevar, self.sexvar, self.agevar])
-        self.gpr = groups.apply(
-            lambda y: gp.fit_gpr(y, obs_variable=self.datavar,
-                                 obs_var_variable=self.variance_var,
-                                 mean_variable=self.mean_var,
-                                 amp=y[self.amp_var].values[0] * 1.4826,
-                                 scale=y['scale'].values[0],
-                                 draws=self.draws))
+        self.gpr = gpr_batch.fit_gpr_batch(
+            self.in_gpr,
+            group_variables=[self.spacevar, self.sexvar, self.agevar],
+            amp_variable=self.amp_var,
+            obs_variable=self.datavar,
+            obs_var_variable=self.variance_var,
+            mean_variable=self.mean_var,
+            year_variable=self.timevar,
+            amp_multiplier=1.4826,
+            draws=self.draws,
+            n_processes=self.n_processes)
 
     def clean_gpr(self):
 
@@ -0,0 +1,265 @@
+"""
+Batched Gaussian process regression of ST-GPR.
+
+Gives the same posterior as gpr.fit_gpr run on every group of a data frame,
+without building a PyMC2 mean and covariance per group. Groups that share a
+year mesh and a scale are fit together: their covariances are stacked into
+3-D arrays and factorized with one batched Cholesky decomposition, and the
+draws of every group in a batch are sampled at once. Batches are
+independent, so they can be spread over a process pool.
+
+The covariance is the Matern function in the parameterization of PyMC2's
+gp.matern.euclidean, so amp, scale and diff_degree mean what they do in
+fit_gpr.
+"""
+from multiprocessing import Pool
+
+import numpy as np
+import pandas as pd
+from scipy.special import gamma, kv
+
+# Most groups whose covariances are stacked in one batch; bounds the memory
+# taken by the draws of a batch
+MAX_BATCH_SIZE = 250
+
+# Relative diagonal jitter tried, in order, when a covariance matrix is not
+# numerically positive definite
+JITTERS = [0., 1e-12, 1e-10, 1e-8, 1e-6]
+
+GROUP = '_gpr_group'
+
+
+def matern(x, y, amp, scale, diff_degree=2):
+    """Matern covariance between every point of x and every point of y, over
+    the last axis of each; leading axes are broadcast."""
+    t = np.abs(x[..., :, np.newaxis] - y[..., np.newaxis, :])
+    t = t * 2. * np.sqrt(diff_degree) / scale
+    with np.errstate(invalid='ignore'):
+        cov = (0.5**(diff_degree - 1.) / gamma(diff_degree) *
+               t**diff_degree * kv(diff_degree, t))
+    cov[t == 0] = 1.
+    return amp**2 * cov
+
+
+def cholesky(matrices, sizes):
+    """Lower Cholesky factors of a stack of covariance matrices, adding the
+    smallest diagonal jitter relative to sizes that makes every matrix
+    positive definite, or else symmetric square roots from the
+    eigendecomposition."""
+    identity = np.eye(matrices.shape[-1])
+    jitter_scale = sizes[:, np.newaxis, np.newaxis] * identity
+    for jitter in JITTERS:
+        try:
+            return np.linalg.cholesky(matrices + jitter * jitter_scale)
+        except np.linalg.LinAlgError:
+            continue
+    values, vectors = np.linalg.eigh(matrices)
+    return vectors * np.sqrt(np.clip(values, 0., None))[:, np.newaxis, :]
+
+
+def posterior(mesh, prior, amp, scale, diff_degree, obs_mesh, obs_vals,
+              obs_prior, obs_var, obs_mask):
+    """
+    Posterior mean and covariance of a stack of series on a shared year
+    mesh.
+
+    Args:
+        mesh (np.ndarray): (T,) years to predict
+        prior (np.ndarray): (G, T) prior mean at mesh
+        amp (np.ndarray): (G,) amplitudes
+        scale, diff_degree: Matern scale and differentiability, either
+            shared scalars or (G,) arrays
+        obs_mesh, obs_vals, obs_prior, obs_var, obs_mask (np.ndarray): the
+            observations padded to the most observed series, each (G, N)
+
+    Returns:
+        (mean, cov): arrays of shape (G, T) and (G, T, T)
+    """
+    size = amp**2
+    amp = amp[:, np.newaxis, np.newaxis]
+    scale = np.reshape(scale, np.shape(scale) + (1, 1))
+    diff_degree = np.reshape(diff_degree, np.shape(diff_degree) + (1, 1))
+    mean = prior
+    # With a shared scale and diff_degree one kernel serves every series
+    cov = size[:, np.newaxis, np.newaxis] * matern(mesh, mesh, 1., scale,
+                                                   diff_degree)
+
+    mask = obs_mask
+    if mask.any():
+        # Padded observations are uncorrelated with everything and have unit
+        # variance and zero residual, so they leave the solves unchanged
+        pair = mask[:, :, np.newaxis] & mask[:, np.newaxis, :]
+        obs_cov = np.where(pair, matern(obs_mesh, obs_mesh, amp, scale,
+                                        diff_degree), 0.)
+        obs_cov += np.eye(mask.shape[1]) * np.where(mask, obs_var, 1.)[:, np.newaxis, :]
+        cross = matern(np.broadcast_to(mesh, prior.shape), obs_mesh, amp,
+                       scale, diff_degree)
+        cross = np.where(mask[:, np.newaxis, :], cross, 0.)
+        resid = np.where(mask, obs_vals - obs_prior, 0.)
+
+        factor = cholesky(obs_cov, size)
+        whitened_cross = np.linalg.solve(factor, np.swapaxes(cross, 1, 2))
+        whitened_resid = np.linalg.solve(factor, resid[:, :, np.newaxis])
+        mean = mean + np.matmul(np.swapaxes(whitened_cross, 1, 2),
+                                whitened_resid)[:, :, 0]
+        cov = cov - np.matmul(np.swapaxes(whitened_cross, 1, 2),
+                              whitened_cross)
+    return mean, cov
+
+
+def fit_batch(batch):
+    """
+    Posterior mean, variance and draws of a batch of groups sharing a year
+    mesh and scale.
+
+    Args:
+        batch (dict): mesh (T,), scale, diff_degree, draws, seed, amp (G,),
+            prior (G, T), and observations padded to the most observed
+            group: obs_mesh, obs_vals, obs_prior, obs_var and obs_mask, each
+            (G, N)
+
+    Returns:
+        (mean, variance, realizations): arrays of shape (G, T), (G, T) and
+        (G, T, draws)
+    """
+    mean, cov = posterior(
+        batch['mesh'], batch['prior'], batch['amp'], batch['scale'],
+        batch['diff_degree'], batch['obs_mesh'], batch['obs_vals'],
+        batch['obs_prior'], batch['obs_var'], batch['obs_mask'])
+
+    variance = np.diagonal(cov, axis1=1, axis2=2)
+    realizations = None
+    if batch['draws'] > 0:
+        noise = np.random.RandomState(batch['seed']).standard_normal(
+            (mean.shape[0], mean.shape[1], batch['draws']))
+        realizations = mean[:, :, np.newaxis] + np.matmul(
+            cholesky(cov, batch['amp']**2), noise)
+    return mean, variance, realizations
+
+
+def _pad(values, width):
+    out = np.zeros(width)
+    out[:len(values)] = values
+    return out
+
+
+def make_batches(df, group_variables, amp_variable, obs_variable,
+                 obs_var_variable, mean_variable, year_variable,
+                 scale_variable, amp_multiplier, diff_degree, draws):
+    """
+    Split the groups of df into batches sharing a year mesh and scale.
+
+    Returns:
+        (batches, groups): list of fit_batch inputs, and for each batch the
+        group ids it holds, in order
+    """
+    firsts = df.drop_duplicates(GROUP).set_index(GROUP)
+    priors = df[[GROUP, year_variable, mean_variable]].drop_duplicates()
+    observed = df[df[obs_variable].notnull() & df[obs_var_variable].notnull()]
+    obs_by_group = {g: o for g, o in observed.groupby(GROUP, sort=False)}
+
+    batched = {}
+    for g, prior in priors.groupby(GROUP, sort=True):
+        years = prior[year_variable].values.astype(float)
+        means = prior[mean_variable].values.astype(float)
+        scale = firsts.at[g, scale_variable]
+        key = (tuple(years), scale)
+        obs = obs_by_group.get(g)
+        if obs is None:
+            obs_years = obs_vals = obs_var = np.zeros(0)
+        else:
+            obs_years = obs[year_variable].values.astype(float)
+            obs_vals = obs[obs_variable].values.astype(float)
+            obs_var = obs[obs_var_variable].values.astype(float)
+        batched.setdefault(key, []).append({
+            'group': g,
+            'amp': firsts.at[g, amp_variable] * amp_multiplier,
+            'prior': means,
+            'obs_mesh': obs_years,
+            'obs_vals': obs_vals,
+            'obs_prior': np.interp(obs_years, years, means),
+            'obs_var': obs_var})
+
+    batches, groups = [], []
+    for (mesh, scale), members in batched.items():
+        for start in range(0, len(members), MAX_BATCH_SIZE):
+            chunk = members[start:start + MAX_BATCH_SIZE]
+            width = max(len(m['obs_mesh']) for m in chunk)
+            batch = {
+                'mesh': np.array(mesh),
+                'scale': scale,
+                'diff_degree': diff_degree,
+                'draws': draws,
+                'seed': np.random.randint(2**31 - 1),
+                'amp': np.array([m['amp'] for m in chunk], dtype=float),
+                'prior': np.stack([m['prior'] for m in chunk]),
+                'obs_mask': np.stack([
+                    np.arange(width) < len(m['obs_mesh']) for m in chunk])}
+            for name in ['obs_mesh', 'obs_vals', 'obs_prior', 'obs_var']:
+                batch[name] = np.stack([_pad(m[name], width) for m in chunk])
+            batches.append(batch)
+            groups.append([m['group'] for m in chunk])
+    return batches, groups
+
+
+def fit_gpr_batch(
+        df, group_variables, amp_variable, obs_variable='observed_data',
+        obs_var_variable='obs_data_variance', mean_variable='st_prediction',
+        year_variable='year_id', scale_variable='scale', amp_multiplier=1.,
+        diff_degree=2, draws=0, n_processes=1):
+    """
+    Fit GPR to every group of df, as df.groupby(group_variables).apply(
+    fit_gpr) would with each group's first amp and scale.
+
+    Args:
+        df (pd.DataFrame): spacetime predictions, data and hyperparameters
+        group_variables (list): columns identifying a time series
+        amp_variable (str): column of amplitudes, multiplied by
+            amp_multiplier
+        scale_variable (str): column of scales
+        draws (int): number of draws to sample, or 0 for none
+        n_processes (int): number of processes to fit the batches in
+
+    Returns:
+        pd.DataFrame: the rows of df, sorted by group, with gpr_mean, gpr_var,
+        gpr_lower, gpr_upper and, with draws, draw_0 ... draw_{draws - 1}
+    """
+    df = df.copy()
+    df[GROUP] = df.groupby(group_variables, sort=True).ngroup()
+    df = df[df[GROUP] >= 0]
+
+    batches, groups = make_batches(
+        df, group_variables, amp_variable, obs_variable, obs_var_variable,
+        mean_variable, year_variable, scale_variable, amp_multiplier,
+        diff_degree, draws)
+    if n_processes > 1 and len(batches) > 1:
+        p = Pool(processes=n_processes)
+        fits = p.map(fit_batch, batches)
+        p.close()
+    else:
+        fits = [fit_batch(batch) for batch in batches]
+
+    results = []
+    for batch, batch_groups, (mean, variance, realizations) in zip(
+            batches, groups, fits):
+        n_groups, n_years = mean.shape
+        result = pd.DataFrame({
+            GROUP: np.repeat(batch_groups, n_years),
+            year_variable: np.tile(batch['mesh'], n_groups),
+            'gpr_mean': mean.ravel(),
+            'gpr_var': variance.ravel()})
+        result['gpr_lower'] = result.gpr_mean - np.sqrt(result.gpr_var) * 1.96
+        result['gpr_upper'] = result.gpr_mean + np.sqrt(result.gpr_var) * 1.96
+        if realizations is not None:
+            draw_columns = ['draw_{}'.format(i) for i in range(draws)]
+            result = pd.concat([result, pd.DataFrame(
+                realizations.reshape(-1, draws), columns=draw_columns)],
+                axis=1)
+        results.append(result)
+    results = pd.concat(results, ignore_index=True)
+    results[year_variable] = results[year_variable].astype(
+        df[year_variable].dtype)
+
+    gpr = pd.merge(df, results, on=[GROUP, year_variable], how='left')
+    gpr = gpr.sort_values(GROUP, kind='mergesort')
+    return gpr.drop(GROUP, axis=1).reset_index(drop=True)
@@ -1,6 +1,6 @@
 import logging
 from os.path import join
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
@@ -51,7 +51,8 @@ def apply_correction(
         parent_dir: str,
         location_id: int,
         sex_id: int,
-        version: MachineParameters
+        version: MachineParameters,
+        by_merge: bool = False
 ) -> None:
     """
     Apply deaths correction to draws.
@@ -71,6 +72,9 @@ def apply_correction(
         sex_id (int): draws sex_id
         version (MachineParameters): machinery parameters for the given
              machine run.
+        by_merge (bool): use the original DataFrame implementation of the
+            correction instead of the array engine. Slow; kept for
+            validation.
 
     Raises:
         ValueError: If there are NaNs in draws after removing non-scalable
@@ -91,6 +95,37 @@ def apply_correction(
     # Filter and preserve zeros, confirm NaNs are gone
     logging.info("Filtering out zeros")
     data, zeros = _filter_zeros(data, version.draw_cols)
+    if by_merge:
+        unscaled_data, scaled_data = _correct_draws_by_merge(
+            data, zeros, spacetime_restrictions, envelope_data, version,
+            location_id, sex_id
+        )
+    else:
+        unscaled_data, scaled_data = _correct_draws(
+            data, zeros, spacetime_restrictions, envelope_data, version,
+            location_id, sex_id
+        )
+    logging.info("Saving formatted, unscaled draws")
+    _save_unscaled_draws(unscaled_data, parent_dir, location_id, sex_id)
+    logging.info("Saving data")
+    _save_rescaled_draws(scaled_data, parent_dir, location_id, sex_id)
+    logging.info("All done!")
+
+
+def _correct_draws_by_merge(
+        data: pd.DataFrame,
+        zeros: pd.DataFrame,
+        spacetime_restrictions: pd.DataFrame,
+        envelope_data: pd.DataFrame,
+        version: MachineParameters,
+        location_id: int,
+        sex_id: int
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    DataFrame implementation of the correction, kept to validate
+    _correct_draws against. Returns unscaled and rescaled draws in deaths
+    space, with zeros added back.
+    """
     # Merge expected data and fill missing demographics with zeros
     expected_data = _filter_and_expand_expected_data(
         version,
@@ -115,11 +150,9 @@ def apply_correction(
         "Formatting data for rescale, converting to cause fraction space"
     )
     formatted_data = _format_for_rescale(data, version)
-    logging.info("Saving formatted, unscaled draws")
     unscaled_data = _convert_to_deaths(
         formatted_data, envelope_data, version.draw_cols)
     unscaled_data = _add_zeros_back(unscaled_data, zeros, version.draw_cols)
-    _save_unscaled_draws(unscaled_data, parent_dir, location_id, sex_id)
     # Rescale data
     logging.info("Rescaling data")
     scaled_data = _rescale_data(formatted_data, version.draw_cols)
@@ -128,9 +161,7 @@ def apply_correction(
         scaled_data, envelope_data, version.draw_cols)
     logging.info("Adding zeros back")
     scaled_data = _add_zeros_back(scaled_data, zeros, version.draw_cols)
-    logging.info("Saving data")
-    _save_rescaled_draws(scaled_data, parent_dir, location_id, sex_id)
-    logging.info("All done!")
+    return unscaled_data, scaled_data
 
 
 def _get_spacetime_restrictions_path(parent_dir: str) -> str:
@@ -615,6 +646,297 @@ def _add_zeros_back(data, zeros, draw_cols):
     return df
 
 
+class _RescaleHierarchy:
+    """
+    Correction hierarchy laid out for the array engine.
+
+    Causes are ordered by level, then parent_id, so every sibling group (the
+    causes sharing a level and parent_id) is a contiguous run along the cause
+    axis and can be summed with np.add.reduceat. Each level is a contiguous
+    run as well, so propagating parent cause fractions down one level is a
+    single gather.
+    """
+
+    def __init__(self, correction_hierarchy: pd.DataFrame, cause_ids):
+        hierarchy = (
+            correction_hierarchy.loc[
+                correction_hierarchy[constants.Columns.CAUSE_ID].isin(
+                    cause_ids),
+                [constants.Columns.CAUSE_ID] +
+                constants.Columns.CAUSE_HIERARCHY
+            ]
+            .drop_duplicates(constants.Columns.CAUSE_ID)
+            .sort_values([
+                constants.Columns.LEVEL,
+                constants.Columns.PARENT_ID,
+                constants.Columns.CAUSE_ID
+            ])
+            .reset_index(drop=True)
+        )
+        self.cause_ids = hierarchy[constants.Columns.CAUSE_ID].values
+        levels = hierarchy[constants.Columns.LEVEL].values
+        parents = hierarchy[constants.Columns.PARENT_ID].values
+
+        new_group = np.ones(len(hierarchy), dtype=bool)
+        new_group[1:] = (
+            (levels[1:] != levels[:-1]) | (parents[1:] != parents[:-1])
+        )
+        self.group_starts = np.flatnonzero(new_group)
+        self.group_index = np.cumsum(new_group) - 1
+
+        # Position of each cause's parent along the cause axis. Causes
+        # below the top level whose parent has no data cannot be scaled to
+        # it and drop out, as they do in the inner merge of
+        # _rescale_to_parent. Top level causes are never scaled to their
+        # parents and are kept
+        position = pd.Series(np.arange(len(hierarchy)), index=self.cause_ids)
+        parent_position = position.reindex(parents).values
+        self.orphans = np.isnan(parent_position)
+        self.parent_position = np.where(
+            self.orphans, np.arange(len(hierarchy)), parent_position
+        ).astype(int)
+
+        # Levels below the top one, in the order they are rescaled
+        self.level_slices = []
+        if len(hierarchy):
+            for level in range(levels.min() + 1, levels.max() + 1):
+                start, stop = np.searchsorted(levels, [level, level + 1])
+                if stop > start:
+                    self.level_slices.append(slice(start, stop))
+
+    def position(self, cause_ids) -> np.ndarray:
+        """Position along the cause axis, -1 for causes not in the axis"""
+        return _positions(self.cause_ids, cause_ids)
+
+
+def _positions(axis: np.ndarray, values) -> np.ndarray:
+    """Index of each value in the sorted or unsorted axis, -1 if missing"""
+    return (
+        pd.Index(axis).get_indexer(np.asarray(values)).astype(np.intp)
+    )
+
+
+def _rescale_array(
+        cause_fractions: np.ndarray,
+        present: np.ndarray,
+        hierarchy: _RescaleHierarchy
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Array equivalent of _rescale_data.
+
+    Arguments:
+        cause_fractions: (cause, age, year, draw) unscaled cause fractions,
+            zero wherever present is False
+        present: (cause, age, year) mask of the demographics in the data
+        hierarchy: cause axis layout
+
+    Returns:
+        Rescaled (cause, age, year, draw) cause fractions and the mask of
+        demographics that survive rescaling to their parents
+    """
+    absent = ~present[..., np.newaxis]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Rescale each sibling group to 1. As in _rescale_group, groups
+        # that total zero are made equal within the group
+        totals = np.add.reduceat(
+            cause_fractions, hierarchy.group_starts, axis=0
+        )
+        scaled = cause_fractions / totals[hierarchy.group_index]
+        scaled[np.isnan(scaled)] = 1
+        np.copyto(scaled, 0, where=absent)
+        totals = np.add.reduceat(scaled, hierarchy.group_starts, axis=0)
+        scaled /= totals[hierarchy.group_index]
+        np.copyto(scaled, 0, where=absent)
+
+    # Propagate down levels
+    present = present.copy()
+    for level_slice in hierarchy.level_slices:
+        parents = hierarchy.parent_position[level_slice]
+        scaled[level_slice] *= scaled[parents]
+        present[level_slice] &= (
+            present[parents] &
+            ~hierarchy.orphans[level_slice, np.newaxis, np.newaxis]
+        )
+    return scaled, present
+
+
+def _correct_draws(
+        data: pd.DataFrame,
+        zeros: pd.DataFrame,
+        spacetime_restrictions: pd.DataFrame,
+        envelope_data: pd.DataFrame,
+        version: MachineParameters,
+        location_id: int,
+        sex_id: int,
+        year_block_size: int = 10
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Array implementation of the correction.
+
+    Rather than merging 1000 draw columns through each step, the expected
+    demographics are laid out once as a (cause, age, year) grid and the
+    draws scattered into a (cause, age, year, draw) array of cause
+    fractions. Sibling groups are rescaled with np.add.reduceat over the
+    cause axis, propagated down the hierarchy one level at a time, and
+    multiplied by the envelope by broadcasting over the cause axis. Years
+    are processed in blocks of year_block_size to bound memory.
+
+    Returns the same unscaled and rescaled draws as _correct_draws_by_merge.
+    """
+    draw_cols = version.draw_cols
+    # Expected demographics for the correction; metadata only, so merges
+    # here are cheap
+    expected_data = _remove_spacetime_restricted_demographics(
+        _filter_and_expand_expected_data(version, sex_id, [location_id]),
+        spacetime_restrictions
+    )
+    expected_data = expected_data.loc[
+        expected_data[constants.Columns.CAUSE_ID].isin(
+            version.correction_hierarchy[constants.Columns.CAUSE_ID])
+    ]
+    hierarchy = _RescaleHierarchy(
+        version.correction_hierarchy,
+        expected_data[constants.Columns.CAUSE_ID].unique()
+    )
+    age_group_ids = np.unique(
+        expected_data[constants.Columns.AGE_GROUP_ID].astype(int))
+    year_ids = np.unique(expected_data[constants.Columns.YEAR_ID].astype(int))
+    shape = (len(hierarchy.cause_ids), len(age_group_ids), len(year_ids))
+
+    def grid_codes(df):
+        return (
+            hierarchy.position(df[constants.Columns.CAUSE_ID]),
+            _positions(age_group_ids, df[constants.Columns.AGE_GROUP_ID]),
+            _positions(year_ids, df[constants.Columns.YEAR_ID])
+        )
+
+    present = np.zeros(shape, dtype=bool)
+    present[grid_codes(expected_data)] = True
+
+    # Draws in cause fraction space, keeping only expected demographics
+    cause, age, year = grid_codes(data)
+    keep = (cause >= 0) & (age >= 0) & (year >= 0)
+    keep[keep] = present[cause[keep], age[keep], year[keep]]
+    cause, age, year = cause[keep], age[keep], year[keep]
+    # Missing draws and envelopes are zero, as in the fillna(0) after the
+    # expected data merge of _correct_draws_by_merge
+    draws = np.nan_to_num(
+        data.loc[keep, draw_cols].to_numpy(dtype=float),
+        nan=0, posinf=np.inf, neginf=-np.inf
+    )
+    envelope = np.nan_to_num(
+        data.loc[keep, constants.Columns.ENVELOPE].to_numpy(dtype=float),
+        nan=0, posinf=np.inf, neginf=-np.inf
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        draws = draws / envelope[:, np.newaxis]
+    draws[np.isnan(draws)] = 0
+
+    # All-cause mortality envelope draws as an (age, year, draw) array
+    env_age, env_year = (
+        _positions(age_group_ids,
+                   envelope_data[constants.Columns.AGE_GROUP_ID]),
+        _positions(year_ids, envelope_data[constants.Columns.YEAR_ID])
+    )
+    env_keep = (env_age >= 0) & (env_year >= 0)
+    env_draws = np.zeros(shape[1:] + (len(draw_cols),))
+    env_draws[env_age[env_keep], env_year[env_keep]] = (
+        envelope_data.loc[env_keep, draw_cols].to_numpy(dtype=float)
+    )
+    env_present = np.zeros(shape[1:], dtype=bool)
+    env_present[env_age[env_keep], env_year[env_keep]] = True
+    if (present & ~env_present).any():
+        raise ValueError(
+            "There are scaled draws not matched to all-cause mortality draws")
+
+    unscaled, scaled = [], []
+    for start in range(0, len(year_ids), year_block_size):
+        stop = min(start + year_block_size, len(year_ids))
+        in_block = (year >= start) & (year < stop)
+        cause_fractions = np.zeros(
+            shape[:2] + (stop - start, len(draw_cols)))
+        cause_fractions[
+            cause[in_block], age[in_block], year[in_block] - start
+        ] = draws[in_block]
+        block_present = present[:, :, start:stop]
+        block_env = env_draws[np.newaxis, :, start:stop]
+
+        rescaled, rescaled_present = _rescale_array(
+            cause_fractions, block_present, hierarchy
+        )
+        rescaled *= block_env
+        cause_fractions *= block_env
+        unscaled.append(
+            _grid_to_frame(cause_fractions, block_present, hierarchy,
+                           age_group_ids, year_ids[start:stop], draw_cols)
+        )
+        scaled.append(
+            _grid_to_frame(rescaled, rescaled_present, hierarchy,
+                           age_group_ids, year_ids[start:stop], draw_cols)
+        )
+        del cause_fractions, rescaled
+
+    unscaled_data = _add_zeros_back_to_grid(
+        unscaled, zeros, location_id, sex_id, draw_cols)
+    scaled_data = _add_zeros_back_to_grid(
+        scaled, zeros, location_id, sex_id, draw_cols)
+    return unscaled_data, scaled_data
+
+
+def _grid_to_frame(
+        values: np.ndarray,
+        present: np.ndarray,
+        hierarchy: _RescaleHierarchy,
+        age_group_ids: np.ndarray,
+        year_ids: np.ndarray,
+        draw_cols: List[str]
+) -> pd.DataFrame:
+    """Draws at the present cells of a (cause, age, year, draw) array"""
+    cause, age, year = np.nonzero(present)
+    df = pd.DataFrame(values[cause, age, year], columns=draw_cols)
+    df[constants.Columns.CAUSE_ID] = hierarchy.cause_ids[cause]
+    df[constants.Columns.AGE_GROUP_ID] = age_group_ids[age]
+    df[constants.Columns.YEAR_ID] = year_ids[year]
+    return df
+
+
+def _add_zeros_back_to_grid(
+        frames: List[pd.DataFrame],
+        zeros: pd.DataFrame,
+        location_id: int,
+        sex_id: int,
+        draw_cols: List[str]
+) -> pd.DataFrame:
+    """
+    Equivalent of _add_zeros_back for draws from _grid_to_frame: zero rows
+    not already in the draws are appended, and the result is sorted by
+    index.
+    """
+    df = pd.concat(frames, ignore_index=True)
+    df[constants.Columns.LOCATION_ID] = location_id
+    df[constants.Columns.SEX_ID] = sex_id
+    zero_index = zeros[constants.Columns.INDEX].drop_duplicates()
+    zero_index = zero_index.loc[
+        ~pd.MultiIndex.from_frame(zero_index).isin(
+            pd.MultiIndex.from_frame(df[constants.Columns.INDEX]))
+    ]
+    zero_draws = pd.DataFrame(
+        np.zeros((len(zero_index), len(draw_cols))),
+        columns=draw_cols,
+        index=zero_index.index
+    )
+    df = pd.concat(
+        [df, pd.concat([zero_index, zero_draws], axis=1)],
+        ignore_index=True,
+        sort=False
+    )
+    return (
+        df[constants.Columns.INDEX + draw_cols]
+        .sort_values(constants.Columns.INDEX)
+        .reset_index(drop=True)
+    )
+
+
 def _save_rescaled_draws(
         draws: pd.DataFrame,
         parent_dir: str,
@@ -0,0 +1,465 @@
+import glob
+import logging
+import os
+import pickle
+import shutil
+from typing import Iterable, List, Optional, Set
+
+import pandas as pd
+
+import gbd.constants as gbd
+
+from fauxcorrect.correct import _read_spacetime_restrictions
+from fauxcorrect.parameters.machinery import MachineParameters
+from fauxcorrect.queries.spacetime_restrictions import (
+    get_all_spacetime_restrictions
+)
+from fauxcorrect.utils import constants
+from fauxcorrect.utils.exceptions import IncrementalRunNotPossible
+
+
+# Parameters that must match between two runs for outputs to be reusable
+COMPARABLE_ATTRIBUTES = [
+    'gbd_round_id', 'decomp_step', 'n_draws', 'year_ids', 'year_start_ids',
+    'year_end_ids', 'sex_ids', 'measure_ids', 'location_set_ids',
+    'cause_set_ids', 'envelope_version_id', 'population_version_id',
+    'life_table_run_id', 'tmrlt_run_id'
+]
+
+
+class IncrementalPlan:
+    """
+    Work out which parts of a CoDCorrect run must be recomputed when only
+    some best models changed since a prior run, and reuse the prior run's
+    outputs for everything else.
+
+    The correction is done per most detailed location and sex over every
+    cause, so a changed model dirties its sex:
+        * models that go into the correction dirty the correction and
+          everything after it
+        * shocks, HIV and imported case models skip the correction and
+          dirty cause aggregation and everything after it
+    Best model metadata carries no location coverage and a new model version
+    redraws every location, so by default all locations of a dirty sex are
+    dirty. Passing location_ids narrows that to the most detailed locations
+    known to have changed (e.g. a custom model fixed for one country); their
+    aggregates in every location set are dirty too.
+
+    COVID scalars are the only stage that works on a subset of causes: they
+    read just the draws of causes with an indirect COVID model. They are
+    recalculated for every location and sex if any of those causes is among
+    the affected causes, and reused otherwise.
+
+    Location aggregation, uploads and the tasks that follow them always run.
+
+    Arguments:
+        parameters (MachineParameters): parameters of the new run
+        prior (MachineParameters): parameters of the run to reuse
+        location_ids (Optional[List[int]]): most detailed locations whose
+            draws changed. Defaults to all most detailed locations.
+
+    Raises:
+        IncrementalRunNotPossible: if the two runs differ in anything but
+            their best models, or if no best models changed
+    """
+
+    def __init__(
+            self,
+            parameters: MachineParameters,
+            prior: MachineParameters,
+            location_ids: Optional[List[int]] = None
+    ):
+        _check_comparable(parameters, prior)
+        self.version_id: int = parameters.version_id
+        self.parent_dir: str = parameters.parent_dir
+        self.prior_version_id: int = prior.version_id
+        self.prior_parent_dir: str = prior.parent_dir
+
+        self.changes: pd.DataFrame = parameters.diff_best_models(prior)
+        if self.changes.empty:
+            raise IncrementalRunNotPossible(
+                f"No best models changed since version {prior.version_id}; "
+                "there is nothing to rerun."
+            )
+        self.changed_model_version_ids: Set[int] = set(
+            parameters.best_model_version_ids
+        ) - set(prior.best_model_version_ids)
+        self.reused_model_version_ids: Set[int] = set(
+            parameters.best_model_version_ids
+        ) & set(prior.best_model_version_ids)
+        self.affected_cause_ids: List[int] = parameters.affected_cause_ids(
+            self.changes[constants.Columns.CAUSE_ID].unique().tolist()
+        )
+        self.covid_scalars_dirty: bool = bool(
+            set(parameters.covid_cause_ids) & set(self.affected_cause_ids)
+        )
+
+        corrected = ~self.changes[
+            constants.Columns.MODEL_VERSION_TYPE_ID
+        ].isin(constants.ModelVersionTypeId.EXEMPT_TYPE_IDS)
+        self.correction_sex_ids: Set[int] = _sexes(
+            self.changes.loc[corrected, constants.Columns.SEX_ID],
+            parameters.sex_ids
+        )
+        self.aggregation_sex_ids: Set[int] = _sexes(
+            self.changes[constants.Columns.SEX_ID], parameters.sex_ids
+        )
+
+        self.most_detailed_location_ids: Set[int] = set(
+            parameters.most_detailed_location_ids
+        )
+        if location_ids is None:
+            self.dirty_most_detailed_location_ids = set(
+                self.most_detailed_location_ids
+            )
+            self.dirty_location_ids: Set[int] = set(parameters.location_ids)
+        else:
+            self.dirty_most_detailed_location_ids = (
+                set(location_ids) & self.most_detailed_location_ids
+            )
+            self.dirty_location_ids = _with_ancestors(
+                self.dirty_most_detailed_location_ids,
+                [
+                    parameters._location_parameters[location_set_id].hierarchy
+                    for location_set_id in parameters.location_set_ids
+                ]
+            )
+        self.location_ids: Set[int] = set(parameters.location_ids)
+        self.clean_location_ids: Set[int] = (
+            self.location_ids - self.dirty_location_ids
+        )
+        self.sex_ids: List[int] = parameters.sex_ids
+        self.measure_ids: List[int] = parameters.measure_ids
+
+    @classmethod
+    def recreate_from_parent_dir(
+            cls,
+            parent_dir: str
+    ) -> Optional['IncrementalPlan']:
+        """Returns the run's cached plan, or None for a full run"""
+        cache_name = _plan_path(parent_dir)
+        if not os.path.exists(cache_name):
+            return None
+        with open(cache_name, 'rb') as cache_file:
+            return pickle.load(cache_file)
+
+    def cache_plan(self) -> str:
+        cache_name = _plan_path(self.parent_dir)
+        with open(cache_name, 'wb') as cache_file:
+            pickle.dump(self, cache_file)
+        return cache_name
+
+    def write_changes_report(self) -> str:
+        """Saves the changed models and the causes they affect"""
+        report = self.changes.copy()
+        report['affected_cause_ids'] = " ".join(
+            str(cause_id) for cause_id in self.affected_cause_ids
+        )
+        report_file = os.path.join(
+            self.parent_dir,
+            constants.FilePaths.INPUT_FILES_DIR,
+            constants.FilePaths.INCREMENTAL_CHANGES_FILE.format(
+                prior_version_id=self.prior_version_id
+            )
+        )
+        report.to_csv(report_file, index=False, encoding="utf8")
+        return report_file
+
+    def validates(self, model_version_id: int) -> bool:
+        return model_version_id in self.changed_model_version_ids
+
+    def corrects(self, location_id: int, sex_id: int) -> bool:
+        return (
+            sex_id in self.correction_sex_ids and
+            location_id in self.dirty_most_detailed_location_ids
+        )
+
+    def aggregates(self, location_id: int, sex_id: int) -> bool:
+        """
+        Whether cause aggregation, YLLs, diagnostics and shocks run for a
+        location and sex
+        """
+        return (
+            sex_id in self.aggregation_sex_ids and
+            location_id in self.dirty_location_ids
+        )
+
+    def summarizes(self, location_id: int) -> bool:
+        """Summaries cover both sexes, so any dirty sex dirties them"""
+        return location_id in self.dirty_location_ids
+
+    def calculates_covid_scalars(self) -> bool:
+        """
+        Whether COVID scalars run. They run for every location and sex or
+        none, so their summaries compile from a single run.
+        """
+        return self.covid_scalars_dirty
+
+    def link_prior_outputs(self) -> int:
+        """
+        Link the prior run's outputs for everything this run will not
+        recompute into this run's directory.
+
+        Only outputs of tasks that are not scheduled are linked, so no task
+        of this run ever writes through a link into the prior run's files.
+
+        Returns:
+            the number of files linked
+        """
+        patterns = [
+            _model_patterns(model_version_id)
+            for model_version_id in self.reused_model_version_ids
+        ]
+        for location_id, sex_id in _product(
+                self.most_detailed_location_ids, self.sex_ids):
+            if not self.corrects(location_id, sex_id):
+                patterns.append(_correction_patterns(location_id, sex_id))
+            if not self.aggregates(location_id, sex_id):
+                patterns.append(
+                    _cause_aggregation_patterns(location_id, sex_id)
+                )
+        for location_id, sex_id in _product(self.location_ids, self.sex_ids):
+            if not self.aggregates(location_id, sex_id):
+                patterns.append(_location_sex_patterns(location_id, sex_id))
+        for location_id in self.clean_location_ids:
+            patterns.append(_summary_patterns(location_id))
+        if not self.calculates_covid_scalars():
+            patterns.append(_covid_scalars_patterns())
+
+        n_linked = 0
+        for pattern in (p for group in patterns for p in group):
+            for prior_file in glob.glob(
+                    os.path.join(self.prior_parent_dir, pattern),
+                    recursive=True):
+                relative_path = os.path.relpath(
+                    prior_file, self.prior_parent_dir
+                )
+                _link(prior_file, os.path.join(self.parent_dir, relative_path))
+                n_linked += 1
+        if not self.calculates_covid_scalars():
+            n_linked += self._link_covid_scalars_summary()
+        logging.info(
+            f"Linked {n_linked} files from version {self.prior_version_id}."
+        )
+        return n_linked
+
+    def _link_covid_scalars_summary(self) -> int:
+        """
+        The compiled COVID scalar summaries are named by version, so they are
+        linked under this run's version_id.
+        """
+        summary_dir = os.path.join(
+            constants.FilePaths.COVID_SCALARS,
+            constants.FilePaths.SUMMARY_DIR
+        )
+        file_name = constants.FilePaths.COVID_SCALARS_SUMMARY_FILE
+        prior_file = os.path.join(
+            self.prior_parent_dir, summary_dir,
+            file_name.format(version_id=self.prior_version_id)
+        )
+        if not os.path.exists(prior_file):
+            return 0
+        _link(prior_file, os.path.join(
+            self.parent_dir, summary_dir,
+            file_name.format(version_id=self.version_id)
+        ))
+        return 1
+
+
+def _check_comparable(
+        parameters: MachineParameters,
+        prior: MachineParameters
+) -> None:
+    differences = [
+        attribute for attribute in COMPARABLE_ATTRIBUTES
+        if getattr(parameters, attribute) != getattr(prior, attribute)
+    ]
+    hierarchy_columns = [
+        constants.Columns.CAUSE_ID,
+        constants.Columns.LEVEL,
+        constants.Columns.PARENT_ID
+    ]
+    if not _same_rows(
+            parameters.correction_hierarchy[hierarchy_columns],
+            prior.correction_hierarchy[hierarchy_columns]):
+        differences.append('correction_hierarchy')
+    if not _same_rows(
+            parameters.expected_metadata[
+                [constants.Columns.CAUSE_ID, constants.Columns.SEX_ID,
+                 constants.Columns.CAUSE_AGE_START,
+                 constants.Columns.CAUSE_AGE_END]],
+            prior.expected_metadata[
+                [constants.Columns.CAUSE_ID, constants.Columns.SEX_ID,
+                 constants.Columns.CAUSE_AGE_START,
+                 constants.Columns.CAUSE_AGE_END]]):
+        differences.append('expected_metadata')
+    if not differences and not _same_rows(
+            _read_spacetime_restrictions(prior.parent_dir),
+            _query_spacetime_restrictions(parameters)):
+        differences.append('spacetime_restrictions')
+    if differences:
+        raise IncrementalRunNotPossible(
+            f"Version {parameters.version_id} cannot reuse the outputs of "
+            f"version {prior.version_id}; they differ in: "
+            f"{', '.join(differences)}."
+        )
+
+
+def _query_spacetime_restrictions(
+        parameters: MachineParameters
+) -> pd.DataFrame:
+    return get_all_spacetime_restrictions(
+        parameters.gbd_round_id, parameters.decomp_step
+    )[[
+        constants.Columns.CAUSE_ID,
+        constants.Columns.LOCATION_ID,
+        constants.Columns.YEAR_ID
+    ]]
+
+
+def _same_rows(left: pd.DataFrame, right: pd.DataFrame) -> bool:
+    """Equal as sets of rows, ignoring order and index"""
+    if list(left.columns) != list(right.columns) or len(left) != len(right):
+        return False
+    columns = list(left.columns)
+    left = left.sort_values(columns).reset_index(drop=True)
+    right = right.sort_values(columns).reset_index(drop=True)
+    return left.astype(str).equals(right.astype(str))
+
+
+def _sexes(changed_sex_ids: pd.Series, sex_ids: List[int]) -> Set[int]:
+    """Sexes touched by changed models; both-sex models touch all of them"""
+    changed = set(changed_sex_ids.astype(int))
+    if gbd.sex.BOTH in changed:
+        return set(sex_ids)
+    return changed & set(sex_ids)
+
+
+def _with_ancestors(
+        location_ids: Iterable[int],
+        hierarchies: List[pd.DataFrame]
+) -> Set[int]:
+    locations = set(location_ids)
+    for hierarchy in hierarchies:
+        parent_of = dict(zip(
+            hierarchy[constants.Columns.LOCATION_ID],
+            hierarchy[constants.Columns.PARENT_ID]
+        ))
+        for location_id in list(locations):
+            while (location_id in parent_of and
+                   parent_of[location_id] != location_id):
+                location_id = parent_of[location_id]
+                locations.add(location_id)
+    return locations
+
+
+def _product(location_ids: Iterable[int], sex_ids: Iterable[int]):
+    return ((l, s) for l in sorted(location_ids) for s in sex_ids)
+
+
+def _plan_path(parent_dir: str) -> str:
+    return os.path.join(
+        parent_dir,
+        constants.FilePaths.PARAM_DIR,
+        constants.FilePaths.INCREMENTAL_PLAN_FILE
+    )
+
+
+def _model_patterns(model_version_id: int) -> List[str]:
+    """Validated draws of a model, saved to the unscaled or shocks dir"""
+    file_name = constants.FilePaths.UNSCALED_DRAWS_FILE_PATTERN.format(
+        model_version_id=model_version_id
+    )
+    return [
+        os.path.join(
+            constants.FilePaths.UNAGGREGATED_DIR, draw_dir,
+            constants.FilePaths.DEATHS_DIR, file_name
+        )
+        for draw_dir in [
+            constants.FilePaths.UNSCALED_DIR, constants.FilePaths.SHOCKS_DIR
+        ]
+    ]
+
+
+def _correction_patterns(location_id: int, sex_id: int) -> List[str]:
+    return [
+        os.path.join(
+            constants.FilePaths.UNAGGREGATED_DIR,
+            constants.FilePaths.RESCALED_DIR,
+            constants.FilePaths.DEATHS_DIR,
+            constants.FilePaths.RESCALED_DRAWS_FILE_PATTERN.format(
+                location_id=location_id, sex_id=sex_id
+            )
+        ),
+        os.path.join(
+            constants.FilePaths.UNAGGREGATED_DIR,
+            constants.FilePaths.UNSCALED_DIR,
+            constants.FilePaths.DIAGNOSTICS_DIR,
+            constants.FilePaths.DEATHS_DIR,
+            constants.FilePaths.UNAGGREGATED_UNSCALED_FILE_PATTERN.format(
+                location_id=location_id, sex_id=sex_id
+            )
+        )
+    ]
+
+
+def _cause_aggregation_patterns(location_id: int, sex_id: int) -> List[str]:
+    """
+    Cause aggregation and YLL outputs of a most detailed location. Aggregate
+    locations in the same directories are rewritten by location aggregation
+    and must never be linked.
+    """
+    return [
+        os.path.join(
+            constants.FilePaths.AGGREGATED_DIR, draw_dir, '*',
+            f'{sex_id}_{location_id}_*.h5'
+        )
+        for draw_dir in [
+            constants.FilePaths.RESCALED_DIR,
+            constants.FilePaths.SHOCKS_DIR,
+            constants.FilePaths.UNSCALED_DIR
+        ]
+    ]
+
+
+def _location_sex_patterns(location_id: int, sex_id: int) -> List[str]:
+    """Appended shocks draws and diagnostics of any location"""
+    return [
+        os.path.join(
+            constants.FilePaths.DIAGNOSTICS_DIR,
+            constants.FilePaths.DIAGNOSTICS_DETAILED_FILE_PATTERN.format(
+                location_id=location_id, sex_id=sex_id
+            )
+        ),
+        os.path.join(
+            constants.FilePaths.DRAWS_DIR, '*',
+            f'{sex_id}_{location_id}_*.h5'
+        )
+    ]
+
+
+def _covid_scalars_patterns() -> List[str]:
+    """
+    COVID scalar draws of every location and sex. Their summaries are
+    removed once compiled, see IncrementalPlan._link_covid_scalars_summary
+    """
+    return [os.path.join(constants.FilePaths.COVID_SCALARS, '*.h5')]
+
+
+def _summary_patterns(location_id: int) -> List[str]:
+    return [
+        os.path.join(
+            constants.FilePaths.SUMMARY_DIR, '**', f'{location_id}.csv'
+        )
+    ]
+
+
+def _link(source: str, destination: str) -> None:
+    """Hard link source to destination, copying across file systems"""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    if os.path.exists(destination):
+        return
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
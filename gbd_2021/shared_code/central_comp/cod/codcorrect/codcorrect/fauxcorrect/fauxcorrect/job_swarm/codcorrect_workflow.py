@@ -3,11 +3,12 @@ from collections import defaultdict
 import datetime
 import itertools
 import os
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import gbd
 from jobmon.client.task import Task
 
+from fauxcorrect.incremental import IncrementalPlan
 from fauxcorrect.job_swarm import monitor, task_templates
 from fauxcorrect.parameters.machinery import CoDCorrectParameters
 from fauxcorrect.utils.constants import (
@@ -18,11 +19,21 @@ from fauxcorrect.utils.constants import (
 
 class CodCorrectWorkflow:
 
-    def __init__(self, parameters: CoDCorrectParameters, resume: bool):
+    def __init__(
+        self,
+        parameters: CoDCorrectParameters,
+        resume: bool,
+        incremental: Optional[IncrementalPlan] = None
+    ):
         self.tool = task_templates.get_jobmon_tool()
         self.parameters = parameters
         self.resume = resume
 
+        # If rerunning incrementally against a prior version, only the tasks
+        # the plan marks dirty are scheduled; the prior version's outputs
+        # stand in for the rest
+        self.incremental = incremental
+
         # Calculate YLLs IFF the measure is passed in
         self.calculate_ylls: bool = gbd.constants.measures.YLL in self.parameters.measure_ids
 
@@ -75,6 +86,29 @@ class CodCorrectWorkflow:
         """Returns list of all tasks for given stage."""
         return list(self.task_map[task_template.template_name].values())
 
+    def get_task_from_stage(
+        self,
+        task_template: task_templates.CodTaskTemplate,
+        **task_name_args
+    ) -> Optional[Task]:
+        """Returns the task of the given stage with the given name args, or
+        None if it was not scheduled (only possible in incremental runs)."""
+        return self.task_map[task_template.template_name].get(
+            task_template.task_name_template.format(**task_name_args)
+        )
+
+    def add_upstream_task_from_stage(
+        self,
+        task: Task,
+        task_template: task_templates.CodTaskTemplate,
+        **task_name_args
+    ) -> None:
+        """Adds the named task of the given stage as upstream for the given
+        task, if it was scheduled."""
+        upstream_task = self.get_task_from_stage(task_template, **task_name_args)
+        if upstream_task is not None:
+            task.add_upstream(upstream_task)
+
     def add_upstream_all_tasks_from_stage(
         self,
         task: Task,
@@ -195,6 +229,8 @@ class CodCorrectWorkflow:
         """
         validation_template = task_templates.Validate(self.tool)
         for model_version_id in self.parameters.best_model_version_ids:
+            if self.incremental and not self.incremental.validates(model_version_id):
+                continue
             task = validation_template.get_task(
                 model_version_id=model_version_id,
                 version_id=self.parameters.version_id,
@@ -212,6 +248,8 @@ class CodCorrectWorkflow:
         for sex_id, location_id in itertools.product(
             self.parameters.sex_ids, self.parameters.most_detailed_location_ids
         ):
+            if self.incremental and not self.incremental.corrects(location_id, sex_id):
+                continue
             correction_task = correction_template.get_task(
                 location_id=location_id,
                 sex_id=sex_id,
@@ -247,6 +285,8 @@ class CodCorrectWorkflow:
         for sex_id, location_id in itertools.product(
             self.parameters.sex_ids, self.parameters.most_detailed_location_ids
         ):
+            if self.incremental and not self.incremental.aggregates(location_id, sex_id):
+                continue
             cause_agg_task = cause_agg_template.get_task(
                 location_id=location_id,
                 sex_id=sex_id,
@@ -255,12 +295,10 @@ class CodCorrectWorkflow:
             )
 
             # Add upstream correction job
-            correction_task_name = task_templates.ApplyCorrection.task_name_template.format(
+            self.add_upstream_task_from_stage(
+                cause_agg_task, task_templates.ApplyCorrection,
                 location_id=location_id, sex_id=sex_id
             )
-            cause_agg_task.add_upstream(
-                self.task_map[task_templates.ApplyCorrection.template_name][correction_task_name]
-            )
 
             self.add_task(cause_agg_template, cause_agg_task)
 
@@ -275,6 +313,8 @@ class CodCorrectWorkflow:
         for sex_id, location_id in itertools.product(
             self.parameters.sex_ids, self.parameters.most_detailed_location_ids
         ):
+            if self.incremental and not self.incremental.aggregates(location_id, sex_id):
+                continue
             calc_ylls_task = calc_ylls_template.get_task(
                 location_id=location_id,
                 sex_id=sex_id,
@@ -371,6 +411,8 @@ class CodCorrectWorkflow:
         for sex_id, location_id in itertools.product(
             self.parameters.sex_ids, self.parameters.location_ids
         ):
+            if self.incremental and not self.incremental.aggregates(location_id, sex_id):
+                continue
             diagnostics_task = diagnostics_template.get_task(
                 location_id=location_id,
                 sex_id=sex_id,
@@ -406,6 +448,8 @@ class CodCorrectWorkflow:
         for sex_id, location_id in itertools.product(
             self.parameters.sex_ids, self.parameters.location_ids
         ):
+            if self.incremental and not self.incremental.aggregates(location_id, sex_id):
+                continue
             most_detailed_location = location_id in self.parameters.most_detailed_location_ids
             append_shocks_task = append_shocks_template.get_task(
                 location_id=location_id,
@@ -453,7 +497,13 @@ class CodCorrectWorkflow:
         Scalar calculation is dependent on corresponding location - sex append shocks task.
         Only run for most detailed locations. Scalar compilation is dependent on
         all scalar calculation tasks.
+
+        Incremental runs skip all of these tasks unless a cause with an
+        indirect COVID model is among the causes affected by the changed models.
         """
+        if self.incremental and not self.incremental.calculates_covid_scalars():
+            return
+
         covid_scalars_template = task_templates.CovidScalarsCalculation(self.tool)
         for sex_id, location_id in itertools.product(
             self.parameters.sex_ids, self.parameters.most_detailed_location_ids
@@ -464,13 +514,11 @@ class CodCorrectWorkflow:
                 version_id=self.parameters.version_id,
             )
 
-            # Add upstream append shocks job
-            append_shocks_task = task_templates.AppendShocks.task_name_template.format(
+            # Add upstream append shocks job, if it was scheduled
+            self.add_upstream_task_from_stage(
+                covid_scalars_task, task_templates.AppendShocks,
                 location_id=location_id, sex_id=sex_id
             )
-            covid_scalars_task.add_upstream(
-                self.task_map[task_templates.AppendShocks.template_name][append_shocks_task]
-            )
 
             self.add_task(covid_scalars_template, covid_scalars_task)
 
@@ -513,6 +561,8 @@ class CodCorrectWorkflow:
             self.parameters.location_ids, self.parameters.measure_ids,
             self.parameters.year_ids
         ):
+            if self.incremental and not self.incremental.summarizes(location_id):
+                continue
             summarize_gbd_task = summarize_gbd_template.get_task(
                 location_id=location_id,
                 measure_id=measure_id,
@@ -526,14 +576,13 @@ class CodCorrectWorkflow:
             # Add corresponding location append shocks task
             append_shocks_tasks = []
             for sex_id in self.parameters.sex_ids:
-                append_shocks_tasks.append(
-                    self.task_map[task_templates.AppendShocks.template_name][
-                        task_templates.AppendShocks.task_name_template.format(
-                            location_id=location_id,
-                            sex_id=sex_id
-                        )
-                    ]
+                append_shocks_task = self.get_task_from_stage(
+                    task_templates.AppendShocks,
+                    location_id=location_id,
+                    sex_id=sex_id
                 )
+                if append_shocks_task is not None:
+                    append_shocks_tasks.append(append_shocks_task)
             for task in append_shocks_tasks:
                 summarize_gbd_task.add_upstream(task)
 
@@ -568,6 +617,8 @@ class CodCorrectWorkflow:
             self.parameters.measure_ids, self.parameters.location_ids
 
         ):
+            if self.incremental and not self.incremental.summarizes(location_id):
+                continue
             summarize_pct_task = summarize_pct_template.get_task(
                 location_id=location_id,
                 measure_id=measure_id,
@@ -581,13 +632,9 @@ class CodCorrectWorkflow:
 
             # Add corresponding location append shocks task
             for sex_id in self.parameters.sex_ids:
-                summarize_pct_task.add_upstream(
-                    self.task_map[task_templates.AppendShocks.template_name][
-                        task_templates.AppendShocks.task_name_template.format(
-                            location_id=location_id,
-                            sex_id=sex_id
-                        )
-                    ]
+                self.add_upstream_task_from_stage(
+                    summarize_pct_task, task_templates.AppendShocks,
+                    location_id=location_id, sex_id=sex_id
                 )
 
             self.add_task(summarize_pct_template, summarize_pct_task)
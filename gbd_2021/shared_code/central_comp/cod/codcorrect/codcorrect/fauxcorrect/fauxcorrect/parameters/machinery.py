@@ -149,6 +149,12 @@ class MachineParameters:
             contain a restricted sex id, and that the models contain all of the
             required indices.
 
+        diff_best_models(): returns the best models added or removed since a
+            prior run.
+
+        affected_cause_ids(): given causes whose draws changed, returns all
+            causes whose corrected or aggregated results can change.
+
         cache_parameters(): saves the MachineParameters to disk for use
             later in the run's pipeline as well as for vetting in the future.
 
@@ -544,6 +550,85 @@ class MachineParameters:
         )
         return pd.DataFrame(index=cartesian_index).reset_index()
 
+    def diff_best_models(self, prior: 'MachineParameters') -> pd.DataFrame:
+        """
+        Compare this run's best models against those of a prior run.
+
+        Arguments:
+            prior (MachineParameters): parameters of the prior run
+
+        Returns:
+            pd.DataFrame of the best model metadata rows present in only one
+            of the two runs, with a 'change' column of 'added' (only in this
+            run) or 'removed' (only in the prior run). A swapped model shows
+            up as one row of each.
+        """
+        columns = [
+            constants.Columns.MODEL_VERSION_ID,
+            constants.Columns.CAUSE_ID,
+            constants.Columns.SEX_ID,
+            constants.Columns.MODEL_VERSION_TYPE_ID,
+            constants.Columns.AGE_START,
+            constants.Columns.AGE_END
+        ]
+        current = self.best_model_metadata[columns]
+        previous = prior.best_model_metadata[columns]
+        added = current.loc[
+            ~current[constants.Columns.MODEL_VERSION_ID].isin(
+                previous[constants.Columns.MODEL_VERSION_ID])
+        ].assign(change='added')
+        removed = previous.loc[
+            ~previous[constants.Columns.MODEL_VERSION_ID].isin(
+                current[constants.Columns.MODEL_VERSION_ID])
+        ].assign(change='removed')
+        return pd.concat([added, removed], ignore_index=True)
+
+    def affected_cause_ids(self, cause_ids: Iterable[int]) -> List[int]:
+        """
+        Returns every cause whose results can change when the draws of the
+        given causes change.
+
+        Rescaling normalizes each group of siblings in the correction
+        hierarchy and multiplies children by their parent, so a changed
+        cause moves its siblings and everything below them. Cause
+        aggregation then carries those changes up to the ancestors in each
+        of the run's cause sets.
+        """
+        hierarchy = self.correction_hierarchy
+        parent_of = dict(zip(hierarchy.cause_id, hierarchy.parent_id))
+        children = hierarchy.groupby(constants.Columns.PARENT_ID).cause_id
+        children = {
+            parent_id: group.tolist() for parent_id, group in children
+        }
+
+        cause_ids = set(cause_ids)
+        affected = set()
+        stack = [
+            sibling for cause_id in cause_ids if cause_id in parent_of
+            for sibling in children.get(parent_of[cause_id], [])
+        ]
+        while stack:
+            cause_id = stack.pop()
+            if cause_id in affected:
+                continue
+            affected.add(cause_id)
+            stack.extend(
+                child for child in children.get(cause_id, [])
+                if child != cause_id
+            )
+        affected.update(cause_ids)
+
+        for cause_set_id in self.cause_set_ids:
+            cause_hierarchy = self._cause_parameters[cause_set_id].hierarchy
+            parent_of = dict(
+                zip(cause_hierarchy.cause_id, cause_hierarchy.parent_id)
+            )
+            for cause_id in list(affected):
+                while cause_id in parent_of and parent_of[cause_id] != cause_id:
+                    cause_id = parent_of[cause_id]
+                    affected.add(cause_id)
+        return sorted(affected)
+
     def validate_model_versions(self) -> None:
         """
         Runs model version validations on the base cause set.
@@ -0,0 +1,130 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fauxcorrect import correct
+from fauxcorrect.utils import constants
+
+LOCATION_ID = 6
+SEX_ID = 1
+YEAR_IDS = [2000, 2001, 2002]
+AGE_GROUP_IDS = [2, 3, 4]
+DRAW_COLS = ['draw_0', 'draw_1', 'draw_2']
+
+# All cause (294) splits into causes 1 and 2, which split into 10 and 11,
+# and 20. The parent of cause 30 is not part of the run.
+HIERARCHY = pd.DataFrame({
+    'cause_id': [294, 1, 2, 10, 11, 20, 30],
+    'level': [0, 1, 1, 2, 2, 2, 2],
+    'parent_id': [294, 294, 294, 1, 1, 2, 3],
+})
+
+
+def make_version(cause_ids):
+    expected_metadata = pd.DataFrame({
+        'cause_id': cause_ids,
+        'sex_id': SEX_ID,
+        # cause 11 only applies to some ages
+        'cause_ages': [
+            AGE_GROUP_IDS[:2] if cause_id == 11 else AGE_GROUP_IDS
+            for cause_id in cause_ids
+        ],
+    })
+    return SimpleNamespace(
+        expected_metadata=expected_metadata,
+        cause_ids_to_correct=cause_ids,
+        correction_hierarchy=HIERARCHY,
+        year_ids=YEAR_IDS,
+        draw_cols=DRAW_COLS,
+    )
+
+
+def make_inputs(cause_ids, seed=8):
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product(
+        [[LOCATION_ID], YEAR_IDS, [SEX_ID], AGE_GROUP_IDS, cause_ids],
+        names=constants.Columns.INDEX
+    ).to_frame(index=False)
+    data = index.assign(envelope=rng.uniform(50, 100, len(index)))
+    for col in DRAW_COLS:
+        data[col] = rng.uniform(0, 10, len(index))
+    # Missing rows, zero sibling groups, and NaN draws and envelopes are all
+    # treated as zero deaths
+    data = data.sample(frac=.9, random_state=seed).reset_index(drop=True)
+    data.loc[data.cause_id == 20, DRAW_COLS] = 0
+    data.loc[data.index[:3], 'draw_1'] = np.nan
+    data.loc[data.index[3], 'envelope'] = np.nan
+    data, zeros = correct._filter_zeros(data, DRAW_COLS)
+
+    envelope = pd.MultiIndex.from_product(
+        [[LOCATION_ID], YEAR_IDS, [SEX_ID], AGE_GROUP_IDS],
+        names=constants.Columns.DEMOGRAPHIC_INDEX
+    ).to_frame(index=False)
+    for col in DRAW_COLS:
+        envelope[col] = rng.uniform(100, 200, len(envelope))
+
+    restrictions = pd.DataFrame({
+        'cause_id': [10], 'location_id': [LOCATION_ID], 'year_id': [2001]})
+    return data, zeros, restrictions, envelope
+
+
+def sorted_draws(df):
+    return (
+        df[constants.Columns.INDEX + DRAW_COLS]
+        .astype(float)
+        .sort_values(constants.Columns.INDEX)
+        .reset_index(drop=True)
+    )
+
+
+@pytest.mark.parametrize('cause_ids', [
+    [294, 1, 2, 10, 11, 20, 30],
+    # without all cause, 1 and 2 are the top level and are kept even though
+    # their parent is not part of the run
+    [1, 2, 10, 11, 20],
+])
+def test_correct_draws_matches_merge(cause_ids):
+    version = make_version(cause_ids)
+    data, zeros, restrictions, envelope = make_inputs(cause_ids)
+
+    expected = correct._correct_draws_by_merge(
+        data, zeros, restrictions, envelope, version, LOCATION_ID, SEX_ID)
+    result = correct._correct_draws(
+        data, zeros, restrictions, envelope, version, LOCATION_ID, SEX_ID,
+        year_block_size=2)
+
+    for result_draws, expected_draws in zip(result, expected):
+        pd.testing.assert_frame_equal(
+            sorted_draws(result_draws), sorted_draws(expected_draws))
+    scaled_causes = set(result[1].loc[
+        (result[1][DRAW_COLS] != 0).any(axis=1), 'cause_id'])
+    assert 30 not in scaled_causes
+    assert {1, 2} <= scaled_causes
+
+
+def test_rescale_array_matches_rescale_data():
+    rng = np.random.default_rng(3)
+    cause_ids = [1, 2, 10, 11, 20, 30]
+    hierarchy = correct._RescaleHierarchy(HIERARCHY, cause_ids)
+    shape = (len(hierarchy.cause_ids), 2, 1)
+    present = rng.random(shape) < .8
+    present[hierarchy.position([1])[0], 0, 0] = False
+    cause_fractions = np.where(
+        present[..., np.newaxis], rng.random(shape + (len(DRAW_COLS),)), 0)
+
+    cause, age, year = np.nonzero(present)
+    data = pd.DataFrame(cause_fractions[cause, age, year], columns=DRAW_COLS)
+    data = data.assign(
+        location_id=LOCATION_ID, year_id=year, sex_id=SEX_ID,
+        age_group_id=age, cause_id=hierarchy.cause_ids[cause])
+    data = data.merge(HIERARCHY, on='cause_id')
+    expected = correct._rescale_data(data, DRAW_COLS)
+
+    scaled, scaled_present = correct._rescale_array(
+        cause_fractions, present, hierarchy)
+    result = correct._grid_to_frame(
+        scaled, scaled_present, hierarchy, np.arange(2), np.arange(1),
+        DRAW_COLS).assign(location_id=LOCATION_ID, sex_id=SEX_ID)
+    pd.testing.assert_frame_equal(sorted_draws(result), sorted_draws(expected))
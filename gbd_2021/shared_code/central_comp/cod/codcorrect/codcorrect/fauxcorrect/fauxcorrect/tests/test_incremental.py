@@ -0,0 +1,103 @@
+import os
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from fauxcorrect.incremental import IncrementalPlan
+from fauxcorrect.parameters.machinery import MachineParameters
+from fauxcorrect.utils.constants import FilePaths
+
+# Correction hierarchy: all cause (294) splits into 1 and 2, 1 into 10 and 11,
+# 2 into 20, and 10 into 100
+CORRECTION_HIERARCHY = pd.DataFrame({
+    'cause_id': [294, 1, 2, 10, 11, 20, 100],
+    'level': [0, 1, 1, 2, 2, 2, 3],
+    'parent_id': [294, 294, 294, 1, 1, 2, 10],
+})
+# The reporting cause set also holds the shock cause 900 under 2, while the
+# second cause set aggregates 11 into 500
+CAUSE_SET_HIERARCHIES = {
+    1: pd.DataFrame({
+        'cause_id': [294, 1, 2, 10, 11, 20, 100, 900],
+        'parent_id': [294, 294, 294, 1, 1, 2, 10, 2],
+    }),
+    2: pd.DataFrame({
+        'cause_id': [294, 500, 11],
+        'parent_id': [294, 294, 500],
+    }),
+}
+
+
+@pytest.fixture
+def parameters():
+    return SimpleNamespace(
+        correction_hierarchy=CORRECTION_HIERARCHY,
+        cause_set_ids=list(CAUSE_SET_HIERARCHIES),
+        _cause_parameters={
+            cause_set_id: SimpleNamespace(hierarchy=hierarchy)
+            for cause_set_id, hierarchy in CAUSE_SET_HIERARCHIES.items()
+        },
+    )
+
+
+@pytest.mark.parametrize('changed, affected', [
+    # siblings and descendants through rescaling, ancestors in every cause
+    # set through aggregation
+    ([10], [1, 10, 11, 100, 294, 500]),
+    # causes outside the correction only carry up to their ancestors
+    ([900], [2, 294, 900]),
+    ([20, 900], [2, 20, 294, 900]),
+])
+def test_affected_cause_ids(parameters, changed, affected):
+    assert MachineParameters.affected_cause_ids(parameters, changed) == affected
+
+
+def make_plan(tmp_path, affected_cause_ids, covid_cause_ids):
+    plan = IncrementalPlan.__new__(IncrementalPlan)
+    plan.version_id, plan.prior_version_id = 2, 1
+    plan.parent_dir = str(tmp_path / 'v2')
+    plan.prior_parent_dir = str(tmp_path / 'v1')
+    plan.affected_cause_ids = affected_cause_ids
+    plan.covid_scalars_dirty = bool(
+        set(covid_cause_ids) & set(affected_cause_ids))
+    plan.reused_model_version_ids = set()
+    plan.most_detailed_location_ids = plan.location_ids = {6}
+    plan.dirty_most_detailed_location_ids = plan.dirty_location_ids = {6}
+    plan.clean_location_ids = set()
+    plan.correction_sex_ids = plan.aggregation_sex_ids = {1}
+    plan.sex_ids = [1]
+    return plan
+
+
+def write_prior_covid_scalars(plan):
+    scalars_dir = os.path.join(plan.prior_parent_dir, FilePaths.COVID_SCALARS)
+    os.makedirs(os.path.join(scalars_dir, FilePaths.SUMMARY_DIR))
+    open(os.path.join(scalars_dir, '10_1_6.h5'), 'w').close()
+    open(os.path.join(
+        scalars_dir, FilePaths.SUMMARY_DIR,
+        FilePaths.COVID_SCALARS_SUMMARY_FILE.format(version_id=1)
+    ), 'w').close()
+
+
+def test_covid_scalars_reused_when_unaffected(tmp_path):
+    plan = make_plan(tmp_path, [20, 2, 294], covid_cause_ids=[10])
+    write_prior_covid_scalars(plan)
+
+    assert not plan.calculates_covid_scalars()
+    assert plan.link_prior_outputs() == 2
+    scalars_dir = os.path.join(plan.parent_dir, FilePaths.COVID_SCALARS)
+    assert os.path.exists(os.path.join(scalars_dir, '10_1_6.h5'))
+    assert os.path.exists(os.path.join(
+        scalars_dir, FilePaths.SUMMARY_DIR,
+        FilePaths.COVID_SCALARS_SUMMARY_FILE.format(version_id=2)))
+
+
+def test_covid_scalars_rerun_when_affected(tmp_path):
+    plan = make_plan(tmp_path, [1, 10, 11, 294], covid_cause_ids=[10])
+    write_prior_covid_scalars(plan)
+
+    assert plan.calculates_covid_scalars()
+    assert plan.link_prior_outputs() == 0
+    assert not os.path.exists(
+        os.path.join(plan.parent_dir, FilePaths.COVID_SCALARS))
@@ -293,6 +293,8 @@ class FilePaths:
     ENVELOPE_SUMMARY_FILE: str = 'envelope_summary.h5'
     GBD_UPLOAD: str = 'gbd'
     INPUT_FILES_DIR: str = 'input_files'
+    INCREMENTAL_CHANGES_FILE: str = 'incremental_changes_v{prior_version_id}.csv'
+    INCREMENTAL_PLAN_FILE: str = 'incremental_plan.pkl'
     INPUT_MODELS_FILE: str = '{process}_v{version_id}_models.csv'
     LOCATION_AGGREGATE_FILE_PATTERN: str = (
         '{{sex_id}}_{{location_id}}_{year_id}.h5'
@@ -25,3 +25,10 @@ class InputDrawsEmpty(DeathMachineBaseException):
 
 class MoreThanOneBestVersion(DeathMachineBaseException):
     """Raised when get_current_best call returns more than one row"""
+
+
+class IncrementalRunNotPossible(DeathMachineBaseException):
+    """
+    Raised when a run cannot reuse the outputs of a prior run because
+    inputs other than the best models differ between the two.
+    """
@@ -4,6 +4,7 @@ import logging
 import gbd.constants as gbd
 from jobmon.client.workflow import WorkflowRunStatus
 
+from fauxcorrect.incremental import IncrementalPlan
 from fauxcorrect.job_swarm.codcorrect_workflow import CodCorrectWorkflow
 from fauxcorrect.parameters import base_cause_set
 from fauxcorrect.parameters.machinery import CoDCorrectParameters
@@ -135,6 +136,23 @@ def parse_args() -> Namespace:
         help=("Optionally pass in a previous CodCorrect version to scatter the results of "
               "this run against; if nothing is passed in, no scatters are made.")
     )
+    parser.add_argument(
+        '--prior_version_id',
+        type=int,
+        default=None,
+        help=("Optionally pass in a previous CodCorrect version to rerun "
+              "incrementally against: only work affected by best models that "
+              "changed since that version is scheduled, and its outputs are "
+              "reused for everything else.")
+    )
+    parser.add_argument(
+        '--incremental_location_ids',
+        type=int,
+        nargs='+',
+        default=None,
+        help=("With --prior_version_id, the most detailed locations whose "
+              "draws changed. Defaults to all most detailed locations.")
+    )
     args = parser.parse_args()
     input_args.set_reactive_defaults(args)
     return args
@@ -190,6 +208,22 @@ def main():
             args.decomp_step
         )
         codcorrect.cache_correction_hierarchy()
+        incremental = None
+        if args.prior_version_id:
+            logger.info(
+                "Planning incremental rerun against CoDCorrect version "
+                f"{args.prior_version_id}."
+            )
+            incremental = IncrementalPlan(
+                codcorrect,
+                CoDCorrectParameters.recreate_from_version_id(
+                    args.prior_version_id
+                ),
+                location_ids=args.incremental_location_ids
+            )
+            incremental.write_changes_report()
+            incremental.link_prior_outputs()
+            incremental.cache_plan()
     else:
         codcorrect = CoDCorrectParameters.recreate_from_version_id(
             args.version_id
@@ -200,6 +234,9 @@ def main():
             args
         )
 
+        incremental = IncrementalPlan.recreate_from_parent_dir(
+            codcorrect.parent_dir
+        )
         if args.restart:
             logger.info(
                 f"Restarting CoDCorrect version {codcorrect.version_id} run."
@@ -213,7 +250,9 @@ def main():
 
     # Wrap jobmon calls so we can message out failure in case of jobmon issue
     try:
-        swarm = CodCorrectWorkflow(parameters=codcorrect, resume=args.resume)
+        swarm = CodCorrectWorkflow(
+            parameters=codcorrect, resume=args.resume, incremental=incremental
+        )
         logger.info("Constructing workflow.")
         swarm.create_workflow()
         logger.info("Running workflow.")
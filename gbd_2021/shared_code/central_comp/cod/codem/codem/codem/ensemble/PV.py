@@ -90,6 +90,25 @@ def country_age_trend(unit_df, window, ln_predictions):
     return errors
 
 
+def trend_pairs(df2, window):
+    """
+    (data frame, int) -> array, array, array, array
+
+    Finds every pair of rows of a location-age that country_age_trend compares:
+    a row and any row of the same location-age from 1 to window years later.
+    Returns the positions of the earlier and later rows of each pair, the
+    years between them and the observed slope in ln_rate.
+    """
+    rows = df2[["location_id", "age", "year", "ln_rate"]].copy()
+    rows["position"] = df2.index.values
+    pairs = rows.merge(rows, on=["location_id", "age"], suffixes=("_1", "_2"))
+    gap = (pairs.year_2 - pairs.year_1).values
+    pairs = pairs[(gap > 0) & (gap <= window)]
+    gap = (pairs.year_2 - pairs.year_1).values.astype(float)
+    obs_slope = (pairs.ln_rate_2 - pairs.ln_rate_1).values / gap
+    return pairs.position_1.values, pairs.position_2.values, gap, obs_slope
+
+
 def ko_rmse_out(df, ko, pred_mat):
     """
     (data frame, data frame, array) -> array
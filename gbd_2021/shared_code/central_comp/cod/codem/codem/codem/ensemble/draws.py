@@ -3,9 +3,11 @@ from concurrent.futures import ProcessPoolExecutor as Pool
 
 import numpy as np
 import pandas as pd
-from pymc import gp
 from tqdm import tqdm
 
+from codem.stgpr.gaussian_process import (gpr_chunksize, location_age_process,
+                                          prior_mean_function)
+
 logger = logging.getLogger(__name__)
 
 
@@ -89,42 +91,36 @@ def linear_draws_map(inputs):
     return linear_draws(list_of_dics, df, linear_floor, response_list, draws)
 
 
-def new_gpr_draws(df2, response, amplitude, prior, scale, has_data, draws):
+def new_gpr_draws(df2, response, amplitude, prior, scale, has_data, draws,
+                  process=None):
     """
     (data frame, str, float, data frame, int, int) -> array
 
     Using the input parameters given above runs an instance of gaussian process
     smoothing in order to account for years where we do not have data. The data
-    frame (df2) is specific to a location-age.
+    frame (df2) is specific to a location-age. All draws are sampled at once
+    from the closed form posterior; pass the location-age's process to share
+    its covariances across submodels.
     """
-    all_indices = df2.index
-    data_indices = df2[(df2.iloc[:, -4])].index
-    years = df2.loc[all_indices]["year"].values
-    data = pd.DataFrame({"year":years, "prior":prior})
-    data.sort_values("year", inplace=True)
-    data.drop_duplicates(inplace=True)
-
-    def mean_function(x):
-        return np.interp(x, data.year.values, data.prior.values)
-    M = gp.Mean(mean_function)
-    C = gp.Covariance(eval_fun=gp.matern.euclidean, diff_degree=2,
-                      amp=amplitude, scale=scale)
-    df4 = df2.loc[data_indices]
-    if has_data:
-        gp.observe(M=M, C=C, obs_mesh=df4.year.values,
-                   obs_vals=df4[response].values,
-                   obs_V=df4[response + "_sd"].values**2 +
-                   df4[response + "_nsv"].values)
-    ca_draws = np.array([gp.Realization(M, C)(years) for d in range(draws)]).T
-    return ca_draws
+    if process is None:
+        process = location_age_process(df2, scale, has_data)
+    mean_function = prior_mean_function(df2.year.values, prior)
+    if not has_data:
+        return process.draws(mean_function, amplitude, draws)
+    df4 = df2[(df2.iloc[:, -4])]
+    return process.draws(mean_function, amplitude, draws,
+                         obs_vals=df4[response].values,
+                         obs_variance=df4[response + "_sd"].values**2 +
+                         df4[response + "_nsv"].values)
 
 
 def age_group_gpr_draw(ca_df, age_amplitude, preds, response_list, scale, draws):
     has_data = ca_df.iloc[:, -4].sum() > 0
     var_type = ca_df.variance_type.values[0]
+    process = location_age_process(ca_df, scale, has_data)
     preds = np.hstack([new_gpr_draws(ca_df, response_list[i],
                                      age_amplitude[var_type][i], preds[:, i],
-                                     scale, has_data, draws[i])
+                                     scale, has_data, draws[i], process=process)
                        for i in range(len(draws)) if draws[i] != 0])
     return preds
 
@@ -148,7 +144,8 @@ def new_ko_gpr_draws(df, ko, amplitude, preds, variance, response_list, scale, d
                response_list, scale, draws)
               for i in range(len(inputs))]
     p = Pool(30)
-    new_draws = list(p.map(age_group_gpr_draw_map, tqdm(inputs)))
+    new_draws = list(p.map(age_group_gpr_draw_map, tqdm(inputs),
+                           chunksize=gpr_chunksize(len(inputs), 30)))
     p.shutdown()
     for i in range(len(new_draws)):
         random_draws[inputs[i][0].index.values, :] = new_draws[i]
@@ -81,16 +81,19 @@ class Model_List:
         """
         logger.info("Applying single instance of spacetime smoothing.")
         pos = self.super_region_positions(indices, sReg, df, ko)
-        st = ST.spacetime(
-            indices, sReg, df, ko, omega_age_smooth, time_weight_method,
-            lambda_time_smooth, lambda_time_smooth_nodata, zeta_space_smooth,
-            zeta_space_smooth_nodata
-        )
         residuals = self.res_mat[pos["train_rows"], :]
         ln_rate_adj = df[ko.iloc[:, 0]]["ln_rate"].values[pos["train_rows"]]
-        new_res = np.dot(st.T, residuals)
-        self.st_smooth_mat[pos["full_rows"], :] = new_res
-        new_simple_st = np.dot(st.T, ln_rate_adj)
+        # smooth the residuals and the simple ln_rate together so the weights
+        # are only built once, a tile at a time
+        smoothed = ST.spacetime_product(
+            df.iloc[indices, :], df[(df.level_1 == sReg) & (ko.iloc[:, 0])],
+            np.column_stack([residuals, ln_rate_adj]), omega_age_smooth,
+            time_weight_method, lambda_time_smooth, lambda_time_smooth_nodata,
+            zeta_space_smooth, zeta_space_smooth_nodata,
+            np.min(df.year), np.max(df.year)
+        )
+        self.st_smooth_mat[pos["full_rows"], :] = smoothed[:, :-1]
+        new_simple_st = smoothed[:, -1]
         self.simple_st_ln_rate[pos["full_rows"]] = new_simple_st + self.simple_st_ln_rate[pos["full_rows"]]
         mini = df.loc[indices, ["pop", "envelope"]]
         new_simple_st = transform_log_data(new_simple_st) * \
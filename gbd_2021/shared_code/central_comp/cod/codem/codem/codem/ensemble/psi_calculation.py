@@ -4,7 +4,7 @@ from concurrent.futures import ProcessPoolExecutor as Pool
 import numpy as np
 from tqdm import tqdm
 
-from codem.ensemble.PV import rmse_out_map, trend_out_map
+from codem.ensemble.PV import rmse_out_map, trend_out_map, trend_pairs
 
 logger = logging.getLogger(__name__)
 
@@ -56,6 +56,24 @@ def psi_weights(space_err, lin_err, psi, cutoff):
     return psi_values[:M], psi_values[M:]
 
 
+def psi_weight_matrix(space_err, lin_err, psi_values, cutoff):
+    """
+    (array, array, array, int) -> tuple of 2 arrays
+
+    psi_weights for every value in psi_values at once. Submodel ranks do not
+    depend on psi, so they are computed once. Returns a (psi, space model) and
+    a (psi, linear model) array whose rows are the psi_weights of each psi.
+    """
+    ranks = rank_array(np.append(space_err, lin_err))
+    N = min([len(ranks), 100])
+    psi = np.asarray(psi_values, dtype=float)[:, np.newaxis]
+    weights = psi**(N - ranks)
+    weights /= weights.sum(axis=1)[:, np.newaxis]
+    weights *= (ranks <= cutoff)
+    M = int(len(ranks) / 2)
+    return weights[:, :M], weights[:, M:]
+
+
 def psi_draws(space_err, lin_err, psi, cutoff):
     """
     (array, array, float, int) -> tuple of 2 arrays
@@ -181,19 +199,69 @@ def trend_ensemble_out(list_of_preds, data_frame, knockouts, window):
     return np.median(trend_all, axis=0)
 
 
+def ko_psi_surface(df, ko, pred_mat, weights, window):
+    """
+    (data frame, data frame, array, array, int) -> tuple of 2 arrays
+
+    Out of sample RMSE and trend of the ensemble for every psi value on a
+    single knockout pattern. pred_mat holds every submodel's predictions
+    (space models, then linear models) and weights is the matching
+    (submodel, psi) weight matrix. The submodel errors at the test rows and
+    the submodel slopes over the test trend pairs are built once and each
+    scored against all psi values with a single matrix product.
+    """
+    test = ko.iloc[:, 1].values
+    test_rows = ko.index.values[test]
+    ln_values = df.loc[test_rows, "ln_rate"].values
+    errors = pred_mat[test_rows, :].dot(weights) - ln_values[..., np.newaxis]
+    rmse = ((errors**2).sum(0) / float(len(test_rows)))**.5
+    first, second, gap, obs_slope = trend_pairs(df[test], window)
+    slopes = (pred_mat[second, :] - pred_mat[first, :]) / gap[..., np.newaxis]
+    trend = (slopes.dot(weights) - obs_slope[..., np.newaxis])**2
+    trend = trend[~np.isnan(trend).any(axis=1)]
+    return rmse, (trend.sum(0) / float(len(trend)))**.5
+
+
+def psi_surface(data_frame, knockouts, window, space_models, linear_models,
+                psi_values, cutoff):
+    """
+    (data frame, list of dfs, int, all_model, all_model, array, int) ->
+    tuple of 2 arrays
+
+    Out of sample RMSE and trend of the ensemble for every knockout pattern
+    (rows) and psi value (columns). Equivalent to scoring the predictions of
+    ensemble_all with rmse_ensemble_out and trend_ensemble_out before they take
+    the median across knockouts.
+    """
+    logger.info("Scoring ensembles for all psi values across all knockouts.")
+    space_weights, lin_weights = psi_weight_matrix(
+        space_models.RMSE + space_models.trend,
+        linear_models.RMSE + linear_models.trend, psi_values, cutoff)
+    weights = np.vstack([space_weights.T, lin_weights.T])
+    surface = [ko_psi_surface(data_frame, knockouts[i],
+                              np.hstack([space_models.all_models[i].pred_mat,
+                                         linear_models.all_models[i].pred_mat]),
+                              weights, window)
+               for i in tqdm(range(len(space_models.all_models) - 1))]
+    rmse, trend = list(map(np.array, zip(*surface)))
+    return rmse, trend
+
+
 def best_psi(data_frame, knockouts, window, space_models, linear_models, psi_values, cutoff):
     """
     (data frame, list of dfs, int, all_model, all_model, array, int) -> float
 
     Get the best value of psi using the median value across all knockouts.
+    The (knockout, psi) RMSE and trend surfaces are returned last.
     """
     logger.info("Getting the best psi value using median rmse and trend error across all knockouts.")
-    ens_preds = ensemble_all(space_models, linear_models, psi_values, cutoff)
-    rmse = rmse_ensemble_out(ens_preds, data_frame, knockouts)
-    trend = trend_ensemble_out(ens_preds, data_frame, knockouts, window)
+    rmse_all, trend_all = psi_surface(data_frame, knockouts, window, space_models,
+                                      linear_models, psi_values, cutoff)
+    rmse = np.median(rmse_all, axis=0)
+    trend = np.median(trend_all, axis=0)
     best_rmse = rmse[np.argmin(rmse + trend)]
     best_trend = trend[np.argmin(rmse + trend)]
     psi = psi_values[np.argmin(rmse + trend)]
     d1, d2, r1, r2 = psi_draws(space_models.RMSE + space_models.trend,
                                linear_models.RMSE + linear_models.trend, psi, cutoff)
-    return psi, d1, d2, best_rmse, best_trend, r1, r2
+    return psi, d1, d2, best_rmse, best_trend, r1, r2, rmse_all, trend_all
@@ -7,6 +7,7 @@ from codem.data.parameters import get_model_parameters
 from codem.joblaunch.resource_predictions import (
     get_step_prediction,
     import_resource_parameters,
+    open_resource_store,
 )
 from codem.metadata.step_metadata import STEP_DICTIONARY, STEP_IDS, STEP_NAMES
 
@@ -32,6 +33,7 @@ class StepTaskGenerator:
         self.old_covariates_mvid = old_covariates_mvid
         self.debug_mode = debug_mode
         self.resource_prediction_data = import_resource_parameters()
+        self.resource_store = open_resource_store()
         if additional_resources is None:
             additional_resources = {}
         self.additional_resources = additional_resources
@@ -40,7 +42,8 @@ class StepTaskGenerator:
         parameters = get_step_prediction(
             resource_parameters=self.resource_prediction_data,
             step_id=step_id,
-            input_info=inputs_info
+            input_info=inputs_info,
+            resource_store=self.resource_store
         )
         if str(step_id) in self.additional_resources:
             if 'max_runtime_seconds' in self.additional_resources[str(step_id)]:
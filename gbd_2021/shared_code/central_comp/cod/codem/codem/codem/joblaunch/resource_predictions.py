@@ -16,6 +16,7 @@ from scipy.stats import t
 from db_tools import ezfuncs
 
 from codem.joblaunch.profiling import START_DATE, query_jobs
+from codem.joblaunch.resource_store import STORE_FILE, ResourceStore
 from codem.joblaunch.resources import STEP_CORES
 from codem.metadata.step_metadata import STEP_IDS, STEP_NAMES
 
@@ -25,6 +26,8 @@ logging.getLogger().setLevel(logging.INFO)
 
 RESOURCE_DIR = 'FILEPATH/codem/resource_predictions'
 RESOURCE_FILE = os.path.join(RESOURCE_DIR, 'resource_file.txt')
+RESOURCE_STORE_FILE = STORE_FILE
+RESOURCE_STORE_PIPELINE = 'codem'
 JOBMON_PORTS = [10010, 10020, 10030]
 
 MAX_MIN = 60 * 24 * 2
@@ -42,12 +45,27 @@ def import_resource_parameters():
     return d
 
 
+def open_resource_store():
+    """
+    The shared resource usage store, or None if it hasn't been built yet, in
+    which case predictions fall back to the regression models.
+    """
+    if not os.path.exists(RESOURCE_STORE_FILE):
+        logger.warning(f"No resource store at {RESOURCE_STORE_FILE}.")
+        return None
+    return ResourceStore(RESOURCE_STORE_FILE)
+
+
 class Parameters:
     """
     Parameters used in fitting the model.
     """
     # Prediction interval width
     ALPHA = 0.02
+    # Quantile of past usage of similar tasks to request from the resource store
+    STORE_QUANTILE = 0.95
+    # Job attributes that identify rather than size a model
+    STORE_KEYS = ['global_model']
     # Outcome variables to predict
     MEASURE_VARS = ['ram_gb', 'runtime_min']
     # Predictors to use in each regression, by step
@@ -252,6 +270,51 @@ def run_resource_prediction_models(
     return all_data, all_models
 
 
+def step_store_features(step_name: str):
+    """
+    Keys and size features a step's resource usage is stored and predicted
+    under: the step's regression predictors, split into identifying keys and
+    sizes.
+    """
+    predictors = Parameters.STEP_VARIABLES[step_name]
+    keys = [p for p in predictors if p in Parameters.STORE_KEYS]
+    sizes = [p for p in predictors if p not in Parameters.STORE_KEYS]
+    return keys, sizes
+
+
+def fetch_step_usage(since=None):
+    """
+    Usage of every finished CODEm step job run since a submission time (or
+    START_DATE), in the layout ResourceStore.record expects.
+    """
+    start_date = START_DATE if since is None else datetime.strptime(
+        since.split("T")[0], "%Y-%m-%d")
+    all_data = get_all_data_for_predictions(start_date=start_date)
+    usage = []
+    for step_name in STEP_IDS:
+        step_string = f'_{STEP_IDS[step_name]:02d}'
+        step_data = all_data[all_data.job_name.str.contains(step_string)].copy()
+        step_data['task_type'] = step_name
+        usage.append(step_data)
+    usage = pd.concat(usage)
+    usage['ran_at'] = usage['submission_time']
+    if since is not None:
+        usage = usage.loc[usage.ran_at > since]
+    return usage
+
+
+def refresh_resource_store(store: ResourceStore):
+    """
+    Add the CODEm jobs run since the store was last refreshed to it.
+    """
+    key_cols = sorted({k for step in Parameters.STEP_VARIABLES
+                       for k in step_store_features(step)[0]})
+    size_cols = sorted({k for step in Parameters.STEP_VARIABLES
+                        for k in step_store_features(step)[1]})
+    return store.refresh(RESOURCE_STORE_PIPELINE, fetch_step_usage,
+                         key_cols=key_cols, size_cols=size_cols)
+
+
 def plot_predictions(all_models: pd.DataFrame, all_data: pd.DataFrame, plot_dir: str):
     """
     Make plots of the predicted v. reality of how much memory
@@ -317,21 +380,10 @@ def make_all_predictions(X: pd.DataFrame, results: Dict[str, int]):
     return predictions + t_value * variance ** 0.5
 
 
-def get_step_prediction(resource_parameters: Dict[str, int], step_id: int, input_info: Dict[str, int]):
+def predict_step_memory(step_parameters: Dict[str, int], new_data: pd.DataFrame):
     """
-    Get the step predictions given resource parameters and a step ID.
-    Also use the input info for the actual job.
-
-    Args:
-        resource_parameters: dictionary of resource parameters
-        step_id: ID of CODEm step
-        input_info: dictionary of inputs parameters
+    Memory in GB from the step's regression model, or the default.
     """
-    step_parameters = resource_parameters[STEP_NAMES[step_id]]
-    new_data = pd.DataFrame.from_dict(input_info, orient='index').T
-
-    run_parameters = {}
-
     params = step_parameters['ram_gb']
     try:
         m_mem_free = make_all_predictions(
@@ -342,14 +394,13 @@ def get_step_prediction(resource_parameters: Dict[str, int], step_id: int, input
         logger.warning("Could not predict for m_mem_free.")
         logger.warning(f"Giving it the default of {DEFAULT_GB}.")
         m_mem_free = DEFAULT_GB
-    if m_mem_free < MIN_GB:
-        m_mem_free = MIN_GB
-    elif m_mem_free > MAX_GB:
-        m_mem_free = MAX_GB
-    m_mem_free = str(math.ceil(m_mem_free)) + 'GB'
+    return m_mem_free
 
-    run_parameters['m_mem_free'] = m_mem_free
 
+def predict_step_runtime(step_parameters: Dict[str, int], new_data: pd.DataFrame):
+    """
+    Runtime in minutes from the step's regression model, or the default.
+    """
     params = step_parameters['runtime_min']
     try:
         minutes = make_all_predictions(
@@ -360,6 +411,53 @@ def get_step_prediction(resource_parameters: Dict[str, int], step_id: int, input
         logger.warning("Could not predict for max_runtime_seconds.")
         logger.warning(f"Giving it the default of {DEFAULT_MIN}.")
         minutes = DEFAULT_MIN
+    return minutes
+
+
+def get_step_prediction(resource_parameters: Dict[str, int], step_id: int, input_info: Dict[str, int],
+                        resource_store: ResourceStore = None):
+    """
+    Get the step predictions given resource parameters and a step ID.
+    Also use the input info for the actual job. If a resource store is given
+    and has history for the step, its quantiles of past usage are used;
+    otherwise the regression predictions, then the defaults.
+
+    Args:
+        resource_parameters: dictionary of resource parameters
+        step_id: ID of CODEm step
+        input_info: dictionary of inputs parameters
+        resource_store: shared store of past resource usage
+    """
+    step_name = STEP_NAMES[step_id]
+    step_parameters = resource_parameters[step_name]
+    new_data = pd.DataFrame.from_dict(input_info, orient='index').T
+
+    run_parameters = {}
+
+    stored = None
+    if resource_store is not None:
+        keys, sizes = step_store_features(step_name)
+        stored = resource_store.predict(
+            RESOURCE_STORE_PIPELINE, step_name,
+            keys={k: input_info.get(k) for k in keys},
+            sizes={k: input_info.get(k) for k in sizes},
+            quantile=Parameters.STORE_QUANTILE
+        )
+
+    if stored is not None:
+        m_mem_free, minutes = stored
+    else:
+        m_mem_free = predict_step_memory(step_parameters, new_data)
+        minutes = predict_step_runtime(step_parameters, new_data)
+
+    if m_mem_free < MIN_GB:
+        m_mem_free = MIN_GB
+    elif m_mem_free > MAX_GB:
+        m_mem_free = MAX_GB
+    m_mem_free = str(math.ceil(m_mem_free)) + 'GB'
+
+    run_parameters['m_mem_free'] = m_mem_free
+
     if minutes > MAX_MIN:
         minutes = MAX_MIN
     elif minutes < MIN_MIN:
@@ -368,7 +466,7 @@ def get_step_prediction(resource_parameters: Dict[str, int], step_id: int, input
         pass
     run_parameters['max_runtime_seconds'] = int(minutes * 60)
 
-    run_parameters['num_cores'] = int(STEP_CORES[STEP_NAMES[step_id]])
+    run_parameters['num_cores'] = int(STEP_CORES[step_name])
     run_parameters['queue'] = 'all.q'
     for k, v in run_parameters.items():
         logger.info(f"Task gets {k}: {v}")
@@ -388,6 +486,8 @@ def main(output_dir: str):
         os.mkdir(output_dir)
     logging.info("Generating resource predictions")
     all_data, all_models = run_resource_prediction_models(output_dir=output_dir)
+    logging.info("Refreshing the resource store")
+    refresh_resource_store(ResourceStore(RESOURCE_STORE_FILE))
     logging.info("Generating graphs of predictions")
     plot_predictions(
         all_models=all_models,
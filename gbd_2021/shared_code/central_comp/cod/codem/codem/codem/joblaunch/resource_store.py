@@ -0,0 +1,233 @@
+"""
+A locally persisted store of task resource usage, and memory and runtime
+predictions made from it.
+
+Each record is one finished task: the pipeline and task type it belongs to,
+identifying keys (modelable entity, location, ...), size features (rows,
+locations, age groups, covariates, ...) and the peak memory and runtime it
+used. A prediction is a quantile of the usage of the past tasks nearest in
+size among those that share the new task's keys, falling back to tasks that
+share fewer keys. When there is no history at all the caller's defaults are
+used.
+
+CODEm and the DisMod cascade (cascade_ode.sge) both size their jobs from the
+store at STORE_FILE, each under its own pipeline name.
+"""
+import json
+import logging
+import math
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Store file shared by every pipeline
+STORE_FILE = 'FILEPATH/resource_predictions/resource_store.sqlite'
+
+DEFAULT_QUANTILE = 0.9
+# Fewest tasks a match coarser than an exact one needs before it is used
+MIN_HISTORY = 5
+# Most past tasks, nearest in size, a prediction is taken over
+NEIGHBOURS = 25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS task_usage (
+    pipeline TEXT NOT NULL,
+    task_type TEXT NOT NULL,
+    task_keys TEXT NOT NULL,
+    sizes TEXT NOT NULL,
+    ram_gb REAL NOT NULL,
+    runtime_min REAL NOT NULL,
+    ran_at TEXT NOT NULL DEFAULT '',
+    UNIQUE (pipeline, task_type, task_keys, sizes, ram_gb, runtime_min, ran_at)
+);
+CREATE INDEX IF NOT EXISTS task_usage_type
+    ON task_usage (pipeline, task_type);
+"""
+
+
+def log_size(value):
+    """Size feature on the log2 scale similarity is measured on. Missing and
+    nonpositive sizes count as zero."""
+    if value is None or value != value or value <= 0:
+        return 0.
+    return math.log2(1. + value)
+
+
+def _encode(values):
+    return json.dumps({k: _plain(v) for k, v in sorted(values.items())})
+
+
+def _plain(value):
+    """numpy scalars to builtins, so keys match however they were passed"""
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return value
+
+
+class ResourceStore:
+    def __init__(self, path, min_history=MIN_HISTORY, neighbours=NEIGHBOURS):
+        """
+        Resource usage history kept in the SQLite file at path, which is
+        created if it doesn't exist.
+
+        Args:
+            path (str): store file
+            min_history (int): fewest tasks a coarse match needs to be used
+            neighbours (int): most tasks, nearest in size, to predict from
+        """
+        self.path = path
+        self.min_history = min_history
+        self.neighbours = neighbours
+        self._history = {}
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def record(self, pipeline, usage, key_cols, size_cols):
+        """
+        Add finished tasks to the store. Tasks already in the store are
+        skipped, so overlapping batches can be recorded safely.
+
+        Args:
+            pipeline (str): pipeline the tasks belong to
+            usage (pd.DataFrame): one row per task with task_type, ram_gb,
+                runtime_min, optionally ran_at, and the key_cols and
+                size_cols columns
+            key_cols (List[str]): columns identifying what the task ran on
+            size_cols (List[str]): columns describing how big the task was
+
+        Returns:
+            int: number of tasks added
+        """
+        usage = usage.dropna(subset=['ram_gb', 'runtime_min'])
+        ran_at = (usage['ran_at'].fillna('').astype(str) if 'ran_at' in usage
+                  else pd.Series('', index=usage.index))
+        rows = [
+            (pipeline, str(row['task_type']),
+             _encode({c: row[c] for c in key_cols}),
+             _encode({c: row[c] for c in size_cols}),
+             float(row['ram_gb']), float(row['runtime_min']), ran_at[i])
+            for i, row in usage.iterrows()]
+        with closing(self._connect()) as conn, conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO task_usage VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows)
+            added = conn.total_changes - before
+        self._history = {}
+        logger.info(f"Recorded {added} new {pipeline} tasks in {self.path}")
+        return added
+
+    def latest(self, pipeline):
+        """ran_at of the most recently run task of a pipeline, or None"""
+        with closing(self._connect()) as conn:
+            latest = conn.execute(
+                "SELECT MAX(ran_at) FROM task_usage WHERE pipeline = ?",
+                (pipeline,)).fetchone()[0]
+        return latest or None
+
+    def refresh(self, pipeline, fetch, key_cols, size_cols):
+        """
+        Record the tasks returned by fetch(since), where since is the ran_at
+        of the latest task already stored for the pipeline (None for an empty
+        store), so each refresh only pulls new telemetry.
+
+        Returns:
+            int: number of tasks added
+        """
+        since = self.latest(pipeline)
+        logger.info(f"Refreshing {pipeline} resource usage since {since}")
+        usage = fetch(since)
+        if usage is None or usage.empty:
+            return 0
+        return self.record(pipeline, usage, key_cols, size_cols)
+
+    def history(self, pipeline, task_type):
+        """
+        Stored usage of one task type, with a column per key and a column of
+        log2(1 + size) per size feature.
+        """
+        if (pipeline, task_type) not in self._history:
+            with closing(self._connect()) as conn:
+                df = pd.read_sql(
+                    "SELECT task_keys, sizes, ram_gb, runtime_min "
+                    "FROM task_usage WHERE pipeline = ? AND task_type = ?",
+                    conn, params=(pipeline, task_type))
+            keys = pd.DataFrame([json.loads(k) for k in df.task_keys],
+                                index=df.index)
+            sizes = pd.DataFrame(
+                [{k: log_size(v) for k, v in json.loads(s).items()}
+                 for s in df.sizes], index=df.index)
+            sizes.columns = [f'{c}_log2' for c in sizes.columns]
+            self._history[(pipeline, task_type)] = pd.concat(
+                [df[['ram_gb', 'runtime_min']], keys, sizes], axis=1)
+        return self._history[(pipeline, task_type)]
+
+    def predict(self, pipeline, task_type, keys=None, sizes=None,
+                quantile=DEFAULT_QUANTILE, default=None):
+        """
+        Predict the memory and runtime of a new task from tasks like it.
+
+        Past tasks are matched on every key, then on all but the last key and
+        so on down to every task of the type. Within a match, if sizes are
+        given, only the neighbours tasks closest in log2 size are used. An
+        exact key match is used however few tasks it has; coarser matches
+        need min_history tasks, except the last.
+
+        Args:
+            pipeline (str): pipeline of the task
+            task_type (str): type of task, e.g. a step name or job type
+            keys (Dict[str, Any]): identifying values of the task, in order
+                from the broadest to the most specific
+            sizes (Dict[str, float]): size features of the task
+            quantile (float): quantile of past usage to predict
+            default (Tuple[float, float]): returned without any history
+
+        Returns:
+            Tuple[float, float]: GB of memory and runtime in minutes
+        """
+        keys = {k: _plain(v) for k, v in (keys or {}).items()}
+        sizes = sizes or {}
+        history = self.history(pipeline, task_type)
+        if history.empty:
+            return default
+
+        names = list(keys)
+        for n_keys in range(len(names), -1, -1):
+            mask = pd.Series(True, index=history.index)
+            for k in names[:n_keys]:
+                if k not in history:
+                    mask[:] = False
+                    break
+                mask &= history[k] == keys[k]
+            matched = history[mask]
+            if matched.empty:
+                continue
+            if sizes:
+                distance = pd.Series(0., index=matched.index)
+                for k, value in sizes.items():
+                    col = f'{k}_log2'
+                    past = (matched[col] if col in matched
+                            else pd.Series(0., index=matched.index))
+                    distance += (past.fillna(0.) - log_size(value))**2
+                matched = matched.loc[
+                    distance.sort_values(kind='mergesort').index[:self.neighbours]]
+            exact = n_keys == len(names) and n_keys > 0
+            if exact or n_keys == 0 or len(matched) >= self.min_history:
+                logger.info(
+                    f"Predicting {task_type} resources from {len(matched)} "
+                    f"past tasks matching {names[:n_keys]}")
+                usage = matched[['ram_gb', 'runtime_min']].quantile(quantile)
+                return float(usage['ram_gb']), float(usage['runtime_min'])
+        return default
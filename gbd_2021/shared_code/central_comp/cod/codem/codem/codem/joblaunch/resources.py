@@ -9,7 +9,7 @@ STEP_CORES = {
     'ApplyGPSmoothing': 25,
     'LinearPV': 20,
     'SpacetimePV': 20,
-    'OptimalPSI': 10,
+    'OptimalPSI': 1,
     'GPRDraws': 25,
     'LinearDraws': 20,
     'EnsemblePredictions': 1,
@@ -0,0 +1,183 @@
+"""
+Closed form Gaussian process regression for the GPR smoothing and GPR draws
+of CODEm submodels.
+
+The covariance is the Matern function in the parameterization of PyMC2's
+gp.matern.euclidean, which the smoothing was originally written against, so
+amplitude, scale and diff_degree keep their meaning.
+"""
+import logging
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+from scipy.special import gamma, kv
+
+logger = logging.getLogger(__name__)
+
+DIFF_DEGREE = 2.
+
+# Relative diagonal jitter tried, in order, when a covariance matrix is not
+# numerically positive definite
+JITTERS = [0., 1e-12, 1e-10, 1e-8, 1e-6]
+
+
+def matern(x, y, amplitude, scale, diff_degree=DIFF_DEGREE):
+    """
+    (array, array, float, float, float) -> array
+
+    Returns the Matern covariance between every point of x (rows) and every
+    point of y (columns).
+    """
+    t = np.abs(np.subtract.outer(np.asarray(x, dtype=float),
+                                 np.asarray(y, dtype=float)))
+    t *= 2. * np.sqrt(diff_degree) / scale
+    with np.errstate(invalid="ignore"):
+        cov = (0.5**(diff_degree - 1.) / gamma(diff_degree) *
+               t**diff_degree * kv(diff_degree, t))
+    cov[t == 0] = 1.
+    return amplitude**2 * cov
+
+
+def prior_mean_function(years, prior):
+    """
+    (array, array) -> function
+
+    Returns the prior mean of a location-age as a function of year, linearly
+    interpolating the submodel predictions in prior.
+    """
+    pairs = np.unique(np.column_stack([np.asarray(years, dtype=float),
+                                       np.asarray(prior, dtype=float)]), axis=0)
+
+    def mean_function(x):
+        return np.interp(x, pairs[:, 0], pairs[:, 1])
+    return mean_function
+
+
+def _cholesky(matrix, size):
+    """
+    Lower Cholesky factor of a covariance matrix, adding the smallest jitter
+    relative to size that makes it positive definite. Falls back to a
+    symmetric square root from the eigen-decomposition.
+    """
+    identity = np.eye(len(matrix))
+    for jitter in JITTERS:
+        try:
+            return np.linalg.cholesky(matrix + jitter * size * identity)
+        except np.linalg.LinAlgError:
+            continue
+    values, vectors = np.linalg.eigh(matrix)
+    return vectors * np.sqrt(np.clip(values, 0., None))
+
+
+def _cho_factor(matrix, size):
+    identity = np.eye(len(matrix))
+    for jitter in JITTERS:
+        try:
+            return cho_factor(matrix + jitter * size * identity, lower=True)
+        except np.linalg.LinAlgError:
+            continue
+    raise np.linalg.LinAlgError("Observed covariance is not positive definite.")
+
+
+class MaternProcess:
+    def __init__(self, years, obs_years, scale, diff_degree=DIFF_DEGREE):
+        """
+        A Matern Gaussian process over the years of a single location-age,
+        observed with noise at obs_years (empty if there is no data).
+
+        The unit amplitude covariances of the year mesh are computed once and
+        shared by every submodel run on the location-age. Factorizations that
+        depend on a submodel's amplitude and observation variance are cached
+        on those values, so submodels that share them share the Cholesky
+        factors as well.
+        """
+        self.mesh, self.mesh_index = np.unique(np.asarray(years, dtype=float),
+                                               return_inverse=True)
+        self.obs_years = np.asarray(obs_years, dtype=float)
+        self.unit_mesh = matern(self.mesh, self.mesh, 1., scale, diff_degree)
+        self.unit_cross = matern(self.mesh, self.obs_years, 1., scale,
+                                 diff_degree)
+        self.unit_obs = matern(self.obs_years, self.obs_years, 1., scale,
+                               diff_degree)
+        self._factors = {}
+
+    @property
+    def observed(self):
+        return len(self.obs_years) > 0
+
+    def _factor(self, amplitude, obs_variance):
+        """
+        Returns the Cholesky factor of the observed covariance, the
+        mesh-observation covariance and a square root of the posterior
+        covariance of the mesh for one amplitude and observation variance.
+        """
+        key = (float(amplitude), None if obs_variance is None
+               else np.asarray(obs_variance, dtype=float).tobytes())
+        if key not in self._factors:
+            size = amplitude**2
+            mesh_cov = size * self.unit_mesh
+            if obs_variance is None:
+                obs_factor, cross = None, None
+                posterior_cov = mesh_cov
+            else:
+                cross = size * self.unit_cross
+                obs_factor = _cho_factor(
+                    size * self.unit_obs + np.diag(obs_variance), size)
+                posterior_cov = mesh_cov - cross.dot(cho_solve(obs_factor,
+                                                               cross.T))
+            self._factors[key] = (obs_factor, cross,
+                                  _cholesky(posterior_cov, size))
+        return self._factors[key]
+
+    def _posterior(self, mean_function, amplitude, obs_vals, obs_variance):
+        if not self.observed:
+            obs_vals, obs_variance = None, None
+        obs_factor, cross, root = self._factor(amplitude, obs_variance)
+        mean = mean_function(self.mesh)
+        if obs_vals is not None:
+            residual = np.asarray(obs_vals, dtype=float) - \
+                mean_function(self.obs_years)
+            mean = mean + cross.dot(cho_solve(obs_factor, residual))
+        return mean, root
+
+    def mean(self, mean_function, amplitude, obs_vals=None, obs_variance=None):
+        """
+        (function, float, array, array) -> array
+
+        Posterior mean at every year the process was built with.
+        """
+        mean, _ = self._posterior(mean_function, amplitude, obs_vals,
+                                  obs_variance)
+        return mean[self.mesh_index]
+
+    def draws(self, mean_function, amplitude, n_draws, obs_vals=None,
+              obs_variance=None):
+        """
+        (function, float, int, array, array) -> array
+
+        n_draws realizations of the posterior at every year the process was
+        built with, as a (year, draw) array.
+        """
+        mean, root = self._posterior(mean_function, amplitude, obs_vals,
+                                     obs_variance)
+        noise = np.random.standard_normal((len(self.mesh), n_draws))
+        return (mean[:, np.newaxis] + root.dot(noise))[self.mesh_index]
+
+
+def location_age_process(df2, scale, has_data):
+    """
+    (data frame, int, bool) -> MaternProcess
+
+    Builds the Gaussian process shared by all submodels of a location-age,
+    observed at the years of its training data if it has any.
+    """
+    obs_years = df2[(df2.iloc[:, -4])].year.values if has_data else []
+    return MaternProcess(df2.year.values, obs_years, scale)
+
+
+def gpr_chunksize(n_location_ages, cores):
+    """
+    Number of location-ages sent to a worker at once, so that each worker
+    gets a handful of batches rather than one task per location-age.
+    """
+    return max(1, n_location_ages // (cores * 4))
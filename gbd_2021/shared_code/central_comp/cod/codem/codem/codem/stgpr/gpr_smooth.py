@@ -4,12 +4,14 @@ from concurrent.futures import ProcessPoolExecutor as Pool
 
 import numpy as np
 import pandas as pd
-from pymc import gp
 from tqdm import tqdm
 
 import gbd.constants as gbd
 from gbd.decomp_step import decomp_step_from_decomp_step_id
 
+from codem.stgpr.gaussian_process import (gpr_chunksize, location_age_process,
+                                          prior_mean_function)
+
 pd.set_option('chained', None)
 
 logger = logging.getLogger(__name__)
@@ -104,7 +106,7 @@ def variance_map(inputs, gbd_round_id):
                               gbd_round_id=gbd_round_id)
 
 
-def gpr(df2, response, amplitude, prior, scale, has_data):
+def gpr(df2, response, amplitude, prior, scale, has_data, process=None):
     """
     (data frame, str, float, data frame, int, int) -> array
 
@@ -112,25 +114,17 @@ def gpr(df2, response, amplitude, prior, scale, has_data):
     smoothing in order to account for years where we do not have data. The data
     frame (df2) is specific to a location-age.
     """
-    all_indices = df2.index
-    data_indices = df2[(df2.iloc[:, -4])].index
-    years = df2.loc[all_indices]["year"].values
-    data = pd.DataFrame({"year": years, "prior": prior})
-    data.sort_values("year", inplace=True)
-    data.drop_duplicates(inplace=True)
-    def mean_function(x):
-        return np.interp(x, data.year.values, data.prior.values)
-    M = gp.Mean(mean_function)
-    C = gp.Covariance(eval_fun=gp.matern.euclidean, diff_degree=2,
-                      amp=amplitude, scale=scale)
-    df4 = df2.loc[data_indices]
-    if has_data:
-        obs_variance = df4[response + "_sd"].values**2 + df4[
-            response + "_nsv"].values
-        gp.observe(M=M, C=C, obs_mesh=df4.year.values,
-                   obs_vals=df4[response].values,
-                   obs_V=obs_variance)
-    return M(df2.year.values)
+    if process is None:
+        process = location_age_process(df2, scale, has_data)
+    mean_function = prior_mean_function(df2.year.values, prior)
+    if not has_data:
+        return process.mean(mean_function, amplitude)
+    df4 = df2[(df2.iloc[:, -4])]
+    obs_variance = df4[response + "_sd"].values**2 + df4[
+        response + "_nsv"].values
+    return process.mean(mean_function, amplitude,
+                        obs_vals=df4[response].values,
+                        obs_variance=obs_variance)
 
 
 def calculate_nsv(df, ko, simple_ln, simple_lt, residuals, variance,
@@ -223,7 +217,8 @@ def new_gpr(df, ko, amplitude, preds, variance,
     if parallel:
         logger.info("Parallel processing for running GPR.")
         p = Pool(cores)
-        new_preds = list(p.map(age_group_gpr_map, tqdm(inputs)))
+        new_preds = list(p.map(age_group_gpr_map, tqdm(inputs),
+                               chunksize=gpr_chunksize(len(inputs), cores)))
         p.shutdown()
     else:
         new_preds = list(map(age_group_gpr_map, inputs))
@@ -243,13 +238,14 @@ def age_group_gpr(ca_df, age_amplitude, preds, response_list, scale):
     has_data = ca_df[train_var].sum() > 0
     new_pred = np.zeros(preds.shape).astype("float32")
     var_type = ca_df.variance_type.values[0]
+    process = location_age_process(ca_df, scale, has_data)
     for i in range(len(response_list)):
         log = f"Running age group GPR for model {i} of {len(response_list)}"
         logger.debug(log)
         new_pred[:, i] = gpr(ca_df,
                              response_list[i],
                              age_amplitude[var_type][i],
-                             preds[:, i], scale, has_data)
+                             preds[:, i], scale, has_data, process=process)
     return new_pred
 
 
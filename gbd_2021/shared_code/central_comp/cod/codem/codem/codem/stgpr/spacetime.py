@@ -8,6 +8,12 @@ from numpy.lib.stride_tricks import as_strided as stride
 
 logger = logging.getLogger(__name__)
 
+# Working memory allowed for one tile of the spacetime weight matrix in
+# spacetime_product, and the approximate bytes each (residual, observation)
+# cell of a tile takes while it is being built
+ST_BLOCK_BYTES = 256 * 1024**2
+ST_BYTES_PER_CELL = 40
+
 
 def location_depth(full, train):
     """
@@ -201,7 +207,8 @@ def spacetime(indices, sReg, df, ko, omega_age_smooth, time_weight_method, lambd
     """
     Compute the spacetime weight matrix for a super region. Full data set tells
     which values need weights, train data set are the residuals which need
-    weighting.
+    weighting. Builds the whole matrix at once; the model smooths with
+    spacetime_product, and this is kept as its dense reference.
     """
     full_sub = df.iloc[indices, :]
     train_sub = df[(df.level_1 == sReg) & (ko.iloc[:, 0])]
@@ -225,6 +232,71 @@ def spacetime(indices, sReg, df, ko, omega_age_smooth, time_weight_method, lambd
     return EV("final / account_missing").astype("float32")
 
 
+def _spacetime_tile(full_tile, train_sub, omega_age_smooth, time_weight_method,
+                    lambda_time_smooth, lambda_time_smooth_nodata, zeta_space_smooth,
+                    zeta_space_smooth_nodata, year_start, year_end):
+    """
+    Returns the columns of the spacetime weight matrix for the observations
+    in full_tile. Every column is weighted and normalized on its own, so this
+    equals the matching columns of spacetime() for any slice of rows of full.
+
+    Each residual falls in exactly one of the NR, SN, C, R and SR classes of
+    matCRS, so instead of five re-weighted float matrices the tile keeps a
+    class code per cell and a (5, tile) table of xi / class sum coefficients.
+    """
+    Wat = timeW(full_tile, train_sub, omega_age_smooth, time_weight_method, lambda_time_smooth,
+                lambda_time_smooth_nodata, year_start, year_end).astype("float32")
+    NR, SN, C, R, SR = matCRS(full_tile, train_sub)
+    code = EV("SN + 2 * C + 3 * R + 4 * SR").astype(np.int8)
+    del NR, SN, C, R, SR
+    xi_mat = calculate_xi_matrix(full_tile, train_sub, zeta_space_smooth,
+                                 zeta_space_smooth_nodata).astype("float32")
+    sum_of_weights = np.stack([np.where(code == k, Wat, np.float32(0)).sum(0)
+                               for k in range(5)])
+    sum_of_weights[sum_of_weights == .0] = 1.
+    coefficients = (xi_mat.T / sum_of_weights).astype("float32")
+    final = Wat * np.take_along_axis(coefficients, code.astype(np.intp), axis=0)
+    del Wat, code
+    account_missing = final.sum(0)
+    account_missing[account_missing == .0] = 1.
+    final /= account_missing
+    return final
+
+
+def spacetime_product(full_sub, train_sub, rhs, omega_age_smooth, time_weight_method,
+                      lambda_time_smooth, lambda_time_smooth_nodata, zeta_space_smooth,
+                      zeta_space_smooth_nodata, year_start, year_end,
+                      block_bytes=ST_BLOCK_BYTES):
+    """
+    (data frame, data frame, array, ...) -> array
+
+    Returns the transposed spacetime weight matrix of full_sub and train_sub
+    multiplied by rhs, which has one row per training observation. Equivalent
+    to np.dot(spacetime(...).T, rhs) to float32 precision, but the weight
+    matrix is only ever built a tile of full_sub rows at a time, with tiles
+    sized to keep the working set under block_bytes. Residuals whose weights
+    are all zero over a tile are left out of that tile's product.
+    """
+    rhs = np.asarray(rhs)
+    out = np.zeros((len(full_sub),) + rhs.shape[1:],
+                   dtype=np.result_type(np.float32, rhs.dtype))
+    if len(full_sub) == 0 or len(train_sub) == 0:
+        return out
+    width = max(1, int(block_bytes // (len(train_sub) * ST_BYTES_PER_CELL)))
+    for start in range(0, len(full_sub), width):
+        stop = min(start + width, len(full_sub))
+        st = _spacetime_tile(full_sub.iloc[start:stop], train_sub, omega_age_smooth,
+                             time_weight_method, lambda_time_smooth,
+                             lambda_time_smooth_nodata, zeta_space_smooth,
+                             zeta_space_smooth_nodata, year_start, year_end)
+        used = np.flatnonzero(st.any(axis=1))
+        if len(used) < len(train_sub):
+            out[start:stop] = np.dot(st[used].T, rhs[used])
+        else:
+            out[start:stop] = np.dot(st.T, rhs)
+    return out
+
+
 def to_numeric(series):
     """
     (series) -> series
@@ -252,7 +324,8 @@ def spacetime2(reg, sReg, df, ko, omega_age_smooth, time_weight_method, lambda_t
     """
     Compute the spacetime weight matrix for a super region. Full data set tells
     which values need weights, train data set are the residuals which need
-    weighting.
+    weighting. Builds the whole matrix at once; the model smooths with
+    spacetime_product, and this is kept as its dense reference.
     """
     full_sub = df[(df.level_2 == reg)]
     train_sub = df[(df.level_1 == sReg) & (ko)]
@@ -302,8 +375,9 @@ def single_st(reg, sReg, df, res_mat, ko, omega_age_smooth, time_weight_method,
     appropriate rows for that super region.
     """
     pos = super_region_positions(reg, sReg, df, ko)
-    st = spacetime2(reg, sReg, df, ko, omega_age_smooth, time_weight_method,
-                    lambda_time_smooth, lambda_time_smooth_nodata,
-                    zeta_space_smooth, zeta_space_smooth_nodata)
     residuals = res_mat[pos["train_rows"], :]
-    return np.dot(st.T, residuals)
+    return spacetime_product(df[(df.level_2 == reg)], df[(df.level_1 == sReg) & (ko)],
+                             residuals, omega_age_smooth, time_weight_method,
+                             lambda_time_smooth, lambda_time_smooth_nodata,
+                             zeta_space_smooth, zeta_space_smooth_nodata,
+                             np.min(df.year), np.max(df.year))
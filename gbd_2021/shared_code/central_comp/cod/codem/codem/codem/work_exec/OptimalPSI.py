@@ -67,6 +67,11 @@ class OptimalPSI(ModelTask):
         self.pickled_outputs['model_pv']['pv_trend_out'] = outputs[4]
         self.pickled_outputs['st_models_id'].ranks = outputs[5]
         self.pickled_outputs['linear_models_id'].ranks = outputs[6]
+        self.pickled_outputs['model_pv']['psi_surface'] = {
+            'psi_values': self.model_metadata.model_parameters['psi_values'],
+            'rmse_out': outputs[7],
+            'trend_out': outputs[8]
+        }
         del outputs
 
     def calculate_weights(self):
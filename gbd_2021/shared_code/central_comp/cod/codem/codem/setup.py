@@ -17,7 +17,6 @@ dependencies = [
     "matplotlib",
     "numpy<1.20",
     "pandas",
-    "pymc",
     "pymysql",
     "scipy",
     "seaborn",
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import pytest
+from codem.ensemble.draws import new_gpr_draws
 from codem.stgpr.gpr_smooth import gpr
 
 
@@ -125,3 +126,15 @@ def test_variance(df, response, amplitude, prior, scale, has_data, result):
     assert sum(abs(data[~np.isnan(data)] - g[~np.isnan(data)])) > \
            sum(abs(data[~np.isnan(data)] - result[~np.isnan(data)]))
 
+
+
+def test_gpr_draws(df, response, amplitude, prior, scale, has_data, result):
+    """
+    Draws are centered on the GPR mean function.
+    """
+    np.random.seed(0)
+    draws = new_gpr_draws(df2=df, response=response, amplitude=amplitude,
+                          prior=prior, scale=scale, has_data=has_data,
+                          draws=4000)
+    assert draws.shape == (len(df), 4000)
+    assert np.isclose(draws.mean(axis=1), result, atol=0.01).all()
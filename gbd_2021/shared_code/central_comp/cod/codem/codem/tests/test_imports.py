@@ -23,5 +23,4 @@ def test_imports():
     import getpass
     import multiprocessing
     import re
-    from pymc import gp
     from db_queries import get_envelope, get_population, get_location_metadata, get_covariate_estimates
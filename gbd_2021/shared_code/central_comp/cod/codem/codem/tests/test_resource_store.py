@@ -0,0 +1,93 @@
+import pandas as pd
+import pytest
+
+from codem.joblaunch.resource_store import ResourceStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResourceStore(str(tmp_path / 'store' / 'resource_store.sqlite'),
+                         min_history=2, neighbours=2)
+
+
+@pytest.fixture
+def usage():
+    return pd.DataFrame({
+        'task_type': ['node'] * 5,
+        'modelable_entity_id': [1, 1, 1, 2, 2],
+        'location_id': [102, 102, 6, 102, 6],
+        'num_children': [50, 3, 30, 4, 4],
+        'ram_gb': [40., 4., 30., 10., 12.],
+        'runtime_min': [400., 40., 300., 100., 120.],
+        'ran_at': ['2020-01-01', '2020-01-02', '2020-01-03', '2020-01-04',
+                   '2020-01-05'],
+    })
+
+
+def record(store, usage):
+    return store.record('dismod', usage,
+                        key_cols=['modelable_entity_id', 'location_id'],
+                        size_cols=['num_children'])
+
+
+def test_record_skips_stored_tasks(store, usage):
+    assert record(store, usage) == 5
+    assert record(store, usage) == 0
+    assert record(store, usage.iloc[:2].assign(ran_at='2021-01-01')) == 2
+    assert len(store.history('dismod', 'node')) == 7
+
+
+def test_refresh_fetches_since_latest(store, usage):
+    seen = []
+
+    def fetch(since):
+        seen.append(since)
+        return usage if since is None else usage.iloc[:0]
+
+    kwargs = dict(key_cols=['modelable_entity_id'], size_cols=[])
+    assert store.refresh('dismod', fetch, **kwargs) == 5
+    assert store.refresh('dismod', fetch, **kwargs) == 0
+    assert seen == [None, '2020-01-05']
+
+
+def test_predict_exact_match(store, usage):
+    record(store, usage)
+    mem, runtime = store.predict(
+        'dismod', 'node', keys={'modelable_entity_id': 1, 'location_id': 6},
+        quantile=.5)
+    assert (mem, runtime) == (30., 300.)
+
+
+def test_predict_nearest_in_size(store, usage):
+    record(store, usage)
+    # no tasks for ME 1 at location 7, so every ME 1 task matches, of which
+    # the two nearest in number of children are used
+    mem, runtime = store.predict(
+        'dismod', 'node', keys={'modelable_entity_id': 1, 'location_id': 7},
+        sizes={'num_children': 40}, quantile=1.)
+    assert (mem, runtime) == (40., 400.)
+
+
+def test_predict_falls_back_to_every_task(store, usage):
+    record(store, usage)
+    mem, runtime = store.predict(
+        'dismod', 'node', keys={'modelable_entity_id': 3, 'location_id': 6},
+        quantile=1.)
+    assert (mem, runtime) == (40., 400.)
+
+
+def test_predict_default_without_history(store, usage):
+    record(store, usage)
+    assert store.predict('dismod', 'varnish', default=(1., 2.)) == (1., 2.)
+    assert store.predict('codem', 'node', default=None) is None
+
+
+def test_pipelines_share_one_file(tmp_path, usage):
+    path = str(tmp_path / 'resource_store.sqlite')
+    record(ResourceStore(path), usage)
+    ResourceStore(path).record(
+        'codem', usage.assign(task_type='InputData'),
+        key_cols=['modelable_entity_id'], size_cols=[])
+    reader = ResourceStore(path)
+    assert len(reader.history('dismod', 'node')) == 5
+    assert len(reader.history('codem', 'InputData')) == 5
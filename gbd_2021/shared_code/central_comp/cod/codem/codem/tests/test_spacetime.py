@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+from codem.stgpr.spacetime import spacetime, spacetime2, spacetime_product
+
+ST_PARAMETERS = {
+    'omega_age_smooth': 1.0,
+    'lambda_time_smooth': 0.5,
+    'lambda_time_smooth_nodata': 2.0,
+    'zeta_space_smooth': 0.9,
+    'zeta_space_smooth_nodata': 0.7,
+}
+
+
+@pytest.fixture
+def df():
+    """
+    One super region (1) with two regions (10, 11) and three countries
+    (100, 101, 102), where country 100 has two subnationals, one of which
+    has only non-representative data.
+    """
+    locations = pd.DataFrame({
+        'location_id': [100, 1001, 1002, 101, 102],
+        'level_1': 1,
+        'level_2': [10, 10, 10, 10, 11],
+        'level_3': [100, 100, 100, 101, 102],
+    })
+    grid = pd.MultiIndex.from_product(
+        [locations.location_id, range(1990, 2001), range(5)],
+        names=['location_id', 'year', 'ageC']
+    ).to_frame(index=False)
+    df = grid.merge(locations, on='location_id')
+    df['national'] = (df.location_id != 1002).astype(int)
+    return df
+
+
+@pytest.fixture
+def ko(df):
+    rng = np.random.RandomState(10)
+    # country 101 has no training data, so it gets the no-data weights
+    return pd.Series((rng.uniform(size=len(df)) < .6) & (df.location_id != 101).values,
+                     index=df.index)
+
+
+@pytest.mark.parametrize('time_weight_method', ['tricubic', 'exponential'])
+@pytest.mark.parametrize('block_bytes', [256 * 1024**2, 200 * 1024])
+def test_spacetime_product_matches_weight_matrix(df, ko, time_weight_method, block_bytes):
+    reg, sReg = 10, 1
+    full_sub = df[df.level_2 == reg]
+    train_sub = df[(df.level_1 == sReg) & ko]
+    rhs = np.random.RandomState(11).normal(size=(len(train_sub), 2))
+
+    product = spacetime_product(full_sub, train_sub, rhs,
+                                time_weight_method=time_weight_method,
+                                year_start=df.year.min(), year_end=df.year.max(),
+                                block_bytes=block_bytes, **ST_PARAMETERS)
+
+    dense = spacetime2(reg, sReg, df, ko, time_weight_method=time_weight_method,
+                       **ST_PARAMETERS)
+    np.testing.assert_allclose(product, np.dot(dense.T, rhs), rtol=1e-5, atol=1e-6)
+    indices = np.flatnonzero((df.level_2 == reg).values)
+    dense = spacetime(indices, sReg, df, ko.to_frame(), time_weight_method=time_weight_method,
+                      **ST_PARAMETERS)
+    np.testing.assert_allclose(product, np.dot(dense.T, rhs), rtol=1e-5, atol=1e-6)
+
+
+def test_spacetime_product_without_training_data(df):
+    full_sub = df[df.level_2 == 10]
+    product = spacetime_product(full_sub, df.iloc[:0], np.zeros((0, 2)),
+                                time_weight_method='tricubic',
+                                year_start=df.year.min(), year_end=df.year.max(),
+                                **ST_PARAMETERS)
+    assert product.shape == (len(full_sub), 2)
+    assert not product.any()
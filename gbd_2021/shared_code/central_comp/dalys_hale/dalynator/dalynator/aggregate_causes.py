@@ -1,7 +1,9 @@
 import logging
 import time
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
 from dalynator.computation_element import ComputationElement
 
@@ -21,6 +23,8 @@ class AggregateCauses(ComputationElement):
 
     def aggregate(self):
         """
+        Level-by-level aggregation, kept to validate aggregate_sparse.
+
         NOTE: .groupby().sum() on an empty dataframe can cause a change in the
         dtypes of the index columns.  This is a pandas bug.
         """
@@ -50,8 +54,84 @@ class AggregateCauses(ComputationElement):
         data = data.groupby(self.index_columns).sum().reset_index()
         return data
 
+    def _ancestor_incidence(self, cause_ids):
+        """Sparse (cause x cause) matrix with a 1 at [a, d] wherever a is d
+        itself or one of its ancestors in the cause tree. Rows and columns
+        follow cause_ids; causes not in the tree only map to themselves.
+        """
+        parent_of = {}
+        for node in self.cause_tree.nodes:
+            for child in node.children:
+                parent_of[child.id] = node.id
+
+        position = {cause_id: i for i, cause_id in enumerate(cause_ids)}
+        rows, cols = [], []
+        for descendant in cause_ids:
+            ancestor = descendant
+            while ancestor is not None:
+                rows.append(position[ancestor])
+                cols.append(position[descendant])
+                ancestor = parent_of.get(ancestor)
+        return sparse.csc_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(cause_ids), len(cause_ids)))
+
+    def aggregate_sparse(self):
+        """
+        Aggregate every level of the cause hierarchy in one pass.
+
+        Each input row contributes to its own cause and to every ancestor of
+        that cause. Those contributions are laid out as a sparse
+        (output row x input row) matrix keyed by the remaining index columns,
+        and the value block is aggregated with one sparse-dense multiply.
+        Produces the same rows and sums as aggregate, which drops rows with
+        a missing index value.
+        """
+        data = self.data_frame
+        key_cols = [col for col in self.index_columns if col != 'cause_id']
+        value_cols = [col for col in data.columns
+                      if col not in self.index_columns]
+
+        # Rows with a missing key are dropped, as the groupbys of aggregate
+        # drop them; otherwise the group codes and keys below disagree
+        data = data.dropna(subset=self.index_columns)
+
+        tree_cause_ids = [node.id for node in self.cause_tree.nodes]
+        cause_ids = list(pd.unique(np.concatenate(
+            [np.asarray(tree_cause_ids), data['cause_id'].unique()])))
+        incidence = self._ancestor_incidence(cause_ids)
+
+        # factorize the rows into (key, cause) codes
+        key_codes = data.groupby(key_cols, sort=False).ngroup().values
+        keys = data[key_cols].drop_duplicates().reset_index(drop=True)
+        cause_codes = pd.Index(cause_ids).get_indexer(data['cause_id'])
+
+        # expand each input row to one entry per ancestor-or-self cause
+        n_ancestors = np.diff(incidence.indptr)[cause_codes]
+        input_rows = np.repeat(np.arange(len(data)), n_ancestors)
+        offsets = (np.arange(n_ancestors.sum()) -
+                   np.repeat(np.cumsum(n_ancestors) - n_ancestors,
+                             n_ancestors))
+        ancestors = incidence.indices[
+            np.repeat(incidence.indptr[cause_codes], n_ancestors) + offsets]
+
+        out_codes, output_rows = np.unique(
+            np.repeat(key_codes, n_ancestors) * len(cause_ids) + ancestors,
+            return_inverse=True)
+        rollup = sparse.csr_matrix(
+            (np.ones(len(input_rows)), (output_rows.ravel(), input_rows)),
+            shape=(len(out_codes), len(data)))
+        values = rollup.dot(data[value_cols].values)
+
+        out = keys.iloc[out_codes // len(cause_ids)].reset_index(drop=True)
+        out['cause_id'] = np.asarray(cause_ids)[out_codes % len(cause_ids)]
+        out = pd.concat(
+            [out, pd.DataFrame(values, columns=value_cols)], axis=1)
+        out = out.sort_values(self.index_columns).reset_index(drop=True)
+        return out[self.index_columns + value_cols]
+
     def get_data_frame(self):
         logger.info("BEGIN aggregate_causes, epoch-time {}".format(time.time()))
-        data = self.aggregate()
+        data = self.aggregate_sparse()
         logger.info("END aggregate_causes, epoch-time {}".format(time.time()))
         return data
@@ -1,5 +1,6 @@
 import logging
 
+import numpy as np
 import pandas as pd
 import gbd.constants as gbd
 
@@ -65,11 +66,47 @@ def risk_attr_burden_to_paf(risk_cause_df, hundred_percent_pafs_df, value_cols,
     return paf_df[keep_cols]
 
 
+def match_rows(left_df, right_df, on):
+    """Inner-join row map between two frames, without merging them.
+
+    Returns (left_rows, right_rows) integer arrays such that
+    left_df.iloc[left_rows] lines up with right_df.iloc[right_rows] on the
+    'on' columns. The pairs are the rows of pd.merge(left_df, right_df,
+    on=on), NaN keys matching each other as they do there, but ordered by
+    left row and then by right row, i.e. the order of a how='left' merge
+    without its unmatched rows. Inner merge order is not reproduced.
+    """
+    keys = pd.concat([left_df[on], right_df[on]], ignore_index=True)
+    codes = keys.groupby(on, sort=False, dropna=False).ngroup().values
+    left_codes = codes[:len(left_df)]
+    right_codes = codes[len(left_df):]
+
+    n_keys = codes.max() + 1 if len(codes) else 0
+    right_order = np.argsort(right_codes, kind='stable')
+    right_counts = np.bincount(right_codes, minlength=n_keys)
+    right_starts = np.cumsum(right_counts) - right_counts
+
+    n_matches = right_counts[left_codes]
+    left_rows = np.repeat(np.arange(len(left_df)), n_matches)
+    offsets = (np.arange(n_matches.sum()) -
+               np.repeat(np.cumsum(n_matches) - n_matches, n_matches))
+    right_rows = right_order[
+        np.repeat(right_starts[left_codes], n_matches) + offsets]
+    return left_rows, right_rows
+
+
 class ApplyPAFs(ComputationElement):
     """ Apply PAFs to cause level data
 
     The math of applying PAFs is very simple:
         Cause-level data * PAFs = Risk attributable data
+
+    Cause draws are held as one (draw, demographic x cause) block and PAF
+    draws as one (draw, demographic x cause x risk) block. Precomputed integer
+    row maps line each PAF row up with its cause row(s), so attributable
+    burden is a gather-and-multiply into a preallocated array instead of a
+    merge of the two frames. Set chunk_size to bound the gathered temporaries
+    when the risk set is large.
     """
     def __init__(self, paf_data_frame, cause_data_frame,
                  paf_data_columns, cause_data_columns,
@@ -83,7 +120,8 @@ class ApplyPAFs(ComputationElement):
                                 'age_group_id', 'cause_id', 'measure_id'],
                  index_columns=['location_id', 'year_id', 'sex_id',
                                 'age_group_id', 'cause_id', 'rei_id',
-                                'star_id', 'measure_id', 'metric_id']):
+                                'star_id', 'measure_id', 'metric_id'],
+                 chunk_size=None):
         self.paf_data_frame = paf_data_frame
         self.cause_data_frame = cause_data_frame
         self.paf_index_columns = paf_index_columns
@@ -92,6 +130,7 @@ class ApplyPAFs(ComputationElement):
         self.cause_data_columns = cause_data_columns
         self.merge_columns = merge_columns
         self.index_columns = index_columns
+        self.chunk_size = chunk_size
 
     def generate_data_columns(self, data_columns, prefix):
         new_col_names = {x: '{}_{}'.format(prefix, i)
@@ -101,6 +140,45 @@ class ApplyPAFs(ComputationElement):
         return new_col_names, new_draw_cols
 
     def get_data_frame(self):
+        logger.info("BEGIN apply_pafs")
+        pafs_df = self.paf_data_frame
+        cause_data_df = self.cause_data_frame
+
+        logger.debug("  map pafs onto cause data")
+        paf_rows, cause_rows = match_rows(pafs_df, cause_data_df,
+                                          self.merge_columns)
+        # draw-major (draw, row) views match pandas' block layout, so the
+        # gathers below read contiguous memory and nothing is transposed
+        paf_values = pafs_df[self.paf_data_columns].values.T
+        cause_values = cause_data_df[self.cause_data_columns].values.T
+
+        # Apply PAFs
+        logger.debug("  apply pafs to {} rows".format(len(paf_rows)))
+        attributable_burden = np.empty(
+            (len(self.cause_data_columns), len(paf_rows)),
+            dtype=np.result_type(paf_values, cause_values))
+        chunk_size = self.chunk_size or max(len(paf_rows), 1)
+        for start in range(0, len(paf_rows), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            np.multiply(np.take(paf_values, paf_rows[chunk], axis=1),
+                        np.take(cause_values, cause_rows[chunk], axis=1),
+                        out=attributable_burden[:, chunk])
+
+        _, cause_cols = self.generate_data_columns(
+            self.cause_data_columns, 'draw')
+        ra_df = pd.DataFrame(
+            {col: (pafs_df[col].values[paf_rows] if col in pafs_df
+                   else cause_data_df[col].values[cause_rows])
+             for col in self.index_columns},
+            columns=self.index_columns)
+        ra_df = ra_df.join(pd.DataFrame(attributable_burden.T,
+                                        columns=cause_cols, copy=False))
+        logger.info("END apply_pafs")
+
+        return ra_df
+
+    def get_data_frame_by_merge(self):
+        """Original merge-based implementation, kept for validation"""
         logger.info("BEGIN apply_pafs")
         # Get data
         logger.debug("  read pafs")
@@ -7,10 +7,11 @@ logger = logging.getLogger(__name__)
 
 
 class ApplyPafsToDf(ComputationElement):
-    def __init__(self, pafs_filter_df, data_frame, n_draws):
+    def __init__(self, pafs_filter_df, data_frame, n_draws, chunk_size=50000):
         self.pafs_filter_df = pafs_filter_df
         self.df = data_frame
         self.n_draws = n_draws
+        self.chunk_size = chunk_size
 
     def get_data_frame(self):
         logger.info("BEGIN apply PAFs")
@@ -21,6 +22,7 @@ class ApplyPafsToDf(ComputationElement):
             self.df,
             paf_data_columns=paf_dcs,
             cause_data_columns=cause_dcs,
+            chunk_size=self.chunk_size,
         )
         paf_df = ce.get_data_frame()
 
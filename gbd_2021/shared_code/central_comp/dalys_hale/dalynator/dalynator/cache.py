@@ -9,6 +9,7 @@ import gbd.constants as gbd
 import gbd.gbd_round as gbr
 
 import dalynator.tool_objects as to
+from dalynator import columnar_cache
 from dalynator.data_source import GetPopulationDataSource
 from dalynator.compute_summaries import MetricConverter
 
@@ -28,7 +29,7 @@ class Cache:
                  fauxcorrect_version, epi_version, paf_version,
                  cause_set_ids, gbd_round_id, decomp_step, cache_dir,
                  location_set_ids, all_year_ids, full_location_ids,
-                 measure_ids):
+                 measure_ids, cache_format=None):
         self.tool_name = tool_name
         self.input_data_root = input_data_root
         self.codcorrect_version = codcorrect_version
@@ -43,6 +44,13 @@ class Cache:
         self.all_year_ids = all_year_ids
         self.full_location_ids = full_location_ids
         self.measure_ids = measure_ids
+        # Arrow caches need pyarrow; without it the HDF caches are written
+        if cache_format is None:
+            cache_format = "arrow" if columnar_cache.AVAILABLE else "hdf"
+        if cache_format not in ["arrow", "hdf"]:
+            raise ValueError("cache_format must be 'arrow' or 'hdf', got "
+                             "{}".format(cache_format))
+        self.cache_format = cache_format
         # we now select either codcorrect or fauxcorrect, but not both
         self.cod_object = to.cod_or_faux_correct(
             self.input_data_root,
@@ -86,10 +94,7 @@ class Cache:
         if len(pop_df[pop_df.location_id == 44620]) == 0:
             pop_df.append(pop_df[pop_df.location_id == 1].replace(
                 {'location_id': {1: 44620}}))
-        cache_file = "{}/pop.h5".format(
-            self.cache_dir)
-        pop_df.to_hdf(cache_file, "pop", data_columns=core_index,
-                      format="table")
+        cache_file = self._write_table(pop_df, "pop", core_index)
         logger.debug(
             "Cached population in {}".format(cache_file))
 
@@ -104,12 +109,8 @@ class Cache:
                  "WHERE process_id = 23 AND gbd_round_id = {} AND status_id = "
                  "5)".format(gbd_round_id))
         scalars = query(sql_q, conn_def='MORTALITY_DATABASE')
-        cache_file = "{}/scalars.h5".format(
-            self.cache_dir)
-        scalars.to_hdf(cache_file, "scalars",
-                       data_columns=[
-                           'location_id', 'year_id'],
-                       format="table")
+        cache_file = self._write_table(scalars, "scalars",
+                                       ['location_id', 'year_id'])
         logger.debug(
             "Cached regional scalars in {}".format(cache_file))
 
@@ -118,10 +119,8 @@ class Cache:
             "Starting to load age_weights cache")
         age_weights_df = get_age_weights(gbd_round_id=int(self.gbd_round_id))
         # returns age_group_id, age_group_weight_value as a pandas df
-        cache_file = "{}/age_weights.h5".format(
-            self.cache_dir)
-        age_weights_df.to_hdf(cache_file, "age_weights",
-                              data_columns=['age_group_id'], format="table")
+        cache_file = self._write_table(age_weights_df, "age_weights",
+                                       ['age_group_id'])
         logger.debug(
             "Cached age_weights in {}".format(cache_file))
 
@@ -132,13 +131,24 @@ class Cache:
         age_spans_df = get_age_spans(age_group_set_id)
         # returns age_group_id, age_group_years_start, age_group_years_end as a
         # pandas df
-        cache_file = "{}/age_spans.h5".format(
-            self.cache_dir)
-        age_spans_df.to_hdf(cache_file, "age_spans",
-                            data_columns=['age_group_id'], format="table")
+        cache_file = self._write_table(age_spans_df, "age_spans",
+                                       ['age_group_id'])
         logger.debug(
             "Cached age_spans in {}".format(cache_file))
 
+    def _write_table(self, df: pd.DataFrame, name: str,
+                     data_columns: List[str]) -> str:
+        """Write a cached table in the configured format. Arrow files are
+        sorted on data_columns so readers can slice them without scanning"""
+        if self.cache_format == "arrow":
+            cache_file = columnar_cache.cache_path(self.cache_dir, name)
+            columnar_cache.write_table(df, cache_file, data_columns)
+        else:
+            cache_file = "{}/{}.h5".format(self.cache_dir, name)
+            df.to_hdf(cache_file, name, data_columns=data_columns,
+                      format="table")
+        return cache_file
+
     def _cache_cause_hierarchy(self) -> None:
         logger.debug("Starting to load cause_hierarchy cache")
         tree_list = []
@@ -0,0 +1,144 @@
+"""Columnar, memory-mappable cache files for the DALYnator/Burdenator.
+
+Tables are written as uncompressed Arrow IPC files sorted on their key
+columns, with the sort order recorded in the schema metadata. A process maps
+each file once and serves filtered views from that mapping: equality filters
+on a prefix of the sort columns become zero-copy slices found by binary
+search, and only the remaining filters (if any) materialize a copy.
+
+The format needs pyarrow. Without it, AVAILABLE is False, Cache writes HDF
+files, and reading or writing an Arrow file raises ImportError.
+"""
+import json
+import logging
+import os
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:
+    pa = pc = None
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = pa is not None
+ARROW_SUFFIX = ".arrow"
+SORT_COLS_KEY = b"dalynator_sort_cols"
+
+# Process-level registry of memory-mapped tables and their sort keys, so each
+# cache file is mapped once no matter how many readers ask for it
+_MAPPED_TABLES: Dict[str, "pa.Table"] = {}
+_KEY_ARRAYS: Dict[str, Dict[str, np.ndarray]] = {}
+
+
+def cache_path(cache_dir: str, name: str) -> str:
+    """Path of a cached table"""
+    return os.path.join(cache_dir, name + ARROW_SUFFIX)
+
+
+def exists(cache_dir: str, name: str) -> bool:
+    return os.path.exists(cache_path(cache_dir, name))
+
+
+def _require_pyarrow() -> None:
+    if not AVAILABLE:
+        raise ImportError("pyarrow is required to read or write the "
+                          "dalynator's Arrow cache files")
+
+
+def write_table(df: pd.DataFrame, path: str, sort_cols: List[str]) -> None:
+    """Sort df on sort_cols and write it as an uncompressed Arrow file.
+
+    The file is written next to its destination and moved into place, so
+    readers never map a partially written file.
+    """
+    _require_pyarrow()
+    df = df.sort_values(sort_cols).reset_index(drop=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SORT_COLS_KEY] = json.dumps(sort_cols).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    _MAPPED_TABLES.pop(path, None)
+    _KEY_ARRAYS.pop(path, None)
+
+
+def open_table(path: str) -> "pa.Table":
+    """Memory-map the Arrow file at path, once per process"""
+    _require_pyarrow()
+    if path not in _MAPPED_TABLES:
+        logger.debug("Memory mapping cache file {}".format(path))
+        source = pa.memory_map(path, "r")
+        _MAPPED_TABLES[path] = pa.ipc.open_file(source).read_all()
+        _KEY_ARRAYS[path] = {}
+    return _MAPPED_TABLES[path]
+
+
+def _sort_cols(table: "pa.Table") -> List[str]:
+    metadata = table.schema.metadata or {}
+    if SORT_COLS_KEY not in metadata:
+        return []
+    return json.loads(metadata[SORT_COLS_KEY].decode())
+
+
+def _key_array(path: str, table: "pa.Table", col: str) -> np.ndarray:
+    keys = _KEY_ARRAYS[path]
+    if col not in keys:
+        column = table.column(col)
+        if column.num_chunks == 1 and column.null_count == 0:
+            keys[col] = column.chunk(0).to_numpy(zero_copy_only=True)
+        else:
+            keys[col] = column.to_numpy()
+    return keys[col]
+
+
+def _is_scalar(value) -> bool:
+    return np.ndim(value) == 0
+
+
+def read_table(path: str, **filters) -> "pa.Table":
+    """Return the rows of the cached table matching filters.
+
+    Each filter is column=value or column=list_of_values. Scalar filters on a
+    leading run of the sort columns narrow a zero-copy slice of the mapped
+    table; everything else is applied as a mask on that slice.
+    """
+    table = open_table(path)
+    start, stop = 0, table.num_rows
+    remaining = dict(filters)
+    for col in _sort_cols(table):
+        if col not in remaining or not _is_scalar(remaining[col]):
+            break
+        keys = _key_array(path, table, col)[start:stop]
+        value = remaining.pop(col)
+        lower = np.searchsorted(keys, value, side="left")
+        upper = np.searchsorted(keys, value, side="right")
+        start, stop = start + lower, start + upper
+
+    view = table.slice(start, stop - start)
+    if remaining:
+        mask = None
+        for col, value in remaining.items():
+            values = [value] if _is_scalar(value) else list(value)
+            col_mask = pc.is_in(
+                view.column(col),
+                value_set=pa.array(values, type=view.schema.field(col).type))
+            mask = col_mask if mask is None else pc.and_(mask, col_mask)
+        view = view.filter(mask)
+    return view
+
+
+def read_frame(path: str, **filters) -> pd.DataFrame:
+    """read_table as a DataFrame, without consolidating columns into blocks
+    so numeric columns can share memory with the mapping"""
+    return read_table(path, **filters).to_pandas(split_blocks=True)
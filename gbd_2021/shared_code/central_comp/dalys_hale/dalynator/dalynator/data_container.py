@@ -10,6 +10,7 @@ from dalynator import get_death_data
 from dalynator import get_yld_data
 from dalynator import get_yll_data
 from dalynator import get_daly_data
+from dalynator import columnar_cache
 from dalynator.data_source import SuperGopherDataSource
 
 
@@ -263,22 +264,18 @@ class DataContainer(object):
             if self.cache_dir is None:
                 raise NameError("cache_dir must be specified on the "
                                 "DataContainer to retrieve pop data")
-            pop_file = "{}/pop.h5".format(self.cache_dir)
-            where = self.build_where_filter(
-                ['location_id', 'year_id', 'age_group_id', 'sex_id'])
-            df = pd.read_hdf(pop_file, where=where)
+            df = self._read_cached_table(
+                'pop', ['location_id', 'year_id', 'age_group_id', 'sex_id'])
         elif key == 'age_weights':
             if self.cache_dir is None:
                 raise NameError("cache_dir must be specified on the "
                                 "DataContainer to retrieve age_weights data")
-            age_weights_file = "{}/age_weights.h5".format(self.cache_dir)
-            df = pd.read_hdf(age_weights_file)
+            df = self._read_cached_table('age_weights')
         elif key == 'age_spans':
             if self.cache_dir is None:
                 raise NameError("cache_dir must be specified on the "
                                 "DataContainer to retrieve age_spans data")
-            age_spans_file = "{}/age_spans.h5".format(self.cache_dir)
-            df = pd.read_hdf(age_spans_file)
+            df = self._read_cached_table('age_spans')
         elif 'cause_hierarchy' in key:
             if self.cache_dir is None:
                 raise NameError("cache_dir must be specified on the "
@@ -340,6 +337,23 @@ class DataContainer(object):
         df = self._resample(df, key)
         self.cached_values[key] = df
 
+    def _read_cached_table(self, name, filter_cols=None):
+        """Read a table cached by dalynator.cache.Cache, filtered to this
+        container's granularity on filter_cols. Prefers the memory-mapped
+        columnar cache and falls back to HDF caches from older runs"""
+        filter_cols = filter_cols or []
+        if columnar_cache.exists(self.cache_dir, name):
+            filters = {col: self.cache_granularity_dict[col]
+                       for col in filter_cols
+                       if col in self.cache_granularity_dict}
+            return columnar_cache.read_frame(
+                columnar_cache.cache_path(self.cache_dir, name), **filters)
+        hdf_file = "{}/{}.h5".format(self.cache_dir, name)
+        if filter_cols:
+            return pd.read_hdf(hdf_file,
+                               where=self.build_where_filter(filter_cols))
+        return pd.read_hdf(hdf_file)
+
     def _resample(self, df, key):
         '''Potentially resample raw data, if dataframe has different number
         of draws from self.n_draws.
@@ -11,6 +11,7 @@ from dataframe_io.io_queue import IOQueue
 from draw_sources.draw_sources import SourceSinkPair
 from gbd import constants as gbd
 
+from dalynator import columnar_cache
 from dalynator import get_input_args
 from dalynator import makedirs_safely as mkds
 from dalynator.computation_element import ComputationElement
@@ -38,9 +39,16 @@ def apply_regional_scalars(df, regional_scalar_path, region_locs, value_cols,
         merge_cols = ['location_id', 'year_id']
         path = '{p}/scalars.h5'.format(p=regional_scalar_path)
         try:
-            scalars = pd.read_hdf(
-                path, 'scalars', where=(["'location_id'=={} & 'year_id'=={}"
-                                        .format(current_loc, year_id)]))
+            if columnar_cache.exists(regional_scalar_path, 'scalars'):
+                path = columnar_cache.cache_path(regional_scalar_path,
+                                                 'scalars')
+                scalars = columnar_cache.read_frame(
+                    path, location_id=current_loc, year_id=year_id)
+            else:
+                scalars = pd.read_hdf(
+                    path, 'scalars',
+                    where=(["'location_id'=={} & 'year_id'=={}"
+                            .format(current_loc, year_id)]))
         except FileNotFoundError:
             scalars = create_default_scalars(current_loc, year_id)
             logger.info(
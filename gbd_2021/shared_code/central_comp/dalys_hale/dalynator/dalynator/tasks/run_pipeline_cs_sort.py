@@ -5,23 +5,17 @@ import pandas as pd
 
 from dalynator import get_input_args
 from dalynator.constants import UMASK_PERMISSIONS
-from dalynator.write_csv import sub_pub_for_cc
+from dalynator.write_csv import (
+    CS_PK_MULTI_YEAR_NORISK as PK_MULTI_YEAR_NORISK,
+    CS_PK_MULTI_YEAR_RISK as PK_MULTI_YEAR_RISK,
+    CS_PK_SINGLE_YEAR_NORISK as PK_SINGLE_YEAR_NORISK,
+    CS_PK_SINGLE_YEAR_RISK as PK_SINGLE_YEAR_RISK,
+    SORTED_RUN_SUFFIX, existing_copy, merge_sorted_runs, sub_pub_for_cc)
 
 
 os.umask(UMASK_PERMISSIONS)
 logger = logging.getLogger(__name__)
 
-PK_SINGLE_YEAR_RISK = ['location_id', 'cause_id', 'rei_id', 'age_group_id',
-                       'year_id', 'metric_id', 'measure_id', 'sex_id']
-PK_MULTI_YEAR_RISK = ['location_id', 'cause_id', 'rei_id', 'age_group_id',
-                      'year_start_id', 'year_end_id', 'metric_id',
-                      'measure_id', 'sex_id']
-PK_SINGLE_YEAR_NORISK = ['location_id', 'cause_id', 'age_group_id', 'year_id',
-                         'metric_id', 'measure_id', 'sex_id']
-PK_MULTI_YEAR_NORISK = ['location_id', 'cause_id', 'age_group_id',
-                        'year_start_id', 'year_end_id', 'metric_id',
-                        'measure_id', 'sex_id']
-
 
 class ColumnstoreSorter(object):
 
@@ -58,10 +52,10 @@ class ColumnstoreSorter(object):
         self.outfile_basename = "{loc}_{tc}_{ny}.csv".format(
             loc=self.location_id, tc=table_class, ny=self.n_years)
 
-    def _get_csv_list(self):
+    def _get_csv_list(self, measure_ids=None):
         file_paths = []
         for year_pf in self.year_postfixes:
-            for meas in self.measure_ids:
+            for meas in measure_ids or self.measure_ids:
                 fd = os.path.join(self.root_dir, "upload", str(meas),
                                   self.n_years)
                 fp = "{prefix}_{loc}_{yr}.csv".format(
@@ -70,10 +64,20 @@ class ColumnstoreSorter(object):
         return file_paths
 
     def _read_csvs_to_dataframe(self, csv_list):
-        df = pd.concat([pd.read_csv(f) for f in csv_list])
+        # Each year csv may have been written as a plain file or as a sorted
+        # run, pandas infers the compression of the latter from its suffix
+        paths = []
+        for f in csv_list:
+            path = existing_copy(f)
+            if path is None:
+                raise FileNotFoundError(
+                    "No column store csv {} or sorted run {}".format(
+                        f, f + SORTED_RUN_SUFFIX))
+            paths.append(path)
+        df = pd.concat([pd.read_csv(f) for f in paths])
         return df
 
-    def _sort_frame(self, df):
+    def _sort_order(self):
         if self.n_years == "single_year":
             if self.tool_name == "burdenator":
                 sort_order = PK_SINGLE_YEAR_RISK
@@ -84,16 +88,43 @@ class ColumnstoreSorter(object):
                 sort_order = PK_MULTI_YEAR_RISK
             elif self.tool_name == "dalynator":
                 sort_order = PK_MULTI_YEAR_NORISK
-        return df.sort_values(sort_order)
+        return sort_order
+
+    def _sort_frame(self, df):
+        return df.sort_values(self._sort_order())
+
+    def _outfile_path(self, measure_id):
+        return "{od}/{m}_{ob}".format(od=self.outfile_dir, m=measure_id,
+                                      ob=self.outfile_basename)
 
     def reduce_to_meas_csvs(self):
+        """Write one column-store sorted csv per measure. Uses a streaming
+        merge of the sorted runs written by write_csv, unless some are
+        missing (e.g. outputs from an older run), in which case the year
+        csvs and whatever sorted runs exist are read in full and sorted."""
+        run_lists = {
+            meas: [f + SORTED_RUN_SUFFIX
+                   for f in self._get_csv_list(measure_ids=[meas])]
+            for meas in self.measure_ids}
+        if not all(os.path.exists(f)
+                   for runs in run_lists.values() for f in runs):
+            logger.info("Sorted runs missing for location {}, falling back "
+                        "to an in-memory sort".format(self.location_id))
+            self.reduce_to_meas_csvs_in_memory()
+            return
+
+        for measure_id, runs in run_lists.items():
+            filepath = self._outfile_path(measure_id)
+            logger.info("Merging {} sorted runs into {}".format(
+                len(runs), filepath))
+            merge_sorted_runs(runs, filepath, self._sort_order())
+
+    def reduce_to_meas_csvs_in_memory(self):
         csvs = self._get_csv_list()
         df = self._read_csvs_to_dataframe(csvs)
         sorted_df = self._sort_frame(df)
         for measure_id in sorted_df.measure_id.unique():
-            filepath = "{od}/{m}_{ob}".format(od=self.outfile_dir,
-                                              m=measure_id,
-                                              ob=self.outfile_basename)
+            filepath = self._outfile_path(measure_id)
             write_df = sorted_df.query("measure_id == {}".format(measure_id))
             write_df.to_csv(filepath, index=False)
 
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dalynator.aggregate_causes import AggregateCauses
+
+INDEX_COLUMNS = ['location_id', 'year_id', 'sex_id', 'age_group_id',
+                 'cause_id', 'measure_id']
+DRAW_COLUMNS = ['draw_0', 'draw_1', 'draw_2']
+
+# All cause (294) splits into 1 and 2, 1 into 10 and 11, 10 into 100 and
+# 101, and 2 into 20
+PARENTS = {1: 294, 2: 294, 10: 1, 11: 1, 20: 2, 100: 10, 101: 10}
+
+
+class CauseTree(object):
+    """ The parts of a hierarchies cause tree the aggregation uses """
+
+    def __init__(self, parents, root):
+        self.nodes = [SimpleNamespace(id=cause_id, children=[])
+                      for cause_id in [root] + list(parents)]
+        by_id = {node.id: node for node in self.nodes}
+        self.depth = {root: 0}
+        for child, parent in parents.items():
+            by_id[parent].children.append(by_id[child])
+            self.depth[child] = self.depth[parent] + 1
+
+    def max_depth(self):
+        return max(self.depth.values())
+
+    def level_n_descendants(self, level):
+        return [node for node in self.nodes if self.depth[node.id] == level]
+
+
+@pytest.mark.parametrize('with_nan', [False, True])
+def test_aggregate_sparse_matches_aggregate(with_nan):
+    rng = np.random.default_rng(5)
+    # most detailed causes sit at different levels; 999 is not in the tree
+    data = pd.MultiIndex.from_product(
+        [[6, 102], [2000, 2010], [1, 2], [10, 11], [100, 101, 11, 20, 999],
+         [3, 4]], names=INDEX_COLUMNS).to_frame(index=False)
+    data = data.sample(frac=.8, random_state=5).reset_index(drop=True)
+    data[DRAW_COLUMNS] = rng.random((len(data), len(DRAW_COLUMNS)))
+    if with_nan:
+        # aggregate drops rows with missing keys
+        data['measure_id'] = data['measure_id'].astype(float)
+        data.loc[rng.random(len(data)) < .1, 'measure_id'] = np.nan
+        data.loc[rng.random(len(data)) < .1, 'cause_id'] = np.nan
+
+    def aggregate_causes():
+        return AggregateCauses(CauseTree(PARENTS, 294), data.copy(),
+                               index_columns=INDEX_COLUMNS)
+
+    expected = aggregate_causes().aggregate()
+    result = aggregate_causes().get_data_frame()
+
+    assert set(result.cause_id) == {294, 1, 2, 10, 11, 20, 100, 101, 999}
+    pd.testing.assert_frame_equal(
+        result,
+        expected[INDEX_COLUMNS + DRAW_COLUMNS].sort_values(
+            INDEX_COLUMNS).reset_index(drop=True),
+        check_dtype=False, rtol=1e-12)
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dalynator.apply_pafs import ApplyPAFs, match_rows
+
+INDEX_COLUMNS = ['location_id', 'year_id', 'sex_id', 'age_group_id',
+                 'cause_id', 'measure_id']
+DRAW_COLUMNS = ['draw_0', 'draw_1']
+
+
+def random_keys(rng, n_rows, with_nan=False):
+    keys = pd.DataFrame({
+        'cause_id': rng.integers(0, 4, n_rows).astype(float),
+        'age_group_id': rng.integers(0, 2, n_rows),
+    })
+    if with_nan:
+        keys.loc[rng.random(n_rows) < .2, 'cause_id'] = np.nan
+    return keys
+
+
+@pytest.mark.parametrize('with_nan', [False, True])
+def test_match_rows_pairs_rows_like_merge(with_nan):
+    rng = np.random.default_rng(6)
+    on = ['cause_id', 'age_group_id']
+    for _ in range(50):
+        left = random_keys(rng, 12, with_nan).assign(left_row=range(12))
+        right = random_keys(rng, 9, with_nan).assign(right_row=range(9))
+
+        left_rows, right_rows = match_rows(left, right, on)
+
+        # same pairs as an inner merge, NaN keys included, in left then
+        # right row order
+        merged = pd.merge(left, right, on=on)
+        assert (sorted(zip(left_rows, right_rows)) ==
+                sorted(zip(merged.left_row, merged.right_row)))
+        expected = pd.merge(left, right, on=on, how='left').dropna(
+            subset=['right_row'])
+        np.testing.assert_array_equal(left_rows, expected.left_row)
+        np.testing.assert_array_equal(right_rows, expected.right_row)
+
+
+def test_match_rows_empty():
+    keys = pd.DataFrame({'cause_id': [1, 2]})
+    for left, right in [(keys, keys.iloc[:0]), (keys.iloc[:0], keys)]:
+        left_rows, right_rows = match_rows(left, right, ['cause_id'])
+        assert len(left_rows) == len(right_rows) == 0
+
+
+def test_apply_pafs_matches_merge():
+    rng = np.random.default_rng(5)
+    cause = pd.MultiIndex.from_product(
+        [[6], [2000, 2001], [1, 2], [10, 11], [294, 300, 301], [1, 3]],
+        names=INDEX_COLUMNS).to_frame(index=False)
+    cause['metric_id'] = 1
+    cause[DRAW_COLUMNS] = rng.random((len(cause), len(DRAW_COLUMNS)))
+    pafs = pd.concat([
+        cause[INDEX_COLUMNS].assign(rei_id=rei_id, star_id=0)
+        for rei_id in [84, 85]
+    ]).sample(frac=.7, random_state=5).reset_index(drop=True)
+    pafs[DRAW_COLUMNS] = rng.random((len(pafs), len(DRAW_COLUMNS)))
+
+    def apply_pafs(chunk_size=None):
+        return ApplyPAFs(pafs.copy(), cause.copy(), DRAW_COLUMNS,
+                         DRAW_COLUMNS, chunk_size=chunk_size)
+
+    expected = apply_pafs().get_data_frame_by_merge()
+    index_columns = apply_pafs().index_columns
+    for chunk_size in [None, 7]:
+        result = apply_pafs(chunk_size).get_data_frame()
+        pd.testing.assert_frame_equal(
+            result.sort_values(index_columns).reset_index(drop=True),
+            expected.sort_values(index_columns).reset_index(drop=True))
@@ -1,3 +1,6 @@
+import csv
+import gzip
+import heapq
 import logging
 import os
 import numpy as np
@@ -22,6 +25,21 @@ PK_MULTI_YEAR_NORISK = ['measure_id', 'year_start_id', 'year_end_id',
                         'location_id', 'sex_id', 'age_group_id', 'cause_id',
                         'metric_id']
 
+# Sort orders for the column store tables
+CS_PK_SINGLE_YEAR_RISK = ['location_id', 'cause_id', 'rei_id', 'age_group_id',
+                          'year_id', 'metric_id', 'measure_id', 'sex_id']
+CS_PK_MULTI_YEAR_RISK = ['location_id', 'cause_id', 'rei_id', 'age_group_id',
+                         'year_start_id', 'year_end_id', 'metric_id',
+                         'measure_id', 'sex_id']
+CS_PK_SINGLE_YEAR_NORISK = ['location_id', 'cause_id', 'age_group_id',
+                            'year_id', 'metric_id', 'measure_id', 'sex_id']
+CS_PK_MULTI_YEAR_NORISK = ['location_id', 'cause_id', 'age_group_id',
+                           'year_start_id', 'year_end_id', 'metric_id',
+                           'measure_id', 'sex_id']
+
+SORTED_RUN_SUFFIX = ".gz"
+SORTED_RUN_CHUNKSIZE = 100000
+
 
 def detect_pk(df):
     """Detect and return the probably db-matching PK for the given DataFrame"""
@@ -35,6 +53,16 @@ def detect_pk(df):
     return None
 
 
+def detect_cs_pk(df):
+    """Detect and return the column store sort order for the given
+    DataFrame"""
+    for pk in [CS_PK_SINGLE_YEAR_RISK, CS_PK_MULTI_YEAR_RISK,
+               CS_PK_SINGLE_YEAR_NORISK, CS_PK_MULTI_YEAR_NORISK]:
+        if len(set(pk) & set(df.columns)) == len(pk):
+            return pk
+    return None
+
+
 def sort_for_db(df):
     """Returns a copy of the DataFrame that has been sorted according
     to the GBD database's PK"""
@@ -71,13 +99,78 @@ def write_csv(df, filename, write_columns_order=None,
         cols = remove_unwanted_star_id_column(df.columns.tolist(),
                                               write_out_star_ids)
 
+    # The upload copy stays uncompressed: it is loaded with LOAD DATA INFILE
+    # (db_tools Infiles), which reads the file from disk as plain text
     write_df.to_csv(filename, columns=cols, index=False)
 
     if dual_upload:
         pub_up_filename = sub_pub_for_cc(filename)
         pub_up_dir = os.path.dirname(pub_up_filename)
         makedirs_safely(pub_up_dir)
-        write_df.to_csv(pub_up_filename, columns=cols, index=False)
+        cs_pk = detect_cs_pk(df)
+        if cs_pk:
+            # The column store copy is only ever read back by cs_sort, so
+            # write it as a compressed run that cs_sort can merge directly
+            write_sorted_run(df, pub_up_filename + SORTED_RUN_SUFFIX, cs_pk,
+                             cols)
+        else:
+            write_df.to_csv(pub_up_filename, columns=cols, index=False)
+
+
+def write_sorted_run(df, filename, sort_cols, columns):
+    """Write df to a gzip-compressed CSV sorted on sort_cols, appending it
+    in chunks. Runs written this way can be combined with merge_sorted_runs
+    without reading them fully into memory."""
+    run_df = df.sort_values(sort_cols)
+    run_df.to_csv(filename, columns=columns, index=False, compression='gzip',
+                  chunksize=SORTED_RUN_CHUNKSIZE)
+
+
+def _open_run(filename):
+    if filename.endswith(SORTED_RUN_SUFFIX):
+        return gzip.open(filename, 'rt', newline='')
+    return open(filename, 'r', newline='')
+
+
+def existing_copy(filename):
+    """Return the path of the column store copy of filename that exists,
+    either the plain CSV or its compressed sorted run, or None."""
+    for path in [filename, filename + SORTED_RUN_SUFFIX]:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def merge_sorted_runs(run_files, out_filename, sort_cols):
+    """Stream a k-way merge of CSV runs, each already sorted on sort_cols,
+    into out_filename. Rows are copied through as text, so memory use is one
+    row per run regardless of file size. Nothing is written if there are no
+    runs. Returns the number of runs merged."""
+    if not run_files:
+        logger.info("No sorted runs to merge into {}".format(out_filename))
+        return 0
+    handles = [_open_run(f) for f in run_files]
+    try:
+        readers = [csv.reader(h) for h in handles]
+        headers = [next(reader) for reader in readers]
+        header = headers[0]
+        for run_file, run_header in zip(run_files, headers):
+            if run_header != header:
+                raise ValueError("Sorted run {} has columns {}, expected {}"
+                                 .format(run_file, run_header, header))
+        key_idx = [header.index(col) for col in sort_cols]
+
+        def sort_key(row):
+            return tuple(float(row[i]) for i in key_idx)
+
+        with open(out_filename, 'w', newline='') as out:
+            writer = csv.writer(out)
+            writer.writerow(header)
+            writer.writerows(heapq.merge(*readers, key=sort_key))
+    finally:
+        for h in handles:
+            h.close()
+    return len(run_files)
 
 
 def df_to_csv(this_df, index_cols, this_out_dir, out_file_basename,
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+# Simulations of one slice that must not share random numbers, such as the
+# sequela and impairment simulations of a COMO run
+DOMAINS = {"sequela": 0, "impairment": 1}
+
+
+class SimulationStreams:
+    """Counter-based random streams for a single COMO simulation slice.
+
+    Every draw gets its own Philox generator keyed by
+    (como_version_id, domain, location_id, year_id, sex_id, age_group_id,
+    draw), so any draw of any slice can be regenerated bit-for-bit in
+    isolation and draws can be filled from independent threads. numpy
+    releases the GIL while filling arrays, so the threads run in parallel.
+    The domain keeps the simulations of one slice independent of each other.
+    """
+
+    key_names = ["location_id", "year_id", "sex_id", "age_group_id"]
+
+    def __init__(
+        self, como_version_id, location_id, year_id, sex_id, age_group_id, domain="sequela"
+    ):
+        if domain not in DOMAINS:
+            raise ValueError(f"domain must be one of {list(DOMAINS)}, got {domain}")
+        self.key = (
+            int(como_version_id),
+            DOMAINS[domain],
+            int(location_id),
+            int(year_id),
+            int(sex_id),
+            int(age_group_id),
+        )
+
+    @classmethod
+    def from_element(cls, como_version_id, index_names, element, domain="sequela"):
+        """build streams for a simulation slice from its index element"""
+        element = dict(zip(index_names, element))
+        return cls(
+            como_version_id, *[element[name] for name in cls.key_names], domain=domain
+        )
+
+    def generator(self, draw_num):
+        seed = np.random.SeedSequence(list(self.key) + [int(draw_num)])
+        return np.random.Generator(np.random.Philox(seed))
+
+    def bernoulli(self, n_simulants, prev, draw_nums, n_threads=1):
+        """Simulate a (draw, simulant, sequela) boolean block.
+
+        Args:
+            n_simulants (int): number of simulants per draw
+            prev (np.ndarray): (sequela, draw) prevalence for draw_nums
+            draw_nums (list): draw numbers used to key each stream
+            n_threads (int): number of threads filling draws concurrently
+        """
+        prev = prev.astype(np.float32)
+        shape = (n_simulants, prev.shape[0])
+        sim_people = np.empty((len(draw_nums),) + shape, dtype=bool)
+
+        def fill(i):
+            uniform = self.generator(draw_nums[i]).random(shape, dtype=np.float32)
+            np.less_equal(uniform, prev[:, i], out=sim_people[i])
+
+        if n_threads > 1:
+            with ThreadPoolExecutor(max_workers=n_threads) as pool:
+                list(pool.map(fill, range(len(draw_nums))))
+        else:
+            for i in range(len(draw_nums)):
+                fill(i)
+        return sim_people
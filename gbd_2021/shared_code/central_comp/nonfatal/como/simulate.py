@@ -1,6 +1,6 @@
 from loguru import logger
 import os
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, RawArray
 from copy import deepcopy
 import numpy as np
 import pandas as pd
@@ -8,6 +8,7 @@ import pandas as pd
 from gbd.constants import measures
 
 from como.legacy.cython_modules import fast_random
+from como.legacy.rng import SimulationStreams
 
 
 SENTINEL = None
@@ -17,8 +18,15 @@ THIS_PATH = os.path.abspath(os.path.dirname(__file__))
 class IndependentComorbidity:
 
     _n_comos = 100
+    _max_dw = 1 - 1e-9
+    _block_bytes = 2 ** 30
 
-    def __init__(self, sim_df, disability_weights_df, draw_cols):
+    def __init__(self, sim_df, disability_weights_df, draw_cols, streams=None, seed=None):
+        """Simulation of one slice. Simulants are drawn from the counter-based
+        streams when given, otherwise from a generator seeded with seed, so
+        every simulation can be reproduced."""
+        if streams is None and seed is None:
+            raise ValueError("IndependentComorbidity requires either streams or a seed")
 
         if sim_df["sequela_id"].duplicated().any():
             raise ValueError("sim_df must be unique by sequela_id")
@@ -38,13 +46,14 @@ class IndependentComorbidity:
         self.sim_dws_df = disability_weights_df
         self.skip_dws_df = None
         self.draw_cols = draw_cols
+        self.streams = streams
 
         self._comos = []
         self._ylds = []
         self._dw_counts = []
         self._sim_people = []
 
-        np.random.seed()
+        self._rng = np.random.default_rng(seed)
 
     @property
     def comos(self):
@@ -90,6 +99,82 @@ class IndependentComorbidity:
 
         self._ylds.append(pd.DataFrame(data={"draw_" + str(draw_num): yld_rate}))
 
+    def _draw_block_size(self, n_simulants, n_sequela):
+        """number of draws that fit in the block memory budget, counting the
+        boolean simulant block and its float32 copy used in the matmul"""
+        bytes_per_draw = max(n_simulants * n_sequela * 5, 1)
+        return max(int(self._block_bytes // bytes_per_draw), 1)
+
+    def _simulate_block(self, sim_mat, n_simulants, draw_nums, n_threads=1):
+        if self.streams is not None:
+            return self.streams.bernoulli(
+                n_simulants, sim_mat[:, draw_nums], draw_nums, n_threads=n_threads
+            )
+
+        shape = (n_simulants, sim_mat.shape[0])
+        uniform = np.empty(shape, dtype=np.float32)
+        prev = sim_mat[:, draw_nums].astype(np.float32)
+        sim_people = np.empty((len(draw_nums),) + shape, dtype=bool)
+        for i in range(len(draw_nums)):
+            self._rng.random(out=uniform, dtype=np.float32)
+            np.less_equal(uniform, prev[:, i], out=sim_people[i])
+        return sim_people
+
+    def _yld_rates_block(self, sim_people, sim_dws_mat, n_simulants, draw_nums):
+        """Batched equivalent of _track_ylds for a block of draws, returning
+        a (sequela, draw) array of yld rates.
+
+        The combined disability weight 1 - prod(1 - dw) is computed in log
+        space, so both it and the sum of disability weights for every
+        simulant come out of a single matrix multiply per draw.
+        """
+        dws = sim_dws_mat[:, draw_nums].T.astype(np.float32)
+        log_keep = np.log1p(-np.minimum(dws, self._max_dw))
+        people = sim_people.astype(np.float32)
+
+        # (draw, simulant, [sum log(1 - dw), sum dw])
+        dw_sums = np.matmul(people, np.stack([log_keep, dws], axis=-1))
+        combined_dw = -np.expm1(dw_sums[..., 0])
+        denom = dw_sums[..., 1]
+        denom[denom == 0] = 1
+
+        # attribute the combined dw back to each constituent disease
+        weight = (combined_dw / denom)[:, np.newaxis, :]
+        yld_rate = np.matmul(weight, people)[:, 0, :] * dws / n_simulants
+        return yld_rate.T.astype(np.float64)
+
+    def _track_ylds_block(self, sim_people, sim_dws_mat, n_simulants, draw_nums):
+        yld_rate = self._yld_rates_block(sim_people, sim_dws_mat, n_simulants, draw_nums)
+        self._ylds.append(
+            pd.DataFrame(
+                data=yld_rate, columns=[f"draw_{draw_num}" for draw_num in draw_nums]
+            )
+        )
+
+    def simulate_ylds_into(
+        self, sim_mat, sim_dws_mat, out, n_simulants, draw_block_size=None, n_threads=1
+    ):
+        """Simulate yld rates from bare (sequela, draw) prevalence and
+        disability weight arrays, writing them into out. Used by the shared
+        memory runner, where the arrays are views into blocks shared by all
+        workers."""
+        if draw_block_size is None:
+            draw_block_size = self._draw_block_size(n_simulants, sim_mat.shape[0])
+
+        n_draws = sim_mat.shape[1]
+        for start in range(0, n_draws, draw_block_size):
+            draw_nums = list(range(start, min(start + draw_block_size, n_draws)))
+            sim_people = self._simulate_block(sim_mat, n_simulants, draw_nums, n_threads)
+            out[:, start : start + len(draw_nums)] = self._yld_rates_block(
+                sim_people, sim_dws_mat, n_simulants, draw_nums
+            )
+
+    def release_inputs(self):
+        """Drop the simulated draws, keeping only the sequela index needed to
+        label results"""
+        self.sim_df = self.sim_df[[]]
+        self.sim_dws_df = self.sim_dws_df[[]]
+
     def _track_comos(self, sim_people, draw_num):
         """Keep track of # of comorbidities for diagnostic purposes"""
         num_diseases_each = np.sum(sim_people, axis=1, dtype=np.uint32)
@@ -147,6 +232,9 @@ class IndependentComorbidity:
         comos=False,
         disability_distribution=False,
         sequela_by_simulant=False,
+        draw_block_size=None,
+        batched=True,
+        n_threads=1,
     ):
 
         if self.skip_df is None:
@@ -155,6 +243,51 @@ class IndependentComorbidity:
         sim_mat = self.sim_df.reset_index()[self.draw_cols].as_matrix()
         sim_dws_mat = self.sim_dws_df.reset_index()[self.draw_cols].as_matrix()
 
+        if not batched:
+            self._simulate_by_draw(
+                sim_mat,
+                sim_dws_mat,
+                n_simulants,
+                ylds,
+                comos,
+                disability_distribution,
+                sequela_by_simulant,
+            )
+            return
+
+        if draw_block_size is None:
+            draw_block_size = self._draw_block_size(n_simulants, sim_mat.shape[0])
+
+        n_draws = len(self.draw_cols)
+        for start in range(0, n_draws, draw_block_size):
+            draw_nums = list(range(start, min(start + draw_block_size, n_draws)))
+            logger.info(f"simulating draws: {draw_nums[0]}-{draw_nums[-1]}")
+            sim_people = self._simulate_block(sim_mat, n_simulants, draw_nums, n_threads)
+
+            if ylds:
+                self._track_ylds_block(sim_people, sim_dws_mat, n_simulants, draw_nums)
+            for i, draw_num in enumerate(draw_nums):
+                if comos:
+                    self._track_comos(sim_people[i], draw_num)
+                if disability_distribution:
+                    self._track_disability_distribution(
+                        sim_people[i], sim_dws_mat, 20, draw_num
+                    )
+                if sequela_by_simulant:
+                    self._track_sequela_by_simulant(sim_people[i], sim_dws_mat, draw_num)
+
+    def _simulate_by_draw(
+        self,
+        sim_mat,
+        sim_dws_mat,
+        n_simulants,
+        ylds,
+        comos,
+        disability_distribution,
+        sequela_by_simulant,
+    ):
+        """Original one-draw-at-a-time simulation, kept for validating the
+        batched engine"""
         for draw_num in range(len(self.draw_cols)):
             logger.info(f"simulating draw: {draw_num}")
             sim_people = fast_random.bernoulli(n_simulants, sim_mat[:, draw_num])
@@ -226,6 +359,100 @@ class SimulationRunner:
         for p in sim_procs:
             p.join()
 
+    def _shm_run_single_simulation(
+        self, inq, outq, shared, n_draws, draw_block_size, n_threads
+    ):
+        prev, dws, ylds = (
+            np.frombuffer(buf, dtype=np.float64).reshape(-1, n_draws) for buf in shared
+        )
+        for simkey, start, stop in iter(inq.get, SENTINEL):
+            try:
+                sim, args, kwargs = self.simulations[simkey]
+                sim.simulate_ylds_into(
+                    prev[start:stop],
+                    dws[start:stop],
+                    ylds[start:stop],
+                    kwargs["n_simulants"],
+                    draw_block_size=draw_block_size,
+                    n_threads=n_threads,
+                )
+                outq.put((simkey, None))
+            except Exception as e:
+                logger.error(
+                    f"shm_run_single_simulation({inq}, {outq}); simkey: {simkey}. "
+                    f"Exception: {e}"
+                )
+                outq.put((simkey, e))
+
+    def run_all_simulations_shm(self, n_processes=23, draw_block_size=None, n_threads=1):
+        """Run yld simulations with inputs and outputs in shared memory.
+
+        Prevalence and disability weight draws for every simulation are packed
+        into one shared block each before the workers fork, and the
+        simulations are stripped down to their sequela index. Workers are only
+        handed row offsets into those blocks and write yld rates straight into
+        a shared output block, so nothing but the offsets crosses the queues.
+        Only yld results are available in this mode. Each worker fills its
+        random draws from n_threads threads.
+        """
+        offsets = {}
+        n_rows = 0
+        n_draws = 0
+        for simkey, (sim, args, kwargs) in self.simulations.items():
+            if sim.skip_df is None:
+                sim.compute_skips(2.0 / kwargs["n_simulants"])
+            n_draws = len(sim.draw_cols)
+            offsets[simkey] = (n_rows, n_rows + len(sim.sim_df))
+            n_rows += len(sim.sim_df)
+
+        if not offsets:
+            return
+
+        shared = [RawArray("d", n_rows * n_draws) for _ in range(3)]
+        prev, dws, ylds = (
+            np.frombuffer(buf, dtype=np.float64).reshape(-1, n_draws) for buf in shared
+        )
+        for simkey, (start, stop) in offsets.items():
+            sim = self.simulations[simkey][0]
+            prev[start:stop] = sim.sim_df[sim.draw_cols].values
+            dws[start:stop] = sim.sim_dws_df[sim.draw_cols].values
+            sim.release_inputs()
+
+        inq = Queue()
+        outq = Queue()
+
+        sim_procs = []
+        for i in range(n_processes):
+            p = Process(
+                target=self._shm_run_single_simulation,
+                args=(inq, outq, shared, n_draws, draw_block_size, n_threads),
+            )
+            sim_procs.append(p)
+            p.start()
+
+        for simkey, (start, stop) in offsets.items():
+            inq.put((simkey, start, stop))
+
+        for _ in sim_procs:
+            inq.put(SENTINEL)
+
+        errors = []
+        for _ in offsets:
+            simkey, error = outq.get()
+            if error is not None:
+                errors.append((simkey, error))
+
+        for p in sim_procs:
+            p.join()
+
+        if errors:
+            raise RuntimeError(f"shared memory simulations failed: {errors}")
+
+        for simkey, (start, stop) in offsets.items():
+            sim = self.simulations[simkey][0]
+            sim._ylds = [pd.DataFrame(ylds[start:stop].copy(), columns=sim.draw_cols)]
+            self.simulation_results[simkey] = (self.get_simulation_results(sim),)
+
     def run_all_simulations_sp(self):
         for simkey in self.simulations.keys():
             sim = self.run_single_simulation(simkey)
@@ -234,10 +461,14 @@ class SimulationRunner:
 
 
 class ComoSimulator:
-    def __init__(self, como_version, dimensions, prevalence_inputs, disability_weights):
+    def __init__(
+        self, como_version, dimensions, prevalence_inputs, disability_weights, domain="sequela"
+    ):
         self.como_version = como_version
         self.prevalence_inputs = prevalence_inputs
         self.disability_weights = disability_weights
+        # which random streams the simulations draw from, see rng.DOMAINS
+        self.domain = domain
 
         self.dimensions = deepcopy(dimensions)
         self.runner = None
@@ -296,15 +527,16 @@ class ComoSimulator:
                 | (prev_draws.sequela_id > 0)
             ]
 
-            sim = simulation(
-                prev_draws,
-                dws,
-                self.dimensions.data_list(),
+            streams = SimulationStreams.from_element(
+                self.como_version.como_version_id, self._sim_idx, element, domain=self.domain
             )
+            sim = simulation(prev_draws, dws, self.dimensions.data_list(), streams=streams)
             self.runner.add_simulation_to_queue(element, sim, *args, **kwargs)
 
-    def run_all_simulations(self, n_processes=23):
-        if n_processes > 1:
+    def run_all_simulations(self, n_processes=23, shared_memory=False, n_threads=1):
+        if n_processes > 1 and shared_memory:
+            self.runner.run_all_simulations_shm(n_processes=n_processes, n_threads=n_threads)
+        elif n_processes > 1:
             self.runner.run_all_simulations_mp(n_processes=n_processes)
         else:
             self.runner.run_all_simulations_sp()
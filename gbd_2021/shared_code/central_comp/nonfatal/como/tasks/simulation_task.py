@@ -35,6 +35,7 @@ class SimulationTaskFactory:
             "--year_id {year_id} "
             "--n_simulants {n_simulants} "
             "--n_processes {n_processes} "
+            "--n_threads {n_threads} "
         )
         self.task_template = tool.get_task_template(
             template_name="como_sim",
@@ -45,7 +46,7 @@ class SimulationTaskFactory:
                 "year_id",
             ],
             task_args=["como_dir", "n_simulants"],
-            op_args=["python", "script", "n_processes"],
+            op_args=["python", "script", "n_processes", "n_threads"],
         )
 
     @staticmethod
@@ -55,7 +56,7 @@ class SimulationTaskFactory:
             {"location_id": location_id, "sex_id": sex_id, "year_id": year_id},
         )
 
-    def get_task(self, location_id, sex_id, year_id, n_simulants, n_processes):
+    def get_task(self, location_id, sex_id, year_id, n_simulants, n_processes, n_threads=1):
         dw_task = DisabilityWeightTaskFactory.get_task_name(location_id)
         sim_input_task = SimulationInputTaskFactory.get_task_name(location_id, sex_id)
         upstream_tasks = [self.task_registry[task] for task in [dw_task, sim_input_task]]
@@ -77,6 +78,7 @@ class SimulationTaskFactory:
             n_simulants=n_simulants,
             sex_id=sex_id,
             n_processes=n_processes,
+            n_threads=n_threads,
             name=name,
             max_attempts=3,
             executor_parameters=exec_params,
@@ -148,7 +150,7 @@ class SimulationTask:
         dws_inputs.get_epi_dws()
         return dws_inputs
 
-    def run_task(self, n_simulants, n_processes):
+    def run_task(self, n_simulants, n_processes, n_threads=1):
         long_en_prev = self.injuries_long_term_prev
         short_en_prev = self.injuries_short_term_prev
         seq_prev = self.sequela_prev
@@ -157,7 +159,7 @@ class SimulationTask:
             [seq_prev, self._prepare_ncode_aggregates(long_en_prev.copy())], sort=True
         )
         prevalence_df["measure_id"] = measures.PREVALENCE
-        como = self.simulate(prevalence_df, n_simulants, n_processes)
+        como = self.simulate(prevalence_df, n_simulants, n_processes, n_threads)
 
         seq_dim = self.dimensions.get_sequela_dimensions(measures.YLD)
         simulated_ylds = como.ylds[seq_dim.index_names + seq_dim.data_list()]
@@ -198,7 +200,11 @@ class SimulationTask:
                 .drop(["sequela_id", "rei_id"], axis=1)
             )
             imp_prev = imp_prev.rename({"fake_id": "sequela_id"}, axis="columns")
-            imp_como = self.simulate(imp_prev, n_simulants, n_processes)
+            # impairments draw from their own random streams so that they are
+            # not correlated with the sequela simulation of the same slice
+            imp_como = self.simulate(
+                imp_prev, n_simulants, n_processes, n_threads, domain="impairment"
+            )
 
             imp_simulated_ylds = imp_como.ylds[seq_dim.index_names + seq_dim.data_list()]
             imp_simulated_ylds = imp_simulated_ylds.rename(
@@ -212,14 +218,22 @@ class SimulationTask:
                 df, append=False, complib="blosc:zstd", complevel=1
             )
 
-    def simulate(self, prevalence_df, n_simulants, n_processes):
+    def simulate(
+        self, prevalence_df, n_simulants, n_processes, n_threads=1, domain="sequela"
+    ):
         sim_idx = self.dimensions.get_simulation_dimensions(measures.PREVALENCE)
 
         como_sim = ComoSimulator(
-            self.como_version, sim_idx, prevalence_df, self.disability_weights
+            self.como_version,
+            sim_idx,
+            prevalence_df,
+            self.disability_weights,
+            domain=domain,
         )
         como_sim.create_simulations(n_simulants=n_simulants)
-        como_sim.run_all_simulations(n_processes=n_processes)
+        como_sim.run_all_simulations(
+            n_processes=n_processes, shared_memory=True, n_threads=n_threads
+        )
         return como_sim
 
     def _compute_en_ylds(self, simulated_ylds, long_term_en_prev, short_term_en_ylds):
@@ -376,9 +390,15 @@ if __name__ == "__main__":
     parser.add_argument(
         "--n_processes", type=int, default=23, help="how many subprocesses to use"
     )
+    parser.add_argument(
+        "--n_threads",
+        type=int,
+        default=1,
+        help="how many threads each subprocess fills random draws from",
+    )
     args = parser.parse_args()
 
     cv = ComoVersion(args.como_dir)
     cv.load_cache()
     task = SimulationTask(cv, args.location_id, args.sex_id, args.year_id)
-    task.run_task(args.n_simulants, args.n_processes)
+    task.run_task(args.n_simulants, args.n_processes, args.n_threads)
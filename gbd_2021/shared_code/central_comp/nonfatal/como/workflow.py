@@ -119,6 +119,8 @@ class ComoWorkFlow:
                 year_id=slices[2],
                 n_simulants=n_simulants,
                 n_processes=23,
+                # the 25 cores of a task leave one thread per subprocess
+                n_threads=1,
             )
             self.workflow.add_task(sim_task)
         logger.info("...finished adding simulation input tasks to DAG")
@@ -259,8 +259,12 @@ def make_dag(mvid, loctree, cv_iter, add_arguments=None):
 
     dag = {}
     demo = Demographics(mvid)
+    # model size, which global and varnish jobs are sized by
+    sizes = {'num_locations': len(loctree.nodes),
+             'num_years': len(demo.year_ids)}
 
-    global_jobs = make_global_jobs(mvid, cv_iter, add_arguments=add_arguments)
+    global_jobs = make_global_jobs(mvid, cv_iter, add_arguments=add_arguments,
+                                   sizes=sizes)
     global_job_names = list(global_jobs.keys())
 
     node_jobs = make_child_jobs(mvid, demo, cv_iter, global_job_names, loctree,
@@ -270,7 +274,7 @@ def make_dag(mvid, loctree, cv_iter, add_arguments=None):
 
     all_job_names = global_job_names + node_job_names
     varnish_job = make_upload_job(
-        mvid, all_job_names, add_arguments=add_arguments)
+        mvid, all_job_names, add_arguments=add_arguments, sizes=sizes)
 
     # this ordering is important -- when we build the jobmon workflow we
     # iterate through this dict and build PythonTasks. For every node in the
@@ -283,7 +287,7 @@ def make_dag(mvid, loctree, cv_iter, add_arguments=None):
     return dag
 
 
-def make_global_jobs(mvid, cv_iter, add_arguments=None):
+def make_global_jobs(mvid, cv_iter, add_arguments=None, sizes=None):
     """
     Returns a dict of job-name -> GlobalDagNode that represents all global
     jobs.
@@ -297,6 +301,8 @@ def make_global_jobs(mvid, cv_iter, add_arguments=None):
             validation jobs
         add_arguments (List[str]): Arguments to add to every executable of
             the Cascade.
+        sizes (Opt[dict[str, int]]): size of the model, added to each job's
+            details for the resource store
 
     Returns:
         dict[str, GlobalDagNode]
@@ -309,7 +315,7 @@ def make_global_jobs(mvid, cv_iter, add_arguments=None):
         job_name = GlobalDagNode.name_template.format(mvid=mvid, cv_iter=i)
         args = [mvid, '--cv_iter', i] + add_arguments
         upstream_jobs = []
-        details = {}
+        details = dict(sizes or {})
         jobs[job_name] = GlobalDagNode(
             job_name, args, upstream_jobs, details)
     return jobs
@@ -382,7 +388,7 @@ def make_child_jobs(mvid, demo, cv_iter, global_job_names, lt,
     return jobs
 
 
-def make_upload_job(mvid, all_job_names, add_arguments=None):
+def make_upload_job(mvid, all_job_names, add_arguments=None, sizes=None):
     """
     Returns a dict of job-name -> UploadDagNode that represents the final
     upload job (varnish.py)
@@ -392,6 +398,8 @@ def make_upload_job(mvid, all_job_names, add_arguments=None):
         all_job_names (List[str]): We need list of all job names
             to associate upstream tasks for varnish
         add_arguments (List[str]): Arguments to add to all jobs.
+        sizes (Opt[dict[str, int]]): size of the model, added to the job's
+            details for the resource store
 
     Returns:
         dict[str, UploadDagNode]
@@ -399,7 +407,7 @@ def make_upload_job(mvid, all_job_names, add_arguments=None):
     add_arguments = add_arguments if add_arguments else list()
     job_name = UploadDagNode.name_template.format(mvid=mvid)
     args = [mvid] + add_arguments
-    details = {}
+    details = dict(sizes or {})
     return {
         job_name: UploadDagNode(job_name, args, all_job_names, details)}
 
@@ -0,0 +1,80 @@
+"""
+Running the DisMod-ODE binaries (dismod_ode, model_draw, data_pred) and
+reading their output tables.
+
+The binaries only take file paths. An output table that is only needed in
+memory is handed to the binary as the /dev/fd path of a pipe, which this
+process parses while the binary writes to it, so the table never touches the
+filesystem.
+"""
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+import pandas as pd
+
+
+def binary_path(bin_dir, name):
+    """Path to the DisMod-ODE binary name in bin_dir"""
+    return os.path.join(os.path.expanduser(bin_dir), name)
+
+
+def run(cmd):
+    """Run a DisMod-ODE binary, echoing its output to stderr if it fails.
+
+    Returns:
+        bytes: combined stdout and stderr of the binary
+    """
+    log = logging.getLogger(__name__)
+    log.info("Running: " + " ".join(cmd))
+    try:
+        return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+    except subprocess.CalledProcessError as e:
+        sys.stderr.write(str(e.output))
+        raise e
+
+
+def run_to_frame(cmd, **read_csv_kwargs):
+    """Run a DisMod-ODE binary whose last argument is its output file, with
+    that argument replaced by a pipe read straight into a DataFrame.
+
+    Args:
+        cmd (List[str]): the binary and its arguments, except the output file
+        **read_csv_kwargs: passed on to pd.read_csv
+
+    Returns:
+        (bytes, pd.DataFrame): combined stdout and stderr of the binary, and
+        the table it wrote
+    """
+    log = logging.getLogger(__name__)
+    read_fd, write_fd = os.pipe()
+    table = {}
+
+    def read():
+        try:
+            with os.fdopen(read_fd, 'r') as pipe:
+                table['frame'] = pd.read_csv(pipe, **read_csv_kwargs)
+        except Exception as e:
+            table['error'] = e
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    cmd = cmd + ['/dev/fd/{}'.format(write_fd)]
+    log.info("Running: " + " ".join(cmd))
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, pass_fds=(write_fd,))
+    finally:
+        # The binary holds the only write end left, so the reader sees the
+        # end of the table when the binary exits
+        os.close(write_fd)
+    output, _ = proc.communicate()
+    reader.join()
+    if proc.returncode:
+        sys.stderr.write(str(output))
+        raise subprocess.CalledProcessError(proc.returncode, cmd, output=output)
+    if 'error' in table:
+        raise table['error']
+    return output, table['frame']
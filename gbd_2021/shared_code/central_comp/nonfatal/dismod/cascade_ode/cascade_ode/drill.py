@@ -6,7 +6,6 @@ import json
 import logging
 import os
 import subprocess
-import sys
 import warnings
 
 from hierarchies.dbtrees import loctree
@@ -17,6 +16,7 @@ import pandas as pd
 
 from cascade_ode import crosswalk as cw
 from cascade_ode import decomp
+from cascade_ode import dismod_io
 from cascade_ode import importer
 from cascade_ode import shared_functions
 from cascade_ode.argument_parser import cascade_parser
@@ -78,6 +78,17 @@ def lower_levels(level):
     return cascade_levels[idx + 1:]
 
 
+def summarize_draws(values):
+    '''summarize a (row, draw) array of draws in one pass over the rows,
+    returning a dict of arrays of the mean, median, std and the 2.5 (lower)
+    and 97.5 (upper) percentiles of each row'''
+    values = np.ascontiguousarray(values, dtype=float)
+    lower, median, upper = np.quantile(values, [.025, .5, .975], axis=1)
+    return {'mean': values.mean(axis=1), 'median': median,
+            'lower': lower, 'upper': upper,
+            'std': values.std(axis=1, ddof=1)}
+
+
 class Cascade(object):
 
     def __init__(
@@ -1189,25 +1200,13 @@ class Cascade_loc(object):
     def summarize_draws_for_children(self, draws, burn=0.2):
         '''summarize draws to be used as inputs into children dismod runs'''
         # Summarize draws
-        draws = draws.copy()
         start_idx = int(len(draws) * burn) - 1
-        draws = draws[start_idx:]
-        draws = draws.transpose()
-        median = draws.median(axis=1)
-        mean = draws.mean(axis=1)
-        std = draws.std(axis=1)
-        lower = draws.apply(lambda x: stats.scoreatpercentile(x, 2.5), axis=1)
-        upper = draws.apply(lambda x: stats.scoreatpercentile(x, 97.5), axis=1)
+        draw_summ = pd.DataFrame(
+            summarize_draws(draws.values[start_idx:].T))
+        draw_summ.insert(0, 'row_name', draws.columns.astype('int'))
 
         # Merge summaries onto the inputs
-        draw_summ = pd.DataFrame(
-            {'mean': mean, 'median': median, 'lower': lower, 'upper': upper,
-             'std': std})
-        draw_summ.index.name = 'row_name'
-        draw_summ = draw_summ.reset_index()
-        draw_summ['row_name'] = draw_summ.row_name.astype('int')
-        predin = pd.read_csv(self.predin_file)
-        predin = predin[predin.for_database == 0]
+        predin = self.predin[self.predin.for_database == 0]
         draw_summ = predin.merge(draw_summ, on='row_name', how='left')
 
         draw_summ['meas_value'] = draw_summ['median']
@@ -1855,8 +1854,8 @@ class Cascade_loc(object):
             At least 1 data point / prior point per integrand must be
             non-inf"""
 
-        dismod_path = os.path.join(os.path.expanduser(
-            settings['dismod_ode_bin_dir']), "dismod_ode")
+        dismod_path = dismod_io.binary_path(
+            settings['dismod_ode_bin_dir'], "dismod_ode")
         cmd = [
             dismod_path,
             self.data_file,
@@ -1866,26 +1865,25 @@ class Cascade_loc(object):
             self.effect_file,
             self.posterior_file,
             self.info_file]
-        log.info("Running: " + " ".join(cmd))
         num_retries = 2
         i = 0
         while i < (num_retries + 1):
             log.info("Retrying. Attempt #{}".format(i))
             try:
-                result = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+                result = dismod_io.run(cmd)
                 i = num_retries + 1
             except subprocess.CalledProcessError as e:
                 i += 1
-                sys.stderr.write(str(e.output))
                 raise e
         self.dismod_finished = True
         return result
 
     def draw(self):
         '''call model_draw program in a subprocess and format output draws
-        before writing to csv'''
-        draw_path = os.path.join(os.path.expanduser(
-            settings['dismod_ode_bin_dir']), "model_draw")
+        before writing to csv. The draws are piped straight back from
+        model_draw rather than written to self.drawout_file'''
+        draw_path = dismod_io.binary_path(
+            settings['dismod_ode_bin_dir'], "model_draw")
         cmd = [
             draw_path,
             self.predin_file,
@@ -1893,20 +1891,13 @@ class Cascade_loc(object):
             self.simple_file,
             self.rate_file,
             self.effect_file,
-            self.posterior_file,
-            self.drawout_file]
-        try:
-            result = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            sys.stderr.write(str(e.output))
-            raise e
+            self.posterior_file]
+        result, draws = dismod_io.run_to_frame(cmd)
 
         # Summarize and write to file
         measure_map = self.cascade.measure_map.copy()
         measure_map.rename(columns={'measure': 'integrand'}, inplace=True)
 
-        draws = pd.read_csv(self.drawout_file)
-        subprocess.check_output(['rm', self.drawout_file])
         if len(self.locnode.children) > 0:
             child_priors = self.summarize_draws_for_children(draws)
             child_priors.to_csv(self.child_prior_file, index=False)
@@ -1914,7 +1905,7 @@ class Cascade_loc(object):
         draws = draws[start_idx:]
         draws = draws.transpose()
         num_draws = draws.shape[1]
-        parent_predin = pd.read_csv(self.predin_file)
+        parent_predin = self.predin
 
         # Format draws for writing to file
         draws = draws.reset_index()
@@ -1958,57 +1949,26 @@ class Cascade_loc(object):
         draws_agestd.drop('weight', axis=1, inplace=True)
         draws = draws.append(draws_agestd)
 
-        for col in draw_cols:
-            clipped = draws.loc[draws.measure_id.isin(
-                [5, 18]), col].clip(upper=1)
-            draws.loc[draws.measure_id.isin([5, 18]), col] = clipped
-        for col in draw_cols:
-            clipped = draws[col].clip(lower=0)
-            draws[col] = clipped
+        values = draws[draw_cols].values
+        proportions = draws.measure_id.isin([5, 18]).values
+        values[proportions] = np.minimum(values[proportions], 1)
+        draws[draw_cols] = np.clip(values, 0, None)
 
-        # Write formatted draw files for lowest estimation levels
+        # Write formatted draw files for lowest estimation levels, and
+        # summarize the draws that are written
         if self.locnode.id in [l.id for l in self.loctree.leaves()]:
-            for y in draws.year_id.unique():
-                for s in draws.sex_id.unique():
-                    filepath = "{}/{}_{}_{}.h5".format(
-                        self.draws_dir, int(float(self.loc)),
-                        int(float(y)), int(float(s)))
-                    np.random.seed(self.cascade.seed)
-                    draw_cols = draws.filter(like='draw').columns
-                    draw_cols = list(np.random.choice(
-                        draw_cols, size=1000, replace=False))
-                    draws = draws[
-                        (draws.year_id == y) & (draws.sex_id == s)][
-                        ['measure_id', 'location_id', 'year_id',
-                                       'age_group_id', 'sex_id'] + draw_cols]
-                    dren = dict((d, 'draw_' + str(i))
-                                for i, d in enumerate(draw_cols))
-                    draws.rename(columns=dren, inplace=True)
-                    draws.to_hdf(filepath, 'draws', mode='w', format='table',
-                                 complib='blosc:zstd', complevel=1,
-                                 data_columns=['measure_id', 'age_group_id'])
-
-        draw_cols = ['draw_' + str(i) for i in range(1000)]
-        draws['median'] = draws[draw_cols].median(axis=1)
-        draws['mean'] = draws[draw_cols].mean(axis=1)
-        draws['std'] = draws[draw_cols].std(axis=1)
-        draws['lower'] = draws[draw_cols].apply(
-            lambda x: stats.scoreatpercentile(x, 2.5), axis=1)
-        draws['upper'] = draws[draw_cols].apply(
-            lambda x: stats.scoreatpercentile(x, 97.5), axis=1)
-
-        # Merge summaries onto the inputs
-        draws['meas_value'] = draws['median']
-        draws['meas_stdev'] = (draws.upper - draws.lower) / (2 * 1.96)
+            np.random.seed(self.cascade.seed)
+            draw_cols = list(np.random.choice(
+                draw_cols, size=1000, replace=False))
+            self.write_leaf_draws(draws, draw_cols)
+        else:
+            draw_cols = ['draw_' + str(i) for i in range(1000)]
+        summary = summarize_draws(draws[draw_cols].values)
 
-        # Format for appending onto data
-        draws.rename(columns={
-            'mean': 'pred_mean',
-            'median': 'pred_median',
-            'lower': 'pred_lower',
-            'upper': 'pred_upper'}, inplace=True)
-        draw_summ = draws[['year_id', 'sex_id', 'age_group_id', 'measure_id',
-                           'pred_mean', 'pred_lower', 'pred_upper']]
+        draw_summ = draws[['year_id', 'sex_id', 'age_group_id', 'measure_id']]
+        draw_summ = draw_summ.assign(pred_mean=summary['mean'],
+                                     pred_lower=summary['lower'],
+                                     pred_upper=summary['upper'])
         draw_summ.to_csv(self.drawout_summ_file, index=False)
 
         if self.loclvl != 'world':
@@ -2026,6 +1986,32 @@ class Cascade_loc(object):
 
         return result
 
+    def write_leaf_draws(self, draws, draw_cols):
+        '''write draw_cols of draws, renamed draw_0 ... draw_999, to one hdf
+        file per year and sex, slicing each file from a single copy of the
+        draws sorted by year and sex'''
+        id_cols = ['measure_id', 'location_id', 'year_id', 'age_group_id',
+                   'sex_id']
+        out = draws[id_cols + draw_cols]
+        out.columns = id_cols + ['draw_' + str(i)
+                                 for i in range(len(draw_cols))]
+        out = out.sort_values(['year_id', 'sex_id'], kind='mergesort')
+        out = out.reset_index(drop=True)
+
+        keys = out[['year_id', 'sex_id']].values
+        starts = np.flatnonzero(
+            np.r_[True, (keys[1:] != keys[:-1]).any(axis=1)])
+        ends = np.r_[starts[1:], len(out)]
+        for start, end in zip(starts, ends):
+            y, s = keys[start]
+            filepath = "{}/{}_{}_{}.h5".format(
+                self.draws_dir, int(float(self.loc)),
+                int(float(y)), int(float(s)))
+            out.iloc[start:end].to_hdf(
+                filepath, 'draws', mode='w', format='table',
+                complib='blosc:zstd', complevel=1,
+                data_columns=['measure_id', 'age_group_id'])
+
     def predict(self):
         pred_runs = [
             {'in': self.data_noarea_file, 'out': self.dataadjout_file},
@@ -2033,8 +2019,8 @@ class Cascade_loc(object):
             {'in': self.data_pred_file, 'out': self.datapredout_file}]
 
         for pred_run in pred_runs:
-            predict_path = os.path.join(os.path.expanduser(
-                settings['dismod_ode_bin_dir']), "data_pred")
+            predict_path = dismod_io.binary_path(
+                settings['dismod_ode_bin_dir'], "data_pred")
             cmd = [
                 predict_path,
                 pred_run['in'],
@@ -2044,11 +2030,7 @@ class Cascade_loc(object):
                 self.effect_file,
                 self.posterior_file,
                 pred_run['out']]
-            try:
-                result = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-            except subprocess.CalledProcessError as e:
-                sys.stderr.write(str(e.output))
-                raise e
+            result = dismod_io.run(cmd)
 
             # Format adjusted data for upload
             if pred_run['out'] == self.dataadjout_file:
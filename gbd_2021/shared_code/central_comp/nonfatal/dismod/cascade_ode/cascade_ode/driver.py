@@ -85,6 +85,14 @@ class Driver(object):
 
         desc = self.mvm.description.values[0]
 
+        # add the latest production job stats to the resource store the jobs
+        # are sized from
+        try:
+            sge.refresh_resource_store()
+        except Exception:
+            log.warning("Couldn't refresh the resource store, sizing jobs "
+                        "from its existing history", exc_info=True)
+
         jobdag = make_dag(
             mvid=self.mvid, loctree=lt, cv_iter=cv_iters,
             add_arguments=extra_arguments
@@ -10,9 +10,11 @@ import pandas as pd
 from cascade_ode import crosswalk as cw
 from cascade_ode import csmr, db, ln_asdr, upload
 from cascade_ode.demographics import Demographics
+from cascade_ode.input_cache import InputCache
 from cascade_ode.settings import load as load_settings
 from cascade_ode.shared_functions import (
     get_age_weights,
+    get_best_model_versions,
     get_covariate_estimates,
     get_envelope,
     get_population,
@@ -30,6 +32,10 @@ this_path = os.path.dirname(os.path.abspath(__file__))
 # Get configuration options
 settings = load_settings()
 
+# Inputs shared between model versions, see cascade_ode.input_cache
+INPUT_CACHE_DIR = os.path.join(
+    os.path.expanduser(settings['cascade_ode_out_dir']), 'input_cache')
+
 # mapping from parameter_type_id to a short name for the prior_type
 # (missing from data-base).
 
@@ -166,6 +172,7 @@ class Importer(object):
             log.exception(
                 "Could not chmod root dir {}".format(self.root_dir))
 
+        self.input_cache = InputCache(INPUT_CACHE_DIR)
         self.demographics = Demographics(model_version_id)
         self.mvid = model_version_id
         self.gbd_round_id = self.demographics.gbd_round_id
@@ -277,7 +284,9 @@ class Importer(object):
         aq = """
                 SELECT age_group_id, age_group_years_start, age_group_years_end
                 FROM shared.age_group"""
-        return db.execute_select(aq, 'cod')
+        return self.input_cache.fetch(
+            {'query': 'age_ranges', 'gbd_round_id': self.gbd_round_id},
+            lambda: db.execute_select(aq, 'cod'))
 
     def promote_asdr_t2_to_t3(self):
         '''
@@ -428,12 +437,12 @@ class Importer(object):
                             'lower', 'upper'])
         return df
 
-    @staticmethod
-    def query_t3_dismod_data(crosswalk_version_id):
+    def query_t3_dismod_data(self, crosswalk_version_id):
         '''
         Return a pandas dataframe of dismod input data
 
-        This data is coming from the relevant crosswalk_version dataset.
+        This data is coming from the relevant crosswalk_version dataset, which
+        is cached since crosswalk versions don't change once saved.
         '''
         columns_to_return = [
             'data_id', 'nid', 'location_id', 'integrand',
@@ -445,7 +454,10 @@ class Importer(object):
             'seq': 'data_id',
             'measure': 'integrand'}
 
-        df = get_crosswalk_version(crosswalk_version_id)
+        df = self.input_cache.fetch(
+            {'query': 'crosswalk_version',
+             'crosswalk_version_id': crosswalk_version_id},
+            lambda: get_crosswalk_version(crosswalk_version_id))
 
         df = rename_potential_overwrite_columns(
             df, list(rename_columns.values()))
@@ -837,7 +849,10 @@ class Importer(object):
             query = """
                 SELECT * FROM shared.age_group
                 WHERE age_group_id IN (%s) """ % (age_group_id_str)
-            age_mesh = db.execute_select(query)
+            age_mesh = self.input_cache.fetch(
+                {'query': 'age_mesh', 'gbd_round_id': self.gbd_round_id,
+                 'age_group_ids': age_group_id_str},
+                lambda: db.execute_select(query))
             age_mesh.rename(columns={
                 'age_group_years_start': 'age_start',
                 'age_group_years_end': 'age_end'}, inplace=True)
@@ -899,8 +914,17 @@ class Importer(object):
                 self.model_version_meta.csmr_cod_output_version_id.squeeze())
             covname = 'lnasdr_%s' % asdr_cause_id
             colname = 'raw_c_{}'.format(covname)
-            covdata = ln_asdr.get_lnasdr_from_db(
-                int(asdr_cause_id), cc_vid, self.gbd_round_id, self.mvid
+            # Ln-ASDR is the age-standardized death rate the CodCorrect
+            # version saved to the outputs database, pulled for the model's
+            # locations, years and sexes
+            covdata = self.input_cache.fetch(
+                {'query': 'lnasdr', 'cause_id': int(asdr_cause_id),
+                 'codcorrect_version_id': int(cc_vid),
+                 'location_set_id': self.demographics.location_set_id,
+                 'year_ids': sorted(self.demographics.mortality_years),
+                 'sex_ids': sorted(self.demographics.sex_ids)},
+                lambda: ln_asdr.get_lnasdr_from_db(
+                    int(asdr_cause_id), cc_vid, self.gbd_round_id, self.mvid)
             ).rename(columns={colname: 'mean_value'}, errors='raise')
             log.info("Adding ASDR column {}".format(colname))
         else:
@@ -909,11 +933,7 @@ class Importer(object):
                 WHERE covariate_id=%s """ % (covariate_id)
             covname = db.execute_select(covnq).values[0][0]
             log.info("Adding country covariate column {}".format(covname))
-            covdata = get_covariate_estimates(
-                covariate_id=int(covariate_id),
-                gbd_round_id=self.gbd_round_id,
-                decomp_step=self.decomp_step,
-                status='best')
+            covdata = self.get_covariate_estimates(int(covariate_id))
             covdata = covdata[['location_id', 'year_id', 'age_group_id',
                                'sex_id', 'mean_value']]
 
@@ -978,6 +998,27 @@ class Importer(object):
 
         return covname, covdata
 
+    def get_covariate_estimates(self, covariate_id):
+        '''Get the best estimates of a country covariate for the model's decomp
+        step. The best model version is looked up first and the estimates are
+        cached on it.
+        '''
+        best = get_best_model_versions(
+            entity='covariate',
+            ids=covariate_id,
+            gbd_round_id=self.gbd_round_id,
+            decomp_step=self.decomp_step,
+            status='best')
+        covariate_mvid = int(best.model_version_id.iat[0])
+        return self.input_cache.fetch(
+            {'query': 'covariate_estimates', 'covariate_id': covariate_id,
+             'model_version_id': covariate_mvid},
+            lambda: get_covariate_estimates(
+                covariate_id=covariate_id,
+                model_version_id=covariate_mvid,
+                gbd_round_id=self.gbd_round_id,
+                decomp_step=self.decomp_step))
+
     def get_effect_priors(self):
         """Apply defaults
 
@@ -1691,7 +1732,9 @@ class Importer(object):
         '''Get dataframe mapping age group id to age standardization weights
         for a given gbd round
         '''
-        df = get_age_weights(gbd_round_id=self.gbd_round_id)
+        df = self.input_cache.fetch(
+            {'query': 'age_weights', 'gbd_round_id': self.gbd_round_id},
+            lambda: get_age_weights(gbd_round_id=self.gbd_round_id))
         df = df.rename(columns={"age_group_weight_value": "weight"})
 
         return df
@@ -0,0 +1,164 @@
+"""
+An on-disk cache of the Importer inputs that don't depend on the model
+version being imported: crosswalk version data, country covariate estimates,
+Ln-ASDR, age weights and age groups. Dozens of model versions launched in
+the same decomp step share these, so only the first one to import them
+queries the databases.
+
+An entry is addressed by the SHA-256 of its key, a dict naming the query and
+every id that pins its result. Inputs chosen by 'best' status must be keyed
+on the version ids they resolve to, never on the round or decomp step they
+were resolved for, so a key only ever describes one result. Each entry is a
+directory holding one .npy file per column. Numeric and datetime columns are
+read back memory mapped copy-on-write, so writing to them never changes the
+cache; string and other object columns are loaded into memory.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+META_FILE = 'columns.json'
+
+
+def _plain(value):
+    """numpy scalars to builtins, so keys hash the same however they were
+    passed"""
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return value
+
+
+def cache_key(key):
+    """SHA-256 of the canonical json of a key dict"""
+    encoded = json.dumps({k: _plain(v) for k, v in sorted(key.items())},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def _encode_column(series):
+    """(array to save, kind) for a column. Columns of strings are stored as
+    fixed width unicode rather than pickled; other object columns are
+    pickled."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype(object)
+    values = series.to_numpy()
+    if values.dtype.kind in 'biufcmM':
+        return values, 'array'
+    if all(isinstance(v, str) for v in values):
+        return values.astype(str), 'str'
+    return values.astype(object), 'object'
+
+
+def _decode_column(path, kind, mmap):
+    if kind == 'object':
+        return np.load(path, allow_pickle=True)
+    values = np.load(path, mmap_mode='c' if mmap else None)
+    if kind == 'str':
+        return values.astype(object)
+    # a plain ndarray view, so the memmap subclass doesn't leak into results
+    # computed from the column
+    return np.asarray(values)
+
+
+class InputCache:
+    def __init__(self, root, mmap=True):
+        """
+        Cache of DataFrames in the directory root, which is created if it
+        doesn't exist.
+
+        Args:
+            root (str): cache directory
+            mmap (bool): memory map numeric and datetime columns when
+                reading entries
+        """
+        self.root = root
+        self.mmap = mmap
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        digest = cache_key(key)
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get(self, key):
+        """The DataFrame cached under key, or None if there isn't one"""
+        path = self.path(key)
+        try:
+            with open(os.path.join(path, META_FILE)) as meta_file:
+                meta = json.load(meta_file)
+        except (IOError, ValueError):
+            return None
+        columns = {
+            column['name']: _decode_column(
+                os.path.join(path, column['file']), column['kind'], self.mmap)
+            for column in meta['columns']}
+        # copy=False keeps the memory mapped columns as they are rather than
+        # consolidating them into new blocks
+        return pd.DataFrame(columns, columns=[c['name']
+                                              for c in meta['columns']],
+                            copy=False)
+
+    def put(self, key, df):
+        """
+        Cache df under key, with a default index. The entry is written to a
+        temporary directory and renamed into place, so readers never see a
+        partial entry; if another process cached the key first, its entry is
+        kept.
+        """
+        path = self.path(key)
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=parent)
+        try:
+            columns = []
+            for i, name in enumerate(df.columns):
+                values, kind = _encode_column(df[name])
+                filename = '{}.npy'.format(i)
+                np.save(os.path.join(tmp, filename), values,
+                        allow_pickle=kind == 'object')
+                columns.append({'name': name, 'file': filename, 'kind': kind})
+            with open(os.path.join(tmp, META_FILE), 'w') as meta_file:
+                json.dump({'key': {k: _plain(v) for k, v in key.items()},
+                           'columns': columns}, meta_file, default=str)
+            os.chmod(tmp, 0o775)
+            os.rename(tmp, path)
+        except OSError:
+            if not os.path.exists(os.path.join(path, META_FILE)):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def fetch(self, key, query):
+        """
+        The DataFrame cached under key, running query() and caching its
+        result if there isn't one.
+
+        Args:
+            key (Dict[str, Any]): the query name and the ids pinning its result
+            query (Callable[[], pd.DataFrame]): fetches the result
+
+        Returns:
+            pd.DataFrame
+        """
+        df = self.get(key)
+        if df is not None:
+            logger.info("Read {} from input cache".format(key))
+            return df
+        logger.info("Querying {}".format(key))
+        df = query().reset_index(drop=True)
+        try:
+            self.put(key, df)
+        except Exception:
+            logger.exception("Could not cache {}".format(key))
+        return df
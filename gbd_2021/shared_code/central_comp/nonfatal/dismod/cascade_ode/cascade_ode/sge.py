@@ -2,6 +2,7 @@ import logging
 from functools import lru_cache
 
 import pandas as pd
+from codem.joblaunch.resource_store import STORE_FILE, ResourceStore
 from jobmon import git_utilities
 
 from cascade_ode.job_stats import ME_FACTORS_FILE, NODE_FILE, VARN_GLOBAL_FILE
@@ -10,6 +11,23 @@ from retrying import retry
 
 LOGGER = logging.getLogger(__name__)
 
+RESOURCE_STORE_FILE = STORE_FILE
+RESOURCE_STORE_PIPELINE = 'dismod'
+# Keys each jobtype's usage is stored under, broadest first, the size
+# features (from the job's DagNode details) nearest past jobs are chosen by,
+# and the quantile of past usage requested for it
+RESOURCE_STORE_KEYS = {
+    'node': ['modelable_entity_id', 'location_id', 'sex', 'year'],
+    'varnish': ['modelable_entity_id'],
+    'global': ['modelable_entity_id'],
+}
+RESOURCE_STORE_SIZES = {
+    'node': ['num_children'],
+    'varnish': ['num_locations', 'num_years'],
+    'global': ['num_locations', 'num_years'],
+}
+RESOURCE_STORE_QUANTILES = {'node': .9, 'varnish': .9, 'global': .95}
+
 
 @retry(wait_exponential_multiplier=1000,
        wait_exponential_max=15000,
@@ -55,6 +73,46 @@ def get_production_stats():
     return node_stats, varn_global_stats
 
 
+@lru_cache(maxsize=None)
+def get_resource_store():
+    """
+    The resource usage store shared with CODEm. It is created empty if it
+    doesn't exist yet, in which case the production stats are used directly.
+    """
+    return ResourceStore(RESOURCE_STORE_FILE)
+
+
+def refresh_resource_store(store_func=get_resource_store,
+                           stats_func=get_production_stats):
+    """
+    Add production job stats that aren't in the resource store yet, with the
+    size features of RESOURCE_STORE_SIZES that the stats carry. Called by
+    the driver before the job dag is sized.
+
+    Returns:
+        int: number of jobs added
+    """
+    store = store_func()
+    node_stats, vg_stats = stats_func()
+    usage = {
+        'node': node_stats,
+        'varnish': vg_stats[vg_stats['varnish']],
+        'global': vg_stats[vg_stats['global']],
+    }
+    added = 0
+    for jobtype, stats in usage.items():
+        size_cols = [c for c in RESOURCE_STORE_SIZES[jobtype] if c in stats]
+        missing = set(RESOURCE_STORE_SIZES[jobtype]) - set(size_cols)
+        if missing:
+            LOGGER.warning(
+                f"{jobtype} job stats have no {sorted(missing)} columns, "
+                "recording them without those sizes")
+        added += store.record(
+            RESOURCE_STORE_PIPELINE, stats.assign(task_type=jobtype),
+            key_cols=RESOURCE_STORE_KEYS[jobtype], size_cols=size_cols)
+    return added
+
+
 def cluster_limits(jobtype, mvm, child_count=None, min_mins=60, min_gb=10,
                    safety_factor=1.3, details=None):
     """
@@ -117,10 +175,13 @@ def cluster_limits(jobtype, mvm, child_count=None, min_mins=60, min_gb=10,
 
 
 def smart_cluster_limits(jobtype, modelable_entity_id, details,
-                         stats_func=get_production_stats):
+                         stats_func=get_production_stats,
+                         store_func=get_resource_store):
     """
     Try to consult known history of modelable entity job stats
-    to get a good estimate of runtime and max ram usage
+    to get a good estimate of runtime and max ram usage. The shared resource
+    store is asked first; the production stats are used if it has no history
+    for the jobtype.
 
     Arguments:
         jobtype str: one of node/varnish/global/driver
@@ -133,6 +194,12 @@ def smart_cluster_limits(jobtype, modelable_entity_id, details,
     Returns:
         Tuple[int, int]: GB of RAM, runtime in minutes
     """
+    store = store_func()
+    if store is not None and jobtype in RESOURCE_STORE_KEYS:
+        limits = store_limits(store, jobtype, modelable_entity_id, details)
+        if limits is not None:
+            return limits
+
     node_stats, vg_stats = stats_func()
 
     if jobtype == 'node':
@@ -145,6 +212,30 @@ def smart_cluster_limits(jobtype, modelable_entity_id, details,
     return runtime, mem
 
 
+def store_limits(store, jobtype, modelable_entity_id, details):
+    """
+    Determine runtime/ram allocation from the resource store, matching on the
+    same ME/location/sex/year keys node_limits falls back through, and
+    within a match on the jobs nearest in the RESOURCE_STORE_SIZES features
+    of details.
+
+    Returns:
+        Opt[Tuple[float, float]]: runtime in minutes, GB of RAM
+    """
+    values = dict(details or {}, modelable_entity_id=modelable_entity_id)
+    keys = {k: values.get(k) for k in RESOURCE_STORE_KEYS[jobtype]}
+    sizes = {k: values[k] for k in RESOURCE_STORE_SIZES[jobtype]
+             if k in values}
+    usage = store.predict(RESOURCE_STORE_PIPELINE, jobtype, keys=keys,
+                          sizes=sizes,
+                          quantile=RESOURCE_STORE_QUANTILES[jobtype])
+    if usage is None:
+        return None
+    mem, runtime = usage
+    runtime = runtime*1.3 if jobtype == 'varnish' else runtime
+    return runtime, mem
+
+
 def node_limits(modelable_entity_id, details, all_stats_df):
     """
     Determine runtime/ram allocation for Node jobtype
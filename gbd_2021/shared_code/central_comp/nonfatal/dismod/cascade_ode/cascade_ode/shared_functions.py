@@ -2,6 +2,7 @@ from db_queries import (
     get_age_metadata,
     get_age_spans,
     get_age_weights,
+    get_best_model_versions,
     get_covariate_estimates,
     get_demographics,
     get_envelope,
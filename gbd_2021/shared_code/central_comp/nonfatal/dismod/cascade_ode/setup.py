@@ -53,7 +53,8 @@ setup(
         'elmo==4.7.4',
         'gbd==4.2.0',
         'click',
-        'ihme-rules>=3.7.0'
+        'ihme-rules>=3.7.0',
+        'codem'
     ],
     include_package_data=True,
     packages=[
@@ -0,0 +1,115 @@
+import mmap
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cascade_ode.input_cache import InputCache, cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return InputCache(str(tmp_path / 'cache'))
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({
+        'location_id': np.array([1, 6, 102], dtype=np.int64),
+        'mean_value': [.1, np.nan, 3.5],
+        'is_outlier': [True, False, True],
+        'sex': ['Male', 'Female', 'Both'],
+        'date_inserted': pd.to_datetime(
+            ['2020-01-01', '2020-06-30', '2021-02-03']),
+        'note': ['a', None, 3],
+        'measure': pd.Categorical(['mtexcess', 'prevalence', 'mtexcess']),
+    })
+
+
+def test_round_trip(cache, df):
+    key = {'query': 'crosswalk_version', 'crosswalk_version_id': 12}
+    assert cache.get(key) is None
+    cache.put(key, df)
+
+    # categories come back as their values
+    expected = df.assign(measure=df.measure.tolist())
+    for mmap in [True, False]:
+        result = InputCache(cache.root, mmap=mmap).get(key)
+        pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+        assert list(result.columns) == list(df.columns)
+        assert result.sex.tolist() == df.sex.tolist()
+        assert result.note.tolist() == df.note.tolist()
+        assert result.location_id.dtype == np.int64
+
+
+def test_round_trip_empty(cache):
+    empty = pd.DataFrame({'age_group_id': np.array([], dtype=np.int64),
+                          'age_group_weight_value': np.array([])})
+    cache.put({'query': 'age_weights', 'gbd_round_id': 7}, empty)
+    result = cache.get({'query': 'age_weights', 'gbd_round_id': 7})
+    pd.testing.assert_frame_equal(result, empty)
+
+
+def test_reads_are_memory_mapped_copy_on_write(cache, df):
+    key = {'query': 'age_weights', 'gbd_round_id': 7}
+    cache.put(key, df)
+
+    result = cache.get(key)
+    values = result['mean_value'].to_numpy()
+    assert type(values) is np.ndarray
+    base = values
+    while base is not None and not isinstance(base, mmap.mmap):
+        base = getattr(base, 'base', None)
+    assert base is not None
+    result.loc[0, 'mean_value'] = 100.
+    assert cache.get(key).mean_value[0] == .1
+
+
+def test_key_canonical(df):
+    key = {'query': 'covariate_estimates', 'covariate_id': 57,
+           'model_version_id': 30000}
+    assert cache_key(key) == cache_key(dict(reversed(list(key.items()))))
+    assert cache_key(key) == cache_key(
+        dict(key, covariate_id=np.int64(57), model_version_id=30000.))
+    assert cache_key(dict(key, sex_ids=[1, 2])) == cache_key(
+        dict(key, sex_ids=(np.int64(1), 2.)))
+    assert cache_key(key) != cache_key(dict(key, model_version_id=30001))
+    assert cache_key(key) != cache_key(dict(key, query='lnasdr'))
+
+
+def test_fetch_queries_once_per_key(cache, df):
+    calls = []
+
+    def query(model_version_id):
+        def run():
+            calls.append(model_version_id)
+            return df.drop(columns='measure').assign(
+                model_version_id=model_version_id)
+        return run
+
+    key = {'query': 'covariate_estimates', 'covariate_id': 57}
+    first = cache.fetch(dict(key, model_version_id=1), query(1))
+    again = cache.fetch(dict(key, model_version_id=np.int64(1)), query(1))
+    # a new best version is a new key, so it is queried rather than served
+    # from the entry of the old one
+    changed = cache.fetch(dict(key, model_version_id=2), query(2))
+
+    assert calls == [1, 2]
+    pd.testing.assert_frame_equal(again, first, check_dtype=False)
+    assert (changed.model_version_id == 2).all()
+    assert (cache.get(dict(key, model_version_id=1)).model_version_id ==
+            1).all()
+
+
+def test_fetch_resets_index(cache, df):
+    key = {'query': 'age_ranges', 'gbd_round_id': 7}
+    indexed = df.set_index(pd.Index([10, 20, 30]))
+    assert cache.fetch(key, lambda: indexed).index.tolist() == [0, 1, 2]
+    assert cache.get(key).index.tolist() == [0, 1, 2]
+
+
+def test_put_keeps_existing_entry(cache, df):
+    key = {'query': 'age_ranges', 'gbd_round_id': 7}
+    cache.put(key, df)
+    cache.put(key, df.iloc[:1])
+    assert len(cache.get(key)) == len(df)
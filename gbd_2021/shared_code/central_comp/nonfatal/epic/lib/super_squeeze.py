@@ -1,10 +1,8 @@
 import os
-from functools import partial
-from multiprocessing import Pool
 
+import numpy as np
 import pandas as pd
 
-from core_maths.scale_split import scale
 from dataframe_io.pusher import SuperPusher
 from db_queries import get_age_spans
 from db_queries.api.internal import get_age_group_set as get_age_group_set_id
@@ -26,64 +24,109 @@ stage_key = {
     'epi': 'epi',
     'id': 'id_noepi',
     'blind': 'blind_noepi_noid'}
-
-
-def squeeze_draws(to_squeeze, envelope, scale_up, n_draws):
-    """Main loop to iterate over draw files and then squeeze (bound) their
-    values to the size of the given envelope"""
+# Impairments in the order they are squeezed
+IMPAIRMENTS = ['blind', 'epi', 'id_bord', 'id_mild', 'id_mod', 'id_sev',
+               'id_prof']
+
+
+def squeeze_prevalence(prevalence, impairment, squeeze, envelope, env_frac,
+                       scale_up):
+    """Squeeze (bound) sequela prevalence to the envelope of each impairment
+    in turn, for every age group and draw at once.
+
+    Arguments:
+        prevalence (np.ndarray): (sequela, age, draw) prevalence
+        impairment (np.ndarray): (impairment, sequela) bool, whether a
+            sequela belongs to the impairment
+        squeeze (np.ndarray): (sequela,) bool, whether a sequela may be
+            squeezed at all
+        envelope (np.ndarray): (impairment, age, draw) envelopes
+        env_frac (list): fraction of each envelope available to its sequelae
+        scale_up (list): whether each impairment's sequelae are scaled to
+            fill the envelope, not only squeezed when they exceed it
+
+    Returns:
+        (squeezed, locked): the squeezed (sequela, age, draw) prevalence and
+        the (sequela, age) mask of sequelae squeezed by some impairment
+    """
+    prevalence = prevalence.copy()
+    locked = np.zeros(prevalence.shape[:2], dtype=bool)
+    for i in range(len(envelope)):
+        in_imp = impairment[i][:, None]
+        squeezable = in_imp & ~locked & squeeze[:, None]
+        fixed = in_imp & (locked | ~squeeze[:, None])
+
+        # Envelope left after sequelae that are already locked
+        filled = np.nan_to_num(prevalence)
+        env = envelope[i] * env_frac[i] - np.einsum('sa,sad->ad', fixed, filled)
+        env = env.clip(min=0)
+
+        # Scale the squeezable sequelae of each age group and draw to the
+        # envelope when they exceed it
+        total = np.einsum('sa,sad->ad', squeezable, filled)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            factor = np.where(total > 0, env / total, 0.)
+        factor = np.where((total > env) | scale_up[i], factor, 1.)
+        prevalence = np.where(squeezable[:, :, None],
+                              prevalence * factor[None, :, :], prevalence)
+
+        locked |= squeezable
+    return prevalence, locked
+
+
+def squeeze_age_groups(unsqueezed, env_dict, n_draws):
+    """Squeeze the unsqueezed sequela prevalence of every age group to the
+    impairment envelopes, holding draws as a (sequela, age, draw) array"""
     drawcols = [f'draw_{i}' for i in range(n_draws)]
-    for draw in drawcols:
-        if (to_squeeze[draw].sum() > envelope[draw]) or scale_up:
-            to_squeeze = scale(
-                to_squeeze,
-                draw,
-                scalar=envelope[draw]
-            )
-    return to_squeeze
+    squeezed = unsqueezed.copy()
+
+    ages = squeezed['age_group_id'].astype(float).astype(int).to_numpy()
+    seq_codes, sequelae = pd.factorize(squeezed['me_id'])
+    age_codes, age_ids = pd.factorize(ages)
+    if pd.Series(seq_codes * len(age_ids) + age_codes).duplicated().any():
+        raise ValueError("Sequela prevalence has duplicate me_id and "
+                         "age_group_id rows")
+
+    prevalence = np.zeros((len(sequelae), len(age_ids), n_draws))
+    prevalence[seq_codes, age_codes] = squeezed[drawcols].to_numpy(dtype=float)
+
+    # Impairment membership and whether a sequela is squeezed come from the
+    # sequela map, so they are the same for all of a sequela's rows
+    impairment = np.zeros((len(IMPAIRMENTS), len(sequelae)), dtype=bool)
+    squeeze = np.zeros(len(sequelae), dtype=bool)
+    squeeze[seq_codes] = (squeezed['squeeze'] == "yes").to_numpy()
+
+    envelope = np.zeros((len(IMPAIRMENTS), len(age_ids), n_draws))
+    env_frac = []
+    scale_up = []
+    for i, imp in enumerate(IMPAIRMENTS):
+        impairment[i, seq_codes] = (squeezed[f'i_{imp}'] == 1).to_numpy()
+
+        env = env_dict[imp].copy()
+        env.index = env.age_group_id.astype(float).astype(int)
+        missing = set(age_ids) - set(env.index)
+        if missing:
+            raise ValueError(
+                f"No {imp} envelope for age groups {sorted(missing)}")
+        envelope[i] = env.loc[age_ids, drawcols].to_numpy(dtype=float)
+
+        if imp == 'epi':
+            env_frac.append(0.95)
+            scale_up.append(False)
+        elif 'id' in imp:
+            env_frac.append(0.95)
+            scale_up.append(False)
+        else:
+            env_frac.append(1)
+            scale_up.append(True)
 
+    print(f'Squeezing {len(age_ids)} age groups')
+    prevalence, locked = squeeze_prevalence(
+        prevalence, impairment, squeeze, envelope, env_frac, scale_up)
 
-def squeeze_age_group(age_group_id, unsqueezed, env_dict, n_draws):
-    drawcols = [f'draw_{i}' for i in range(n_draws)]
-    try:
-        # Get envelope
-        squeezed = unsqueezed[unsqueezed['age_group_id'] == age_group_id]
-        squeezed["locked"] = False
-        for imp in ['blind', 'epi', 'id_bord', 'id_mild', 'id_mod', 'id_sev',
-                    'id_prof']:
-            print(f'Running {age_group_id} {imp}')
-
-            if imp == 'epi':
-                env_frac = 0.95
-                scale_up = False
-            elif 'id' in imp:
-                env_frac = 0.95
-                scale_up = False
-            else:
-                env_frac = 1
-                scale_up = True
-
-            # Squeeze to envelope if exceeded
-            imp_bin = (squeezed[f'i_{imp}'] == 1)
-            imp_prev = squeezed[imp_bin]
-            other_prev = squeezed[~imp_bin]
-
-            squeezable = imp_prev[~(imp_prev.locked) &
-                                  (imp_prev['squeeze'] == "yes")]
-            locked = imp_prev[(imp_prev.locked) |
-                              (imp_prev['squeeze'] == "no")]
-
-            env = env_dict[imp].copy()
-            env = env[env.age_group_id.astype(float).astype(int) ==
-                      int(float(age_group_id))]
-            env = env[drawcols].squeeze() * env_frac - locked[drawcols].sum()
-            env = env.clip(lower=0)
-            squeezable = squeeze_draws(squeezable, env, scale_up, n_draws)
-            squeezable["locked"] = True
-            squeezed = pd.concat([other_prev, locked, squeezable])
-
-        return squeezed
-    except Exception as e:
-        return ('error', e)
+    squeezed.loc[:, drawcols] = prevalence[seq_codes, age_codes]
+    squeezed["locked"] = locked[seq_codes, age_codes]
+    return squeezed
 
 
 ###################################
@@ -391,19 +434,7 @@ def run_squeeze(
     ###################################
     # SQUEEZE
     ###################################
-    # Parallelize the squeezing
-    pool = Pool(20)
-    ages = list(pd.unique(unsqueezed['age_group_id']))
-    partial_squeeze = partial(
-        squeeze_age_group,
-        unsqueezed=unsqueezed,
-        env_dict=envelope_dict,
-        n_draws=n_draws
-    )
-    squeezed = pool.map(partial_squeeze, ages, chunksize=1)
-    pool.close()
-    pool.join()
-    squeezed = pd.concat(squeezed)
+    squeezed = squeeze_age_groups(unsqueezed, envelope_dict, n_draws)
     squeezed = squeezed.groupby(['location_id', 'year_id', 'age_group_id',
                                  'sex_id', 'me_id']).sum()
     squeezed = squeezed.reset_index()
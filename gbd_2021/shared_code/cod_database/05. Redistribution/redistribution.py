@@ -3,11 +3,13 @@
 import re
 import json
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
 
 from cod_prep.claude.cod_process import CodProcess
 from cod_prep.claude.configurator import Configurator
-from cod_prep.utils import print_log_message, report_if_merge_fail, CodSchema
+from cod_prep.utils import print_log_message, CodSchema
 
 
 def get_cause_restrictions(cause_map):
@@ -38,6 +40,68 @@ def eval_condition(x):
     return eval(condition)
 
 
+# proportion metadata columns that cause restrictions are written in terms of
+RESTRICTION_VARIABLES = [
+    'age', 'sex', 'super_region', 'year_id', 'country', 'region', 'nid'
+]
+
+
+def compile_restriction(condition, proportion_metadata):
+    """Evaluate a restriction for every proportion_id at once.
+
+    The condition is evaluated once with each variable bound to its whole
+    column. Conditions that can't be evaluated on arrays (e.g. ones using
+    'and'/'or') are evaluated row by row with eval_condition, once per
+    unique combination of the restriction variables.
+
+    Returns:
+        numpy.ndarray of bool, one per row of proportion_metadata
+    """
+    n = len(proportion_metadata)
+    variables = {
+        c: proportion_metadata[c].values for c in RESTRICTION_VARIABLES
+    }
+    try:
+        mask = np.asarray(eval(condition, {}, variables))
+    except (TypeError, ValueError):
+        mask = None
+    if mask is not None and mask.shape in [(), (n,)]:
+        return np.broadcast_to(mask.astype(bool), (n,))
+    combos = proportion_metadata[RESTRICTION_VARIABLES].drop_duplicates()
+    combos = combos.assign(restrictions=condition)
+    combos['eval'] = combos.apply(eval_condition, axis=1).astype(bool)
+    return proportion_metadata[RESTRICTION_VARIABLES].merge(
+        combos.drop(columns='restrictions'), how='left',
+        on=RESTRICTION_VARIABLES
+    )['eval'].values
+
+
+def compile_cause_restrictions(cause_map, proportion_metadata):
+    """Compile each unique cause restriction into a boolean mask over
+    proportion_ids.
+
+    Returns:
+        restriction_of_cause, pandas.Series: cause -> row of masks
+        masks, numpy.ndarray: (restriction, proportion_id) bool array; False
+            means nothing is redistributed to a cause with that restriction
+            in that proportion_id
+    """
+    assert (proportion_metadata['proportion_id'].values ==
+            np.arange(len(proportion_metadata))).all()
+    cmap = cause_map[['cause', 'restrictions']].drop_duplicates()
+    assert not cmap['cause'].duplicated().any(), \
+        "Causes with more than one restriction in the cause map"
+
+    restrictions = cmap['restrictions'].drop_duplicates().tolist()
+    masks = np.array([
+        compile_restriction(r, proportion_metadata) for r in restrictions
+    ], dtype=bool).reshape(len(restrictions), len(proportion_metadata))
+    restriction_of_cause = cmap.set_index('cause')['restrictions'].map(
+        {r: i for i, r in enumerate(restrictions)}
+    )
+    return restriction_of_cause, masks
+
+
 def evaluate_cause_restrictions(cause_map, proportion_metadata):
     """Determine proportion_ids within which each cause can be targeted
 
@@ -46,49 +110,18 @@ def evaluate_cause_restrictions(cause_map, proportion_metadata):
             'eval' is True or False; if False, nothing will be redistributed
             to this cause in this proportion_id
     """
-
-    prop_metadata = proportion_metadata.copy()
-    cmap = cause_map.copy()
-
-    # get all unique restrictions mapped to a restriction_id
-    restrictions = cause_map[['restrictions']].drop_duplicates()
-    restrictions = restrictions.reset_index(drop=True)
-    restrictions['restriction_id'] = restrictions.index
-
-    # get cartesian product of proportion_ids and restrictions
-    restrictions['join_key'] = 1
-    prop_metadata['join_key'] = 1
-    prop_restrictions = prop_metadata.merge(
-        restrictions,
-        on='join_key'
-    ).drop('join_key', axis=1)
-
-    # check if each proportion_id passes each restriction
-    prop_restrictions['eval'] = prop_restrictions.apply(
-        lambda x: eval_condition(x), axis=1
+    restriction_of_cause, masks = compile_cause_restrictions(
+        cause_map, proportion_metadata
     )
-
-    # make mapping from restriction to restriction_id
-    restrict_dict = restrictions.set_index(
-        'restrictions', verify_integrity=True
-    ).to_dict()['restriction_id']
-
-    # get cartesian product of all causes and all proportion ids
-    cmap['restriction_id'] = cmap['restrictions'].map(restrict_dict)
-    cmap = cmap[['cause', 'restriction_id']]
-    prop_ids = prop_metadata[['proportion_id']]
-    cmap['join_key'] = 1
-    prop_ids['join_key'] = 1
-    cm_eval = cmap.merge(prop_ids, on='join_key').drop('join_key', axis=1)
-
-    # now find out if each proportion_id passes the cause's restriction
-    cm_eval = cm_eval.merge(
-        prop_restrictions, on=['proportion_id', 'restriction_id']
-    )
-    assert cm_eval['eval'].notnull().all()
-    cm_eval = cm_eval[['cause', 'proportion_id', 'eval']]
-
-    return cm_eval
+    n_pid = masks.shape[1]
+    return pd.DataFrame({
+        'cause': np.repeat(restriction_of_cause.index.values, n_pid),
+        'proportion_id': np.tile(
+            proportion_metadata['proportion_id'].values,
+            len(restriction_of_cause)
+        ),
+        'eval': masks[restriction_of_cause.values].ravel(),
+    })
 
 
 def evaluate_cause_restrictions_old(nid, extract_type_id, cause_map,
@@ -333,230 +366,220 @@ def find_weight_groups(package, proportion_metadata,
     return weight_groups
 
 
-def get_proportions(data, proportion_metadata, package, cause_map_evaluated,
-                    residual_cause='cc_code'):
+def package_proportions(package, proportion_metadata, freq, rows,
+                        restriction_of_cause, restriction_masks, causes,
+                        residual_cause='cc_code'):
     """
-    Generate proportions based on frequencies.
+    Generate the proportions a package splits garbage by as a sparse
+    (proportion_id, cause) matrix, each row summing to 1 (or 0 where the
+    proportion_id has no weight group).
 
-    Can be broken down step by step:
+    Steps, with every (proportion_id, target) computed at once:
         1. Get list of targets for each target group
-        2. Generate base proportions (if the package is
-            supposed to create causes)
-        3. Pull frequencies of each cause in the data
-        4. Determine and pull weight group for proportion group
-        5. Pull weights from weight group for each target group
-        6. Calculate fraction to each cause
+        2. Generate base frequencies for each matched weight group (if the
+            package is supposed to create causes)
+        3. Add frequencies of each target cause in the data
+        4. Drop restricted targets, sending target groups that are
+            entirely restricted to the residual cause
+        5. Give every target of a target group with no deaths a small
+            frequency, so the group is split evenly
+        6. Weight each target group's share by the weights of the
+            proportion_id's weight groups and normalize
+
+    Arguments:
+        freq, scipy.sparse matrix: (proportion_id, cause) deaths in the data
+        rows, scipy.sparse matrix: (proportion_id, cause) 1 where the data
+            has the cause in the proportion_id
+        restriction_of_cause, restriction_masks: see
+            compile_cause_restrictions
+        causes, pandas.Index: the cause columns of freq and rows
     """
+    n_pid = len(proportion_metadata)
     weight_groups = find_weight_groups(
         package, proportion_metadata, filter_impossible=True,
         verify_integrity=False
     )
 
     print_log_message("                -Identifying targets")
-    targets = []
-    for tg in package['target_groups']:
-        temp = pd.DataFrame(
-            {'cause': package['target_groups'][tg]['target_codes']}
-        )
-        temp['target_group'] = tg
-        targets.append(temp)
-    targets = pd.concat(targets).reset_index(drop=True)
-
-    print_log_message("                -Pulling data counts - 1")
-    proportions = []
-    for pid in weight_groups['proportion_id']:
-        temp = targets.copy(deep=True)
-        if package['create_targets'] == 1:
-            temp['freq'] = 0.001
-        else:
-            temp['freq'] = 0
-        temp['proportion_id'] = pid
-        proportions.append(temp)
-    print_log_message("                -Pulling data counts - 2")
-    tg_dict = {}
-    for tg in package['target_groups']:
-        tg_dict[tg] = package['target_groups'][tg]['target_codes']
-    tg_df = pd.DataFrame.from_dict(tg_dict, orient='index').stack().reset_index()
-    tg_df.columns = ['target_group', 'index', 'cause']
-    tg_df = tg_df[['target_group', 'cause']]
-    tg_df = tg_df.merge(
-        data.groupby(['cause', 'proportion_id'], as_index=False)['freq'].sum(),
-        on='cause',
+    target_groups = list(package['target_groups'])
+    targets = [
+        (tg, cause) for tg in range(len(target_groups))
+        for cause in package['target_groups'][target_groups[tg]]['target_codes']
+    ]
+    tg_of_target = np.array([tg for tg, _ in targets], dtype=int)
+    cause_of_target = causes.get_indexer([cause for _, cause in targets])
+    in_group = np.zeros((len(targets), len(target_groups)))
+    in_group[np.arange(len(targets)), tg_of_target] = 1
+
+    print_log_message("                -Matching weight groups")
+    n_wg = max(
+        [len(package['weight_groups'])] +
+        [len(package['target_groups'][tg]['weights']) for tg in target_groups]
     )
-    proportions.append(tg_df)
-    print_log_message("                -Pulling data counts - 3")
-    proportions = (
-        pd.concat(proportions, sort=False)
-        .loc[:, ['proportion_id', 'cause', 'target_group', 'freq']]
-        .merge(
-            cause_map_evaluated.drop_duplicates(),
-            how='left', on=['proportion_id', 'cause'],
-            validate='many_to_one'
-        )
+    matched = np.zeros((n_pid, n_wg))
+    np.add.at(
+        matched,
+        (weight_groups['proportion_id'].values,
+         weight_groups['weight_group'].astype(int).values),
+        1
     )
-    report_if_merge_fail(proportions, 'eval', ['proportion_id', 'cause'])
-    proportions = (
-        # For any proportion_id/target_group where all targets are restricted,
-        # add a row for the residual cause so that we can send all garbage for this
-        # proportion_id/target_group there
-        proportions.append(
-            proportions.groupby(['proportion_id', 'target_group'], as_index=False)
-            ['eval'].any().query("~eval")
-            .assign(cause=residual_cause, freq=0, eval=True))
-        # Drop all restricted proportion_id/causes
-        .query("eval").drop(columns='eval')
-        .assign(
-            freq=lambda d: d['freq'].mask(
-                d.groupby(['proportion_id', 'target_group'])['freq'].transform(sum) == 0,
-                0.001,
-            )
+    weights = np.zeros((len(target_groups), n_wg))
+    for tg in range(len(target_groups)):
+        wgts = package['target_groups'][target_groups[tg]]['weights']
+        weights[tg, :len(wgts)] = wgts
+    tg_weights = matched.dot(weights.T)
+    n_matched = matched.sum(axis=1)[:, None]
+
+    print_log_message("                -Pulling data counts")
+    base = 0.001 if package['create_targets'] == 1 else 0
+    has_data = rows[:, cause_of_target].toarray() > 0
+    n_rows = n_matched + has_data
+    exists = n_rows > 0
+    target_freq = n_matched * base + freq[:, cause_of_target].toarray()
+
+    print_log_message("                -Applying cause restrictions")
+    restriction = restriction_of_cause.reindex(causes[cause_of_target])
+    unmapped = restriction.isnull().values & exists.any(axis=0)
+    if unmapped.any():
+        raise AssertionError(
+            "Could not find eval for these target causes: {}".format(
+                sorted(set(causes[cause_of_target[unmapped]])))
         )
-    )
-    # Calculate totals for each cause
-    print_log_message("                -Calculating totals for each cause")
-    proportions = proportions.ix[
-        :,
-        ['proportion_id', 'target_group', 'cause', 'freq']
-    ].groupby(['proportion_id', 'target_group', 'cause']).sum().reset_index()
-    print_log_message("                -Calculating totals for each target group")
-    proportions = proportions.set_index(
-        ['proportion_id', 'target_group']
-    ).join(
-        proportions.groupby(
-            ['proportion_id', 'target_group']
-        ).sum().rename(columns={'freq': 'total'})
-    )
-    proportions = pd.merge(
-        proportions.reset_index(),
-        weight_groups,
-        on='proportion_id'
-    )
-    # Merge on weights
-    print_log_message("                -Merging on weights")
-    weights = []
-    for tg in package['target_groups']:
-        wg = 0
-        for wgt in package['target_groups'][tg]['weights']:
-            weights.append(
-                {'target_group': tg, 'weight_group': str(wg), 'weight': wgt}
-            )
-            wg += 1
-    weights = pd.DataFrame(weights)
-    proportions = pd.merge(
-        proportions,
-        weights,
-        on=['target_group', 'weight_group']
-    )
-    # Calculate final proportions to apply
-    print_log_message("                -Reformatting data type")
-    for c in ['freq', 'weight', 'total']:
-        proportions[c] = proportions[c].astype('float64')
+    allowed = exists & restriction_masks[
+        restriction.fillna(0).astype(int).values].T
+    group_exists = exists.dot(in_group) > 0
+    # For any proportion_id/target_group where all targets are restricted,
+    # send all garbage for this proportion_id/target_group to the residual
+    to_residual = group_exists & ~(allowed.dot(in_group) > 0)
+    target_freq = np.where(allowed, target_freq, 0)
+    no_deaths = (target_freq.dot(in_group) == 0)[:, tg_of_target]
+    target_freq = np.where(
+        allowed & no_deaths, 0.001 * n_rows, target_freq)
+    residual_freq = np.where(to_residual, 0.001, 0)
+
     print_log_message("                -Calculating proportions")
-    proportions['proportion'] = (proportions.freq / proportions.total) * \
-        proportions.weight
-    print_log_message("                -Adding residual causes where needed")
-    proportions = pd.concat([
-        proportions.ix[
-            proportions.total == 0,
-            ['proportion_id', 'target_group', 'weight', 'total']
-        ].drop_duplicates().set_index('total').set_value(
-            0,
-            'cause',
-            residual_cause
-        ).rename(
-            columns={'weight': 'proportion'}
-        ).reset_index().ix[
-            :,
-            ['proportion_id', 'proportion', 'cause']
-        ].groupby(
-            ['proportion_id', 'cause']
-        ).sum().reset_index(),
-        proportions.ix[
-            proportions.total != 0,
-            ['proportion_id', 'cause', 'proportion']
-        ].groupby(
-            ['proportion_id', 'cause']
-        ).sum().reset_index()
-    ]).reset_index(drop=True)
-    # Again make sure everything sums to 1
+    total = target_freq.dot(in_group) + residual_freq
+    share = np.divide(tg_weights, total, out=np.zeros_like(total),
+                      where=total != 0)
+    target_props = target_freq * share[:, tg_of_target]
+    residual_props = (residual_freq * share).sum(axis=1)
+    to_cause = sparse.csr_matrix(
+        (np.ones(len(targets)), (np.arange(len(targets)), cause_of_target)),
+        shape=(len(targets), len(causes))
+    )
+    proportions = sparse.csr_matrix(target_props).dot(to_cause) + \
+        sparse.csr_matrix(
+            (residual_props,
+             (np.arange(n_pid), np.full(n_pid, causes.get_loc(residual_cause)))),
+            shape=(n_pid, len(causes))
+        )
+
+    # Make sure everything sums to 1
     print_log_message("                -Make sure everything sums to 1")
-    proportions = proportions.set_index(['proportion_id']).join(
-        proportions.groupby(
-            ['proportion_id']
-        ).sum().rename(columns={'proportion': 'total'}))
-    proportions['proportion'] = (proportions.proportion / proportions.total)
-    proportions = proportions.reset_index()[
-        ['proportion_id', 'cause', 'proportion']]
-    return proportions
-
-
-def redistribute_garbage(data, proportions, package):
-    """Prepare garbage codes for redistribution."""
-    diagnostics = []
-    # Make sure the package contains all the codes in the proportions set
-    print_log_message("                -Expanding proportions to signature id")
-    temp = data[
-        ['proportion_id', 'signature_id']
-    ].drop_duplicates().reset_index(drop=True).copy(deep=True)
-    proportions = pd.merge(
-        temp,
-        proportions,
-        on='proportion_id'
+    pid_total = np.asarray(proportions.sum(axis=1)).ravel()
+    scale = np.divide(1., pid_total, out=np.zeros_like(pid_total),
+                      where=pid_total != 0)
+    return sparse.diags(scale).dot(proportions).tocsr()
+
+
+def get_proportions(data, proportion_metadata, package, cause_map,
+                    residual_cause='cc_code'):
+    """Proportions a package splits garbage by in each proportion_id.
+
+    Returns:
+        pandas.DataFrame: proportion_id, cause, proportion
+    """
+    causes = pd.Index(sorted(
+        set(data['cause']) | {residual_cause} |
+        {c for tg in package['target_groups'].values()
+         for c in tg['target_codes']}
+    ))
+    pid = data['proportion_id'].values
+    cause = causes.get_indexer(data['cause'])
+    shape = (len(proportion_metadata), len(causes))
+    freq = sparse.csr_matrix((data['freq'].values, (pid, cause)), shape=shape)
+    rows = sparse.csr_matrix((np.ones(len(data)), (pid, cause)), shape=shape)
+    restriction_of_cause, restriction_masks = compile_cause_restrictions(
+        cause_map, proportion_metadata
     )
-    # Tag garbage
-    print_log_message("                -Tagging garbage")
-    causes = data[['cause']].drop_duplicates()
-    causes['garbage'] = 0
-    causes.loc[causes['cause'].isin(package['garbage_codes']), 'garbage'] = 1
-    cause_garbage_map = causes.set_index('cause').to_dict()['garbage']
-    data['garbage'] = data['cause'].map(cause_garbage_map)
-    diagnostics.append(data.loc[data['garbage'] == 1])
-    # Get total number of garbage codes for each signature_id
+    proportions = package_proportions(
+        package, proportion_metadata, freq, rows, restriction_of_cause,
+        restriction_masks, causes, residual_cause=residual_cause
+    ).tocoo()
+    return pd.DataFrame({
+        'proportion_id': proportions.row,
+        'cause': causes[proportions.col],
+        'proportion': proportions.data,
+    })
+
+
+def _coalesce(pair, cause, freq, n_causes):
+    """Sum freq over duplicate (pair, cause) cells, sorted by pair, cause."""
+    key = pair.astype(np.int64) * n_causes + cause
+    key, inverse = np.unique(key, return_inverse=True)
+    return key // n_causes, key % n_causes, \
+        np.bincount(inverse, weights=freq, minlength=len(key))
+
+
+def redistribute_garbage(cells, proportions, garbage, pair_pid, residual):
+    """Move the garbage deaths of every signature onto targets.
+
+    Arguments:
+        cells, tuple of numpy.ndarray: (pair, cause, freq) deaths by
+            proportion_id/signature_id pair and cause
+        proportions, scipy.sparse matrix: (proportion_id, cause) package
+            proportions, see package_proportions
+        garbage, numpy.ndarray: bool by cause, True for the package's
+            garbage codes
+        pair_pid, numpy.ndarray: proportion_id of each pair
+        residual, int: cause of the residual code
+
+    Returns:
+        cells after redistribution and the garbage and additions of each
+        (proportion_id, cause), as (pair, cause, freq) arrays
+    """
+    pair, cause, freq = cells
+    is_garbage = garbage[cause]
     print_log_message("                -Summing garbage per signature id")
-    temp = data.loc[
-        data['garbage'] == 1,
-        ['proportion_id', 'signature_id', 'freq']
-    ].groupby(['proportion_id', 'signature_id']).sum().reset_index()
-    temp = temp.rename(columns={'freq': 'garbage'})
-    print_log_message("                -Splitting garbage onto targets: merge")
-    # Redistribute garbage onto targets
-    additions = pd.merge(
-        proportions,
-        temp,
-        on=['proportion_id', 'signature_id'],
-        how='outer'
+    pair_garbage = np.bincount(
+        pair[is_garbage], weights=freq[is_garbage], minlength=len(pair_pid)
     )
-    print_log_message("                -Splitting garbage onto targets: multiply")
-    for c in ['proportion', 'garbage']:
-        additions[c] = additions[c].fillna(0)
-    additions['freq'] = additions['proportion'] * additions['garbage']
-    additions = additions.loc[additions['freq'] > 0,
-                              ['signature_id', 'proportion_id', 'cause', 'freq']
-                              ]
-    diagnostics.append(additions)
+    print_log_message("                -Splitting garbage onto targets")
+    receiving = np.flatnonzero(pair_garbage > 0)
+    additions = sparse.diags(pair_garbage[receiving]).dot(
+        proportions[pair_pid[receiving]]
+    ).tocoo()
+    keep = additions.data > 0
+    add_pair = receiving[additions.row[keep]]
+    add_cause = additions.col[keep]
+    add_freq = additions.data[keep]
+
     print_log_message("                -Appending split garbage onto non-garbage")
-    # Zero out garbage codes
-    data.loc[data['garbage'] == 1, 'freq'] = 0
-    # Tack on redistributed data
-    data = pd.concat([data, additions])
-    data = data.loc[:, ['proportion_id', 'signature_id', 'cause', 'freq']]
-    data = data.reset_index(drop=True)
-    # Create diagnostics
-    print_log_message("                -Making diagnostic dataframe")
-    diagnostics = pd.concat(diagnostics)
-    diagnostics['garbage'] = diagnostics['garbage'].fillna(0)
-    # Collapse to proportion id
-    diagnostics = diagnostics.groupby(
+    diagnostics = (
+        (pair[is_garbage], cause[is_garbage], freq[is_garbage]),
+        (add_pair, add_cause, add_freq),
+    )
+    freq = np.where(is_garbage, 0, freq)
+    pair = np.concatenate([pair, add_pair])
+    cause = np.concatenate([cause, add_cause])
+    freq = np.concatenate([freq, add_freq])
+    keep = (freq > 0) | (cause == residual)
+    cells = _coalesce(pair[keep], cause[keep], freq[keep], len(garbage))
+    return cells, diagnostics
+
+
+def make_diagnostics(diagnostics, pair_pid, causes):
+    """Garbage removed and deaths added by a package in each proportion_id
+    and cause."""
+    diagnostics = pd.concat([
+        pd.DataFrame({
+            'proportion_id': pair_pid[pair], 'garbage': is_garbage,
+            'cause': causes[cause], 'freq': freq,
+        }) for (pair, cause, freq), is_garbage in zip(diagnostics, [1., 0.])
+    ])
+    return diagnostics.groupby(
         ['proportion_id', 'garbage', 'cause']
     )['freq'].sum().reset_index()
-    # Return outputs
-    return data, diagnostics
-
-
-def data_has_any_package_garbage(data, package):
-    garbage_codes = set(package['garbage_codes'])
-    causes = set(data['cause'].unique())
-    return not garbage_codes.isdisjoint(causes)
 
 
 def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
@@ -573,21 +596,41 @@ def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
     packages = get_packages(package_folder, cause_map)
     print_log_message("Evaluating cause map restrictions")
 
-    cause_map_evaluated = evaluate_cause_restrictions(
+    restriction_of_cause, restriction_masks = compile_cause_restrictions(
         cause_map,
         proportion_metadata
     )
-    print_log_message("Run redistribution!")
-    diagnostics_all = []
-    diagnostics_add_cols = ['shared_package_version_id', 'package_version_id', 'package_name', 'package_id']
-    seq = 0
     if first_and_last_only:
         first = packages[0]
         last = packages[-1]
         packages = [first, last]
-    for package in packages:
 
-        if not data_has_any_package_garbage(data, package):
+    # Deaths are kept as (pair, cause, freq) cells, where a pair is a
+    # proportion_id/signature_id combination in the data
+    causes = pd.Index(sorted(
+        set(data['cause']) | {residual_cause} |
+        {c for package in packages for tg in package['target_groups'].values()
+         for c in tg['target_codes']}
+    ))
+    residual = causes.get_loc(residual_cause)
+    n_sig = len(signature_metadata)
+    pair_key = data['proportion_id'].values.astype(np.int64) * n_sig + \
+        data['signature_id'].values
+    pair_keys, pair = np.unique(pair_key, return_inverse=True)
+    pair_pid = pair_keys // n_sig
+    pair_sig = pair_keys % n_sig
+    cells = _coalesce(pair, causes.get_indexer(data['cause']),
+                      data['freq'].values.astype(float), len(causes))
+    shape = (len(proportion_metadata), len(causes))
+
+    print_log_message("Run redistribution!")
+    diagnostics_all = []
+    diagnostics_add_cols = ['shared_package_version_id', 'package_version_id', 'package_name', 'package_id']
+    seq = 0
+    for package in packages:
+        pair, cause, freq = cells
+        garbage = causes.isin(package['garbage_codes'])
+        if not garbage[cause].any():
             continue
 
         print_log_message(
@@ -597,34 +640,45 @@ def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
             "    package_description: {}".format(
                 package['package_description'])
         )
-        print_log_message("        Deaths before = " + str(data.freq.sum()))
-        print_log_message("        Rows before = " + str(len(data)))
+        print_log_message("        Deaths before = " + str(freq.sum()))
+        print_log_message("        Rows before = " + str(len(freq)))
         print_log_message("            ... calculating proportions")
-        proportions = get_proportions(
-            data,
-            proportion_metadata,
+        pid = pair_pid[pair]
+        proportions = package_proportions(
             package,
-            cause_map_evaluated,
+            proportion_metadata,
+            sparse.csr_matrix((freq, (pid, cause)), shape=shape),
+            sparse.csr_matrix((np.ones(len(freq)), (pid, cause)), shape=shape),
+            restriction_of_cause,
+            restriction_masks,
+            causes,
             residual_cause=residual_cause
         )
         print_log_message("            ... redistributing data")
-        data, diagnostics = redistribute_garbage(
-            data,
+        cells, diagnostics = redistribute_garbage(
+            cells,
             proportions,
-            package
+            garbage,
+            pair_pid,
+            residual
         )
-        data = data.loc[(data['freq'] > 0) | (data['cause'] == residual_cause)]
-        data = data.groupby(['proportion_id', 'signature_id', 'cause']
-                            ).sum().reset_index()
+        diagnostics = make_diagnostics(diagnostics, pair_pid, causes)
         if diagnostic_output:
             diagnostics['seq'] = seq
             for add_col in diagnostics_add_cols:
                 diagnostics[add_col] = package[add_col]
             seq += 1
             diagnostics_all.append(diagnostics)
-        print_log_message("        Deaths after = " + str(data.freq.sum()))
-        print_log_message("        Rows after = " + str(len(data)))
+        print_log_message("        Deaths after = " + str(cells[2].sum()))
+        print_log_message("        Rows after = " + str(len(cells[2])))
     print_log_message("Done!")
+    pair, cause, freq = cells
+    data = pd.DataFrame({
+        'proportion_id': pair_pid[pair],
+        'signature_id': pair_sig[pair],
+        'cause': causes[cause],
+        'freq': freq,
+    })
     data = pd.merge(data, signature_metadata, on='signature_id')
     if diagnostic_output:
         if not diagnostics_all:
@@ -633,10 +687,11 @@ def run_redistribution(input_data, signature_ids, proportion_ids, cause_map,
             )
         else:
             diagnostics = pd.concat(diagnostics_all).reset_index(drop=True)
-    return data.ix[data.freq > 0], diagnostics, \
+    return data.loc[data.freq > 0], diagnostics, \
         signature_metadata, proportion_metadata
 
 
+
 class GarbageRedistributor(CodProcess):
     """Redistribute garbage."""
 
@@ -0,0 +1,152 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import redistribution
+
+SIGNATURE_IDS = ['location_id', 'site_id', 'sex', 'sex_id', 'age',
+                 'age_group_id', 'year_id', 'nid', 'country', 'region',
+                 'super_region']
+PROPORTION_IDS = ['site_id', 'sex', 'age', 'year_id', 'nid', 'country',
+                  'region', 'super_region']
+RESIDUAL_CAUSE = 'ZZZ'
+
+CAUSE_MAP = pd.DataFrame({
+    'cause': ['A', 'B', 'C', 'D', 'G1', 'G2', 'ZZZ'],
+    'restrictions': [
+        '(age >= 0)', '(age >= 5) & (sex == 1)', 'age < 70 and sex == 2',
+        'not sex == 1', '(age >= 0)', '(age >= 0)', 'True'
+    ],
+})
+
+
+def make_package(package_id, garbage_codes, target_groups, weight_groups,
+                 create_targets=0):
+    return {
+        'package_id': str(package_id),
+        'package_name': 'package {}'.format(package_id),
+        'package_description': '',
+        'package_version_id': package_id,
+        'shared_package_version_id': package_id,
+        'create_targets': create_targets,
+        'garbage_codes': garbage_codes,
+        'target_groups': {
+            str(i): {'target_codes': codes, 'weights': weights}
+            for i, (codes, weights) in enumerate(target_groups)
+        },
+        'weight_groups': {str(i): w for i, w in enumerate(weight_groups)},
+    }
+
+
+# Both packages have target groups that are entirely restricted in some
+# proportion_ids, so part of their garbage goes to the residual cause; the
+# second creates targets missing from the data
+PACKAGES = [
+    make_package(
+        1, ['G1'], [(['A', 'B'], [.7, .2]), (['C', 'D'], [.3, .8])],
+        ['(age < 15)', '(age >= 15)']),
+    make_package(
+        2, ['G2'], [(['B', 'C'], [.5, .5]), (['D'], [.5, .5])],
+        ['(sex == 1)', '(age >= 0)'], create_targets=1),
+]
+
+
+@pytest.fixture
+def data():
+    index = pd.MultiIndex.from_product(
+        [[1, 2], [1, 15, 70], ['A', 'B', 'C', 'G1', 'G2']],
+        names=['sex', 'age', 'cause']).to_frame(index=False)
+    df = index.assign(
+        location_id=1, site_id=1, sex_id=index['sex'],
+        age_group_id=index['age'] + 100, year_id=2010, nid=1, country='X',
+        region='R', super_region='S',
+        freq=[3., 0, 2, 1, 4, 2, 5, 1, 0, 2, 3, 1, 2, 2, 1,
+              4, 3, 0, 1, 2, 2, 1, 3, 1, 2, 1, 1, 2, 3, 4])
+    return df.loc[df.freq > 0].reset_index(drop=True)
+
+
+def by_sex_age(df, proportion_metadata, value):
+    return (
+        df.loc[df[value] > 0]
+        .merge(proportion_metadata[['proportion_id', 'sex', 'age']])
+        .set_index(['sex', 'age', 'cause'])[value]
+        .sort_index()
+    )
+
+
+def test_compile_restriction_matches_eval_condition():
+    proportion_metadata = pd.DataFrame({
+        'age': [0, 1, 5, 15, 70, 80] * 2,
+        'sex': [1] * 6 + [2] * 6,
+    }).assign(super_region=4, year_id=2010, country=6, region=5, nid=1)
+    for condition in CAUSE_MAP['restrictions'].tolist() + [
+            '(sex == 1) | (age > 70)', 'age in [1, 5]']:
+        expected = proportion_metadata.assign(
+            restrictions=condition
+        ).apply(redistribution.eval_condition, axis=1).astype(bool)
+        np.testing.assert_array_equal(
+            redistribution.compile_restriction(condition, proportion_metadata),
+            expected.values)
+
+
+def test_package_proportions_match_merge_based_proportions(data):
+    prepped, _, proportion_metadata = redistribution.prep_data(
+        data, SIGNATURE_IDS, PROPORTION_IDS, residual_cause=RESIDUAL_CAUSE)
+
+    # proportions from the merge-based get_proportions this replaced
+    expected = [
+        {(1, 1, 'A'): .7, (1, 1, 'ZZZ'): .3,
+         (1, 15, 'A'): .2 * 2 / 7, (1, 15, 'B'): .2 * 5 / 7,
+         (1, 15, 'ZZZ'): .8,
+         (1, 70, 'A'): .15, (1, 70, 'B'): .05, (1, 70, 'ZZZ'): .8,
+         (2, 1, 'A'): .7, (2, 1, 'C'): .15, (2, 1, 'D'): .15,
+         (2, 15, 'A'): .2, (2, 15, 'C'): .8,
+         (2, 70, 'A'): .2, (2, 70, 'D'): .8},
+        {(1, 1, 'ZZZ'): 1.,
+         (1, 15, 'B'): .5, (1, 15, 'ZZZ'): .5,
+         (1, 70, 'B'): .5, (1, 70, 'ZZZ'): .5,
+         (2, 1, 'C'): .5, (2, 1, 'D'): .5,
+         (2, 15, 'C'): .5, (2, 15, 'D'): .5,
+         (2, 70, 'D'): .5, (2, 70, 'ZZZ'): .5},
+    ]
+    for package, package_expected in zip(PACKAGES, expected):
+        proportions = redistribution.get_proportions(
+            prepped, proportion_metadata, package, CAUSE_MAP,
+            residual_cause=RESIDUAL_CAUSE)
+        result = by_sex_age(proportions, proportion_metadata, 'proportion')
+        expected_series = pd.Series(package_expected).sort_index()
+        assert result.index.tolist() == expected_series.index.tolist()
+        np.testing.assert_allclose(result.values, expected_series.values)
+
+
+def test_redistribution_matches_merge_based_output(data, monkeypatch):
+    monkeypatch.setattr(redistribution, 'get_packages',
+                        lambda folder, cause_map: copy.deepcopy(PACKAGES))
+
+    result, diagnostics, _, proportion_metadata = \
+        redistribution.run_redistribution(
+            data, SIGNATURE_IDS, PROPORTION_IDS, CAUSE_MAP, '',
+            residual_cause=RESIDUAL_CAUSE, diagnostic_output=True)
+
+    # deaths after redistribution by the merge-based implementation
+    expected = pd.Series({
+        (1, 1, 'A'): 3.7, (1, 1, 'C'): 2., (1, 1, 'ZZZ'): 4.3,
+        (1, 15, 'A'): 2., (1, 15, 'B'): 6., (1, 15, 'C'): 1.,
+        (1, 15, 'ZZZ'): 1.,
+        (1, 70, 'A'): 3.3, (1, 70, 'B'): 1.6, (1, 70, 'C'): 2.,
+        (1, 70, 'ZZZ'): 2.1,
+        (2, 1, 'A'): 4.7, (2, 1, 'B'): 3., (2, 1, 'C'): 1.15,
+        (2, 1, 'D'): 1.15,
+        (2, 15, 'A'): 2.2, (2, 15, 'B'): 1., (2, 15, 'C'): 4.8,
+        (2, 15, 'D'): 1.,
+        (2, 70, 'A'): 1.6, (2, 70, 'B'): 1., (2, 70, 'C'): 2.,
+        (2, 70, 'D'): 4.4, (2, 70, 'ZZZ'): 2.,
+    }).sort_index()
+    result = result.groupby(['sex', 'age', 'cause'])['freq'].sum()
+    assert result.index.tolist() == expected.index.tolist()
+    np.testing.assert_allclose(result.values, expected.values)
+
+    moved = diagnostics.groupby(['package_name', 'garbage'])['freq'].sum()
+    np.testing.assert_allclose(moved.values, [8., 8., 15., 15.])